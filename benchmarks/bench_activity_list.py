@@ -0,0 +1,117 @@
+"""Compare stravalib and lean parsing of /athlete/activities pages
+
+Both paths start from the same 200-activity JSON page, shaped like
+Strava's SummaryActivity (maps, gear and all). stravalib validates every
+field into pydantic models; the lean reader picks the four it needs.
+
+    python -m benchmarks.bench_activity_list
+"""
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from stravalib import model
+
+from src.strava.activities import MAX_PAGE_SIZE, _activity_record, activity_type, lean_activity_record
+
+PAGES = 20
+
+
+def _summary_activity(i: int) -> dict:
+    start = datetime(2024, 1, 1, 7) + timedelta(days=i)
+    return {
+        "resource_state": 2,
+        "athlete": {"id": 134815, "resource_state": 1},
+        "name": f"Morning Run {i}",
+        "distance": 10234.5,
+        "moving_time": 3012,
+        "elapsed_time": 3120,
+        "total_elevation_gain": 84.2,
+        "type": "Run" if i % 5 else "Ride",
+        "sport_type": "Run" if i % 5 else "Ride",
+        "workout_type": None,
+        "id": 10_000_000_000 + i,
+        "start_date": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "start_date_local": (start + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "timezone": "(GMT+01:00) Europe/Paris",
+        "utc_offset": 3600.0,
+        "location_city": None,
+        "location_state": None,
+        "location_country": "France",
+        "achievement_count": 3,
+        "kudos_count": 12,
+        "comment_count": 1,
+        "athlete_count": 1,
+        "photo_count": 0,
+        "map": {
+            "id": f"a{10_000_000_000 + i}",
+            "summary_polyline": "ki{eFvqfiVqAWQIGEEKAYJgBVqDJ{BHa@jAkNJw@Pw@V{APs@^aABQAOEQGKoJ_FuJkFqAo@" * 4,
+            "resource_state": 2,
+        },
+        "trainer": False,
+        "commute": False,
+        "manual": False,
+        "private": False,
+        "visibility": "everyone",
+        "flagged": False,
+        "gear_id": "g12345678",
+        "start_latlng": [48.85, 2.35],
+        "end_latlng": [48.86, 2.36],
+        "average_speed": 3.398,
+        "max_speed": 5.2,
+        "average_cadence": 86.4,
+        "has_heartrate": True,
+        "average_heartrate": 148.3,
+        "max_heartrate": 171.0,
+        "heartrate_opt_out": False,
+        "display_hide_heartrate_option": True,
+        "elev_high": 72.4,
+        "elev_low": 31.0,
+        "upload_id": 20_000_000_000 + i,
+        "external_id": f"garmin_push_{i}",
+        "from_accepted_tag": False,
+        "pr_count": 0,
+        "total_photo_count": 0,
+        "has_kudoed": False,
+        "suffer_score": 42.0,
+    }
+
+
+def _stravalib_page(text: str) -> list:
+    activities = [model.Activity.parse_obj(raw) for raw in json.loads(text)]
+    return [_activity_record(activity) for activity in activities if activity_type(activity) == 'Run']
+
+
+def _lean_page(text: str) -> list:
+    return [lean_activity_record(raw) for raw in json.loads(text) if raw.get('type') == 'Run']
+
+
+def _measure(parse, text: str):
+    start = time.process_time()
+    for _ in range(PAGES):
+        records = parse(text)
+    cpu_ms = 1000 * (time.process_time() - start) / PAGES
+
+    tracemalloc.start()
+    parse(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_ms, peak / 1024, records
+
+
+def main():
+    text = json.dumps([_summary_activity(i) for i in range(MAX_PAGE_SIZE)])
+    stravalib_ms, stravalib_kb, stravalib_records = _measure(_stravalib_page, text)
+    lean_ms, lean_kb, lean_records = _measure(_lean_page, text)
+    assert stravalib_records == lean_records
+
+    print(f"page: {MAX_PAGE_SIZE} activities, {len(text) / 1024:.0f} KB of JSON")
+    print(f"stravalib: {stravalib_ms:.2f} ms CPU/page, {stravalib_kb:.0f} KB peak")
+    print(f"lean:      {lean_ms:.2f} ms CPU/page, {lean_kb:.0f} KB peak")
+    print(f"saved: {stravalib_ms - lean_ms:.2f} ms/page ({100 * (1 - lean_ms / stravalib_ms):.0f}%), "
+          f"{stravalib_kb - lean_kb:.0f} KB peak ({100 * (1 - lean_kb / stravalib_kb):.0f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Compare sequential and overlapped startup of process_activities
+
+Strava and Spotify calls are replaced with fakes that sleep for a typical
+round trip. The sequential run initializes and reads one service after the
+other; the overlapped run is what process_activities does.
+
+    python -m benchmarks.bench_startup
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+from src.context import AppContext
+from src.startup import start_run
+
+# Simulated round-trip latency of one upstream call, in seconds
+CALL_LATENCY = 0.05
+RUNS = 5
+
+
+def _slow(return_value=None, calls=1):
+    def call(*args, **kwargs):
+        time.sleep(calls * CALL_LATENCY)
+        return return_value
+    return MagicMock(side_effect=call)
+
+
+def _fake_auth(use_s3=False, session=None, bundle=None):
+    auth = MagicMock()
+    # Token load plus refresh
+    auth.authenticate = _slow(calls=2)
+    auth.client.token_expires_at = time.time() + 3600
+    auth.get_cached_athlete.return_value = None
+    return auth
+
+
+def _fake_activities(auth):
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(hours=1)
+    activities = MagicMock()
+    activities.get_activities = _slow([("Bench Run", now, now.timestamp(), end, end.timestamp())])
+    return activities
+
+
+def _fake_spotify(session=None, **kwargs):
+    spotify = MagicMock()
+    spotify.history_max_age = 60
+    # Token refresh plus one history page
+    spotify.get_recently_played = _slow([], calls=2)
+    return spotify
+
+
+def _sequential(context):
+    context.ensure()
+    list(context.strava.get_activities(limit=1))
+    context.spotify.get_recently_played(max_age=context.spotify.history_max_age)
+
+
+def _time(run):
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def main():
+    with patch("src.context.StravaAuth", side_effect=_fake_auth), \
+         patch("src.context.StravaActivities", side_effect=_fake_activities), \
+         patch("src.context.SpotifyHandler", side_effect=_fake_spotify):
+        sequential = [_time(lambda: _sequential(AppContext())) for _ in range(RUNS)]
+        overlapped = [_time(lambda: start_run(AppContext(), limit=1)) for _ in range(RUNS)]
+
+    sequential_ms = 1000 * sum(sequential) / RUNS
+    overlapped_ms = 1000 * sum(overlapped) / RUNS
+    print(f"sequential: {sequential_ms:.1f} ms/run")
+    print(f"overlapped: {overlapped_ms:.1f} ms/run")
+    print(f"saved: {sequential_ms - overlapped_ms:.1f} ms/run ({100 * (1 - overlapped_ms / sequential_ms):.0f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Compare cold and warm invocation latency of process_activities
+
+Upstream calls are replaced with fakes that sleep for a typical round trip,
+so the numbers show how much per-invocation setup the warm context skips.
+
+    python -m benchmarks.bench_warm_start
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+from src.context import AppContext
+from src.main import process_activities
+
+# Simulated round-trip latency of one upstream call, in seconds
+CALL_LATENCY = 0.05
+RUNS = 5
+
+
+def _slow(return_value=None):
+    def call(*args, **kwargs):
+        time.sleep(CALL_LATENCY)
+        return return_value
+    return MagicMock(side_effect=call)
+
+
+def _fake_auth(use_s3=False, session=None, bundle=None):
+    auth = MagicMock()
+    auth.authenticate = _slow()
+    auth.client.token_expires_at = time.time() + 3600
+    return auth
+
+
+def _fake_activities(auth):
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(hours=1)
+    activities = MagicMock()
+    activities.get_athlete_info = _slow(MagicMock(firstname="Bench", lastname="Mark"))
+    activities.get_activities = _slow([("Bench Run", now, now.timestamp(), end, end.timestamp())])
+    return activities
+
+
+def _fake_spotify(session=None, **kwargs):
+    # Constructing spotipy's OAuth manager reads the token cache from disk
+    time.sleep(CALL_LATENCY)
+    spotify = MagicMock()
+    spotify.get_activity_tracks = _slow(["spotify:track:bench"])
+    return spotify
+
+
+def _time_run(context):
+    start = time.perf_counter()
+    process_activities(create_playlist=False, context=context)
+    return time.perf_counter() - start
+
+
+def main():
+    with patch("src.context.StravaAuth", side_effect=_fake_auth), \
+         patch("src.context.StravaActivities", side_effect=_fake_activities), \
+         patch("src.context.SpotifyHandler", side_effect=_fake_spotify):
+        cold = [_time_run(AppContext()) for _ in range(RUNS)]
+
+        context = AppContext()
+        _time_run(context)
+        warm = [_time_run(context) for _ in range(RUNS)]
+
+    cold_ms = 1000 * sum(cold) / RUNS
+    warm_ms = 1000 * sum(warm) / RUNS
+    print(f"cold: {cold_ms:.1f} ms/run")
+    print(f"warm: {warm_ms:.1f} ms/run")
+    print(f"saved: {cold_ms - warm_ms:.1f} ms/run ({100 * (1 - warm_ms / cold_ms):.0f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,13 +4,26 @@ import boto3
 import base64
 from botocore.exceptions import ClientError
 import logging
+from contextlib import nullcontext
 
+from src.context import AppContext
+from src.deadline import Deadline, WorkDeferred, boto_config
+from src.export import exporter_from_env
+from src.batch import process_batch
 from src.main import process_activities
+from src.profiling import profiler_from_env
+from src.token_refresh import refresh_window_from_env
+from src.webhook import handle_webhook, queue_from_env
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Created once per container and reused by warm invocations.
+# In Lambda, we always use S3 for token storage
+app_context = AppContext(use_s3=True)
+webhook_queue = None
+
 def get_secret():
     """Retrieve secrets from AWS Secrets Manager"""
     secret_name = os.environ.get('SECRET_NAME')
@@ -23,7 +36,9 @@ def get_secret():
     session = boto3.session.Session()
     client = session.client(
         service_name='secretsmanager',
-        region_name=region_name
+        region_name=region_name,
+        # Bounded timeouts, like every other boto3 client
+        config=boto_config()
     )
 
     try:
@@ -50,12 +65,15 @@ def lambda_handler(event, context):
     try:
         logger.info("Starting Motivator scheduled run")
         
-        # Load secrets
-        get_secret()
+        # Load secrets once per container
+        if not app_context.secrets_loaded:
+            get_secret()
+            app_context.secrets_loaded = True
         
         # Get parameters from environment variables with defaults
         create_playlist = os.environ.get('CREATE_PLAYLIST', 'true').lower() == 'true'
         limit = int(os.environ.get('ACTIVITY_LIMIT', 1))
+        align_streams = os.environ.get('ALIGN_STREAMS', 'false').lower() == 'true'
         
         # In Lambda, we always use S3 for token storage
         use_s3 = True
@@ -68,18 +86,97 @@ def lambda_handler(event, context):
             
         logger.info(f"Processing with create_playlist={create_playlist}, limit={limit}, s3_bucket={s3_bucket}")
         
-        # Process activities
-        results = process_activities(
-            create_playlist=create_playlist, 
-            limit=limit,
-            use_s3=use_s3
-        )
+        # Process activities, profiled when PROFILE is set
+        deadline = Deadline.from_lambda_context(context)
+        with profiler_from_env(use_s3=use_s3, label='lambda') or nullcontext():
+            results = process_activities(
+                create_playlist=create_playlist, 
+                limit=limit,
+                use_s3=use_s3,
+                context=app_context,
+                align_streams=align_streams,
+                exporter=exporter_from_env(use_s3=use_s3),
+                deadline=deadline
+            )
         
         logger.info(f"Successfully processed {len(results)} activities")
+
+        # With the work done, renew tokens that would expire before the
+        # next run so it doesn't wait on OAuth
+        refresh_window = refresh_window_from_env()
+        if refresh_window:
+            app_context.refresh_tokens(refresh_window, deadline=deadline)
+        app_context.cache_missing_athlete(deadline=deadline)
         return {
             'success': True,
-            'activities': results
+            'activities': results,
+            'deferred': len(app_context.deferred)
+        }
+    except WorkDeferred as e:
+        # An upstream is down or time ran out before any work was done;
+        # return rather than raise so the schedule doesn't retry into it
+        logger.warning(f"Run deferred: {str(e)}")
+        return {
+            'success': False,
+            'deferred': str(e)
         }
     except Exception as e:
         logger.error(f"Error running Motivator: {str(e)}")
-        raise
\ No newline at end of file
+        # Don't let a possibly broken client leak into the next invocation
+        app_context.reset()
+        raise
+
+
+def webhook_handler(event, context):
+    """AWS Lambda handler for Strava webhook push events via API Gateway"""
+    try:
+        if not app_context.secrets_loaded:
+            get_secret()
+            app_context.secrets_loaded = True
+
+        if not os.environ.get('S3_BUCKET'):
+            raise ValueError("S3_BUCKET environment variable must be set")
+
+        # Hand events to the queue when one is configured, answering Strava at once
+        global webhook_queue
+        if webhook_queue is None:
+            webhook_queue = queue_from_env()
+
+        create_playlist = os.environ.get('CREATE_PLAYLIST', 'true').lower() == 'true'
+        return handle_webhook(event, create_playlist=create_playlist, use_s3=True, context=app_context,
+                              queue=webhook_queue, deadline=Deadline.from_lambda_context(context))
+    except Exception as e:
+        logger.error(f"Error handling webhook: {str(e)}")
+        app_context.reset()
+        raise
+
+
+def batch_handler(event, context):
+    """AWS Lambda handler for SQS batches of activity IDs
+
+    Requires ReportBatchItemFailures on the event source mapping so that
+    only the failed records are retried.
+    """
+    try:
+        if not app_context.secrets_loaded:
+            get_secret()
+            app_context.secrets_loaded = True
+
+        if not os.environ.get('S3_BUCKET'):
+            raise ValueError("S3_BUCKET environment variable must be set")
+
+        create_playlist = os.environ.get('CREATE_PLAYLIST', 'true').lower() == 'true'
+        max_workers = int(os.environ.get('BATCH_WORKERS', 4))
+        response = process_batch(
+            event.get('Records', []),
+            create_playlist=create_playlist,
+            use_s3=True,
+            context=app_context,
+            max_workers=max_workers,
+            deadline=Deadline.from_lambda_context(context)
+        )
+        return {'batchItemFailures': response['batchItemFailures']}
+    except Exception as e:
+        logger.error(f"Error handling batch: {str(e)}")
+        app_context.reset()
+        raise
@@ -26,4 +26,10 @@ setup(
         "spotipy>=2.22.1",
         "boto3>=1.28.0",
     ],
+    extras_require={
+        "analysis": [
+            "numpy>=1.22",
+            "pyarrow>=12.0",
+        ],
+    },
 )
\ No newline at end of file
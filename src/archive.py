@@ -0,0 +1,283 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+
+from src.storage import LocalStorage, S3Storage, S3_PREFIX, WriteConflict
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('day', 'month')
+
+# Partitions with more objects than this are merged on the next flush
+COMPACT_THRESHOLD = 8
+
+# Conditional manifest writes to try before giving up on a flush
+MANIFEST_ATTEMPTS = 3
+
+
+def _to_epoch(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(timezone.utc).timestamp()
+
+
+def partition_of(epoch: float, granularity: str) -> str:
+    """Partition name (``YYYY-MM-DD`` or ``YYYY-MM``) of a timestamp"""
+    moment = datetime.fromtimestamp(epoch, tz=timezone.utc)
+    return moment.strftime('%Y-%m-%d' if granularity == 'day' else '%Y-%m')
+
+
+def partition_bounds(partition: str, granularity: str):
+    """Return the [start, end) epoch range covered by a partition"""
+    if granularity == 'day':
+        start = datetime.strptime(partition, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+    else:
+        start = datetime.strptime(partition, '%Y-%m').replace(tzinfo=timezone.utc)
+        end = (start + timedelta(days=32)).replace(day=1)
+    return start.timestamp(), end.timestamp()
+
+
+class PartitionedArchive:
+    """Append-only records sharded into gzip JSON-lines objects by time
+
+    Objects live under ``<name>/<partition>/part-<hash>.jsonl.gz`` with a
+    small ``<name>/manifest.json`` listing each object's record count and
+    time range. Lookups read the manifest and fetch only the objects that
+    overlap the requested window, so the I/O per run stays flat however
+    long the archive grows. Appends are buffered and written by flush().
+
+    Args:
+        storage: LocalStorage or S3Storage
+        name (str): Archive name, used as key prefix
+        time_field (str): Record field holding an ISO timestamp or epoch
+        granularity (str): ``day`` or ``month`` partitions
+    """
+
+    def __init__(self, storage, name: str, time_field: str, granularity='day'):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unsupported archive granularity: {granularity}")
+        self.storage = storage
+        self.name = name
+        self.time_field = time_field
+        self.granularity = granularity
+        self._manifest = None
+        self._pending = []
+
+    @property
+    def manifest_key(self) -> str:
+        return f"{self.name}/manifest.json"
+
+    @property
+    def manifest(self) -> dict:
+        if self._manifest is None:
+            self._manifest = self._parse_manifest(self.storage.get(self.manifest_key))
+        return self._manifest
+
+    def _parse_manifest(self, data) -> dict:
+        manifest = json.loads(data) if data else {
+            'version': 1,
+            'granularity': self.granularity,
+            'latest': None,
+            'partitions': {},
+        }
+        if manifest['granularity'] != self.granularity:
+            raise ValueError(
+                f"Archive {self.name} uses {manifest['granularity']} partitions, not {self.granularity}"
+            )
+        return manifest
+
+    def append(self, records: list, only_newer=False) -> int:
+        """Buffer records for the next flush
+
+        Args:
+            records (list): Dicts with ``time_field`` set
+            only_newer (bool): Drop records not newer than the newest
+                archived one, for sources that re-send recent history
+
+        Returns:
+            int: Number of records buffered
+        """
+        latest = self.manifest['latest']
+        if self._pending:
+            pending_latest = max(_to_epoch(record[self.time_field]) for record in self._pending)
+            latest = pending_latest if latest is None else max(latest, pending_latest)
+        if only_newer and latest is not None:
+            records = [record for record in records if _to_epoch(record[self.time_field]) > latest]
+        self._pending.extend(records)
+        return len(records)
+
+    def _read_object(self, key: str) -> list:
+        data = self.storage.get(key)
+        if data is None:
+            return []
+        return [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines() if line]
+
+    def _write_object(self, partition: str, records: list) -> dict:
+        records = sorted(records, key=lambda record: _to_epoch(record[self.time_field]))
+        body = '\n'.join(json.dumps(record, sort_keys=True) for record in records).encode('utf-8')
+        key = f"{self.name}/{partition}/part-{hashlib.sha256(body).hexdigest()[:16]}.jsonl.gz"
+        self.storage.put(key, gzip.compress(body))
+        return {
+            'key': key,
+            'count': len(records),
+            'min': _to_epoch(records[0][self.time_field]),
+            'max': _to_epoch(records[-1][self.time_field]),
+        }
+
+    def flush(self, attempts: int = MANIFEST_ATTEMPTS) -> int:
+        """Write buffered records and the manifest
+
+        The manifest is written conditionally on the version that was read.
+        If another process flushed in between, its manifest is read again
+        and the new objects are added to that one instead.
+
+        Args:
+            attempts (int): Conditional manifest writes to try
+
+        Returns:
+            int: Number of objects written
+
+        Raises:
+            WriteConflict: If another process won every attempt. The
+            records stay buffered, so the next flush tries again.
+        """
+        if not self._pending:
+            return 0
+
+        by_partition = {}
+        for record in self._pending:
+            partition = partition_of(_to_epoch(record[self.time_field]), self.granularity)
+            by_partition.setdefault(partition, []).append(record)
+
+        entries = {
+            partition: self._write_object(partition, records)
+            for partition, records in sorted(by_partition.items())
+        }
+        newest = max(_to_epoch(record[self.time_field]) for record in self._pending)
+
+        # Parts merged away and merged objects of failed attempts
+        unreferenced = set()
+        for attempt in range(1, attempts + 1):
+            data, version = self.storage.get_versioned(self.manifest_key)
+            manifest = self._parse_manifest(data)
+            written = len(entries)
+            for partition, entry in entries.items():
+                objects = manifest['partitions'].setdefault(partition, [])
+                objects.append(entry)
+                if len(objects) > COMPACT_THRESHOLD:
+                    unreferenced.update(self._compact(manifest, partition))
+                    unreferenced.add(manifest['partitions'][partition][0]['key'])
+                    written += 1
+            manifest['latest'] = newest if manifest['latest'] is None else max(manifest['latest'], newest)
+            try:
+                self.storage.put_if(self.manifest_key, json.dumps(manifest, sort_keys=True).encode('utf-8'), version)
+                break
+            except WriteConflict:
+                if attempt == attempts:
+                    self._manifest = None
+                    raise
+                logger.warning(f"Archive {self.name}: manifest changed during flush, retrying (attempt {attempt})")
+
+        self._manifest = manifest
+        # Delete only once the manifest no longer lists them, and only what
+        # the current manifest (which includes every other flush) doesn't
+        listed = {entry['key'] for objects in manifest['partitions'].values() for entry in objects}
+        for key in unreferenced - listed:
+            self.storage.delete(key)
+        self._pending = []
+        logger.info(f"Archive {self.name}: wrote {written} objects")
+        return written
+
+    def _compact(self, manifest: dict, partition: str) -> list:
+        """Merge all objects of a partition into one
+
+        Returns:
+            list: Keys of the merged objects, to delete once the manifest
+            no longer lists them
+        """
+        objects = manifest['partitions'][partition]
+        records = []
+        for entry in objects:
+            records.extend(self._read_object(entry['key']))
+        merged = self._write_object(partition, records)
+        manifest['partitions'][partition] = [merged]
+        return [entry['key'] for entry in objects if entry['key'] != merged['key']]
+
+    def reload(self) -> None:
+        """Drop the cached manifest to see objects written by another process"""
+        if not self._pending:
+            self._manifest = None
+
+    def partitions_between(self, start_epoch: float, end_epoch: float) -> list:
+        """Names of the partitions overlapping a window"""
+        return [
+            partition for partition in sorted(self.manifest['partitions'])
+            if partition_bounds(partition, self.granularity)[0] < end_epoch
+            and partition_bounds(partition, self.granularity)[1] > start_epoch
+        ]
+
+    def query(self, start_epoch: float, end_epoch: float) -> list:
+        """Records strictly inside a window, oldest first"""
+        records = []
+        for partition in self.partitions_between(start_epoch, end_epoch):
+            for entry in self.manifest['partitions'][partition]:
+                if entry['max'] <= start_epoch or entry['min'] >= end_epoch:
+                    continue
+                records.extend(self._read_object(entry['key']))
+        records.extend(self._pending)
+        matches = [
+            record for record in records
+            if start_epoch < _to_epoch(record[self.time_field]) < end_epoch
+        ]
+        return sorted(matches, key=lambda record: _to_epoch(record[self.time_field]))
+
+
+class PlayArchive(PartitionedArchive):
+    """Partitioned archive of Spotify plays, usable as a play source"""
+
+    def __init__(self, storage, granularity='day', name='plays'):
+        super().__init__(storage, name, 'played_at', granularity)
+
+    def add_plays(self, items: list) -> int:
+        """Buffer recently-played items newer than anything archived"""
+        return self.append(
+            [{'played_at': item['played_at'], 'track_uri': item['track']['uri']} for item in items],
+            only_newer=True
+        )
+
+    def plays_between(self, start_epoch: float, end_epoch: float) -> list:
+        """Return (track_uri, played_at) pairs inside a window, newest first"""
+        return [
+            (record['track_uri'], record['played_at'])
+            for record in reversed(self.query(start_epoch, end_epoch))
+        ]
+
+
+def archives_from_env(use_s3=False):
+    """Build the (plays, results) archives configured by environment variables
+
+    ``ARCHIVE`` selects ``local`` (``ARCHIVE_DIR``), ``s3`` (under
+    ``S3_BUCKET``/``S3_PREFIX``/archive) or ``off`` (default).
+    ``ARCHIVE_GRANULARITY`` is ``day`` (default) or ``month``.
+
+    Returns:
+        tuple: (PlayArchive, PartitionedArchive) or (None, None)
+    """
+    mode = os.environ.get('ARCHIVE', 'off').lower()
+    if mode == 'off':
+        return None, None
+    granularity = os.environ.get('ARCHIVE_GRANULARITY', 'day')
+    if mode == 's3':
+        prefix = os.environ.get('S3_PREFIX', S3_PREFIX)
+        storage = S3Storage(os.environ.get('S3_BUCKET'), f"{prefix}/archive")
+    else:
+        storage = LocalStorage(os.environ.get('ARCHIVE_DIR', 'archive'))
+    return (
+        PlayArchive(storage, granularity),
+        PartitionedArchive(storage, 'results', 'start_time', granularity),
+    )
@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from stravalib.client import Client
+
+from src.lease import FileLease
+from src.sessions import create_session
+from src.store import store_from_env
+from src.strava.activities import _activity_record, activity_type
+from src.strava.auth import StravaAuth
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Strava's default read limits: (requests, window in seconds)
+STRAVA_LIMITS = ((100, 15 * 60), (1000, 24 * 3600))
+
+# Activities per page stravalib requests from /athlete/activities
+PAGE_SIZE = 200
+
+# Shared by every backfill on the machine
+BUDGET_PATH = os.path.join(tempfile.gettempdir(), 'motivator-rate-budget.json')
+
+ShardJob = namedtuple('ShardJob', 'index after before access_token budget_path activity_types')
+
+
+def shard_ranges(start_epoch: float, end_epoch: float, shards: int) -> list:
+    """Split [start, end) into ``shards`` contiguous (after, before) ranges"""
+    shards = max(1, int(shards))
+    step = (end_epoch - start_epoch) / shards
+    bounds = [start_epoch + i * step for i in range(shards)] + [end_epoch]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class RateBudget:
+    """Request budget shared by every process on the machine
+
+    Usage per fixed window (Strava resets every quarter hour and at
+    midnight UTC) is kept in a small JSON file guarded by a FileLease, so
+    worker processes draw from one budget instead of each assuming they
+    own the full limit. When a window is spent, acquire() sleeps until
+    it resets.
+
+    Args:
+        path (str): Budget file, shared by the workers
+        limits (tuple): (requests, window seconds) pairs
+        clock (callable): Current time in seconds, for tests
+        sleep (callable): Sleep function, for tests
+    """
+
+    def __init__(self, path: str, limits=STRAVA_LIMITS, clock=time.time, sleep=time.sleep):
+        self.path = path
+        self.limits = limits
+        self.clock = clock
+        self.sleep = sleep
+        self.waited = 0.0
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _try_take(self, calls: int) -> float:
+        """Take ``calls`` from every window, or return seconds to wait"""
+        with FileLease(f"{self.path}.lock", ttl=5, poll_interval=0.01):
+            now = self.clock()
+            usage = self._read()
+            windows = []
+            wait = 0.0
+            for limit, period in self.limits:
+                window = int(now // period) * period
+                used = usage.get(str(period), [window, 0])
+                used = used[1] if used[0] == window else 0
+                if used + calls > limit:
+                    wait = max(wait, window + period - now)
+                windows.append((period, window, used))
+            if wait:
+                return wait
+            for period, window, used in windows:
+                usage[str(period)] = [window, used + calls]
+            with open(self.path, 'w') as f:
+                json.dump(usage, f)
+            return 0.0
+
+    def acquire(self, calls: int = 1) -> None:
+        while True:
+            wait = self._try_take(calls)
+            if not wait:
+                return
+            logger.info(f"Rate budget spent, waiting {wait:.0f}s")
+            self.waited += wait
+            self.sleep(wait)
+
+    def used(self) -> dict:
+        """Requests used in the current window, keyed by window seconds"""
+        now = self.clock()
+        usage = self._read()
+        return {
+            period: usage[str(period)][1] if usage.get(str(period), [None])[0] == int(now // period) * period else 0
+            for _, period in self.limits
+        }
+
+
+def _utc(epoch: float) -> datetime:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc)
+
+
+def fetch_shard(job: ShardJob, client=None) -> tuple:
+    """List one time range of activities; runs inside a worker process
+
+    Each worker builds its own HTTP session and stravalib client from the
+    access token, so nothing but the token crosses the process boundary.
+
+    Returns:
+        tuple: (shard index, list of ActivityRecord, pages requested)
+    """
+    if client is None:
+        client = Client(access_token=job.access_token, requests_session=create_session())
+    budget = RateBudget(job.budget_path)
+
+    records = []
+    pages = 1
+    budget.acquire()
+    for count, activity in enumerate(client.get_activities(after=_utc(job.after), before=_utc(job.before)), 1):
+        if job.activity_types is None or activity_type(activity) in job.activity_types:
+            records.append(_activity_record(activity))
+        if count % PAGE_SIZE == 0:
+            # The next item comes from another page request
+            budget.acquire()
+            pages += 1
+    logger.info(f"Shard {job.index}: {len(records)} activities in {pages} pages")
+    return job.index, records, pages
+
+
+def merge_shards(shard_results: list) -> list:
+    """Combine shard outputs into one list, oldest first, one per activity ID
+
+    The order only depends on the activities, never on which worker
+    finished first, so reruns write identical rows.
+    """
+    by_id = {}
+    for _, records, _ in sorted(shard_results, key=lambda result: result[0]):
+        for record in records:
+            by_id.setdefault(record.activity_id, record)
+    return sorted(by_id.values(), key=lambda record: (record.start_epoch, record.activity_id))
+
+
+def backfill(access_token: str, store, start_epoch: float, end_epoch: float = None,
+             workers: int = None, shards: int = None, budget_path: str = None,
+             activity_types=('Run',), executor_factory=ProcessPoolExecutor) -> dict:
+    """Import Strava history into the state store in parallel
+
+    The time range is cut into more shards than workers so a busy year
+    doesn't leave the other workers idle. Failed shards are reported and
+    left out; rerunning the backfill fills them in.
+
+    Args:
+        access_token (str): Valid Strava access token shared by the workers
+        store (StateStore): Where the activities are merged into
+        start_epoch (float): Oldest start time to import
+        end_epoch (float): Newest start time (default: now)
+        workers (int): Worker processes (default: CPU count)
+        shards (int): Time ranges (default: 4 per worker)
+        budget_path (str): Shared rate budget file
+        activity_types (tuple): Activity types to keep, or None for all
+        executor_factory (callable): Pool class, e.g. a thread pool in tests
+
+    Returns:
+        dict: Counts of shards, failed shards, pages, activities and new rows
+    """
+    started = time.perf_counter()
+    end_epoch = end_epoch or time.time()
+    workers = workers or os.cpu_count() or 1
+    shards = shards or workers * 4
+    budget_path = budget_path or BUDGET_PATH
+
+    jobs = [
+        ShardJob(index, after, before, access_token, budget_path,
+                 tuple(activity_types) if activity_types else None)
+        for index, (after, before) in enumerate(shard_ranges(start_epoch, end_epoch, shards))
+    ]
+
+    results = []
+    failed = []
+    with executor_factory(max_workers=workers) as executor:
+        futures = [(job, executor.submit(fetch_shard, job)) for job in jobs]
+        for job, future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"Shard {job.index} ({_utc(job.after)} - {_utc(job.before)}) failed: {str(e)}")
+                failed.append(job.index)
+
+    records = merge_shards(results)
+    stored = store.add_activities(records) if store is not None else 0
+    if store is not None:
+        store.save()
+
+    report = {
+        'shards': len(jobs),
+        'failed_shards': failed,
+        'pages': sum(pages for _, _, pages in results),
+        'activities': len(records),
+        'stored': stored,
+        'wall': round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"Backfill done: {report}")
+    return report
+
+
+def main(argv=None):
+    """Backfill from the command line: python -m src.backfill --since 2018-01-01"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(processName)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description='Backfill Strava history into the state store')
+    parser.add_argument('--since', required=True, help='Oldest activity date, YYYY-MM-DD')
+    parser.add_argument('--until', help='Newest activity date, YYYY-MM-DD (default: now)')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--shards', type=int, help='Time ranges (default: 4 per worker)')
+    parser.add_argument('--all-types', action='store_true', help='Keep every activity type, not only runs')
+    parser.add_argument('--plan', action='store_true', help='Estimate pages and time without calling Strava')
+    args = parser.parse_args(argv)
+
+    store = store_from_env()
+    if store is None:
+        parser.error('STATE_DB must be set to local or s3 to backfill')
+
+    def epoch(day):
+        return datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+
+    if args.plan:
+        from src.dry_run import plan_backfill
+        plan = plan_backfill(
+            store,
+            epoch(args.since),
+            epoch(args.until) if args.until else None,
+            workers=args.workers,
+            shards=args.shards,
+            budget=RateBudget(BUDGET_PATH)
+        )
+        print(json.dumps(plan, indent=2))
+        return plan
+
+    auth = StravaAuth()
+    auth.authenticate()
+
+    return backfill(
+        auth.client.access_token,
+        store,
+        epoch(args.since),
+        epoch(args.until) if args.until else None,
+        workers=args.workers,
+        shards=args.shards,
+        activity_types=None if args.all_types else ('Run',)
+    )
+
+
+if __name__ == '__main__':
+    main()
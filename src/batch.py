@@ -0,0 +1,181 @@
+import json
+import uuid
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.deadline import get_request_guard
+from src.main import process_activity_id, sync_top_tracks
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def parse_activity_id(record: dict) -> int:
+    """Extract the Strava activity ID from an SQS record
+
+    The body is either a bare ID or JSON with an ``activity_id`` (or a
+    Strava webhook event with ``object_id``).
+    """
+    body = json.loads(record['body'])
+    if isinstance(body, dict):
+        body = body.get('activity_id', body.get('object_id'))
+    return int(body)
+
+
+def wants_fresh(record: dict) -> bool:
+    """Whether a message asks for the activity to be fetched past the HTTP cache"""
+    body = json.loads(record['body'])
+    return isinstance(body, dict) and bool(body.get('fresh'))
+
+
+def process_batch(records: list, create_playlist=True, use_s3=False, context=None,
+                  max_workers=4, deadline=None) -> dict:
+    """Process SQS records concurrently and report partial failures
+
+    Each record is one activity. Failures are collected instead of raised so
+    that only the failed records go back to the queue. Records for the same
+    activity are processed once and succeed or fail together. A failure to
+    save the state at the end is logged and reported, not turned into
+    record failures: the playlists exist, and retrying the records would
+    create them again.
+
+    Args:
+        records (list): SQS records with ``messageId`` and ``body``
+        create_playlist (bool): Whether to create Spotify playlists
+        use_s3 (bool): Whether to use S3 for token storage
+        context (AppContext): Warm context shared by all workers
+        max_workers (int): Number of records processed at once
+        deadline (Deadline): Time budget for the batch's outbound calls
+
+    Returns:
+        dict: ``batchItemFailures`` in the SQS partial batch response format,
+        plus the per-activity ``results`` and any ``save_error``
+    """
+    get_request_guard().start(deadline)
+    if not records:
+        return {'batchItemFailures': [], 'results': []}
+
+    failed = set()
+    by_activity = {}
+    for record in records:
+        try:
+            activity_id = parse_activity_id(record)
+        except Exception as e:
+            logger.error(f"Record {record['messageId']} failed: {str(e)}")
+            failed.add(record['messageId'])
+            continue
+        # Duplicates would race past is_processed in parallel workers
+        by_activity.setdefault(activity_id, []).append(record)
+
+    # Authenticate once up front rather than racing from every worker
+    if context is not None and by_activity:
+        context.ensure()
+
+    def process(activity_id, group):
+        return process_activity_id(
+            activity_id,
+            create_playlist=create_playlist,
+            use_s3=use_s3,
+            context=context,
+            save=False,
+            fresh=any(wants_fresh(record) for record in group)
+        )
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            (group, executor.submit(process, activity_id, group))
+            for activity_id, group in by_activity.items()
+        ]
+        for group, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                for record in group:
+                    logger.error(f"Record {record['messageId']} failed: {str(e)}")
+                    failed.add(record['messageId'])
+            else:
+                if result is not None:
+                    results.append(result)
+
+    response = {
+        'batchItemFailures': [{'itemIdentifier': record['messageId']} for record in records
+                              if record['messageId'] in failed],
+        'results': results,
+    }
+
+    # One top tracks sync and one state upload for the whole batch
+    if context is not None:
+        if create_playlist and context.top_tracks is not None:
+            sync_top_tracks(context.top_tracks, context.spotify)
+        try:
+            context.save_state()
+        except Exception as e:
+            logger.error(f"Could not save state after the batch: {str(e)}")
+            response['save_error'] = str(e)
+
+    logger.info(f"Processed {len(records)} records, {len(failed)} failed")
+    return response
+
+
+class InMemoryQueue:
+    """Minimal SQS stand-in for running the batch handler locally
+
+    Messages received but not acknowledged are redelivered on a later
+    receive, like an SQS visibility timeout expiring.
+    """
+
+    def __init__(self):
+        self._messages = deque()
+        self._in_flight = {}
+        self.receive_counts = {}
+
+    def __len__(self):
+        return len(self._messages) + len(self._in_flight)
+
+    def send(self, body) -> str:
+        message_id = str(uuid.uuid4())
+        self._messages.append({
+            'messageId': message_id,
+            'body': body if isinstance(body, str) else json.dumps(body),
+            'eventSource': 'aws:sqs',
+        })
+        return message_id
+
+    def receive(self, max_messages=10) -> dict:
+        """Return an SQS-style event with up to ``max_messages`` records"""
+        # Unacknowledged messages become visible again
+        self._messages.extend(self._in_flight.values())
+        self._in_flight.clear()
+
+        records = []
+        while self._messages and len(records) < max_messages:
+            message = self._messages.popleft()
+            self._in_flight[message['messageId']] = message
+            self.receive_counts[message['messageId']] = self.receive_counts.get(message['messageId'], 0) + 1
+            records.append(message)
+        return {'Records': records}
+
+    def acknowledge(self, event: dict, response: dict) -> None:
+        """Delete successful records, keeping the reported failures"""
+        failed = {failure['itemIdentifier'] for failure in response.get('batchItemFailures', [])}
+        for record in event['Records']:
+            if record['messageId'] not in failed:
+                self._in_flight.pop(record['messageId'], None)
+
+    def drain(self, handler, max_messages=10, max_receives=3) -> list:
+        """Feed the queue through ``handler`` until empty or out of retries
+
+        Returns:
+            list: Bodies of messages that still failed after ``max_receives``
+        """
+        dead_letters = []
+        while len(self):
+            event = self.receive(max_messages)
+            self.acknowledge(event, handler(event))
+            for message_id, message in list(self._in_flight.items()):
+                if self.receive_counts[message_id] >= max_receives:
+                    dead_letters.append(message['body'])
+                    del self._in_flight[message_id]
+        return dead_letters
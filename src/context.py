@@ -0,0 +1,237 @@
+import time
+import logging
+
+from src.archive import archives_from_env
+from src.deadline import get_request_guard
+from src.http_cache import SPOTIFY_HOST, STRAVA_HOST, cache_from_env
+from src.sessions import create_session, log_connection_stats
+from src.state_bundle import BundleStorage, StateConflict, bundle_from_env
+from src.storage import WriteConflict
+from src.store import merge_databases, store_from_env
+from src.token_refresh import refresh_tokens
+from src.top_tracks import top_tracks_from_env
+from src.strava.auth import StravaAuth
+from src.strava.activities import StravaActivities
+from src.spotify.enrichment import enricher_from_env
+from src.spotify.handler import SpotifyHandler
+from src.spotify.recorder import recorded_plays_from_env
+from src.spotify.token_cache import cache_handler_from_env
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class AppContext:
+    """Authenticated clients and caches shared across invocations
+
+    A Lambda container keeps module globals alive between warm invocations,
+    so a context created at import time lets warm runs skip secret loading,
+    token loading, client construction and profile lookups. Each run only
+    calls ensure(), which re-authenticates when the Strava token is close
+    to expiry and is otherwise free.
+    """
+
+    def __init__(self, use_s3=False, token_margin=300):
+        self.use_s3 = use_s3
+        self.token_margin = token_margin
+        self.secrets_loaded = False
+        self.session = None
+        self.bundle = None
+        self.http_cache = None
+        self.strava_auth = None
+        self.strava = None
+        self.spotify = None
+        self.store = None
+        self.play_archive = None
+        self.results_archive = None
+        self.recorded_plays = None
+        self.enricher = None
+        self.top_tracks = None
+        self.athlete = None
+        self.processed_activity_ids = set()
+        self.in_flight_activity_ids = set()
+        self.invocations = 0
+        self.startup_report = None
+        self.deferred = []
+        self._state_changed = False
+        self._athlete_fetched = False
+
+    @property
+    def initialized(self) -> bool:
+        return self.strava_auth is not None and self.spotify is not None
+
+    def is_valid(self) -> bool:
+        """Cheap check that the cached clients can be used as-is"""
+        if not self.initialized:
+            return False
+        expires_at = self.strava_auth.client.token_expires_at
+        if not isinstance(expires_at, (int, float)):
+            return False
+        return time.time() + self.token_margin < expires_at
+
+    def prepare(self) -> 'AppContext':
+        """Set up what both API clients depend on: state, HTTP cache and session
+
+        On warm starts this only checks whether the state bundle changed.
+        """
+        self.invocations += 1
+        self._state_changed = False
+        if self.session is None:
+            logger.info("Cold start: initializing clients")
+            self.bundle = bundle_from_env(use_s3=self.use_s3)
+            blob_storage = None
+            if self.bundle is not None:
+                self.bundle.load()
+                blob_storage = BundleStorage(self.bundle)
+                blob_storage.register_merge('state.db', merge_databases)
+            self.http_cache = cache_from_env(use_s3=self.use_s3, storage=blob_storage)
+            if self.http_cache is not None:
+                # Key cached responses by who asks, so they outlive token rotation
+                self.http_cache.set_identity(STRAVA_HOST, self._strava_identity)
+                self.http_cache.set_identity(SPOTIFY_HOST, self._spotify_identity)
+            self.session = create_session(cache=self.http_cache, guard=get_request_guard())
+            self.store = store_from_env(use_s3=self.use_s3, storage=blob_storage)
+            self.play_archive, self.results_archive = archives_from_env(use_s3=self.use_s3)
+            self.recorded_plays = recorded_plays_from_env()
+            self.enricher = enricher_from_env(use_s3=self.use_s3)
+            self.top_tracks = top_tracks_from_env(use_s3=self.use_s3, storage=blob_storage)
+        elif self.bundle is not None and self.bundle.load():
+            # Another container changed the state; re-read what derives from it
+            logger.info("State bundle changed since last run, reloading")
+            self._state_changed = True
+            if self.store is not None:
+                self.store.reload()
+            if self.top_tracks is not None:
+                self.top_tracks.reload()
+        else:
+            logger.info(f"Warm start: reusing clients (invocation {self.invocations})")
+        if self.recorded_plays is not None:
+            # Written by a recorder process since the last run
+            self.recorded_plays.reload()
+        for archive in (self.play_archive, self.results_archive):
+            if archive is not None:
+                # Other containers append to the same archives
+                archive.reload()
+        return self
+
+    def _strava_identity(self):
+        athlete = self.strava_auth.athlete if self.strava_auth is not None else None
+        return athlete.get('id') if athlete else None
+
+    def _spotify_identity(self):
+        return self.spotify.user_id if self.spotify is not None else None
+
+    def ensure_strava(self):
+        """Build or re-authenticate the Strava client; call after prepare()"""
+        if self.strava_auth is None:
+            self.strava_auth = StravaAuth(use_s3=self.use_s3, session=self.session, bundle=self.bundle)
+            self.strava_auth.authenticate()
+            self.strava = StravaActivities(self.strava_auth)
+        elif self._state_changed:
+            self.strava_auth.authenticate()
+        elif not self.is_valid():
+            logger.info("Warm start: Strava token expiring, re-authenticating")
+            self.strava_auth.authenticate()
+        return self.strava
+
+    def ensure_spotify(self):
+        """Build the Spotify client once; call after prepare()"""
+        if self.spotify is None:
+            self.spotify = SpotifyHandler(
+                session=self.session,
+                play_log=self.recorded_plays,
+                # Keep the Spotify token where the Strava token is kept
+                cache_handler=cache_handler_from_env(use_s3=self.use_s3, bundle=self.bundle)
+            )
+        return self.spotify
+
+    def ensure(self) -> 'AppContext':
+        """Initialize on cold start, re-authenticate only when needed"""
+        self.prepare()
+        self.ensure_strava()
+        self.ensure_spotify()
+        return self
+
+    def save_state(self) -> None:
+        """Persist everything that changed during the run
+
+        With a state bundle the store and cache write into the bundle first,
+        so the whole run costs one PUT at most. If another container keeps
+        winning the write, the changes stay pending for the next save
+        rather than failing a run whose playlists already exist.
+
+        The track metadata cache and the archives are not part of the
+        bundle: the former is shared by all users and the latter are
+        append-only partitions, so both keep writing their own objects.
+        """
+        if self.store is not None:
+            self.store.save()
+        if self.enricher is not None:
+            self.enricher.save()
+        if self.top_tracks is not None:
+            self.top_tracks.save()
+        for archive in (self.play_archive, self.results_archive):
+            if archive is not None:
+                try:
+                    archive.flush()
+                except WriteConflict as e:
+                    logger.error(f"Archive not saved, will retry on the next run: {str(e)}")
+        if self.bundle is not None:
+            try:
+                self.bundle.save()
+            except StateConflict as e:
+                logger.error(f"State not saved, will retry on the next run: {str(e)}")
+
+    def refresh_tokens(self, window: float, deadline=None) -> dict:
+        """Renew Strava and Spotify tokens expiring within ``window`` seconds
+
+        Run after the work of an invocation, so the next one starts with
+        valid tokens instead of refreshing inline.
+        """
+        return refresh_tokens({'strava': self.strava_auth, 'spotify': self.spotify}, window, deadline)
+
+    def get_athlete(self, fetch=False):
+        """Return the cached athlete profile
+
+        Args:
+            fetch (bool): Call the Strava API if no fresh profile is cached
+
+        Returns:
+            dict: Profile with id, firstname and lastname, or None
+        """
+        if self.athlete is None:
+            self.athlete = self.strava_auth.get_cached_athlete()
+        if self.athlete is None and fetch:
+            self.strava.get_athlete_info()
+            self.athlete = self.strava_auth.get_cached_athlete()
+        return self.athlete
+
+    def cache_missing_athlete(self, deadline=None) -> None:
+        """Fetch and cache the athlete profile once if the token has none
+
+        Tokens saved before profiles were cached have no athlete, and the
+        hot path never spends a call on it; run this after the work of a
+        run instead. Failures are logged and not retried in this container.
+        """
+        if self.strava_auth is None or self._athlete_fetched:
+            return
+        if deadline is not None and deadline.remaining() <= 0:
+            return
+        self._athlete_fetched = True
+        try:
+            if self.get_athlete() is None and self.get_athlete(fetch=True) is not None and self.bundle is not None:
+                # The profile is stored with the token, inside the bundle
+                self.bundle.save()
+        except Exception as e:
+            logger.warning(f"Could not fetch the athlete profile: {str(e)}")
+
+    def log_connection_stats(self) -> None:
+        """Log how many requests reused pooled connections"""
+        if self.session is not None:
+            log_connection_stats(self.session)
+        if self.http_cache is not None:
+            logger.info(f"HTTP cache: {self.http_cache.stats}")
+
+    def reset(self) -> None:
+        """Drop all cached state, forcing a cold start on the next run"""
+        self.__init__(use_s3=self.use_s3, token_margin=self.token_margin)
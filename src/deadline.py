@@ -0,0 +1,201 @@
+import time
+import logging
+import threading
+
+from botocore.config import Config
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Per-request timeout when no deadline is set or a client passes none
+DEFAULT_TIMEOUT = 10.0
+# Calls with less time than this left are not started
+MIN_TIMEOUT = 0.5
+# Time kept back from the deadline for saving state before Lambda stops
+DEADLINE_RESERVE = 5.0
+
+BOTO_CONNECT_TIMEOUT = 2
+BOTO_READ_TIMEOUT = 5
+
+_request_guard = None
+_request_guard_lock = threading.Lock()
+
+
+class WorkDeferred(Exception):
+    """Raised when the rest of a run should be left for the next one"""
+
+
+class DeadlineExceeded(WorkDeferred):
+    """Raised instead of starting a call the run has no time left for"""
+
+
+class CircuitOpen(WorkDeferred):
+    """Raised instead of calling an upstream that keeps failing"""
+
+
+class Deadline:
+    """Time budget for one run
+
+    Args:
+        seconds (float): Time until the run is stopped
+        reserve (float): Time kept back for saving state
+    """
+
+    def __init__(self, seconds: float, reserve: float = DEADLINE_RESERVE):
+        self.expires_at = time.monotonic() + seconds
+        self.reserve = reserve
+
+    @classmethod
+    def from_lambda_context(cls, context, reserve: float = DEADLINE_RESERVE):
+        """Deadline from a Lambda context, or None outside Lambda"""
+        remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        if not callable(remaining):
+            return None
+        millis = remaining()
+        if not isinstance(millis, (int, float)):
+            return None
+        return cls(millis / 1000, reserve)
+
+    def remaining(self) -> float:
+        """Seconds left for outbound calls, after the reserve"""
+        return self.expires_at - time.monotonic() - self.reserve
+
+    def timeout(self, requested=None):
+        """Clamp a requests-style timeout (seconds or a tuple) to the time left
+
+        Raises:
+            DeadlineExceeded: If too little time is left to start a call
+        """
+        budget = self.remaining()
+        if budget < MIN_TIMEOUT:
+            raise DeadlineExceeded(f"Run deadline reached ({budget:.1f}s left)")
+        if requested is None:
+            requested = DEFAULT_TIMEOUT
+        if isinstance(requested, tuple):
+            return tuple(budget if part is None else min(part, budget) for part in requested)
+        return min(requested, budget)
+
+
+class CircuitBreaker:
+    """Fail fast after repeated errors from one upstream
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls raise CircuitOpen for ``reset_after`` seconds. Then one trial call
+    is let through; success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_after: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_after:
+            return 'open'
+        return 'half-open'
+
+    def check(self) -> None:
+        """Raise CircuitOpen if calls to this upstream should not be made"""
+        with self._lock:
+            if self.state == 'open':
+                raise CircuitOpen(f"{self.name} failed {self.failures} times in a row, deferring")
+            if self.state == 'half-open':
+                # Let exactly one trial through until it reports back
+                self.opened_at = time.monotonic()
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+class RequestGuard:
+    """Run deadline plus one circuit breaker per upstream host
+
+    Shared by the HTTP adapters and S3 clients of a process. Breakers
+    outlive a run, so warm Lambda invocations during an outage fail fast.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_after: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.deadline = None
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def start(self, deadline=None) -> None:
+        """Apply a new run's deadline (None for no deadline)"""
+        self.deadline = deadline
+
+    def breaker(self, upstream: str) -> CircuitBreaker:
+        with self._lock:
+            if upstream not in self.breakers:
+                self.breakers[upstream] = CircuitBreaker(upstream, self.failure_threshold, self.reset_after)
+            return self.breakers[upstream]
+
+    def before(self, upstream: str, timeout=None):
+        """Check the breaker and return the timeout to use for one call"""
+        self.breaker(upstream).check()
+        if self.deadline is None:
+            return DEFAULT_TIMEOUT if timeout is None else timeout
+        return self.deadline.timeout(timeout)
+
+    def after(self, upstream: str, ok: bool) -> None:
+        breaker = self.breaker(upstream)
+        if ok:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+
+def get_request_guard() -> RequestGuard:
+    """Return the process-wide request guard"""
+    global _request_guard
+    with _request_guard_lock:
+        if _request_guard is None:
+            _request_guard = RequestGuard()
+        return _request_guard
+
+
+def boto_config() -> Config:
+    """botocore Config with bounded timeouts and few retries"""
+    return Config(
+        connect_timeout=BOTO_CONNECT_TIMEOUT,
+        read_timeout=BOTO_READ_TIMEOUT,
+        retries={'max_attempts': 2, 'mode': 'standard'}
+    )
+
+
+def guard_boto_client(client, guard: RequestGuard, upstream: str = 's3'):
+    """Put a boto3 client's calls behind a circuit breaker
+
+    The run deadline is not applied: state is saved to S3 inside the
+    deadline reserve, and boto_config() already bounds each call.
+    """
+    def before_call(**kwargs):
+        guard.breaker(upstream).check()
+
+    def after_call(http_response=None, **kwargs):
+        guard.after(upstream, ok=http_response is None or http_response.status_code < 500)
+
+    def after_call_error(**kwargs):
+        guard.after(upstream, ok=False)
+
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('after-call-error', after_call_error)
+    return client
@@ -0,0 +1,294 @@
+import os
+import math
+import time
+import logging
+from datetime import datetime, timezone
+
+from src.backfill import BUDGET_PATH, PAGE_SIZE, STRAVA_LIMITS, RateBudget, shard_ranges
+from src.planner import group_by_from_env, plan_playlists
+from src.spotify.enrichment import AUDIO_FEATURES_BATCH, TRACKS_BATCH
+from src.spotify.handler import MAX_PLAYLIST_ADD
+from src.store import _played_at_epoch
+from src.strava.activities import ActivityRecord
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Typical round trip of one API call, in seconds
+STRAVA_LATENCY = 0.4
+SPOTIFY_LATENCY = 0.25
+
+# Spotify calls that change the account
+SPOTIFY_WRITES = ('create_playlist', 'add_items', 'remove_items')
+
+
+def _calls(items: int, per_call: int) -> int:
+    return math.ceil(items / per_call) if items > 0 else 0
+
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat() if epoch is not None else None
+
+
+def rate_windows(calls: int, limits=STRAVA_LIMITS, used=None) -> list:
+    """Spread ``calls`` requests over fixed rate-limit windows
+
+    Args:
+        calls (int): Requests to make
+        limits (tuple): (requests, window seconds) pairs
+        used (dict): Requests already spent in the current windows, keyed by
+            window seconds, e.g. RateBudget.used()
+
+    Returns:
+        list: Per limit, the ``windows`` the calls span and the most time
+        spent waiting for them to reset
+    """
+    used = used or {}
+    windows = []
+    for limit, period in limits:
+        spent = used.get(period, 0)
+        count = max(math.ceil((spent + calls) / limit), 1)
+        windows.append({
+            'limit': limit,
+            'window': period,
+            'used': spent,
+            'windows': count,
+            'wait': (count - 1) * period,
+        })
+    return windows
+
+
+def plan_run(store, limit: int = 1, create_playlist: bool = True, align_streams: bool = False,
+             group_by: str = None, activity_ids: list = None, enricher=None, top_tracks=None,
+             budget=None, source: str = 'strava', since: float = None, strava_latency: float = STRAVA_LATENCY,
+             spotify_latency: float = SPOTIFY_LATENCY) -> dict:
+    """Work out what a run would do from cached state, without calling either API
+
+    The newest stored activities stand in for the Strava listing, and
+    stored plays for the Spotify history. Activities that ended after the
+    newest stored play are marked ``history_pending``: their tracks only
+    show up once the run fetches history, so each still counts one
+    playlist write. Activities newer than anything in the store can't be
+    planned; ``cached_through`` says how far the store reaches.
+
+    Args:
+        store (StateStore): Cached activities, plays and playlists
+        limit (int): Activities the run would list
+        create_playlist (bool): Whether the run writes playlists
+        align_streams (bool): Whether the run fetches activity streams
+        group_by (str): Playlist grouping; defaults to PLAYLIST_GROUP_BY
+        activity_ids (list): Plan process_activity_id calls for these IDs
+            (webhook and queue mode) instead of a listing
+        enricher (TrackEnricher): Counts metadata calls for uncached tracks
+        top_tracks (TopTracks): Counts the top tracks playlist sync
+        budget (RateBudget): Strava requests already spent by other processes
+        source (str): Where the run lists activities: ``strava`` or ``store``
+            (no listing calls, see process_activities)
+        since (float): With ``source='store'``, every run starting after
+            this epoch instead of the newest ``limit``
+        strava_latency (float): Seconds per Strava call
+        spotify_latency (float): Seconds per Spotify call
+
+    Returns:
+        dict: Activities, playlists, call counts per endpoint, rate-limit
+        windows and the projected wall time in seconds
+    """
+    strava = {'list_activities': 0, 'get_activity': 0, 'streams': 0}
+    spotify = {
+        'recently_played': 1,
+        'current_user': 0,
+        'create_playlist': 0,
+        'add_items': 0,
+        'remove_items': 0,
+        'tracks': 0,
+        'audio_features': 0,
+    }
+
+    unknown = []
+    if activity_ids is None and source == 'store':
+        rows = store.runs(limit, since)
+        group_by = group_by or group_by_from_env()
+    elif activity_ids is None:
+        if source != 'strava':
+            raise ValueError(f"Unknown activity source: {source}")
+        rows = store.recent_activities(limit)
+        strava['list_activities'] = _calls(limit, PAGE_SIZE)
+        group_by = group_by or group_by_from_env()
+    else:
+        rows = []
+        for activity_id in activity_ids:
+            row = store.activity(activity_id)
+            if row is None:
+                unknown.append(activity_id)
+            else:
+                rows.append(row)
+        strava['get_activity'] = len(activity_ids)
+        # process_activity_id writes one playlist per activity
+        group_by = 'activity'
+
+    latest_play = store.latest_play()
+    history_through = _played_at_epoch(latest_play) if latest_play else None
+    cached_through = max((row[3] for row in rows), default=None)
+
+    activities = []
+    skipped = []
+    matched = []
+    pending = set()
+    for row in rows:
+        record = ActivityRecord.from_row(row)
+        if create_playlist and row[6] is not None:
+            skipped.append(record.activity_id)
+            continue
+        tracks = [uri for uri, _ in store.plays_between(record.start_epoch, record.end_epoch)]
+        history_pending = history_through is None or history_through < record.end_epoch
+        streams = align_streams and activity_ids is None and not store.moving_intervals(record.activity_id)
+        if history_pending:
+            pending.add(record.activity_id)
+        if streams:
+            strava['streams'] += 1
+        activities.append({
+            'activity_id': record.activity_id,
+            'name': record.name,
+            'start_time': record.start.isoformat(),
+            'known_tracks': len(tracks),
+            'history_pending': history_pending,
+            'streams_call': streams,
+        })
+        matched.append((record, {
+            'activity_id': record.activity_id,
+            'activity_type': record.activity_type,
+            'activity_name': record.name,
+            'start_time': record.start.isoformat(),
+            'end_time': record.end.isoformat(),
+            'tracks': tracks,
+        }))
+
+    playlists = []
+    if create_playlist and matched:
+        for group in plan_playlists(matched, group_by, store.playlist_names()):
+            activity_ids_in_group = [activity.activity_id for activity in group.activities]
+            track_count = len(group.tracks)
+            if not track_count and not pending.intersection(activity_ids_in_group):
+                # No tracks, no playlist: the activities are only marked processed
+                continue
+            spotify['current_user'] += 1
+            spotify['create_playlist'] += 1
+            spotify['add_items'] += max(_calls(track_count, MAX_PLAYLIST_ADD), 1)
+            playlists.append({'name': group.name, 'activities': activity_ids_in_group, 'tracks': track_count})
+
+    if enricher is not None:
+        unique = dict.fromkeys(uri for _, result in matched for uri in result['tracks'])
+        uncached = [uri for uri in unique if enricher.cache.get(uri) is None]
+        spotify['tracks'] = _calls(len(uncached), TRACKS_BATCH)
+        spotify['audio_features'] = _calls(len(uncached), AUDIO_FEATURES_BATCH)
+
+    if top_tracks is not None and create_playlist and activity_ids is None and playlists:
+        # At most one create and a full replacement of the playlist
+        if top_tracks.playlist_id is None:
+            spotify['current_user'] += 1
+            spotify['create_playlist'] += 1
+        else:
+            spotify['remove_items'] += _calls(top_tracks.size, MAX_PLAYLIST_ADD)
+        spotify['add_items'] += _calls(top_tracks.size, MAX_PLAYLIST_ADD)
+
+    strava_calls = sum(strava.values())
+    spotify_calls = sum(spotify.values())
+    windows = rate_windows(strava_calls, used=budget.used() if budget is not None else None)
+    wait = max(window['wait'] for window in windows)
+    # Startup lists Strava activities while Spotify fetches history
+    startup = max(strava['list_activities'] * strava_latency, spotify['recently_played'] * spotify_latency)
+    wall = (
+        startup
+        + (strava_calls - strava['list_activities']) * strava_latency
+        + (spotify_calls - spotify['recently_played']) * spotify_latency
+        + wait
+    )
+
+    plan = {
+        'activities': activities,
+        'skipped': skipped,
+        'unknown': unknown,
+        'cached_through': _iso(cached_through),
+        'history_through': latest_play,
+        'playlists': playlists,
+        'calls': {
+            'strava': strava,
+            'spotify': spotify,
+            'total': strava_calls + spotify_calls,
+            'writes': sum(spotify[name] for name in SPOTIFY_WRITES),
+        },
+        'rate_limits': {'strava': windows},
+        'wall': round(wall, 2),
+    }
+    logger.info(
+        f"Plan: {len(activities)} activities, {len(playlists)} playlists, "
+        f"{strava_calls} Strava and {spotify_calls} Spotify calls, about {plan['wall']}s"
+    )
+    return plan
+
+
+def plan_backfill(store, start_epoch: float, end_epoch: float = None, workers: int = None,
+                  shards: int = None, budget=None, latency: float = STRAVA_LATENCY) -> dict:
+    """Estimate the pages, rate-limit windows and wall time of a backfill
+
+    Pages per shard come from the activities the store already holds in
+    its range (one more for the final short page), so before a first
+    backfill the estimate is a lower bound of one page per shard.
+
+    Args:
+        store (StateStore): Cached activities, or None
+        start_epoch (float): Oldest start time to import
+        end_epoch (float): Newest start time (default: now)
+        workers (int): Worker processes (default: CPU count)
+        shards (int): Time ranges (default: 4 per worker)
+        budget (RateBudget): Requests already spent in the shared budget
+        latency (float): Seconds per page request
+
+    Returns:
+        dict: Shards, known activities, pages, rate-limit windows and wall time
+    """
+    end_epoch = end_epoch or time.time()
+    workers = workers or os.cpu_count() or 1
+    shards = shards or workers * 4
+    ranges = shard_ranges(start_epoch, end_epoch, shards)
+    known = [len(store.activities_between(after, before)) if store is not None else 0 for after, before in ranges]
+    pages = sum(count // PAGE_SIZE + 1 for count in known)
+
+    windows = rate_windows(pages, used=budget.used() if budget is not None else None)
+    wait = max(window['wait'] for window in windows)
+    # Workers page side by side but draw from one budget
+    wall = math.ceil(pages / min(workers, len(ranges))) * latency + wait
+
+    plan = {
+        'shards': len(ranges),
+        'known_activities': sum(known),
+        'pages': pages,
+        'rate_limits': {'strava': windows},
+        'wall': round(wall, 2),
+    }
+    logger.info(f"Backfill plan: {plan}")
+    return plan
+
+
+def plan_from_context(context, limit: int = 1, create_playlist: bool = True, align_streams: bool = False,
+                      group_by: str = None, source: str = 'strava', since: float = None) -> dict:
+    """Plan a process_activities run from a context's cached state
+
+    Only prepare() runs, which loads state but authenticates nothing.
+    Strava requests spent by a running backfill are taken into account.
+    """
+    context.prepare()
+    if context.store is None:
+        raise ValueError('Planning needs the state store: set STATE_DB to local or s3')
+    return plan_run(
+        context.store,
+        limit=limit,
+        create_playlist=create_playlist,
+        align_streams=align_streams,
+        group_by=group_by,
+        enricher=context.enricher,
+        top_tracks=context.top_tracks,
+        budget=RateBudget(BUDGET_PATH),
+        source=source,
+        since=since
+    )
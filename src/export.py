@@ -0,0 +1,236 @@
+import io
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    from pyarrow import fs
+except ImportError:  # pragma: no cover
+    pa = None
+
+from src.storage import LocalStorage, S3Storage, S3_PREFIX
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+EXPORT_STATE_KEY = '_export_state.json'
+FORMAT_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("Columnar export requires pyarrow: python3 -m pip install pyarrow")
+
+
+def _schemas() -> dict:
+    timestamp = pa.timestamp('us', tz='UTC')
+    return {
+        'activities': pa.schema([
+            ('activity_id', pa.int64()),
+            ('name', pa.string()),
+            ('activity_type', pa.string()),
+            ('start_time', timestamp),
+            ('end_time', timestamp),
+            ('track_count', pa.int32()),
+        ]),
+        'plays': pa.schema([
+            ('played_at', timestamp),
+            ('track_uri', pa.string()),
+        ]),
+        'matches': pa.schema([
+            ('activity_id', pa.int64()),
+            ('position', pa.int32()),
+            ('track_uri', pa.string()),
+            ('played_at', timestamp),
+            ('moving', pa.bool_()),
+            ('heartrate', pa.float64()),
+            ('pace', pa.float64()),
+        ]),
+    }
+
+
+def _parse_time(value: str) -> datetime:
+    """Parse an ISO time; naive values are Strava's local wall-clock times
+
+    Naive times are labelled UTC as they are rather than converted with the
+    machine's timezone, so the export is the same wherever it runs.
+    """
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _month(value: datetime) -> str:
+    return value.strftime('%Y-%m')
+
+
+class ColumnarExporter:
+    """Write activities, plays and matches as month-partitioned column files
+
+    Files land in ``<table>/month=YYYY-MM/part-<name>.<ext>`` in a
+    LocalStorage or S3Storage. Activities and their matches get one file
+    per activity, named by activity ID, so a later run over the same
+    activity replaces its rows instead of adding them again. Plays are
+    exported incrementally from a cursor kept in the same storage, in
+    files named by a hash of their contents.
+
+    Args:
+        storage: LocalStorage or S3Storage to write to
+        format (str): ``parquet`` or ``arrow`` (Arrow IPC, zero-copy mmap)
+    """
+
+    def __init__(self, storage, format='parquet'):
+        _require_pyarrow()
+        if format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Unsupported export format: {format}")
+        self.storage = storage
+        self.format = format
+        self.schemas = _schemas()
+
+    def _serialize(self, table) -> bytes:
+        buffer = io.BytesIO()
+        if self.format == 'parquet':
+            pq.write_table(table, buffer)
+        else:
+            with pa.ipc.new_file(buffer, table.schema) as writer:
+                writer.write_table(table)
+        return buffer.getvalue()
+
+    def _key(self, table_name: str, month: str, name: str) -> str:
+        return f"{table_name}/month={month}/part-{name}.{FORMAT_EXTENSIONS[self.format]}"
+
+    def write_rows(self, table_name: str, rows_by_month: dict, part: str = None) -> list:
+        """Write rows grouped by month, returning the keys written
+
+        Files are named ``part`` when given, else by a hash of their contents.
+        A named part with no rows is deleted, so a re-export that no longer
+        has any rows doesn't leave the previous file behind.
+        """
+        keys = []
+        for month, rows in sorted(rows_by_month.items()):
+            if not rows:
+                if part is not None:
+                    self.storage.delete(self._key(table_name, month, part))
+                continue
+            table = pa.Table.from_pylist(rows, schema=self.schemas[table_name])
+            data = self._serialize(table)
+            key = self._key(table_name, month, part or hashlib.sha256(data).hexdigest()[:16])
+            self.storage.put(key, data)
+            keys.append(key)
+        return keys
+
+    def export_results(self, results: list) -> list:
+        """Export processed activities and their matched tracks, one file per activity"""
+        keys = []
+        for result in results:
+            start = _parse_time(result['start_time'])
+            month = _month(start)
+            activity_id = result.get('activity_id')
+            activity = {
+                'activity_id': activity_id,
+                'name': result['activity_name'],
+                'activity_type': result.get('activity_type'),
+                'start_time': start,
+                'end_time': _parse_time(result['end_time']),
+                'track_count': result['track_count'],
+            }
+
+            if result.get('plays') is not None:
+                rows = [
+                    {
+                        'track_uri': play['uri'],
+                        'played_at': _parse_time(play['played_at']),
+                        'moving': play['moving'],
+                        'heartrate': play['heartrate'],
+                        'pace': play['pace'],
+                    }
+                    for play in result['plays']
+                ]
+            else:
+                rows = [{'track_uri': uri} for uri in result.get('tracks', [])]
+            for position, row in enumerate(rows):
+                row.update(activity_id=activity_id, position=position)
+
+            part = f"activity-{activity_id}" if activity_id is not None else None
+            keys += self.write_rows('activities', {month: [activity]}, part)
+            keys += self.write_rows('matches', {month: rows}, part)
+        return keys
+
+    def export_plays(self, history: list) -> list:
+        """Export recently played items not exported by an earlier run"""
+        state_data = self.storage.get(EXPORT_STATE_KEY)
+        state = json.loads(state_data) if state_data else {}
+        cursor = state.get('plays_after')
+
+        plays = {}
+        latest = cursor
+        for item in history:
+            if cursor is not None and item['played_at'] <= cursor:
+                continue
+            played_at = _parse_time(item['played_at'])
+            plays.setdefault(_month(played_at), []).append({
+                'played_at': played_at,
+                'track_uri': item['track']['uri'],
+            })
+            if latest is None or item['played_at'] > latest:
+                latest = item['played_at']
+
+        keys = self.write_rows('plays', plays)
+        if latest != cursor:
+            state['plays_after'] = latest
+            self.storage.put(EXPORT_STATE_KEY, json.dumps(state).encode('utf-8'))
+        return keys
+
+    def export_run(self, results: list, history: list) -> list:
+        """Export everything a process_activities run produced"""
+        keys = self.export_results(results) + self.export_plays(history)
+        logger.info(f"Exported {len(keys)} {self.format} files to {self.storage}")
+        return keys
+
+
+def read_table(root: str, table_name: str, format='parquet', months=None):
+    """Read an exported table from a local export directory
+
+    Files are memory-mapped, so scans over years of history stay cheap.
+
+    Args:
+        root (str): Export directory
+        table_name (str): ``activities``, ``plays`` or ``matches``
+        format (str): ``parquet`` or ``arrow``
+        months (list): Optional ``YYYY-MM`` partitions to read
+    """
+    _require_pyarrow()
+    dataset = ds.dataset(
+        os.path.join(root, table_name),
+        format='parquet' if format == 'parquet' else 'ipc',
+        partitioning='hive',
+        filesystem=fs.LocalFileSystem(use_mmap=True)
+    )
+    if months is None:
+        return dataset.to_table()
+    return dataset.to_table(filter=ds.field('month').isin(months))
+
+
+def exporter_from_env(use_s3=False):
+    """Build the exporter configured by environment variables
+
+    ``EXPORT`` selects ``local`` (``EXPORT_DIR``), ``s3`` (under
+    ``S3_BUCKET``/``S3_PREFIX``/export) or ``off`` (default).
+    ``EXPORT_FORMAT`` is ``parquet`` (default) or ``arrow``.
+    """
+    mode = os.environ.get('EXPORT', 'off').lower()
+    if mode == 'off':
+        return None
+    export_format = os.environ.get('EXPORT_FORMAT', 'parquet')
+    if mode == 's3':
+        prefix = os.environ.get('S3_PREFIX', S3_PREFIX)
+        storage = S3Storage(os.environ.get('S3_BUCKET'), f"{prefix}/export")
+    else:
+        storage = LocalStorage(os.environ.get('EXPORT_DIR', 'export'))
+    return ColumnarExporter(storage, format=export_format)
@@ -0,0 +1,288 @@
+import os
+import re
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from src.sessions import PooledAdapter
+from src.storage import LocalStorage, S3Storage, S3_PREFIX
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Seconds a cached response is served without contacting the server, by URL
+# pattern. Stale entries are revalidated with ETag/Last-Modified when the
+# server sent validators. GET endpoints that match no pattern are not cached.
+DEFAULT_TTLS = [
+    (r'/api/v3/athlete$', 7 * 24 * 3600),
+    (r'/api/v3/athlete/activities', 0),
+    (r'/api/v3/activities/\d+$', 3600),
+    (r'/v1/me$', 7 * 24 * 3600),
+    (r'/v1/tracks', 30 * 24 * 3600),
+    (r'/v1/audio-features', 30 * 24 * 3600),
+]
+
+# Headers describing the live request budget must not be replayed from cache
+UNCACHED_HEADERS = ('x-ratelimit-limit', 'x-ratelimit-usage', 'x-readratelimit-limit',
+                    'x-readratelimit-usage', 'date', 'set-cookie')
+
+CACHE_STATUS_HEADER = 'X-Motivator-Cache'
+
+# Stale entries with validators are kept this long past their TTL so they
+# can still be revalidated; everything else is dropped once its TTL is up
+STALE_RETENTION = 7 * 24 * 3600
+
+# API hosts whose entries are keyed by caller identity when one is set
+STRAVA_HOST = 'www.strava.com'
+SPOTIFY_HOST = 'api.spotify.com'
+
+
+class HttpCache:
+    """Persistent cache of GET responses with per-endpoint TTLs
+
+    Entries live in a blob storage (LocalStorage or S3Storage) with an
+    in-memory layer in front so warm invocations don't re-read them. They
+    are keyed by URL and the caller: the athlete or user id set with
+    set_identity(), else a hash of the Authorization header. Either way a
+    shared cache never answers one user's request with another user's data,
+    and with an identity set the entries outlive token rotation.
+
+    An index of entry expiry times is kept next to the entries; expired
+    entries are deleted when the index is loaded and whenever one is stored.
+    """
+
+    def __init__(self, storage, ttls=None, namespace='http-cache'):
+        self.storage = storage
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or DEFAULT_TTLS)]
+        self.namespace = namespace
+        self._memory = {}
+        self._identities = {}
+        self._index = None
+        self._index_lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0}
+
+    @property
+    def bypassed(self) -> bool:
+        return getattr(self._local, 'bypass', False)
+
+    @contextmanager
+    def bypass(self):
+        """Fetch fresh responses on this thread, e.g. after a change notification
+
+        Responses are still stored, so later reads get the new version.
+        """
+        previous = self.bypassed
+        self._local.bypass = True
+        try:
+            yield self
+        finally:
+            self._local.bypass = previous
+
+    def ttl_for(self, url: str):
+        """Return the TTL for a URL, or None if it should not be cached"""
+        path = url.split('?', 1)[0]
+        for pattern, ttl in self.ttls:
+            if pattern.search(path):
+                return ttl
+        return None
+
+    def set_identity(self, host: str, identity) -> None:
+        """Key entries for an API host by a stable caller id instead of the token
+
+        Strava and Spotify tokens rotate every few hours, and keying by the
+        token would orphan every entry at each rotation.
+
+        Args:
+            host (str): API host, e.g. STRAVA_HOST
+            identity (callable): Returns the athlete or user id, or None
+                while it is unknown (the token is used then)
+        """
+        self._identities[host] = identity
+
+    def _caller(self, url: str, authorization: str = None) -> str:
+        if not authorization:
+            return ''
+        identity = self._identities.get(urlsplit(url).netloc)
+        caller = identity() if identity is not None else None
+        return f"id:{caller}" if caller is not None else authorization
+
+    def _key(self, url: str, authorization: str = None) -> str:
+        identity = f"{url}\n{self._caller(url, authorization)}"
+        return f"{self.namespace}/{hashlib.sha256(identity.encode('utf-8')).hexdigest()}.json"
+
+    @property
+    def index_key(self) -> str:
+        return f"{self.namespace}/index.json"
+
+    def expires_at(self, url: str, entry: dict) -> float:
+        """Return when an entry stops being useful, even for revalidation"""
+        ttl = self.ttl_for(url) or 0
+        headers = CaseInsensitiveDict(entry.get('headers', {}))
+        if 'ETag' in headers or 'Last-Modified' in headers:
+            ttl += STALE_RETENTION
+        return entry['stored_at'] + ttl
+
+    def _load_index(self) -> dict:
+        """Read the expiry index once, deleting expired and unindexed entries"""
+        if self._index is None:
+            data = self.storage.get(self.index_key)
+            self._index = json.loads(data) if data else {}
+            unindexed = []
+            if hasattr(self.storage, 'keys'):
+                # Entries written before the index existed, e.g. under old token keys
+                unindexed = [
+                    key for key in self.storage.keys(f"{self.namespace}/")
+                    if key != self.index_key and key not in self._index
+                ]
+            if self._drop_expired(unindexed):
+                self._save_index()
+        return self._index
+
+    def _drop_expired(self, keys=()) -> int:
+        now = time.time()
+        expired = [key for key, expires_at in self._index.items() if expires_at <= now]
+        expired.extend(keys)
+        for key in expired:
+            self._index.pop(key, None)
+            self._memory.pop(key, None)
+            self.storage.delete(key)
+        if expired:
+            logger.info(f"HTTP cache: dropped {len(expired)} expired entries")
+        return len(expired)
+
+    def _save_index(self) -> None:
+        self.storage.put(self.index_key, json.dumps(self._index).encode('utf-8'))
+
+    def lookup(self, url: str, authorization: str = None):
+        if self._index is None:
+            with self._index_lock:
+                self._load_index()
+        key = self._key(url, authorization)
+        if key not in self._memory:
+            data = self.storage.get(key)
+            self._memory[key] = json.loads(data) if data else None
+        entry = self._memory[key]
+        if entry is not None and self.expires_at(url, entry) <= time.time():
+            return None
+        return entry
+
+    def store(self, url: str, entry: dict, authorization: str = None) -> None:
+        key = self._key(url, authorization)
+        with self._index_lock:
+            index = self._load_index()
+            self._memory[key] = entry
+            self.storage.put(key, json.dumps(entry).encode('utf-8'))
+            index[key] = self.expires_at(url, entry)
+            self._drop_expired()
+            self._save_index()
+
+    def store_response(self, url: str, response: Response, authorization: str = None) -> None:
+        headers = {
+            name: value for name, value in response.headers.items()
+            if name.lower() not in UNCACHED_HEADERS
+        }
+        self.store(url, {
+            'url': url,
+            'status': response.status_code,
+            'headers': headers,
+            'body': base64.b64encode(response.content).decode('ascii'),
+            'stored_at': time.time(),
+        }, authorization)
+
+    def touch(self, url: str, entry: dict, authorization: str = None) -> None:
+        """Mark a revalidated entry as fresh again"""
+        entry = dict(entry, stored_at=time.time())
+        self.store(url, entry, authorization)
+
+
+def _build_response(entry: dict, request, cache_status: str) -> Response:
+    """Rebuild a requests Response from a cache entry"""
+    response = Response()
+    response.status_code = entry['status']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response.headers[CACHE_STATUS_HEADER] = cache_status
+    response._content = base64.b64decode(entry['body'])
+    response.url = entry['url']
+    response.request = request
+    response.reason = 'OK'
+    response.encoding = 'utf-8'
+    return response
+
+
+class CachingAdapter(PooledAdapter):
+    """Pooled adapter that answers GETs from an HttpCache when possible
+
+    Fresh entries are returned without a network call. Stale entries are
+    sent with If-None-Match/If-Modified-Since and a 304 reply is answered
+    with the cached body.
+    """
+
+    def __init__(self, cache: HttpCache, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return super().send(request, **kwargs)
+
+        ttl = self.cache.ttl_for(request.url)
+        if ttl is None:
+            return super().send(request, **kwargs)
+
+        authorization = request.headers.get('Authorization')
+        entry = None if self.cache.bypassed else self.cache.lookup(request.url, authorization)
+        if entry is not None:
+            if time.time() - entry['stored_at'] < ttl:
+                self.cache.stats['hits'] += 1
+                return _build_response(entry, request, 'HIT')
+
+            headers = CaseInsensitiveDict(entry['headers'])
+            if 'ETag' in headers:
+                request.headers['If-None-Match'] = headers['ETag']
+            if 'Last-Modified' in headers:
+                request.headers['If-Modified-Since'] = headers['Last-Modified']
+
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.cache.stats['revalidated'] += 1
+            self.cache.touch(request.url, entry, authorization)
+            return _build_response(entry, request, 'REVALIDATED')
+
+        self.cache.stats['misses'] += 1
+        if response.status_code == 200:
+            has_validators = 'ETag' in response.headers or 'Last-Modified' in response.headers
+            if ttl > 0 or has_validators:
+                self.cache.store_response(request.url, response, authorization)
+        return response
+
+
+def cache_from_env(use_s3=False, storage=None):
+    """Build the HTTP cache configured by environment variables
+
+    ``HTTP_CACHE`` selects ``local`` (``HTTP_CACHE_DIR``), ``s3`` (under
+    ``S3_BUCKET``/``S3_PREFIX``) or ``off``. Defaults to S3 when tokens are
+    stored in S3 and to a local directory otherwise. An explicit
+    ``storage`` (e.g. the state bundle) replaces the S3 location.
+    """
+    mode = os.environ.get('HTTP_CACHE', 's3' if use_s3 else 'local').lower()
+    if mode == 'off':
+        return None
+    if mode == 's3' and storage is not None:
+        return HttpCache(storage)
+    if mode == 's3':
+        bucket = os.environ.get('S3_BUCKET')
+        if not bucket:
+            logger.warning("HTTP cache disabled: S3_BUCKET is not set")
+            return None
+        return HttpCache(S3Storage(bucket, os.environ.get('S3_PREFIX', S3_PREFIX)))
+    return HttpCache(LocalStorage(os.environ.get('HTTP_CACHE_DIR', '.motivator_cache')))
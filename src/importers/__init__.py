@@ -0,0 +1,4 @@
+from .spotify_history import import_history
+from .strava_archive import import_archive
+
+__all__ = ['import_history', 'import_archive']
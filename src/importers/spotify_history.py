@@ -0,0 +1,234 @@
+import os
+import json
+import glob
+import time
+import logging
+import argparse
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from src.store import store_from_env
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Text read from a history file at a time
+CHUNK_SIZE = 1 << 20
+
+# Plays whose timestamps are converted together
+BATCH_SIZE = 5000
+
+# Spotify counts a stream as a play after 30 seconds
+MIN_MS_PLAYED = 30000
+
+HISTORY_PATTERNS = ('Streaming_History_Audio_*.json', 'endsong_*.json')
+
+_SEPARATORS = ' \t\r\n,'
+
+
+def _skip(buffer: str, pos: int) -> int:
+    while pos < len(buffer) and buffer[pos] in _SEPARATORS:
+        pos += 1
+    return pos
+
+
+def iter_json_array(f, chunk_size: int = CHUNK_SIZE):
+    """Yield the items of a top-level JSON array without loading it whole
+
+    Reads ``chunk_size`` characters at a time and decodes one item after
+    the other with raw_decode, so memory stays at about one chunk however
+    large the file is.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Expected a JSON array')
+    pos = 1
+    while True:
+        pos = _skip(buffer, pos)
+        if buffer[pos:pos + 1] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The item runs past the buffer; keep the tail and read on
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+        pos = end
+
+
+def _epochs(stamps: list) -> list:
+    """Convert ``YYYY-MM-DDTHH:MM:SS`` UTC strings to epoch seconds in one go"""
+    if np is not None:
+        return np.array(stamps, dtype='datetime64[s]').astype('int64').astype('float64').tolist()
+    return [datetime.fromisoformat(stamp).replace(tzinfo=timezone.utc).timestamp() for stamp in stamps]
+
+
+def history_rows(items: list, min_ms_played: int = MIN_MS_PLAYED) -> list:
+    """Convert history entries to (played_at, played_at_iso, track_uri) rows
+
+    Podcast episodes and plays shorter than ``min_ms_played`` are dropped.
+    ``ts`` is when the stream ended, like played_at in the Web API, and is
+    stored in the same format.
+    """
+    kept = [
+        (item['ts'][:19], item['spotify_track_uri'])
+        for item in items
+        if item.get('spotify_track_uri') and (item.get('ms_played') or 0) >= min_ms_played
+    ]
+    epochs = _epochs([stamp for stamp, _ in kept])
+    return [(epoch, f"{stamp}.000Z", uri) for epoch, (stamp, uri) in zip(epochs, kept)]
+
+
+def iter_history_batches(path: str, min_ms_played: int = MIN_MS_PLAYED, batch_size: int = BATCH_SIZE):
+    """Yield (rows, entries read) for each ``batch_size`` entries of a history file"""
+    batch = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for item in iter_json_array(f):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield history_rows(batch, min_ms_played), len(batch)
+                batch = []
+    if batch:
+        yield history_rows(batch, min_ms_played), len(batch)
+
+
+def read_history_file(path: str, min_ms_played: int = MIN_MS_PLAYED, batch_size: int = BATCH_SIZE) -> tuple:
+    """Read one history file into play rows
+
+    Returns:
+        tuple: (path, rows, entries read)
+    """
+    rows = []
+    entries = 0
+    for batch_rows, batch_entries in iter_history_batches(path, min_ms_played, batch_size):
+        rows.extend(batch_rows)
+        entries += batch_entries
+    return path, rows, entries
+
+
+def spool_history_file(path: str, spool_dir: str, min_ms_played: int = MIN_MS_PLAYED,
+                       batch_size: int = BATCH_SIZE) -> tuple:
+    """Parse one history file into spooled batches; runs inside a worker process
+
+    Each batch of rows is written to its own file in ``spool_dir`` as soon
+    as it is parsed, so neither the worker nor the process reading the
+    results holds more than one batch of a large file.
+
+    Returns:
+        tuple: (path, spool file paths, plays, entries read)
+    """
+    spooled = []
+    plays = 0
+    entries = 0
+    for rows, batch_entries in iter_history_batches(path, min_ms_played, batch_size):
+        entries += batch_entries
+        if not rows:
+            continue
+        # Exports can hold files of the same name in different directories
+        fd, spool_path = tempfile.mkstemp(suffix='.json', prefix=os.path.basename(path), dir=spool_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(rows, f)
+        spooled.append(spool_path)
+        plays += len(rows)
+    return path, spooled, plays, entries
+
+
+def history_files(paths: list) -> list:
+    """Expand files and export directories into history files, largest first"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in HISTORY_PATTERNS:
+                files.extend(glob.glob(os.path.join(path, '**', pattern), recursive=True))
+        else:
+            files.append(path)
+    # Big files first so the pool doesn't end waiting on one straggler
+    return sorted(set(files), key=os.path.getsize, reverse=True)
+
+
+def import_history(paths: list, store, workers: int = None, min_ms_played: int = MIN_MS_PLAYED,
+                   executor_factory=ProcessPoolExecutor) -> dict:
+    """Import Spotify Extended Streaming History files into the play store
+
+    Files are parsed in parallel worker processes that spool their rows in
+    batches of ``BATCH_SIZE``; this process writes each spooled batch in one
+    transaction. At most two files per worker are in flight and only one
+    batch is held at a time, so memory stays flat however large the files.
+
+    Args:
+        paths (list): History JSON files or export directories
+        store (StateStore): Where plays are inserted (duplicates ignored)
+        workers (int): Parser processes (default: CPU count)
+        min_ms_played (int): Shortest stream counted as a play
+        executor_factory (callable): Pool class, e.g. a thread pool in tests
+
+    Returns:
+        dict: Counts of files, entries, plays and new rows, and throughput
+    """
+    started = time.perf_counter()
+    files = history_files(paths)
+    workers = workers or os.cpu_count() or 1
+    report = {'files': len(files), 'entries': 0, 'plays': 0, 'stored': 0}
+    size = sum(os.path.getsize(path) for path in files)
+
+    pending = list(reversed(files))
+    in_flight = set()
+    with tempfile.TemporaryDirectory(prefix='spotify-history-') as spool_dir, \
+            executor_factory(max_workers=workers) as executor:
+        while pending or in_flight:
+            while pending and len(in_flight) < 2 * workers:
+                in_flight.add(executor.submit(spool_history_file, pending.pop(), spool_dir, min_ms_played))
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, spooled, plays, entries = future.result()
+                stored = 0
+                for spool_path in spooled:
+                    with open(spool_path, 'r', encoding='utf-8') as f:
+                        stored += store.add_play_rows([tuple(row) for row in json.load(f)])
+                    os.remove(spool_path)
+                report['entries'] += entries
+                report['plays'] += plays
+                report['stored'] += stored
+                logger.info(f"{os.path.basename(path)}: {plays} plays, {stored} new")
+    store.save()
+
+    wall = time.perf_counter() - started
+    report['wall'] = round(wall, 3)
+    report['mb_per_s'] = round(size / (1 << 20) / wall, 1) if wall else None
+    logger.info(f"Streaming history imported: {report}")
+    return report
+
+
+def main(argv=None):
+    """Import from the command line: python -m src.importers.spotify_history my_spotify_data/"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description='Import Spotify Extended Streaming History into the state store')
+    parser.add_argument('paths', nargs='+', help='History JSON files or export directories')
+    parser.add_argument('--workers', type=int, help='Parser processes (default: CPU count)')
+    parser.add_argument('--min-ms-played', type=int, default=MIN_MS_PLAYED,
+                        help=f"Shortest stream counted as a play (default: {MIN_MS_PLAYED})")
+    args = parser.parse_args(argv)
+
+    store = store_from_env()
+    if store is None:
+        parser.error('STATE_DB must be set to local or s3 to import history')
+    return import_history(args.paths, store, workers=args.workers, min_ms_played=args.min_ms_played)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+import io
+import os
+import csv
+import gzip
+import time
+import struct
+import logging
+import argparse
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from xml.etree import ElementTree
+
+from src.store import store_from_env
+from src.strava.activities import ActivityRecord
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Seconds between 1970-01-01 and the FIT epoch, 1989-12-31
+FIT_EPOCH = 631065600
+FIT_RECORD = 20
+FIT_TIMESTAMP = 253
+FIT_INVALID = 0xFFFFFFFF
+
+# A gap between samples longer than this is a pause (auto-pause or stop)
+PAUSE_GAP = 15
+
+# Files each worker takes from the queue at a time
+CHUNK_SIZE = 16
+
+_archive = None
+
+
+def fit_timestamps(data: bytes) -> list:
+    """Epoch seconds of every record message in a FIT file
+
+    Only what is needed to find the timestamps is decoded: definition
+    messages for field sizes, and the timestamp field (or the compressed
+    timestamp header) of data messages.
+    """
+    if len(data) < 12 or data[8:12] != b'.FIT':
+        raise ValueError('Not a FIT file')
+    header_size = data[0]
+    end = header_size + struct.unpack_from('<I', data, 4)[0]
+    pos = header_size
+    definitions = {}
+    last = None
+    stamps = []
+    while pos < end:
+        header = data[pos]
+        pos += 1
+        if header & 0x80:
+            # Compressed timestamp header: a 5-bit offset from the last timestamp
+            definition = definitions[(header >> 5) & 0x03]
+            if last is not None:
+                offset = header & 0x1F
+                last = (last & ~0x1F) + offset + (0x20 if offset < (last & 0x1F) else 0)
+                if definition['message'] == FIT_RECORD:
+                    stamps.append(last)
+            pos += definition['size']
+        elif header & 0x40:
+            big_endian = data[pos + 1] == 1
+            message = struct.unpack_from('>H' if big_endian else '<H', data, pos + 2)[0]
+            fields = data[pos + 4]
+            pos += 5
+            size = 0
+            timestamp = None
+            for _ in range(fields):
+                number, field_size = data[pos], data[pos + 1]
+                if number == FIT_TIMESTAMP and field_size == 4:
+                    timestamp = size
+                size += field_size
+                pos += 3
+            if header & 0x20:
+                # Developer fields
+                developer_fields = data[pos]
+                pos += 1
+                for _ in range(developer_fields):
+                    size += data[pos + 1]
+                    pos += 3
+            definitions[header & 0x0F] = {
+                'message': message,
+                'size': size,
+                'timestamp': timestamp,
+                'format': '>I' if big_endian else '<I',
+            }
+        else:
+            definition = definitions[header & 0x0F]
+            if definition['timestamp'] is not None:
+                value = struct.unpack_from(definition['format'], data, pos + definition['timestamp'])[0]
+                if value != FIT_INVALID:
+                    last = value
+                    if definition['message'] == FIT_RECORD:
+                        stamps.append(value)
+            pos += definition['size']
+    return [FIT_EPOCH + stamp for stamp in stamps]
+
+
+def _iso_epoch(text: str) -> float:
+    return datetime.fromisoformat(text.strip().replace('Z', '+00:00')).timestamp()
+
+
+def xml_timestamps(data: bytes, point: str, stamp: str) -> list:
+    """Epoch seconds of each ``point`` element's ``stamp`` child (GPX or TCX)"""
+    stamps = []
+    # Strava's TCX files can start with whitespace, which expat rejects
+    for _, element in ElementTree.iterparse(io.BytesIO(data.lstrip())):
+        if element.tag.rsplit('}', 1)[-1] == point:
+            for child in element:
+                if child.tag.rsplit('}', 1)[-1] == stamp and child.text:
+                    stamps.append(_iso_epoch(child.text))
+                    break
+            element.clear()
+    return stamps
+
+
+def activity_timestamps(name: str, data: bytes) -> list:
+    """Sample timestamps of an activity file, by extension, gzipped or not"""
+    if name.endswith('.gz'):
+        data = gzip.decompress(data)
+        name = name[:-3]
+    extension = name.rsplit('.', 1)[-1].lower()
+    if extension == 'fit':
+        return fit_timestamps(data)
+    if extension == 'gpx':
+        return xml_timestamps(data, 'trkpt', 'time')
+    if extension == 'tcx':
+        return xml_timestamps(data, 'Trackpoint', 'Time')
+    raise ValueError(f"Unsupported activity file: {name}")
+
+
+def moving_intervals(stamps: list, pause_gap: float = PAUSE_GAP) -> list:
+    """Split sorted sample timestamps into [start, end] moving stretches"""
+    intervals = []
+    for stamp in stamps:
+        if intervals and stamp - intervals[-1][1] <= pause_gap:
+            intervals[-1][1] = stamp
+        else:
+            intervals.append([stamp, stamp])
+    return intervals
+
+
+def _open_archive(path: str) -> None:
+    global _archive
+    _archive = zipfile.ZipFile(path)
+
+
+def parse_member(member: str):
+    """Moving intervals of one activity file in the open archive
+
+    Runs in a worker process, which opens the zip once and reads members
+    straight out of it.
+
+    Returns:
+        list: [start, end] intervals, or None if the file can't be read
+    """
+    try:
+        stamps = sorted(activity_timestamps(member, _archive.read(member)))
+    except Exception as e:
+        logger.warning(f"Could not parse {member}: {str(e)}")
+        return None
+    return moving_intervals(stamps) or None
+
+
+def _column(header: list, name: str):
+    return header.index(name) if name in header else None
+
+
+def read_activities_csv(archive: zipfile.ZipFile) -> list:
+    """Rows of activities.csv as dicts, read straight from the zip
+
+    The export lists some columns twice; the first, in seconds, is used.
+    Dates are in UTC.
+    """
+    with archive.open('activities.csv') as raw:
+        reader = csv.reader(io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''))
+        header = next(reader)
+        columns = {
+            key: _column(header, name) for key, name in (
+                ('id', 'Activity ID'), ('date', 'Activity Date'), ('name', 'Activity Name'),
+                ('type', 'Activity Type'), ('elapsed', 'Elapsed Time'), ('filename', 'Filename'),
+            )
+        }
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            start = datetime.strptime(row[columns['date']], '%b %d, %Y, %I:%M:%S %p').replace(tzinfo=timezone.utc)
+            rows.append({
+                'activity_id': int(row[columns['id']]),
+                'name': row[columns['name']],
+                'type': row[columns['type']],
+                'start_epoch': start.timestamp(),
+                'elapsed': float(row[columns['elapsed']] or 0),
+                'filename': row[columns['filename']] if columns['filename'] is not None else '',
+            })
+    return rows
+
+
+def _record(row: dict, intervals) -> ActivityRecord:
+    if intervals:
+        start_epoch, end_epoch = intervals[0][0], intervals[-1][1]
+    else:
+        start_epoch = row['start_epoch']
+        end_epoch = start_epoch + row['elapsed']
+    return ActivityRecord(
+        row['name'],
+        datetime.fromtimestamp(start_epoch, tz=timezone.utc),
+        start_epoch,
+        datetime.fromtimestamp(end_epoch, tz=timezone.utc),
+        end_epoch,
+        activity_id=row['activity_id'],
+        activity_type=row['type']
+    )
+
+
+def read_archive(path: str, workers: int = None, activity_types=('Run',),
+                 executor_factory=ProcessPoolExecutor) -> list:
+    """Activity records and moving intervals from a Strava bulk export zip
+
+    Start and end come from the first and last sample of the activity
+    file when it has one, else from activities.csv.
+
+    Args:
+        path (str): export_XXXX.zip downloaded from Strava
+        workers (int): Parser processes (default: CPU count)
+        activity_types (tuple): Activity types to keep, or None for all
+        executor_factory (callable): Pool class, e.g. a thread pool in tests
+
+    Returns:
+        list: (ActivityRecord, intervals or None) pairs, oldest first
+    """
+    with zipfile.ZipFile(path) as archive:
+        members = set(archive.namelist())
+        rows = [
+            row for row in read_activities_csv(archive)
+            if activity_types is None or row['type'] in activity_types
+        ]
+
+    with_files = [row for row in rows if row['filename'] in members]
+    with executor_factory(max_workers=workers or os.cpu_count() or 1,
+                          initializer=_open_archive, initargs=(path,)) as executor:
+        kwargs = {'chunksize': CHUNK_SIZE} if isinstance(executor, ProcessPoolExecutor) else {}
+        parsed = dict(zip(
+            (row['activity_id'] for row in with_files),
+            executor.map(parse_member, [row['filename'] for row in with_files], **kwargs)
+        ))
+
+    records = [(_record(row, parsed.get(row['activity_id'])), parsed.get(row['activity_id'])) for row in rows]
+    return sorted(records, key=lambda pair: (pair[0].start_epoch, pair[0].activity_id))
+
+
+def import_archive(path: str, store, workers: int = None, activity_types=('Run',),
+                   executor_factory=ProcessPoolExecutor) -> dict:
+    """Import a Strava bulk export into the state store without API calls
+
+    Activities go in like a backfill; moving intervals are stored too, so
+    aligning plays with pauses doesn't need the streams endpoint.
+
+    Returns:
+        dict: Counts of activities, parsed files and new rows
+    """
+    started = time.perf_counter()
+    records = read_archive(path, workers, activity_types, executor_factory)
+    stored = store.add_activities([record for record, _ in records])
+    for record, intervals in records:
+        if intervals:
+            store.add_moving_intervals(record.activity_id, intervals)
+    store.save()
+
+    report = {
+        'activities': len(records),
+        'parsed': sum(1 for _, intervals in records if intervals),
+        'stored': stored,
+        'wall': round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"Strava archive imported: {report}")
+    return report
+
+
+def main(argv=None):
+    """Import from the command line: python -m src.importers.strava_archive export_123.zip"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description='Import a Strava bulk export archive into the state store')
+    parser.add_argument('path', help='Strava export zip')
+    parser.add_argument('--workers', type=int, help='Parser processes (default: CPU count)')
+    parser.add_argument('--all-types', action='store_true', help='Keep every activity type, not only runs')
+    args = parser.parse_args(argv)
+
+    store = store_from_env()
+    if store is None:
+        parser.error('STATE_DB must be set to local or s3 to import an archive')
+    return import_archive(args.path, store, workers=args.workers,
+                          activity_types=None if args.all_types else ('Run',))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import uuid
+import logging
+
+from botocore.exceptions import ClientError
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class LeaseTimeout(Exception):
+    """Raised when a lease could not be acquired in time"""
+
+
+class _BaseLease:
+    """Cross-process mutual exclusion with a stale-lease expiry
+
+    Subclasses implement _try_acquire, _read, _remove and _release. A lease
+    that outlives ``ttl`` seconds is considered abandoned (e.g. the holding
+    Lambda was killed) and may be broken by the next waiter. Every lease
+    records a random owner token, and a lease is only removed by the owner
+    that wrote it, so a holder whose lease was broken as stale can't delete
+    the lease of whoever took over.
+    """
+
+    def __init__(self, ttl: float = 30, timeout: float = 60, poll_interval: float = 0.2):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.owner = None
+
+    def acquire(self) -> None:
+        deadline = time.time() + self.timeout
+        while True:
+            owner = uuid.uuid4().hex
+            if self._try_acquire(owner, time.time() + self.ttl):
+                self.owner = owner
+                return
+
+            holder = self._read()
+            if holder is not None and time.time() > holder['expires_at']:
+                logger.warning(f"Breaking stale lease: {self}")
+                self._remove(holder)
+                continue
+
+            if time.time() > deadline:
+                raise LeaseTimeout(f"Timed out waiting for lease: {self}")
+            time.sleep(self.poll_interval)
+
+    def release(self) -> None:
+        if self.owner is None:
+            return
+        if not self._release():
+            logger.warning(f"Lease was broken while held, leaving the new holder's lease: {self}")
+        self.owner = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class FileLease(_BaseLease):
+    """Lease backed by an exclusively created lock file
+
+    Checking the owner and removing the lock file happen under a short
+    guard file, so two processes can't both remove the same lease.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.guard_path = f"{path}.guard"
+
+    def __repr__(self):
+        return f"FileLease({self.path})"
+
+    def _try_acquire(self, owner: str, expires_at: float) -> bool:
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'pid': os.getpid(), 'owner': owner, 'expires_at': expires_at}, f)
+        return True
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                holder = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Lock file is being written by its owner; treat as live
+            return None
+        return holder if 'expires_at' in holder else None
+
+    def _guard(self) -> None:
+        while True:
+            try:
+                os.close(os.open(self.guard_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return
+            except FileExistsError:
+                try:
+                    # Held only for a read and a remove; older means its holder died
+                    if time.time() - os.path.getmtime(self.guard_path) > 5:
+                        os.remove(self.guard_path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.001)
+
+    def _remove_if_owner(self, owner) -> bool:
+        self._guard()
+        try:
+            holder = self._read()
+            if holder is None or holder.get('owner') != owner:
+                return False
+            os.remove(self.path)
+            return True
+        finally:
+            os.remove(self.guard_path)
+
+    def _remove(self, holder: dict) -> None:
+        self._remove_if_owner(holder.get('owner'))
+
+    def _release(self) -> bool:
+        return self._remove_if_owner(self.owner)
+
+
+class S3Lease(_BaseLease):
+    """Lease backed by a conditionally written S3 object
+
+    Uses ``IfNoneMatch='*'`` so that only one writer can create the lock
+    object; everyone else gets a 412 and waits. Deletes are conditional
+    on the ETag of the lock object being removed.
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str, **kwargs):
+        super().__init__(**kwargs)
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.etag = None
+
+    def __repr__(self):
+        return f"S3Lease({self.bucket}/{self.key})"
+
+    def _try_acquire(self, owner: str, expires_at: float) -> bool:
+        try:
+            response = self.s3_client.put_object(
+                Body=json.dumps({'pid': os.getpid(), 'owner': owner, 'expires_at': expires_at}),
+                Bucket=self.bucket,
+                Key=self.key,
+                IfNoneMatch='*'
+            )
+        except ClientError as e:
+            if _is_precondition_failure(e):
+                return False
+            raise
+        self.etag = response.get('ETag')
+        return True
+
+    def _read(self):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+            holder = json.loads(response['Body'].read().decode('utf-8'))
+        except (ClientError, ValueError):
+            return None
+        if 'expires_at' not in holder:
+            return None
+        holder['etag'] = response.get('ETag')
+        return holder
+
+    def _delete(self, etag) -> bool:
+        try:
+            if etag:
+                self.s3_client.delete_object(Bucket=self.bucket, Key=self.key, IfMatch=etag)
+            else:
+                self.s3_client.delete_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as e:
+            if _is_precondition_failure(e) or e.response.get('Error', {}).get('Code') == 'NoSuchKey':
+                return False
+            raise
+        return True
+
+    def _remove(self, holder: dict) -> None:
+        if holder.get('etag'):
+            self._delete(holder['etag'])
+
+    def _release(self) -> bool:
+        released = self._delete(self.etag)
+        self.etag = None
+        return released
+
+
+def _is_precondition_failure(e: ClientError) -> bool:
+    return e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict')
@@ -1,73 +1,381 @@
 import os
+import json
+import argparse
 import logging
-from src.strava.auth import StravaAuth
-from src.strava.activities import StravaActivities
-from src.spotify.handler import SpotifyHandler
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from src.context import AppContext
+from src.deadline import Deadline, WorkDeferred, get_request_guard
+from src.dry_run import plan_from_context
+from src.export import exporter_from_env
+from src.profiling import PROFILE_MODES, profiler_from_env
+from src.planner import group_by_from_env, plan_playlists, write_playlist
+from src.spotify.handler import merge_recorded_plays
+from src.startup import start_run
+from src.strava.activities import ActivityRecord
+from src.strava.streams import ActivityStreams, align_plays
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-def process_activities(create_playlist=True, limit=1, use_s3=False):
+def process_activities(create_playlist=True, limit=1, use_s3=False, context=None, align_streams=False,
+                       exporter=None, deadline=None, group_by=None, source='strava', since=None):
     """Process Strava activities and create Spotify playlists
     
     Args:
         create_playlist (bool): Whether to create Spotify playlists
         limit (int): Number of recent activities to process
         use_s3 (bool): Whether to use S3 for token storage
+        context (AppContext): Warm context to reuse; a fresh one is created if None
+        align_streams (bool): Drop tracks played while paused, using activity streams
+        exporter (ColumnarExporter): Write results and plays as Parquet/Arrow files
+        deadline (Deadline): Time budget; outbound calls get timeouts within it
+            and activities left when it runs out are deferred to the next run
+        group_by (str): One playlist per ``activity`` (default), ``day``,
+            ``week`` or activity ``type``; defaults to PLAYLIST_GROUP_BY
+        source (str): List activities from ``strava`` (default) or from the
+            state ``store``, e.g. after importing a Strava archive
+        since (float): With ``source='store'``, every run starting after
+            this epoch instead of the newest ``limit``
         
     Returns:
         list: List of processed activities
     """
     logger.info(f"Processing {limit} activities (create_playlist={create_playlist}, use_s3={use_s3})")
     
-    # Initialize auth handlers
-    strava_auth = StravaAuth(use_s3=use_s3)
-    strava_auth.authenticate()
-    
-    strava = StravaActivities(strava_auth)
-    spotify = SpotifyHandler()
-
-    # Get user info
-    athlete = strava.get_athlete_info()
-    logger.info(f'Hello, {athlete.firstname} {athlete.lastname}!')
-
-    results = []
-    # Process activities
-    activity_count = 0
-    for activity in strava.get_activities(limit=limit):
-        activity_count += 1
-        name, start, start_epoch, end, end_epoch = activity
-        logger.info(f'Activity: {name}')
-        logger.info(f'Start: {start} ({start_epoch}), End: {end} ({end_epoch})')
+    # Initialize auth handlers, reusing warm clients when available. Strava
+    # auth and listing overlap with Spotify auth and the history prefetch.
+    get_request_guard().start(deadline)
+    if context is None:
+        context = AppContext(use_s3=use_s3)
+    list_activities = None
+    if source == 'store':
+        list_activities = lambda: stored_activities(context.store, limit, since)
+    elif source != 'strava':
+        raise ValueError(f"Unknown activity source: {source}")
+    activities, context.startup_report = start_run(context, limit, list_activities=list_activities)
 
-        activity_tracks = spotify.get_activity_tracks(start_epoch, end_epoch)
-        logger.info(f'Found {len(activity_tracks)} tracks played during this activity')
-
-        if create_playlist and activity_tracks:
-            spotify.create_activity_playlist(name, start, end, activity_tracks)
-            logger.info(f'Created playlist with {len(activity_tracks)} tracks')
-            
-        results.append({
-            'activity_name': name,
-            'start_time': start.isoformat(),
-            'end_time': end.isoformat(),
-            'track_count': len(activity_tracks)
-        })
-    
-    logger.info(f"Processed {activity_count} activities")
+    strava = context.strava
+    spotify = context.spotify
+    store = context.store
+
+    # Greet from the cached profile; never spend an API call on it
+    athlete = context.get_athlete()
+    if athlete:
+        logger.info(f"Hello, {athlete['firstname']} {athlete['lastname']}!")
+
+    matched = []
+    context.deferred = []
+    # Match every activity first, then write one playlist per group
+    for position, activity in enumerate(activities):
+        if create_playlist and _already_processed(store, activity):
+            continue
+        try:
+            matched.append((activity, process_activity(
+                activity,
+                spotify,
+                create_playlist=False,
+                strava=strava if align_streams else None,
+                store=store,
+                archive=context.play_archive
+            )))
+        except WorkDeferred as e:
+            # Save what is done; the rest is picked up by the next run
+            context.deferred = activities[position:]
+            logger.warning(f"Deferring {len(context.deferred)} activities: {str(e)}")
+            break
+
+    results = [result for _, result in matched]
+    if context.enricher is not None:
+        # One lookup for the run's unique tracks, before descriptions are written
+        try:
+            enrich_results(context.enricher, spotify, results)
+        except WorkDeferred as e:
+            logger.warning(f"Skipping track details: {str(e)}")
+    if create_playlist:
+        groups = plan_playlists(
+            matched,
+            group_by or group_by_from_env(),
+            taken_names=store.playlist_names() if store is not None else ()
+        )
+        results = []
+        for position, group in enumerate(groups):
+            try:
+                write_playlist(group, spotify, store, top_tracks=context.top_tracks)
+            except WorkDeferred as e:
+                unwritten = [activity for pending in groups[position:] for activity in pending.activities]
+                context.deferred = unwritten + context.deferred
+                logger.warning(f"Deferring {len(context.deferred)} activities: {str(e)}")
+                break
+            results.extend(result for _, result in group.members)
+
+    if context.top_tracks is not None:
+        if create_playlist:
+            sync_top_tracks(context.top_tracks, spotify)
+        else:
+            for activity, result in matched:
+                context.top_tracks.add(activity, result['tracks'])
+
+    if context.play_archive is not None:
+        context.play_archive.add_plays(spotify.play_history)
+    if context.results_archive is not None:
+        context.results_archive.append(results)
+    if exporter is not None:
+        exporter.export_run(results, spotify.play_history)
+    context.save_state()
+
+    logger.info(f"Processed {len(activities)} activities")
+    context.log_connection_stats()
     return results
 
 
-def main():
+def stored_activities(store, limit: int, since: float = None) -> list:
+    """List runs from the state store, newest first, like Strava would
+
+    Args:
+        store (StateStore): Store filled by a backfill or archive import
+        limit (int): Number of newest runs, when ``since`` is not given
+        since (float): Every run starting after this epoch
+
+    Returns:
+        list: ActivityRecords
+    """
+    if store is None:
+        raise ValueError("Listing activities from the store needs STATE_DB set to local or s3")
+    return [ActivityRecord.from_row(row) for row in store.runs(limit, since)]
+
+
+def sync_top_tracks(top_tracks, spotify) -> None:
+    """Bring the top tracks playlist up to date with the activities counted in"""
+    try:
+        top_tracks.sync(spotify)
+    except Exception as e:
+        # The diff is still pending and goes out with the next run
+        logger.warning(f"Could not update the top tracks playlist: {str(e)}")
+
+
+def enrich_results(enricher, spotify, results: list) -> None:
+    """Add ``track_details`` to results, looking up all their tracks at once
+
+    Args:
+        enricher (TrackEnricher): Track metadata source
+        spotify (SpotifyHandler): Handler whose client makes the calls
+        results (list): Processed activity summaries, updated in place
+    """
+    uris = list(dict.fromkeys(uri for result in results for uri in result['tracks']))
+    details = enricher.enrich(spotify, uris)
+    for result in results:
+        result['track_details'] = [details.get(uri) for uri in result['tracks']]
+
+
+def _already_processed(store, activity) -> bool:
+    """Whether the state store says this activity already got its playlist"""
+    activity_id = getattr(activity, 'activity_id', None)
+    if store is None or not activity_id or not store.is_processed(activity_id):
+        return False
+    logger.info(f"Activity {activity_id} already processed, skipping")
+    return True
+
+
+def process_activity(activity, spotify, create_playlist=True, strava=None, store=None, archive=None,
+                     enricher=None, top_tracks=None):
+    """Match one activity against Spotify history and create its playlist
+
+    Args:
+        activity (tuple): (name, start, start_epoch, end, end_epoch) record
+        spotify (SpotifyHandler): Spotify handler
+        create_playlist (bool): Whether to create a Spotify playlist
+        strava (StravaActivities): If given, align plays with the activity
+            streams (or moving intervals in the store) and drop tracks
+            played while paused
+        store (StateStore): If given, plays are stored and the activity
+            window is matched with an indexed query, which also finds plays
+            that have since dropped out of Spotify's recent history
+        archive (PlayArchive): Used like ``store`` for plays when there is no
+            store; only the partitions overlapping the activity are read
+        enricher (TrackEnricher): If given, add artist, duration and tempo to
+            the result and the playlist description
+        top_tracks (TopTracks): Counts the activity in once its playlist is
+            written; syncing the playlist is left to the caller
+
+    Returns:
+        dict: Processed activity summary
+    """
+    name, start, start_epoch, end, end_epoch = activity
+    logger.info(f'Activity: {name}')
+    logger.info(f'Start: {start} ({start_epoch}), End: {end} ({end_epoch})')
+
+    plays = None
+    streams = None
+    if strava is not None and getattr(activity, 'activity_id', None):
+        intervals = store.moving_intervals(activity.activity_id) if store is not None else None
+        if intervals:
+            # Imported from the activity file; no streams call needed
+            streams = ActivityStreams.from_intervals(start_epoch, intervals)
+        else:
+            streams = strava.get_activity_streams(activity)
+
+    window_plays = None
+    play_log = store if store is not None else archive
+    if play_log is not None:
+        play_log.add_plays(spotify.get_recently_played(max_age=spotify.history_max_age))
+        window_plays = play_log.plays_between(start_epoch, end_epoch)
+        if spotify.play_log is not None:
+            window_plays = merge_recorded_plays(spotify.play_log.plays_between(start_epoch, end_epoch), window_plays)
+
+    if streams is not None:
+        if window_plays is None:
+            window_plays = spotify.get_activity_plays(start_epoch, end_epoch)
+        plays = align_plays(streams, window_plays)
+        activity_tracks = [play['uri'] for play in plays if play['moving']]
+        logger.info(f'Dropped {len(plays) - len(activity_tracks)} tracks played while paused')
+    elif window_plays is not None:
+        activity_tracks = [uri for uri, _ in window_plays]
+    else:
+        activity_tracks = spotify.get_activity_tracks(start_epoch, end_epoch)
+    logger.info(f'Found {len(activity_tracks)} tracks played during this activity')
+
+    result = {
+        'activity_id': getattr(activity, 'activity_id', None),
+        'activity_type': getattr(activity, 'activity_type', None),
+        'activity_name': name,
+        'start_time': start.isoformat(),
+        'end_time': end.isoformat(),
+        'track_count': len(activity_tracks),
+        'tracks': activity_tracks
+    }
+    if plays is not None:
+        result['plays'] = plays
+    if enricher is not None:
+        enrich_results(enricher, spotify, [result])
+
+    if create_playlist:
+        taken_names = store.playlist_names() if store is not None else ()
+        write_playlist(plan_playlists([(activity, result)], 'activity', taken_names)[0], spotify, store,
+                       top_tracks=top_tracks)
+    return result
+
+
+def process_activity_id(activity_id, create_playlist=True, use_s3=False, context=None, save=True, fresh=False,
+                        deadline=None):
+    """Process a single Strava activity by ID
+
+    Args:
+        activity_id (int): Strava activity ID
+        create_playlist (bool): Whether to create a Spotify playlist
+        use_s3 (bool): Whether to use S3 for token storage
+        context (AppContext): Warm context to reuse; a fresh one is created if None
+        save (bool): Persist the state store afterwards; batch callers save once
+        fresh (bool): Fetch the activity past the HTTP cache, e.g. for a
+            webhook event saying it changed
+        deadline (Deadline): Time budget for the outbound calls. Only applied
+            when saving: batch workers (save=False) run under the batch's
+            deadline, which process_batch has already started
+
+    Returns:
+        dict: Processed activity summary, or None if the activity isn't a run
+        or was already processed
+    """
+    if save:
+        # Don't inherit the deadline of an earlier run in this container
+        get_request_guard().start(deadline)
+    if context is None:
+        context = AppContext(use_s3=use_s3)
+    context.ensure()
+    store = context.store
+
+    if create_playlist and store is not None and store.is_processed(activity_id):
+        logger.info(f"Activity {activity_id} already processed, skipping")
+        return None
+
+    cache = context.http_cache if fresh else None
+    with cache.bypass() if cache is not None else nullcontext():
+        activity = context.strava.get_activity(activity_id)
+    if activity is None:
+        logger.info(f"Activity {activity_id} is not a run, skipping")
+        return None
+    result = process_activity(
+        activity,
+        context.spotify,
+        create_playlist=create_playlist,
+        store=store,
+        archive=context.play_archive,
+        enricher=context.enricher,
+        top_tracks=context.top_tracks
+    )
+    if save:
+        if create_playlist and context.top_tracks is not None:
+            sync_top_tracks(context.top_tracks, context.spotify)
+        context.save_state()
+    return result
+
+
+def _date_epoch(text: str) -> float:
+    """Epoch of midnight UTC on a YYYY-MM-DD date"""
+    return datetime.strptime(text, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+
+
+def parse_args(argv=None):
+    """Parse command-line options for local execution"""
+    parser = argparse.ArgumentParser(description='Create Spotify playlists from Strava activities')
+    parser.add_argument('--deadline', type=float, default=None,
+                        help='Stop starting new API calls after this many seconds')
+    parser.add_argument('--profile', choices=sorted(PROFILE_MODES), default=None,
+                        help='Profile the run (defaults to the PROFILE environment variable)')
+    parser.add_argument('--profile-dir', default=None,
+                        help='Directory for profile reports (default: PROFILE_DIR or ./profiles)')
+    parser.add_argument('--limit', type=int, default=1,
+                        help='Number of recent activities to process (default: 1)')
+    parser.add_argument('--from-store', action='store_true',
+                        help='List activities from the state database instead of Strava, e.g. after an archive import')
+    parser.add_argument('--since', type=_date_epoch, default=None,
+                        help='With --from-store, process every run since this date (YYYY-MM-DD) instead of --limit')
+    parser.add_argument('--align-streams', action='store_true',
+                        help='Drop tracks played while paused, using stored moving stretches or activity streams '
+                             '(always on with --from-store)')
+    parser.add_argument('--plan', action='store_true',
+                        help='Print the calls and time the run would take from cached state, calling no API')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """Main function for local execution"""
+    args = parse_args(argv)
+
     # Configure basic logging
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
+    if args.plan:
+        plan = plan_from_context(
+            AppContext(),
+            limit=args.limit,
+            align_streams=args.align_streams or args.from_store,
+            source='store' if args.from_store else 'strava',
+            since=args.since
+        )
+        print(json.dumps(plan, indent=2))
+        return plan
+
     # Run with default settings for local execution
-    process_activities(create_playlist=True)
+    deadline = Deadline(args.deadline, reserve=0) if args.deadline else None
+    profiler = profiler_from_env(mode=args.profile, directory=args.profile_dir)
+    context = AppContext()
+    with profiler or nullcontext():
+        process_activities(
+            create_playlist=True,
+            limit=args.limit,
+            context=context,
+            exporter=exporter_from_env(),
+            deadline=deadline,
+            # Imported activities come with their moving stretches
+            align_streams=args.align_streams or args.from_store,
+            source='store' if args.from_store else 'strava',
+            since=args.since
+        )
+    context.cache_missing_athlete(deadline=deadline)
 
 
 if __name__ == '__main__':
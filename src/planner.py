@@ -0,0 +1,159 @@
+import os
+import logging
+from datetime import datetime
+
+from src.spotify.enrichment import describe_tracks
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+GROUPINGS = ('activity', 'day', 'week', 'type')
+
+
+class PlaylistGroup:
+    """Activities that share one playlist
+
+    Args:
+        key (str): Grouping key, e.g. the day
+        name (str): Unique playlist name
+        members (list): (activity, result) pairs, oldest first
+    """
+
+    def __init__(self, key: str, name: str, members: list):
+        self.key = key
+        self.name = name
+        self.members = members
+
+    def __repr__(self):
+        return f"PlaylistGroup({self.name!r}, {len(self.members)} activities, {len(self.tracks)} tracks)"
+
+    @property
+    def activities(self) -> list:
+        return [activity for activity, _ in self.members]
+
+    @property
+    def tracks(self) -> list:
+        """Track lists of all members, one activity after the other"""
+        return [uri for _, result in self.members for uri in result['tracks']]
+
+    def description(self) -> str:
+        title = ' + '.join(result['activity_name'] for _, result in self.members)
+        details = {}
+        for _, result in self.members:
+            for uri, track in zip(result['tracks'], result.get('track_details') or []):
+                if track is not None:
+                    details[uri] = track
+        if details:
+            return describe_tracks(title, self.tracks, details)
+        return title
+
+
+def _start(result: dict) -> datetime:
+    return datetime.fromisoformat(result['start_time'])
+
+
+def group_key(activity, result: dict, group_by: str) -> str:
+    start = _start(result)
+    if group_by == 'day':
+        return start.date().isoformat()
+    if group_by == 'week':
+        year, week, _ = start.isocalendar()
+        return f"{year}-W{week:02d}"
+    if group_by == 'type':
+        return result.get('activity_type') or 'Run'
+    return str(result.get('activity_id') or id(activity))
+
+
+def playlist_name(group_by: str, key: str, start: datetime, activity_type=None) -> str:
+    if group_by == 'week':
+        year, week = key.split('-W')
+        return f"Runlist - week {int(week)}/{year}"
+    if group_by == 'type':
+        return f"Runlist - {key} {start.day}/{start.month}"
+    if activity_type and activity_type != 'Run':
+        return f"Runlist - {activity_type} {start.day}/{start.month}"
+    return f"Runlist - {start.day}/{start.month}"
+
+
+def plan_playlists(matched: list, group_by: str = 'activity', taken_names=()) -> list:
+    """Group matched activities into playlists with unique names
+
+    Args:
+        matched (list): (activity, result) pairs from process_activity
+        group_by (str): ``activity``, ``day``, ``week`` or ``type``
+        taken_names (iterable): Names of existing playlists to avoid
+
+    Returns:
+        list: PlaylistGroup per group, in order of their first activity
+    """
+    if group_by not in GROUPINGS:
+        raise ValueError(f"Unsupported playlist grouping: {group_by}")
+
+    members_by_key = {}
+    for activity, result in sorted(matched, key=lambda pair: _start(pair[1])):
+        members_by_key.setdefault(group_key(activity, result, group_by), []).append((activity, result))
+
+    taken = set(taken_names)
+    groups = []
+    for key, members in members_by_key.items():
+        first = members[0][1]
+        base = playlist_name(group_by, key, _start(first), first.get('activity_type'))
+        name = base
+        suffix = 2
+        while name in taken:
+            name = f"{base} ({suffix})"
+            suffix += 1
+        taken.add(name)
+        groups.append(PlaylistGroup(key, name, members))
+    return groups
+
+
+def write_playlist(group: PlaylistGroup, spotify, store=None, top_tracks=None):
+    """Create one group's playlist and record it
+
+    Activities without tracks get no playlist. They are only marked
+    processed once the Spotify history is known to cover their window;
+    until then the plays may just not have been fetched yet, and the next
+    run tries again. Activities that are done are counted into
+    ``top_tracks``, whichever path (scheduled, webhook, batch) wrote them.
+
+    Returns:
+        str: Playlist ID, or None if the group had no tracks
+    """
+    playlist_id = None
+    tracks = group.tracks
+    if tracks:
+        first = group.members[0][1]
+        last = group.members[-1][1]
+        playlist_id = spotify.create_activity_playlist(
+            first['activity_name'],
+            _start(first),
+            datetime.fromisoformat(last['end_time']),
+            tracks,
+            description=group.description(),
+            name=group.name
+        )
+        logger.info(f"Created playlist {group.name!r} with {len(tracks)} tracks from {len(group.members)} activities")
+
+    activity_ids = [getattr(activity, 'activity_id', None) for activity in group.activities]
+    if store is not None and playlist_id is not None:
+        store.add_playlist(playlist_id, activity_ids[0], group.name, len(tracks))
+        store.link_playlist(playlist_id, [activity_id for activity_id in activity_ids if activity_id])
+
+    for activity, result in group.members:
+        if playlist_id is not None:
+            result['playlist_id'] = playlist_id
+            result['playlist_name'] = group.name
+        if store is not None and getattr(activity, 'activity_id', None):
+            if not (result['tracks'] or spotify.history_covers(activity.start_epoch, activity.end_epoch)):
+                logger.info(f"No tracks yet for activity {activity.activity_id}, leaving it for the next run")
+                continue
+            store.mark_processed(activity, len(result['tracks']))
+        if top_tracks is not None:
+            top_tracks.add(activity, result['tracks'])
+    return playlist_id
+
+
+def group_by_from_env() -> str:
+    """``PLAYLIST_GROUP_BY``: activity (default), day, week or type"""
+    return os.environ.get('PLAYLIST_GROUP_BY', 'activity').lower()
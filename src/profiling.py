@@ -0,0 +1,180 @@
+import io
+import os
+import sys
+import time
+import pstats
+import random
+import logging
+import cProfile
+import tempfile
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+from src.storage import LocalStorage, S3Storage, S3_PREFIX
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = {
+    'cpu': (True, False),
+    'memory': (False, True),
+    'all': (True, True),
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unknown"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Profiler:
+    """cProfile, tracemalloc and peak RSS around a block of code
+
+    Used as a context manager. On exit a text report (and the raw cProfile
+    stats for snakeviz/pstats) is written to ``storage`` under a name built
+    from ``label`` and the start time.
+
+    cProfile only sees the thread that enabled it, so every thread started
+    inside the block (thread pools included) gets its own profile, merged
+    into the report. Threads that were already running when the block
+    started, such as workers of a pool kept from an earlier run, are not
+    profiled; the report says how many threads were covered.
+
+    Args:
+        storage: LocalStorage or S3Storage the reports go to
+        cpu (bool): Collect cProfile stats
+        memory (bool): Trace allocations with tracemalloc
+        top (int): Number of functions/allocation sites in the report
+        label (str): Report name prefix
+    """
+
+    def __init__(self, storage, cpu=True, memory=True, top=25, label='run'):
+        self.storage = storage
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self.label = label
+        self.keys = []
+        self._profile = None
+        self._thread_profiles = []
+        self._unprofiled_threads = 0
+        self._lock = threading.Lock()
+        self._started_at = None
+
+    def __enter__(self):
+        self._started_at = time.time()
+        if self.memory:
+            tracemalloc.start()
+        if self.cpu:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            threading.setprofile(self._profile_thread)
+        return self
+
+    def _profile_thread(self, frame, event, arg):
+        """Runs once in each new thread to give it its own profile"""
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler per interpreter
+            with self._lock:
+                self._unprofiled_threads += 1
+            return
+        with self._lock:
+            self._thread_profiles.append(profile)
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self._started_at
+        if self._profile is not None:
+            threading.setprofile(None)
+            self._profile.disable()
+        snapshot = None
+        traced_peak = None
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        try:
+            self._write(elapsed, snapshot, traced_peak)
+        except Exception as e:
+            # Never let profiling break the run it is measuring
+            logger.error(f"Could not write profile: {str(e)}")
+        return False
+
+    def report(self, elapsed, snapshot=None, traced_peak=None) -> str:
+        lines = [f"{self.label}: {elapsed:.3f}s wall"]
+        rss = peak_rss_mb()
+        if rss is not None:
+            lines.append(f"peak RSS: {rss:.1f} MB")
+
+        if self._profile is not None:
+            out = io.StringIO()
+            stats = self.stats(stream=out)
+            stats.sort_stats('cumulative').print_stats(self.top)
+            threads = f"{1 + len(self._thread_profiles)} threads"
+            if self._unprofiled_threads:
+                threads += f", {self._unprofiled_threads} started but not profiled"
+            lines += ['', f"== cProfile (cumulative, {threads}) ==", out.getvalue()]
+
+        if snapshot is not None:
+            lines += ['', f"== tracemalloc (peak {traced_peak / 1024:.1f} KB) =="]
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                lines.append(str(stat))
+        return '\n'.join(lines)
+
+    def stats(self, stream=None) -> pstats.Stats:
+        """cProfile stats of the block, all profiled threads merged"""
+        with self._lock:
+            profiles = list(self._thread_profiles)
+        return pstats.Stats(self._profile, *profiles, stream=stream)
+
+    def _write(self, elapsed, snapshot, traced_peak) -> None:
+        name = f"{self.label}-{time.strftime('%Y%m%dT%H%M%S', time.gmtime(self._started_at))}"
+        report = self.report(elapsed, snapshot, traced_peak)
+        self.storage.put(f"{name}.txt", report.encode('utf-8'))
+        self.keys.append(f"{name}.txt")
+
+        if self._profile is not None:
+            with tempfile.NamedTemporaryFile(suffix='.prof') as f:
+                self.stats().dump_stats(f.name)
+                self.storage.put(f"{name}.prof", f.read())
+            self.keys.append(f"{name}.prof")
+        logger.info(f"Profile written to {self.storage}: {', '.join(self.keys)}")
+
+
+def profiler_from_env(use_s3=False, mode=None, directory=None, label='run'):
+    """Build the profiler configured by environment variables, if any
+
+    ``PROFILE`` is ``cpu``, ``memory``, ``all`` or ``off`` (default).
+    ``PROFILE_SAMPLE_RATE`` profiles only that fraction of runs (default
+    1.0). Reports go to ``PROFILE_DIR`` locally, or next to the token under
+    ``S3_BUCKET``/``S3_PREFIX``/profiles when ``use_s3`` is set. ``mode`` and
+    ``directory`` override the environment, e.g. from CLI flags.
+
+    Returns:
+        Profiler: Or None when profiling is off or the run wasn't sampled
+    """
+    mode = (mode or os.environ.get('PROFILE', 'off')).lower()
+    if mode not in PROFILE_MODES:
+        return None
+    if random.random() >= float(os.environ.get('PROFILE_SAMPLE_RATE', 1.0)):
+        return None
+
+    if use_s3:
+        prefix = os.environ.get('S3_PREFIX', S3_PREFIX)
+        storage = S3Storage(os.environ.get('S3_BUCKET'), f"{prefix}/profiles")
+    else:
+        storage = LocalStorage(directory or os.environ.get('PROFILE_DIR', 'profiles'))
+    cpu, memory = PROFILE_MODES[mode]
+    return Profiler(storage, cpu=cpu, memory=memory, label=label)
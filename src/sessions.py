@@ -0,0 +1,139 @@
+import socket
+import logging
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Idempotent methods are safe to retry; playlist creation (POST) is not
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Detect dead keep-alive connections instead of hanging on them
+KEEPALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+
+_shared_session = None
+_shared_session_guard = threading.Lock()
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter with TCP keep-alive enabled on pooled connections
+
+    With a RequestGuard every request gets a timeout clamped to the run
+    deadline and goes through the circuit breaker of its host.
+    """
+
+    def __init__(self, *args, guard=None, **kwargs):
+        self.guard = guard
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault('socket_options', KEEPALIVE_SOCKET_OPTIONS)
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if self.guard is None:
+            return super().send(request, timeout=timeout, **kwargs)
+
+        host = urlparse(request.url).hostname
+        timeout = self.guard.before(host, timeout)
+        try:
+            response = super().send(request, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            self.guard.after(host, ok=False)
+            raise
+        self.guard.after(host, ok=response.status_code < 500)
+        return response
+
+
+def create_session(pool_connections: int = 4, pool_maxsize: int = 10,
+                   retries: int = 3, backoff_factor: float = 0.3, cache=None,
+                   guard=None) -> requests.Session:
+    """Create a requests session with pooled keep-alive connections and retries
+
+    Args:
+        pool_connections (int): Number of hosts to keep connection pools for
+        pool_maxsize (int): Connections kept open per host
+        retries (int): Retries for failed idempotent requests
+        backoff_factor (float): Exponential backoff factor between retries
+        cache (HttpCache): Optional response cache for GET requests
+        guard (RequestGuard): Optional deadline and circuit breakers
+
+    Returns:
+        requests.Session: Configured session
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=RETRY_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter_kwargs = dict(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+        guard=guard
+    )
+    if cache is not None:
+        # Imported here as the cache adapter builds on PooledAdapter
+        from src.http_cache import CachingAdapter
+        adapter = CachingAdapter(cache, **adapter_kwargs)
+    else:
+        adapter = PooledAdapter(**adapter_kwargs)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+
+def get_shared_session() -> requests.Session:
+    """Return the process-wide session shared by the Strava and Spotify clients"""
+    global _shared_session
+    with _shared_session_guard:
+        if _shared_session is None:
+            _shared_session = create_session()
+        return _shared_session
+
+
+def connection_stats(session: requests.Session) -> dict:
+    """Report per-host request and connection counts for a session
+
+    Returns:
+        dict: host -> {'requests', 'connections', 'reused'}, where ``reused``
+        is the number of requests served over an already open connection
+    """
+    stats = {}
+    for adapter in set(session.adapters.values()):
+        poolmanager = getattr(adapter, 'poolmanager', None)
+        if poolmanager is None:
+            continue
+        for key in list(poolmanager.pools.keys()):
+            pool = poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            host = stats.setdefault(pool.host, {'requests': 0, 'connections': 0, 'reused': 0})
+            host['requests'] += pool.num_requests
+            host['connections'] += pool.num_connections
+            host['reused'] += max(pool.num_requests - pool.num_connections, 0)
+    return stats
+
+
+def log_connection_stats(session: requests.Session) -> None:
+    """Log connection reuse for each host the session talked to"""
+    for host, host_stats in connection_stats(session).items():
+        logger.info(
+            f"{host}: {host_stats['requests']} requests over "
+            f"{host_stats['connections']} connections ({host_stats['reused']} reused)"
+        )
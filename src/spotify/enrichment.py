@@ -0,0 +1,210 @@
+import os
+import gzip
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from spotipy.exceptions import SpotifyException
+
+from src.storage import LocalStorage, S3Storage
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Spotify's batch endpoint limits
+TRACKS_BATCH = 50
+AUDIO_FEATURES_BATCH = 100
+
+# Shared by every user, so it lives outside the per-user S3_PREFIX
+TRACK_CACHE_PREFIX = 'shared'
+TRACK_CACHE_KEY = 'track-metadata.json.gz'
+
+# Spotify's description limit
+MAX_DESCRIPTION = 300
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class TrackCache:
+    """LRU cache of track metadata with a TTL, persisted to blob storage
+
+    Track metadata rarely changes and is the same for every user, so one
+    cache object is shared across runs and users. Saving merges with the
+    stored copy, so concurrent writers only ever add entries.
+
+    Args:
+        storage: LocalStorage or S3Storage
+        ttl (float): Seconds an entry stays fresh
+        max_entries (int): Least recently used entries beyond this are dropped
+    """
+
+    def __init__(self, storage, ttl: float = 90 * 24 * 3600, max_entries: int = 20000,
+                 key: str = TRACK_CACHE_KEY):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.key = key
+        self.entries = None
+        self.dirty = False
+        self.stats = {'hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict:
+        data = self.storage.get(self.key)
+        return json.loads(gzip.decompress(data).decode('utf-8')) if data else {}
+
+    def _load(self) -> None:
+        if self.entries is None:
+            stored = self._read()
+            self.entries = OrderedDict(sorted(stored.items(), key=lambda item: item[1]['fetched_at']))
+
+    def get(self, uri: str):
+        """Return fresh metadata for a track, or None"""
+        with self._lock:
+            self._load()
+            entry = self.entries.get(uri)
+            if entry is None or time.time() - entry['fetched_at'] > self.ttl:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(uri)
+            self.stats['hits'] += 1
+            return entry['track']
+
+    def put(self, uri: str, track: dict) -> None:
+        with self._lock:
+            self._load()
+            self.entries[uri] = {'track': track, 'fetched_at': time.time()}
+            self.entries.move_to_end(uri)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def save(self) -> bool:
+        """Write new entries back, merged with what others stored meanwhile"""
+        with self._lock:
+            if not self.dirty:
+                return False
+            merged = self._read()
+            for uri, entry in self.entries.items():
+                if uri not in merged or merged[uri]['fetched_at'] < entry['fetched_at']:
+                    merged[uri] = entry
+            newest = sorted(merged.items(), key=lambda item: item[1]['fetched_at'])[-self.max_entries:]
+            self.storage.put(self.key, gzip.compress(json.dumps(dict(newest)).encode('utf-8')))
+            self.dirty = False
+        logger.info(f"Track cache saved: {len(newest)} tracks ({self.stats})")
+        return True
+
+
+class TrackEnricher:
+    """Artist, duration and tempo for tracks, fetched in batches and cached
+
+    Only tracks missing from the cache are requested, 50 per ``tracks``
+    call and 100 per ``audio-features`` call, so the cost of a run grows
+    with the number of new unique tracks rather than with plays.
+
+    Args:
+        cache (TrackCache): Shared metadata cache
+    """
+
+    def __init__(self, cache: TrackCache):
+        self.cache = cache
+        self.calls = 0
+        self._audio_features = True
+
+    def enrich(self, spotify, uris: list) -> dict:
+        """Return metadata for each unique URI
+
+        Args:
+            spotify (SpotifyHandler): Handler whose client makes the calls
+            uris (list): Track URIs, possibly repeated
+
+        Returns:
+            dict: uri -> {'name', 'artist', 'duration_ms', 'tempo'}
+        """
+        unique = list(dict.fromkeys(uris))
+        details = {}
+        missing = []
+        for uri in unique:
+            track = self.cache.get(uri)
+            if track is None:
+                missing.append(uri)
+            else:
+                details[uri] = track
+
+        fetched = self._fetch(spotify.sp, missing)
+        for uri, track in fetched.items():
+            self.cache.put(uri, track)
+        details.update(fetched)
+        return details
+
+    def _fetch(self, sp, uris: list) -> dict:
+        fetched = {}
+        for batch in _chunks(uris, TRACKS_BATCH):
+            self.calls += 1
+            for track in sp.tracks(batch)['tracks']:
+                if track is None:
+                    continue
+                fetched[track['uri']] = {
+                    'name': track['name'],
+                    'artist': ', '.join(artist['name'] for artist in track['artists']),
+                    'duration_ms': track['duration_ms'],
+                    'tempo': None,
+                }
+
+        for batch in _chunks(list(fetched), AUDIO_FEATURES_BATCH):
+            if not self._audio_features:
+                break
+            self.calls += 1
+            try:
+                features = sp.audio_features(batch)
+            except SpotifyException as e:
+                # Not available to every app; keep the rest of the metadata
+                logger.warning(f"Audio features unavailable, skipping tempo: {str(e)}")
+                self._audio_features = False
+                break
+            for feature in features or []:
+                if feature and feature.get('uri') in fetched:
+                    fetched[feature['uri']]['tempo'] = feature.get('tempo')
+        return fetched
+
+    def save(self) -> bool:
+        return self.cache.save()
+
+
+def describe_tracks(activity_name: str, tracks: list, details: dict) -> str:
+    """Playlist description summarising an activity's tracks"""
+    known = [details[uri] for uri in tracks if uri in details]
+    parts = [activity_name, f"{len(tracks)} tracks"]
+    duration_ms = sum(track['duration_ms'] for track in known)
+    if duration_ms:
+        parts.append(f"{round(duration_ms / 60000)} min")
+    tempos = [track['tempo'] for track in known if track.get('tempo')]
+    if tempos:
+        parts.append(f"avg {round(sum(tempos) / len(tempos))} BPM")
+    artists = list(dict.fromkeys(track['artist'] for track in known))
+    if artists:
+        parts.append(', '.join(artists[:5]))
+    return ' · '.join(parts)[:MAX_DESCRIPTION]
+
+
+def enricher_from_env(use_s3=False):
+    """Build the track enricher configured by environment variables
+
+    ``ENRICH`` selects ``local`` (``TRACK_CACHE_DIR``), ``s3`` (under
+    ``S3_BUCKET``/``TRACK_CACHE_PREFIX``, shared by all users) or ``off``
+    (default). ``TRACK_CACHE_TTL_DAYS`` sets the entry TTL (default 90).
+    """
+    mode = os.environ.get('ENRICH', 'off').lower()
+    if mode == 'off':
+        return None
+    if mode == 's3':
+        storage = S3Storage(os.environ.get('S3_BUCKET'), os.environ.get('TRACK_CACHE_PREFIX', TRACK_CACHE_PREFIX))
+    else:
+        storage = LocalStorage(os.environ.get('TRACK_CACHE_DIR', '.motivator_cache'))
+    ttl = float(os.environ.get('TRACK_CACHE_TTL_DAYS', 90)) * 24 * 3600
+    return TrackEnricher(TrackCache(storage, ttl=ttl))
@@ -1,48 +1,201 @@
 import os
+import time
+import threading
+from collections import Counter
 from datetime import datetime, timezone
 
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 
+from src.sessions import get_shared_session
+
+
+# Recently played items kept in memory between warm invocations
+MAX_HISTORY_ITEMS = 500
+
+# Items per add-to-playlist call
+MAX_PLAYLIST_ADD = 100
+
+# Most items the recently-played endpoint returns
+RECENTLY_PLAYED_LIMIT = 50
+
+# Plays can take a few minutes to show up in recently played
+HISTORY_LAG = 5 * 60
+
 
 class SpotifyHandler:
-    def __init__(self):
-        scope = 'user-read-recently-played,playlist-modify-private,playlist-read-private,playlist-modify-public'
-        self.sp = spotipy.Spotify(auth_manager=SpotifyOAuth(scope=scope))
+    def __init__(self, history_max_age: float = 60, session=None, play_log=None, cache_handler=None):
+        scope = 'user-read-recently-played,user-read-currently-playing,playlist-modify-private,playlist-read-private,playlist-modify-public'
+        self.session = session or get_shared_session()
+        self.sp = spotipy.Spotify(
+            # cache_handler: where the token is kept; spotipy's .cache file if None
+            auth_manager=SpotifyOAuth(scope=scope, requests_session=self.session, cache_handler=cache_handler),
+            requests_session=self.session
+        )
+        self.history_max_age = history_max_age
+        # Plays captured by a PlayRecorder, beyond the last 50 Spotify keeps
+        self.play_log = play_log
+        self.play_history = []
+        self._user_id = None
+        self._history_fetched_at = None
+        self._history_lock = threading.Lock()
 
     def create_activity_playlist(self, activity_name: str, start_time: datetime,
-                                end_time: datetime, tracks: list) -> None:
-        """Create a playlist for an activity with the given tracks"""
-        user = self.sp.current_user()
-        playlist_name = f"Runlist - {start_time.day}/{start_time.month}"
+                                end_time: datetime, tracks: list, description: str = None,
+                                name: str = None) -> str:
+        """Create a playlist for an activity with the given tracks, returning its ID"""
+        playlist_name = name or f"Runlist - {start_time.day}/{start_time.month}"
+        playlist_id = self.create_playlist(playlist_name, description or activity_name)
+        self.update_playlist(playlist_id, add=tracks)
+        return playlist_id
+
+    @property
+    def user_id(self):
+        """Spotify user id saved with the token, or None until it is looked up"""
+        if self._user_id is None:
+            token = self.sp.auth_manager.cache_handler.get_cached_token()
+            if isinstance(token, dict):
+                self._user_id = token.get('user_id')
+        return self._user_id
+
+    def _remember_user(self, user_id: str) -> None:
+        """Keep the user id with the token so later runs don't look it up"""
+        self._user_id = user_id
+        cache_handler = self.sp.auth_manager.cache_handler
+        token = cache_handler.get_cached_token()
+        if isinstance(token, dict) and token.get('user_id') != user_id:
+            cache_handler.save_token_to_cache(dict(token, user_id=user_id))
+
+    def create_playlist(self, name: str, description: str) -> str:
+        """Create an empty playlist for the current user, returning its ID"""
+        user_id = self.user_id
+        if user_id is None:
+            user_id = self.sp.current_user()['id']
+            self._remember_user(user_id)
         playlist = self.sp.user_playlist_create(
-            user=user['id'],
-            name=playlist_name,
-            description=activity_name
+            user=user_id,
+            name=name,
+            description=description
         )
-        self.sp.playlist_add_items(playlist_id=playlist['id'], items=tracks)
+        return playlist['id']
 
-    def get_activity_tracks(self, start_epoch: float, end_epoch: float) -> list:
-        """Get tracks played during activity timeframe"""
-        track_results = self.sp.current_user_recently_played()
-        tracks = track_results['items']
+    def update_playlist(self, playlist_id: str, add=(), remove=()) -> None:
+        """Remove and then append tracks, at most 100 per call as the endpoints allow"""
+        remove = list(remove)
+        add = list(add)
+        for i in range(0, len(remove), MAX_PLAYLIST_ADD):
+            self.sp.playlist_remove_all_occurrences_of_items(playlist_id, remove[i:i + MAX_PLAYLIST_ADD])
+        for i in range(0, len(add), MAX_PLAYLIST_ADD):
+            self.sp.playlist_add_items(playlist_id=playlist_id, items=add[i:i + MAX_PLAYLIST_ADD])
+
+    def refresh_if_expiring(self, window: float) -> bool:
+        """Refresh the cached access token if it expires within ``window`` seconds
+
+        spotipy only refreshes once the token is all but expired, inline
+        with the next API call; this moves that call off the hot path.
+
+        Returns:
+            bool: Whether the token was refreshed
+        """
+        auth_manager = self.sp.auth_manager
+        token = auth_manager.cache_handler.get_cached_token()
+        if not token or token['expires_at'] - time.time() > window:
+            return False
+        auth_manager.refresh_access_token(token['refresh_token'])
+        return True
 
-        while track_results['next']:
-            track_results = self.sp.next(track_results)
-            tracks.extend(track_results['items'])
+    def get_recently_played(self, max_age: float = 0) -> list:
+        """Get recently played items, newest first
 
-        activity_tracks = []
+        Items are cached on the handler. Once the cache is older than
+        ``max_age`` seconds only plays newer than the latest cached one are
+        fetched, so warm invocations download just the new plays.
+        """
+        # Concurrent batch workers share one fetch
+        with self._history_lock:
+            if self._history_fetched_at is not None and time.time() - self._history_fetched_at <= max_age:
+                return self.play_history
+
+            if self.play_history:
+                latest = _parse_played_at(self.play_history[0]['played_at'])
+                track_results = self.sp.current_user_recently_played(after=int(latest.timestamp() * 1000))
+            else:
+                track_results = self.sp.current_user_recently_played()
+            tracks = list(track_results['items'])
+
+            while track_results['next']:
+                track_results = self.sp.next(track_results)
+                tracks.extend(track_results['items'])
+
+            seen = {item['played_at'] for item in self.play_history}
+            new_items = [item for item in tracks if item['played_at'] not in seen]
+            self.play_history = sorted(
+                new_items + self.play_history,
+                key=lambda item: item['played_at'],
+                reverse=True
+            )[:MAX_HISTORY_ITEMS]
+            self._history_fetched_at = time.time()
+            return self.play_history
+
+    def history_covers(self, start_epoch: float, end_epoch: float) -> bool:
+        """Whether the fetched history holds every play of a window
+
+        True once history was fetched a little after the window ended and
+        reaches back past its start, or Spotify had no older plays to drop.
+        """
+        if self._history_fetched_at is None or self._history_fetched_at < end_epoch + HISTORY_LAG:
+            return False
+        if len(self.play_history) < RECENTLY_PLAYED_LIMIT:
+            return True
+        return _parse_played_at(self.play_history[-1]['played_at']).timestamp() <= start_epoch
+
+    def get_activity_plays(self, start_epoch: float, end_epoch: float) -> list:
+        """Get (track_uri, played_at) pairs played during activity timeframe"""
+        tracks = self.get_recently_played(max_age=self.history_max_age)
+
+        activity_plays = []
 
         time_start = datetime.fromtimestamp(start_epoch, tz=timezone.utc)
         time_end = datetime.fromtimestamp(end_epoch, tz=timezone.utc)
 
         for track in tracks:
-            track_time = datetime.strptime(
-                track['played_at'],
-                '%Y-%m-%dT%H:%M:%S.%fZ'
-            ).replace(tzinfo=timezone.utc)
+            track_time = _parse_played_at(track['played_at'])
 
             if time_start < track_time < time_end:
-                activity_tracks.append(track['track']['uri'])
+                activity_plays.append((track['track']['uri'], track['played_at']))
+
+        if self.play_log is not None:
+            activity_plays = merge_recorded_plays(
+                self.play_log.plays_between(start_epoch, end_epoch),
+                activity_plays
+            )
+        return activity_plays
+
+    def get_activity_tracks(self, start_epoch: float, end_epoch: float) -> list:
+        """Get tracks played during activity timeframe"""
+        return [uri for uri, _ in self.get_activity_plays(start_epoch, end_epoch)]
+
+
+def merge_recorded_plays(recorded: list, history: list) -> list:
+    """Combine recorded and recently-played plays of a window, newest first
+
+    The recorder stamps a play when it starts and Spotify when it ends, so
+    the same play shows up at different times. Plays are matched by track
+    instead: each history play of a track already recorded is dropped.
+    """
+    unmatched = Counter(uri for uri, _ in recorded)
+    merged = list(recorded)
+    for uri, played_at in history:
+        if unmatched[uri]:
+            unmatched[uri] -= 1
+        else:
+            merged.append((uri, played_at))
+    return sorted(merged, key=lambda play: _parse_played_at(play[1]), reverse=True)
+
 
-        return activity_tracks
+def _parse_played_at(played_at: str) -> datetime:
+    """Parse a Spotify played_at timestamp"""
+    return datetime.strptime(
+        played_at,
+        '%Y-%m-%dT%H:%M:%S.%fZ'
+    ).replace(tzinfo=timezone.utc)
@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+
+from src.archive import PlayArchive
+from src.spotify.handler import SpotifyHandler
+from src.storage import LocalStorage, S3Storage, S3_PREFIX
+from src.token_refresh import TokenRefresher, refresh_window_from_env
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+RECORDED_PLAYS = 'recorded-plays'
+
+
+def _played_at(epoch_ms: float) -> str:
+    """Format a millisecond timestamp like Spotify's played_at"""
+    moment = datetime.fromtimestamp(epoch_ms / 1000, tz=timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}Z"
+
+
+class PlayRecorder:
+    """Record every track played by sampling Spotify's currently-playing state
+
+    While music plays the next poll is timed for just after the current
+    track should end (at most ``active_interval`` later), so each track is
+    seen about once. When nothing plays the interval doubles up to
+    ``max_interval``, kept at a minute so a track started while idle is
+    still seen before it ends. New plays are buffered and appended to ``log`` in
+    batches.
+
+    Args:
+        spotify (SpotifyHandler): Authenticated handler
+        log (PlayArchive): Where recorded plays go
+        min_interval (float): Shortest time between polls, in seconds
+        active_interval (float): Longest time between polls while playing
+        idle_interval (float): First interval after playback stops
+        max_interval (float): Longest time between polls while idle
+        batch_size (int): Plays buffered before the log is written
+        clock (callable): Current time in seconds, for tests
+    """
+
+    def __init__(self, spotify, log, min_interval=5, active_interval=30, idle_interval=30,
+                 max_interval=60, batch_size=20, clock=time.time):
+        self.spotify = spotify
+        self.log = log
+        self.min_interval = min_interval
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.max_interval = max_interval
+        self.batch_size = batch_size
+        self.clock = clock
+        self.interval = idle_interval
+        self.polls = 0
+        self.pending = 0
+        self._current = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll_once(self) -> float:
+        """Sample playback once and return the seconds until the next poll"""
+        self.polls += 1
+        playback = self.spotify.sp.current_user_playing_track()
+        now_ms = self.clock() * 1000
+
+        item = (playback or {}).get('item')
+        if not playback or not playback.get('is_playing') or not item:
+            self.flush()
+            self.interval = min(max(self.interval * 2, self.idle_interval), self.max_interval)
+            return self.interval
+
+        progress = playback.get('progress_ms') or 0
+        if self._is_new_play(item['uri'], progress):
+            self.log.append([{
+                'played_at': _played_at(now_ms - progress),
+                'track_uri': item['uri'],
+            }])
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self.flush()
+        self._current = (item['uri'], progress)
+
+        remaining = max((item.get('duration_ms') or 0) - progress, 0) / 1000
+        self.interval = min(max(remaining + 1, self.min_interval), self.active_interval)
+        return self.interval
+
+    def _is_new_play(self, uri: str, progress: int) -> bool:
+        if self._current is None:
+            return True
+        last_uri, last_progress = self._current
+        # A different track, or the same one started over
+        return uri != last_uri or progress < last_progress
+
+    def flush(self) -> None:
+        """Write buffered plays to the log"""
+        if self.pending:
+            self.log.flush()
+            logger.info(f"Recorded {self.pending} plays")
+            self.pending = 0
+
+    def run(self) -> None:
+        """Poll until stop() is called, flushing on the way out"""
+        try:
+            while not self._stop.is_set():
+                try:
+                    interval = self.poll_once()
+                except Exception as e:
+                    logger.error(f"Polling currently playing failed: {str(e)}")
+                    interval = self.active_interval
+                self._stop.wait(interval)
+        finally:
+            self.flush()
+
+    def start(self) -> 'PlayRecorder':
+        """Run the recorder on a daemon thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='play-recorder', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def recorded_plays_from_env(mode=None):
+    """Build the recorded-play log configured by environment variables
+
+    ``PLAY_RECORDER`` (or ``mode``) selects ``local`` (``ARCHIVE_DIR``),
+    ``s3`` (under ``S3_BUCKET``/``S3_PREFIX``/archive) or ``off``
+    (default). The log is a PlayArchive named ``recorded-plays`` next to
+    the other archives.
+    """
+    mode = (mode or os.environ.get('PLAY_RECORDER', 'off')).lower()
+    if mode == 'off':
+        return None
+    granularity = os.environ.get('ARCHIVE_GRANULARITY', 'day')
+    if mode == 's3':
+        prefix = os.environ.get('S3_PREFIX', S3_PREFIX)
+        storage = S3Storage(os.environ.get('S3_BUCKET'), f"{prefix}/archive")
+    else:
+        storage = LocalStorage(os.environ.get('ARCHIVE_DIR', 'archive'))
+    return PlayArchive(storage, granularity, name=RECORDED_PLAYS)
+
+
+def main():
+    """Record plays until interrupted: python -m src.spotify.recorder"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    mode = os.environ.get('PLAY_RECORDER', 'off').lower()
+    log = recorded_plays_from_env(mode='local' if mode == 'off' else mode)
+    spotify = SpotifyHandler()
+    recorder = PlayRecorder(spotify, log)
+    refresh_window = refresh_window_from_env()
+    refresher = TokenRefresher({'spotify': spotify}, refresh_window).start() if refresh_window else None
+    logger.info(f"Recording plays to {log.storage}")
+    try:
+        recorder.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if refresher is not None:
+            refresher.stop()
+
+
+if __name__ == '__main__':
+    main()
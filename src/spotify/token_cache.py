@@ -0,0 +1,111 @@
+import os
+import json
+import logging
+
+from spotipy.cache_handler import CacheFileHandler, CacheHandler
+
+from src.state_bundle import StateConflict, newest_token
+from src.storage import S3Storage, S3_PREFIX
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+SPOTIFY_TOKEN_SECTION = 'spotify_token'
+SPOTIFY_TOKEN_KEY = 'spotify_token'
+
+
+def _keep_user(token_info: dict, previous) -> dict:
+    """Carry the user id over to a refreshed token, which spotipy builds from scratch"""
+    if isinstance(previous, dict) and 'user_id' in previous and 'user_id' not in token_info:
+        return dict(token_info, user_id=previous['user_id'])
+    return token_info
+
+
+class StorageCacheHandler(CacheHandler):
+    """spotipy token cache kept in blob storage, e.g. S3 next to the Strava token
+
+    spotipy's default ``.cache`` file is read-only in Lambda, so a refreshed
+    token would be lost with the container. Until a token is stored, the
+    ``.cache`` file (e.g. shipped with the deployment) is used as the seed.
+    spotipy asks for the token before every API call, so it is read from
+    storage once and then kept in memory.
+
+    Args:
+        storage: LocalStorage or S3Storage
+        key (str): Key of the token
+        fallback (CacheHandler): Read when nothing is stored yet
+    """
+
+    def __init__(self, storage, key: str = SPOTIFY_TOKEN_KEY, fallback=None):
+        self.storage = storage
+        self.key = key
+        self.fallback = fallback or CacheFileHandler()
+        self._token = None
+
+    def get_cached_token(self):
+        if self._token is None:
+            data = self.storage.get(self.key)
+            self._token = json.loads(data) if data is not None else self.fallback.get_cached_token()
+        return self._token
+
+    def save_token_to_cache(self, token_info: dict) -> None:
+        token_info = _keep_user(token_info, self.get_cached_token())
+        self.storage.put(self.key, json.dumps(token_info).encode('utf-8'))
+        self._token = token_info
+        logger.info(f"Spotify token saved to {self.storage}/{self.key}")
+
+
+class BundleCacheHandler(CacheHandler):
+    """spotipy token cache kept in a section of the state bundle
+
+    A refreshed token is written to S3 right away, like the Strava token;
+    if another container wins that write the token stays pending and goes
+    out with the end-of-run save.
+
+    Args:
+        bundle (StateBundle): Loaded state bundle
+        section (str): Bundle section holding the token
+        fallback (CacheHandler): Read when the bundle has no token yet
+    """
+
+    def __init__(self, bundle, section: str = SPOTIFY_TOKEN_SECTION, fallback=None):
+        self.bundle = bundle
+        self.section = section
+        self.fallback = fallback or CacheFileHandler()
+        bundle.register_merge(section, newest_token)
+
+    def get_cached_token(self):
+        if not self.bundle.loaded:
+            self.bundle.load()
+        token = self.bundle.get(self.section)
+        if token is None:
+            token = self.fallback.get_cached_token()
+            if token is not None:
+                self.bundle.set(self.section, token)
+                logger.info("Spotify token migrated into the state bundle")
+        return token
+
+    def save_token_to_cache(self, token_info: dict) -> None:
+        token_info = _keep_user(token_info, self.bundle.get(self.section))
+        self.bundle.set(self.section, token_info)
+        try:
+            self.bundle.save()
+        except StateConflict as e:
+            logger.error(f"Could not save the refreshed Spotify token: {str(e)}")
+
+
+def cache_handler_from_env(use_s3=False, bundle=None):
+    """Build the Spotify token cache to match where the Strava token lives
+
+    The state bundle when there is one, else ``S3_BUCKET``/``S3_PREFIX``/
+    spotify_token when ``use_s3`` is set, else spotipy's ``.cache`` file.
+
+    Returns:
+        CacheHandler: Or None for spotipy's default
+    """
+    if bundle is not None:
+        return BundleCacheHandler(bundle)
+    if use_s3:
+        prefix = os.environ.get('S3_PREFIX', S3_PREFIX)
+        return StorageCacheHandler(S3Storage(os.environ.get('S3_BUCKET'), prefix))
+    return None
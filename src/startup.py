@@ -0,0 +1,103 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """Durations of startup chains that ran side by side
+
+    Args:
+        durations (dict): Seconds each chain took on its own
+        wall (float): Seconds until all chains had finished
+    """
+
+    def __init__(self, durations: dict, wall: float):
+        self.durations = durations
+        self.wall = wall
+
+    @property
+    def sequential(self) -> float:
+        """Time the chains would have taken one after another"""
+        return sum(self.durations.values())
+
+    @property
+    def saved(self) -> float:
+        return max(self.sequential - self.wall, 0.0)
+
+    def as_dict(self) -> dict:
+        return {
+            **{name: round(seconds, 3) for name, seconds in self.durations.items()},
+            'wall': round(self.wall, 3),
+            'sequential': round(self.sequential, 3),
+            'saved': round(self.saved, 3),
+        }
+
+    def __str__(self):
+        chains = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.durations.items())
+        return f"{chains}; wall {self.wall:.2f}s (sequential {self.sequential:.2f}s, saved {self.saved:.2f}s)"
+
+
+def run_parallel(chains: dict):
+    """Run independent callables on their own threads and wait for all
+
+    Every chain runs to completion before the first error is raised, so a
+    failure on one side never leaves the other half-done in the background.
+
+    Args:
+        chains (dict): Name to zero-argument callable
+
+    Returns:
+        tuple: (dict of name to return value, StartupReport)
+    """
+    def timed(chain):
+        start = time.perf_counter()
+        return chain(), time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(chains)) as executor:
+        futures = {name: executor.submit(timed, chain) for name, chain in chains.items()}
+    wall = time.perf_counter() - start
+
+    results = {}
+    durations = {}
+    for name, future in futures.items():
+        results[name], durations[name] = future.result()
+    return results, StartupReport(durations, wall)
+
+
+def start_run(context, limit: int, prefetch_history=True, list_activities=None):
+    """Authenticate both services and do their first reads concurrently
+
+    Strava auth and activity listing run alongside Spotify client setup and
+    the recently-played prefetch, so startup costs the longer of the two
+    chains rather than their sum.
+
+    Args:
+        context (AppContext): Context to initialize
+        limit (int): Number of recent activities to list
+        prefetch_history (bool): Fetch Spotify history while Strava lists
+        list_activities (callable): Lists the activities instead of Strava,
+            e.g. from the state store
+
+    Returns:
+        tuple: (list of activity records, StartupReport)
+    """
+    context.prepare()
+
+    def strava_chain():
+        context.ensure_strava()
+        if list_activities is not None:
+            return list(list_activities())
+        return list(context.strava.get_activities(limit=limit))
+
+    def spotify_chain():
+        context.ensure_spotify()
+        if prefetch_history:
+            context.spotify.get_recently_played(max_age=context.spotify.history_max_age)
+
+    results, report = run_parallel({'strava': strava_chain, 'spotify': spotify_chain})
+    logger.info(f"Startup: {report}")
+    return results['strava'], report
@@ -0,0 +1,315 @@
+import os
+import copy
+import gzip
+import json
+import base64
+import logging
+
+from botocore.exceptions import ClientError
+
+from src.storage import S3_PREFIX, create_s3_client
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+SAVE_ATTEMPTS = 3
+
+
+class StateConflict(Exception):
+    """Raised when the bundle was changed by another writer since it was read"""
+
+
+def _error_code(e: ClientError) -> str:
+    return str(e.response.get('Error', {}).get('Code'))
+
+
+def newest_token(base, ours, theirs):
+    """Pick the token that expires last when two writers saved one
+
+    Each refresh revokes the previous refresh token, so the newest token
+    is the only one guaranteed to still work.
+    """
+    tokens = [token for token in (ours, theirs) if token]
+    if not tokens:
+        return None
+    return max(tokens, key=lambda token: token.get('expires_at', 0))
+
+
+class StateBundle:
+    """All per-user state in one versioned, gzip-compressed S3 object
+
+    The bundle is read once per run (a conditional GET on warm runs) and
+    written back once at the end, only if a section changed. Writes are
+    conditional on the ETag that was read, so a concurrent writer causes
+    a StateConflict instead of silently losing its update.
+
+    On a conflict the bundle is read again and the sections changed by this
+    process are applied on top of the other writer's copy, then the write
+    is retried. Sections that both writers changed go through the merge
+    function registered for them (see register_merge), or this process'
+    copy wins. Dict sections are merged key by key, so writers touching
+    different blobs never collide.
+
+    Args:
+        s3_client: boto3 S3 client, reused for every request
+        bucket (str): S3 bucket
+        key (str): Object key of the bundle
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str):
+        if not bucket:
+            raise ValueError("S3_BUCKET environment variable must be set when use_s3=True")
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.sections = {}
+        self.etag = None
+        self.dirty = False
+        self.loaded = False
+        self.mergers = {}
+        # Sections as last read or written, the common ancestor of a merge
+        self._base = {}
+        self._merged = False
+
+    def __repr__(self):
+        return f"StateBundle({self.bucket}/{self.key})"
+
+    def load(self) -> bool:
+        """Read the bundle, skipping the download if it is unchanged
+
+        Pending changes are kept; reloading a dirty bundle is a no-op.
+
+        Returns:
+            bool: Whether the content differs from what was last seen, i.e.
+            new content was downloaded or a save merged another writer's
+            changes in
+        """
+        if self.dirty:
+            return False
+
+        merged, self._merged = self._merged, False
+        payload = self._fetch(conditional=True)
+        if payload is None:
+            return merged
+        self.sections, self.etag = payload
+        self._base = copy.deepcopy(self.sections)
+        logger.info(f"State bundle loaded: {self}")
+        return True
+
+    def load_section(self, name: str) -> bool:
+        """Read the latest stored copy of one section, even with pending changes
+
+        load() keeps a dirty bundle as it is. A token about to be refreshed
+        must still be the newest one, so its section is fetched and merged
+        with this process' copy; the other sections and the ETag are left
+        alone for the end-of-run save to reconcile.
+
+        Returns:
+            bool: Whether the section changed
+        """
+        if not self.dirty:
+            return self.load()
+
+        payload = self._fetch()
+        if payload is None:
+            return False
+        theirs = payload[0].get(name)
+        base, ours = self._base.get(name), self.sections.get(name)
+        value = theirs if ours == base else self._merge(name, base, ours, theirs)
+        self._base[name] = copy.deepcopy(theirs)
+        if value == ours:
+            return False
+        if value is None:
+            self.sections.pop(name, None)
+        else:
+            self.sections[name] = value
+        logger.info(f"State bundle section {name} reloaded: {self}")
+        return True
+
+    def _fetch(self, conditional=False):
+        """Download the bundle
+
+        Returns:
+            tuple: (sections, etag), or None if unchanged since ``self.etag``
+        """
+        kwargs = {'Bucket': self.bucket, 'Key': self.key}
+        if conditional and self.etag:
+            kwargs['IfNoneMatch'] = self.etag
+        try:
+            response = self.s3_client.get_object(**kwargs)
+        except ClientError as e:
+            code = _error_code(e)
+            if code in ('304', 'NotModified'):
+                return None
+            if code in ('NoSuchKey', '404'):
+                self.loaded = True
+                if self.etag is None:
+                    return None
+                return {}, None
+            raise
+
+        payload = json.loads(gzip.decompress(response['Body'].read()).decode('utf-8'))
+        if payload.get('version', 0) > BUNDLE_VERSION:
+            raise ValueError(f"State bundle version {payload['version']} is newer than supported")
+        self.loaded = True
+        return payload.get('sections', {}), response.get('ETag')
+
+    def get(self, section: str, default=None):
+        return self.sections.get(section, default)
+
+    def set(self, section: str, value) -> None:
+        if self.sections.get(section) != value:
+            self.sections[section] = value
+            self.dirty = True
+
+    def register_merge(self, name: str, merge) -> None:
+        """Resolve concurrent changes to a section or blob
+
+        Args:
+            name (str): Section name, or ``section/key`` for one key of a
+                dict section
+            merge (callable): ``merge(base, ours, theirs)`` returning the
+                merged value; any argument may be None
+        """
+        self.mergers[name] = merge
+
+    def save(self, attempts: int = SAVE_ATTEMPTS) -> bool:
+        """Write the bundle back if anything changed
+
+        Args:
+            attempts (int): Conditional writes to try before giving up
+
+        Returns:
+            bool: Whether a PUT was issued
+
+        Raises:
+            StateConflict: If another writer won every attempt. The changes
+            stay pending, so the next save tries again.
+        """
+        if not self.dirty:
+            return False
+
+        for attempt in range(1, attempts + 1):
+            try:
+                self._put()
+                return True
+            except StateConflict:
+                if attempt == attempts:
+                    raise
+                logger.warning(f"{self} changed during the run, merging (attempt {attempt})")
+                self._rebase()
+        return False
+
+    def _put(self) -> None:
+        body = gzip.compress(json.dumps({
+            'version': BUNDLE_VERSION,
+            'sections': self.sections,
+        }, sort_keys=True).encode('utf-8'))
+        kwargs = {'Body': body, 'Bucket': self.bucket, 'Key': self.key}
+        if self.etag:
+            kwargs['IfMatch'] = self.etag
+        else:
+            kwargs['IfNoneMatch'] = '*'
+
+        try:
+            response = self.s3_client.put_object(**kwargs)
+        except ClientError as e:
+            if _error_code(e) in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise StateConflict(f"{self} was modified by another writer") from e
+            raise
+
+        self.etag = response.get('ETag')
+        self._base = copy.deepcopy(self.sections)
+        self.dirty = False
+        logger.info(f"State bundle saved: {self} ({len(body)} bytes)")
+
+    def _rebase(self) -> None:
+        """Re-apply this process' changes on top of the stored bundle"""
+        theirs, etag = self._fetch() or ({}, None)
+        merged = dict(theirs)
+        for name in set(self.sections) | set(self._base):
+            base, ours = self._base.get(name), self.sections.get(name)
+            if ours == base:
+                continue
+            value = self._merge(name, base, ours, theirs.get(name))
+            if value is None:
+                merged.pop(name, None)
+            else:
+                merged[name] = value
+        self.sections = merged
+        self.etag = etag
+        self._base = copy.deepcopy(theirs)
+        self._merged = True
+
+    def _merge(self, name: str, base, ours, theirs):
+        if theirs == base:
+            return ours
+        if name in self.mergers:
+            return self.mergers[name](base, ours, theirs)
+        if not all(isinstance(value, dict) for value in (ours, theirs)):
+            return ours
+        base = base if isinstance(base, dict) else {}
+        merged = dict(theirs)
+        for key in set(ours) | set(base):
+            value = self._merge(f"{name}/{key}", base.get(key), ours.get(key), theirs.get(key)) \
+                if ours.get(key) != base.get(key) else theirs.get(key)
+            if value is None:
+                merged.pop(key, None)
+            else:
+                merged[key] = value
+        return merged
+
+
+class BundleStorage:
+    """Blob storage interface (get/put/delete) over a StateBundle section
+
+    Lets the HTTP cache and the SQLite state store keep their data inside
+    the bundle instead of in separate S3 objects.
+    """
+
+    def __init__(self, bundle: StateBundle, section: str = 'blobs'):
+        self.bundle = bundle
+        self.section = section
+
+    def __repr__(self):
+        return f"BundleStorage({self.bundle}#{self.section})"
+
+    def get(self, key: str):
+        data = self.bundle.get(self.section, {}).get(key)
+        return None if data is None else base64.b64decode(data)
+
+    def put(self, key: str, data: bytes) -> None:
+        blobs = dict(self.bundle.get(self.section, {}))
+        blobs[key] = base64.b64encode(data).decode('ascii')
+        self.bundle.set(self.section, blobs)
+
+    def delete(self, key: str) -> None:
+        blobs = dict(self.bundle.get(self.section, {}))
+        if blobs.pop(key, None) is not None:
+            self.bundle.set(self.section, blobs)
+
+    def keys(self, prefix: str = ''):
+        """Return the keys in the section starting with ``prefix``"""
+        return [key for key in self.bundle.get(self.section, {}) if key.startswith(prefix)]
+
+    def register_merge(self, key: str, merge) -> None:
+        """Resolve concurrent changes to one blob with ``merge(base, ours, theirs)`` on bytes"""
+        def decoded(*values):
+            values = [None if value is None else base64.b64decode(value) for value in values]
+            data = merge(*values)
+            return None if data is None else base64.b64encode(data).decode('ascii')
+
+        self.bundle.register_merge(f"{self.section}/{key}", decoded)
+
+
+def bundle_from_env(use_s3=False):
+    """Build the state bundle if ``STATE_BUNDLE`` is enabled
+
+    The bundle lives at ``S3_BUCKET``/``S3_PREFIX``/state.json.gz and only
+    applies when state is kept in S3.
+    """
+    if not use_s3 or os.environ.get('STATE_BUNDLE', 'false').lower() != 'true':
+        return None
+    prefix = os.environ.get('S3_PREFIX', S3_PREFIX)
+    return StateBundle(create_s3_client(), os.environ.get('S3_BUCKET'), f"{prefix}/state.json.gz")
@@ -0,0 +1,161 @@
+import os
+import hashlib
+import logging
+
+import boto3
+from botocore.exceptions import ClientError
+
+from src.deadline import boto_config, get_request_guard, guard_boto_client
+from src.lease import FileLease
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Default key prefix for everything Motivator keeps in the S3 bucket
+S3_PREFIX = 'motivator'
+
+
+class WriteConflict(Exception):
+    """Raised when a conditional put finds the object changed since it was read"""
+
+
+def create_s3_client():
+    """Create an S3 client with bounded timeouts behind the process circuit breaker"""
+    return guard_boto_client(boto3.client('s3', config=boto_config()), get_request_guard())
+
+
+class LocalStorage:
+    """Key/value blob storage in a local directory"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def __repr__(self):
+        return f"LocalStorage({self.root})"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def get(self, key: str):
+        """Return the stored bytes, or None if the key does not exist"""
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so readers never see a partial blob
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get_versioned(self, key: str):
+        """Return (bytes, version) for put_if; both None if the key does not exist"""
+        data = self.get(key)
+        return data, None if data is None else hashlib.sha256(data).hexdigest()
+
+    def put_if(self, key: str, data: bytes, version) -> None:
+        """Write only if the key still has ``version`` (None: doesn't exist yet)
+
+        Raises:
+            WriteConflict: If another writer changed the key since it was read
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with FileLease(f"{path}.lock", ttl=5, poll_interval=0.01):
+            if self.get_versioned(key)[1] != version:
+                raise WriteConflict(f"{self}/{key} was modified by another writer")
+            self.put(key, data)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self, prefix: str = ''):
+        """Return the stored keys starting with ``prefix``"""
+        keys = []
+        for directory, _, files in os.walk(self.root):
+            relative = os.path.relpath(directory, self.root)
+            for name in files:
+                if '.tmp.' in name or name.endswith(('.lock', '.guard')):
+                    continue
+                key = name if relative == '.' else '/'.join(relative.split(os.sep) + [name])
+                if key.startswith(prefix):
+                    keys.append(key)
+        return keys
+
+
+class S3Storage:
+    """Key/value blob storage under a prefix of an S3 bucket"""
+
+    def __init__(self, bucket: str, prefix: str = '', s3_client=None):
+        if not bucket:
+            raise ValueError("S3_BUCKET environment variable must be set when use_s3=True")
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.s3_client = s3_client or create_s3_client()
+
+    def __repr__(self):
+        return f"S3Storage({self.bucket}/{self.prefix})"
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def get(self, key: str):
+        """Return the stored bytes, or None if the key does not exist"""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return response['Body'].read()
+
+    def put(self, key: str, data: bytes) -> None:
+        self.s3_client.put_object(Body=data, Bucket=self.bucket, Key=self._key(key))
+
+    def get_versioned(self, key: str):
+        """Return (bytes, ETag) for put_if; both None if the key does not exist"""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None, None
+            raise
+        return response['Body'].read(), response.get('ETag')
+
+    def put_if(self, key: str, data: bytes, version) -> None:
+        """Write only if the object still has ETag ``version`` (None: doesn't exist yet)
+
+        Raises:
+            WriteConflict: If another writer changed the object since it was read
+        """
+        kwargs = {'Body': data, 'Bucket': self.bucket, 'Key': self._key(key)}
+        if version:
+            kwargs['IfMatch'] = version
+        else:
+            kwargs['IfNoneMatch'] = '*'
+        try:
+            self.s3_client.put_object(**kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise WriteConflict(f"{self}/{key} was modified by another writer") from e
+            raise
+
+    def delete(self, key: str) -> None:
+        self.s3_client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def keys(self, prefix: str = ''):
+        """Return the stored keys starting with ``prefix``, without the storage prefix"""
+        strip = len(self._key(''))
+        keys = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            keys.extend(item['Key'][strip:] for item in page.get('Contents', []))
+        return keys
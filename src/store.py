@@ -0,0 +1,405 @@
+import os
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+from src.storage import S3Storage, S3_PREFIX
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plays (
+    played_at REAL NOT NULL,
+    played_at_iso TEXT NOT NULL,
+    track_uri TEXT NOT NULL,
+    PRIMARY KEY (played_at, track_uri)
+);
+CREATE TABLE IF NOT EXISTS activities (
+    activity_id INTEGER PRIMARY KEY,
+    name TEXT,
+    activity_type TEXT,
+    start_epoch REAL NOT NULL,
+    end_epoch REAL NOT NULL,
+    track_count INTEGER,
+    processed_at REAL
+);
+CREATE INDEX IF NOT EXISTS activities_start ON activities (start_epoch);
+CREATE TABLE IF NOT EXISTS playlists (
+    playlist_id TEXT PRIMARY KEY,
+    activity_id INTEGER,
+    name TEXT,
+    track_count INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS playlists_activity ON playlists (activity_id);
+CREATE TABLE IF NOT EXISTS playlist_activities (
+    playlist_id TEXT NOT NULL,
+    activity_id INTEGER NOT NULL,
+    PRIMARY KEY (activity_id, playlist_id)
+);
+CREATE TABLE IF NOT EXISTS moving_intervals (
+    activity_id INTEGER NOT NULL,
+    start_epoch REAL NOT NULL,
+    end_epoch REAL NOT NULL,
+    PRIMARY KEY (activity_id, start_epoch)
+);
+"""
+
+
+# Plays of the same track this close together are one play: the Web API
+# reports milliseconds, the streaming history export whole seconds
+PLAY_TOLERANCE = 1.0
+
+
+def _played_at_epoch(played_at: str) -> float:
+    return datetime.fromisoformat(played_at.replace('Z', '+00:00')).astimezone(timezone.utc).timestamp()
+
+
+class StateStore:
+    """Embedded SQLite store for plays, processed activities and playlists
+
+    Runs in WAL mode so readers don't block the writer. Plays are keyed and
+    indexed by ``played_at`` so activity windows are range scans, and
+    activities by Strava ID and start time so "already processed?" is a
+    primary-key lookup. A lock serializes access from batch worker threads.
+
+    Args:
+        path (str): Database file
+    """
+
+    def __init__(self, path: str = 'motivator.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        self.dirty = False
+        self._connect()
+
+    def _connect(self) -> None:
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    def _write(self, sql: str, rows: list) -> int:
+        if not rows:
+            return 0
+        with self._lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(sql, rows)
+            changed = self.conn.total_changes - before
+        if changed:
+            self.dirty = True
+        return changed
+
+    def _read(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # Plays
+
+    def add_plays(self, items: list) -> int:
+        """Bulk insert Spotify recently-played items, ignoring duplicates
+
+        Returns:
+            int: Number of new plays stored
+        """
+        return self.add_play_rows([
+            (_played_at_epoch(item['played_at']), item['played_at'], item['track']['uri'])
+            for item in items
+        ])
+
+    def add_play_rows(self, rows: list) -> int:
+        """Bulk insert (played_at, played_at_iso, track_uri) rows, ignoring duplicates
+
+        A row is a duplicate if the same track is already stored within
+        PLAY_TOLERANCE seconds, so a play seen by both the Web API and an
+        imported history export is stored once.
+        """
+        return self._write(
+            'INSERT INTO plays SELECT ?, ?, ? WHERE NOT EXISTS ('
+            'SELECT 1 FROM plays WHERE played_at BETWEEN ? AND ? AND track_uri = ?)',
+            [
+                (played_at, played_at_iso, track_uri,
+                 played_at - PLAY_TOLERANCE, played_at + PLAY_TOLERANCE, track_uri)
+                for played_at, played_at_iso, track_uri in rows
+            ]
+        )
+
+    def plays_between(self, start_epoch: float, end_epoch: float) -> list:
+        """Return (track_uri, played_at) pairs strictly inside a window, newest first"""
+        return self._read(
+            'SELECT track_uri, played_at_iso FROM plays '
+            'WHERE played_at > ? AND played_at < ? ORDER BY played_at DESC',
+            (start_epoch, end_epoch)
+        )
+
+    def latest_play(self):
+        """Return the newest stored played_at string, or None"""
+        rows = self._read('SELECT played_at_iso FROM plays ORDER BY played_at DESC LIMIT 1')
+        return rows[0][0] if rows else None
+
+    # Activities
+
+    def add_activities(self, activities: list) -> int:
+        """Bulk insert activity records without marking them processed"""
+        rows = [
+            (
+                activity.activity_id,
+                activity.name,
+                activity.activity_type,
+                activity.start_epoch,
+                activity.end_epoch,
+            )
+            for activity in activities
+        ]
+        return self._write(
+            'INSERT OR IGNORE INTO activities (activity_id, name, activity_type, start_epoch, end_epoch) '
+            'VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+
+    def mark_processed(self, activity, track_count: int) -> None:
+        """Record that an activity has been matched"""
+        self._write(
+            'INSERT INTO activities VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (activity_id) DO UPDATE SET '
+            'track_count = excluded.track_count, processed_at = excluded.processed_at',
+            [(
+                activity.activity_id,
+                activity.name,
+                activity.activity_type,
+                activity.start_epoch,
+                activity.end_epoch,
+                track_count,
+                time.time(),
+            )]
+        )
+
+    def is_processed(self, activity_id: int) -> bool:
+        rows = self._read(
+            'SELECT 1 FROM activities WHERE activity_id = ? AND processed_at IS NOT NULL',
+            (activity_id,)
+        )
+        return bool(rows)
+
+    def activities_between(self, start_epoch: float, end_epoch: float) -> list:
+        """Return stored activities starting inside a window, oldest first"""
+        return self._read(
+            'SELECT activity_id, name, activity_type, start_epoch, end_epoch, track_count, processed_at '
+            'FROM activities WHERE start_epoch >= ? AND start_epoch < ? ORDER BY start_epoch',
+            (start_epoch, end_epoch)
+        )
+
+    def runs(self, limit: int, since: float = None) -> list:
+        """Return stored runs newest first: the newest ``limit``, or all starting after ``since``"""
+        if since is None:
+            return self.recent_activities(limit)
+        return [row for row in reversed(self.activities_between(since, time.time())) if row[2] == 'Run']
+
+    def recent_activities(self, limit: int, activity_types=('Run',)) -> list:
+        """Return the newest stored activities, newest first, like a listing would"""
+        if activity_types is None:
+            return self._read(
+                'SELECT activity_id, name, activity_type, start_epoch, end_epoch, track_count, processed_at '
+                'FROM activities ORDER BY start_epoch DESC LIMIT ?',
+                (limit,)
+            )
+        marks = ', '.join('?' * len(activity_types))
+        return self._read(
+            'SELECT activity_id, name, activity_type, start_epoch, end_epoch, track_count, processed_at '
+            f'FROM activities WHERE activity_type IN ({marks}) ORDER BY start_epoch DESC LIMIT ?',
+            (*activity_types, limit)
+        )
+
+    def activity(self, activity_id: int):
+        """Return one stored activity row, or None"""
+        rows = self._read(
+            'SELECT activity_id, name, activity_type, start_epoch, end_epoch, track_count, processed_at '
+            'FROM activities WHERE activity_id = ?',
+            (activity_id,)
+        )
+        return rows[0] if rows else None
+
+    def add_moving_intervals(self, activity_id: int, intervals: list) -> int:
+        """Store the [start, end] epochs an activity was moving, e.g. from its file"""
+        return self._write(
+            'INSERT OR REPLACE INTO moving_intervals VALUES (?, ?, ?)',
+            [(activity_id, start, end) for start, end in intervals]
+        )
+
+    def moving_intervals(self, activity_id: int) -> list:
+        """Return stored (start, end) moving intervals of an activity, in order"""
+        return self._read(
+            'SELECT start_epoch, end_epoch FROM moving_intervals WHERE activity_id = ? ORDER BY start_epoch',
+            (activity_id,)
+        )
+
+    # Playlists
+
+    def add_playlist(self, playlist_id: str, activity_id, name: str, track_count: int) -> None:
+        self._write(
+            'INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?, ?)',
+            [(playlist_id, activity_id, name, track_count, time.time())]
+        )
+        if activity_id:
+            self.link_playlist(playlist_id, [activity_id])
+
+    def link_playlist(self, playlist_id: str, activity_ids: list) -> None:
+        """Record that a playlist holds the tracks of these activities"""
+        self._write(
+            'INSERT OR IGNORE INTO playlist_activities VALUES (?, ?)',
+            [(playlist_id, activity_id) for activity_id in activity_ids]
+        )
+
+    def playlist_names(self) -> set:
+        """Names of all recorded playlists"""
+        return {row[0] for row in self._read('SELECT name FROM playlists')}
+
+    def playlists_for_activity(self, activity_id: int) -> list:
+        return [
+            row[0] for row in self._read(
+                'SELECT playlist_id FROM playlist_activities WHERE activity_id = ? '
+                'UNION SELECT playlist_id FROM playlists WHERE activity_id = ?',
+                (activity_id, activity_id)
+            )
+        ]
+
+    # S3 sync
+
+    def sync_from(self, storage, key: str) -> bool:
+        """Replace the local database with the copy in ``storage``, if any"""
+        data = storage.get(key)
+        if data is None:
+            return False
+        with self._lock:
+            self.conn.close()
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+            with open(self.path, 'wb') as f:
+                f.write(data)
+            # Reconnect before releasing, so no worker sees the closed connection
+            self._connect()
+            self.dirty = False
+        logger.info(f"State database loaded from {storage}/{key}")
+        return True
+
+    def save(self) -> bool:
+        """Persist pending changes; a local database is always up to date"""
+        return False
+
+    def reload(self) -> bool:
+        """Pick up changes made elsewhere; a local database has none"""
+        return False
+
+    def sync_to(self, storage, key: str, force=False) -> bool:
+        """Upload the database to ``storage`` if it changed"""
+        if not (self.dirty or force):
+            return False
+        with self._lock:
+            # Fold the WAL into the main file so one object holds everything
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        storage.put(key, data)
+        self.dirty = False
+        logger.info(f"State database saved to {storage}/{key}")
+        return True
+
+
+class SyncedStateStore(StateStore):
+    """StateStore mirrored to a blob storage, e.g. S3 for Lambda
+
+    The database is downloaded when opened and uploaded by save() only if
+    it changed. Concurrent writers are last-writer-wins, unless the storage
+    merges them with merge_databases (the state bundle does).
+    """
+
+    def __init__(self, path: str, storage, key: str = 'state.db'):
+        super().__init__(path)
+        self.storage = storage
+        self.key = key
+        self.sync_from(storage, key)
+
+    def save(self) -> bool:
+        return self.sync_to(self.storage, self.key)
+
+    def reload(self) -> bool:
+        return self.sync_from(self.storage, self.key)
+
+
+def merge_databases(base, ours, theirs):
+    """Merge two copies of the state database that diverged from ``base``
+
+    Rows are only ever added, so the merge is the union of both copies;
+    an activity processed in either copy stays processed. Used to resolve
+    concurrent writes to the state bundle.
+
+    Args:
+        base (bytes): Common ancestor (unused, the union needs none)
+        ours (bytes): This process' database
+        theirs (bytes): The other writer's database
+
+    Returns:
+        bytes: The merged database
+    """
+    if ours is None or theirs is None:
+        return ours if theirs is None else theirs
+    with tempfile.TemporaryDirectory() as directory:
+        ours_path = os.path.join(directory, 'ours.db')
+        theirs_path = os.path.join(directory, 'theirs.db')
+        for path, data in ((ours_path, ours), (theirs_path, theirs)):
+            with open(path, 'wb') as f:
+                f.write(data)
+
+        conn = sqlite3.connect(ours_path)
+        try:
+            conn.executescript(SCHEMA)
+            conn.execute('ATTACH DATABASE ? AS theirs', (theirs_path,))
+            with conn:
+                conn.execute(
+                    'INSERT INTO main.plays SELECT * FROM theirs.plays AS theirs_play WHERE NOT EXISTS ('
+                    'SELECT 1 FROM main.plays AS play WHERE play.track_uri = theirs_play.track_uri '
+                    'AND play.played_at BETWEEN theirs_play.played_at - ? AND theirs_play.played_at + ?)',
+                    (PLAY_TOLERANCE, PLAY_TOLERANCE)
+                )
+                for table in ('playlists', 'playlist_activities', 'moving_intervals'):
+                    conn.execute(f'INSERT OR IGNORE INTO main.{table} SELECT * FROM theirs.{table}')
+                conn.execute(
+                    'INSERT INTO main.activities SELECT * FROM theirs.activities WHERE true '
+                    'ON CONFLICT (activity_id) DO UPDATE SET '
+                    'track_count = COALESCE(activities.track_count, excluded.track_count), '
+                    'processed_at = COALESCE(activities.processed_at, excluded.processed_at)'
+                )
+            conn.execute('DETACH DATABASE theirs')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+        with open(ours_path, 'rb') as f:
+            return f.read()
+
+
+def store_from_env(use_s3=False, storage=None):
+    """Build the state store configured by environment variables
+
+    ``STATE_DB`` selects ``local`` (``STATE_DB_PATH``), ``s3`` (a local copy
+    in ``/tmp`` synced to ``S3_BUCKET``/``S3_PREFIX``/state.db) or ``off``
+    (default). An explicit ``storage`` (e.g. the state bundle) replaces the
+    S3 location.
+    """
+    mode = os.environ.get('STATE_DB', 'off').lower()
+    if mode == 'off':
+        return None
+    if mode == 's3':
+        if storage is None:
+            prefix = os.environ.get('S3_PREFIX', S3_PREFIX)
+            storage = S3Storage(os.environ.get('S3_BUCKET'), prefix)
+        return SyncedStateStore(os.environ.get('STATE_DB_PATH', '/tmp/motivator.db'), storage)
+    return StateStore(os.environ.get('STATE_DB_PATH', 'motivator.db'))
@@ -1,4 +1,4 @@
 from .auth import StravaAuth
-from .activities import StravaActivities
+from .activities import StravaActivities, ActivityRecord
 
-__all__ = ['StravaAuth', 'StravaActivities']
+__all__ = ['StravaAuth', 'StravaActivities', 'ActivityRecord']
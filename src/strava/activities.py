@@ -1,28 +1,223 @@
-from datetime import datetime, timedelta
-from typing import Generator, Tuple
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Generator, Optional
 
 from .auth import StravaAuth
+from .streams import ActivityStreams, STREAM_TYPES
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+STRAVA_API = 'https://www.strava.com/api/v3'
+
+# Largest page /athlete/activities returns
+MAX_PAGE_SIZE = 200
+
+
+class ActivityRecord(tuple):
+    """(name, start, start_epoch, end, end_epoch) tuple of a Strava activity
+
+    Still unpacks as the original 5-tuple; the Strava ID and activity type
+    ride along as attributes.
+    """
+
+    def __new__(cls, name, start, start_epoch, end, end_epoch, activity_id=None, activity_type='Run'):
+        record = super().__new__(cls, (name, start, start_epoch, end, end_epoch))
+        record.activity_id = activity_id
+        record.activity_type = activity_type
+        return record
+
+    def __reduce__(self):
+        # Rebuild with the attributes, e.g. when sent between processes
+        return (ActivityRecord, tuple(self) + (self.activity_id, self.activity_type))
+
+    @classmethod
+    def from_row(cls, row) -> 'ActivityRecord':
+        """Build a record from a state store activity row, with UTC times"""
+        activity_id, name, activity_type, start_epoch, end_epoch = row[:5]
+        return cls(
+            name,
+            datetime.fromtimestamp(start_epoch, tz=timezone.utc),
+            start_epoch,
+            datetime.fromtimestamp(end_epoch, tz=timezone.utc),
+            end_epoch,
+            activity_id=activity_id,
+            activity_type=activity_type
+        )
+
+    @property
+    def name(self) -> str:
+        return self[0]
+
+    @property
+    def start(self) -> datetime:
+        return self[1]
+
+    @property
+    def start_epoch(self) -> float:
+        return self[2]
+
+    @property
+    def end(self) -> datetime:
+        return self[3]
+
+    @property
+    def end_epoch(self) -> float:
+        return self[4]
 
 
 class StravaActivities:
-    def __init__(self, auth: StravaAuth):
+    """Strava reads for the authenticated athlete
+
+    Args:
+        auth (StravaAuth): Authenticated Strava client and session
+        lean (bool): List activities from the raw JSON pages instead of
+            stravalib models, falling back to stravalib if that fails
+            (default: ``STRAVA_LEAN``, on unless set to false)
+    """
+
+    def __init__(self, auth: StravaAuth, lean: bool = None):
         self.auth = auth
         self.client = auth.client
+        if lean is None:
+            lean = os.environ.get('STRAVA_LEAN', 'true').lower() == 'true'
+        self.lean = lean
+
+    def get_activities(self, limit: int = 1) -> Generator[ActivityRecord, None, None]:
+        """Retrieve recent runs"""
+        if self.lean:
+            try:
+                records = self.get_activities_lean(limit)
+            except Exception as e:
+                logger.warning(f"Lean activity listing failed, using stravalib: {str(e)}")
+            else:
+                yield from records
+                return
 
-    def get_activities(self, limit: int = 1) -> Generator[Tuple[str, datetime, float, datetime, float], None, None]:
-        """Retrieve recent activities"""
         activities = self.client.get_activities(limit=limit)
         for activity in activities:
-            if activity.type.root == 'Run':
-                end_time = activity.start_date_local + timedelta(seconds=activity.elapsed_time)
-                yield (
-                    activity.name,
-                    activity.start_date_local,
-                    activity.start_date_local.timestamp(),
-                    end_time,
-                    end_time.timestamp()
-                )
+            if activity_type(activity) == 'Run':
+                yield _activity_record(activity)
+
+    def get_activities_lean(self, limit: int = 1, after: float = None, before: float = None) -> list:
+        """List runs straight from /athlete/activities pages
+
+        stravalib validates every field of every activity into pydantic
+        models, maps and gear included; only four fields are needed here,
+        so they are picked from the decoded JSON instead.
+
+        Args:
+            limit (int): Most activities to list, runs or not
+            after (float): Only activities starting after this epoch
+            before (float): Only activities starting before this epoch
+
+        Returns:
+            list: ActivityRecord per run, newest first unless ``after`` is set
+        """
+        records = []
+        for page in iter_activity_pages(
+            self.auth.session, self.client.access_token,
+            after=after, before=before, limit=limit
+        ):
+            records.extend(
+                lean_activity_record(activity) for activity in page if activity.get('type') == 'Run'
+            )
+        return records
+
+    def get_activity(self, activity_id: int) -> Optional[ActivityRecord]:
+        """Retrieve a single activity by ID, or None if it isn't a run"""
+        activity = self.client.get_activity(activity_id)
+        if activity_type(activity) != 'Run':
+            return None
+        return _activity_record(activity)
     
+    def get_activity_streams(self, activity: ActivityRecord) -> Optional[ActivityStreams]:
+        """Fetch the time/moving/effort streams of an activity"""
+        streams = self.client.get_activity_streams(
+            activity.activity_id,
+            types=STREAM_TYPES,
+            series_type='time'
+        )
+        return ActivityStreams.from_stravalib(activity.start_epoch, streams or {})
+
     def get_athlete_info(self):
-        """Get athlete information"""
-        return self.client.get_athlete()
+        """Get athlete information from the API and cache the profile"""
+        athlete = self.client.get_athlete()
+        self.auth.cache_athlete(athlete)
+        return athlete
+
+
+def iter_activity_pages(session, access_token: str, after: float = None, before: float = None,
+                        limit: int = None, per_page: int = MAX_PAGE_SIZE):
+    """Yield decoded /athlete/activities pages until the listing or ``limit`` runs out"""
+    per_page = min(per_page, limit) if limit else per_page
+    headers = {'Authorization': f"Bearer {access_token}"}
+    params = {'per_page': per_page}
+    if after is not None:
+        params['after'] = int(after)
+    if before is not None:
+        params['before'] = int(before)
+
+    page_number = 1
+    remaining = limit
+    while True:
+        response = session.get(
+            f"{STRAVA_API}/athlete/activities",
+            params=dict(params, page=page_number),
+            headers=headers,
+            timeout=10
+        )
+        response.raise_for_status()
+        page = response.json()
+        if not isinstance(page, list):
+            raise ValueError(f"Unexpected activity page: {type(page).__name__}")
+        if remaining is not None:
+            page = page[:remaining]
+            remaining -= len(page)
+        if page:
+            yield page
+        if len(page) < per_page or remaining == 0:
+            return
+        page_number += 1
+
+
+def lean_activity_record(activity: dict) -> ActivityRecord:
+    """Convert a raw SummaryActivity JSON object to an ActivityRecord
+
+    Like stravalib, start_date_local is read as a naive local time even
+    though Strava suffixes it with Z.
+    """
+    start = datetime.fromisoformat(activity['start_date_local'].replace('Z', '')).replace(tzinfo=None)
+    end_time = start + timedelta(seconds=activity['elapsed_time'])
+    return ActivityRecord(
+        activity['name'],
+        start,
+        start.timestamp(),
+        end_time,
+        end_time.timestamp(),
+        activity_id=activity['id'],
+        activity_type=activity['type']
+    )
+
+
+def activity_type(activity) -> str:
+    """Type of a stravalib activity: a str in stravalib 1.x, a root model in 2.x"""
+    return getattr(activity.type, 'root', activity.type)
+
+
+def _activity_record(activity) -> ActivityRecord:
+    """Convert a stravalib activity to an ActivityRecord"""
+    elapsed = activity.elapsed_time
+    if not isinstance(elapsed, timedelta):
+        elapsed = timedelta(seconds=elapsed)
+    end_time = activity.start_date_local + elapsed
+    return ActivityRecord(
+        activity.name,
+        activity.start_date_local,
+        activity.start_date_local.timestamp(),
+        end_time,
+        end_time.timestamp(),
+        activity_id=activity.id,
+        activity_type=activity_type(activity)
+    )
@@ -6,17 +6,39 @@ from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse, parse_qs
 import webbrowser
 import logging
+import threading
 
-import boto3
 from botocore.exceptions import ClientError
 from stravalib.client import Client
 
+from src.lease import FileLease, S3Lease
+from src.sessions import get_shared_session
+from src.state_bundle import StateConflict, newest_token
+from src.storage import create_s3_client
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# How long a cached athlete profile is trusted before it is refetched
+ATHLETE_TTL = 30 * 24 * 3600
+
+# In-process refresh locks, one per token location
+_refresh_locks = {}
+_refresh_locks_guard = threading.Lock()
+
+
+def _get_refresh_lock(location: str) -> threading.Lock:
+    """Return the shared refresh lock for a token location"""
+    with _refresh_locks_guard:
+        if location not in _refresh_locks:
+            _refresh_locks[location] = threading.Lock()
+        return _refresh_locks[location]
+
+
 class StravaAuth:
-    def __init__(self, token_path='access_token', use_s3=False):
-        self.client = Client()
+    def __init__(self, token_path='access_token', use_s3=False, session=None, bundle=None):
+        self.session = session or get_shared_session()
+        self.client = Client(requests_session=self.session)
         self.client_id = os.environ.get('MY_STRAVA_CLIENT_ID')
         self.client_secret = os.environ.get('MY_STRAVA_CLIENT_SECRET')
         self.code = os.environ.get('MY_STRAVA_CODE')
@@ -24,6 +46,12 @@ class StravaAuth:
         self.use_s3 = use_s3
         self.s3_bucket = os.environ.get('S3_BUCKET')
         self.s3_key = os.environ.get('S3_TOKEN_KEY', 'motivator/access_token')
+        self.bundle = bundle
+        if bundle is not None:
+            bundle.register_merge('token', newest_token)
+        self._s3_client = None
+        self.token_data = None
+        self.athlete = None
 
     class AuthHandler(BaseHTTPRequestHandler):
         def do_GET(self):
@@ -99,6 +127,11 @@ class StravaAuth:
             code=code
         )
 
+        # Fetch the profile once here so regular runs never need to
+        self.athlete = _athlete_profile(self.client.get_athlete())
+        access_token = dict(access_token, athlete=self.athlete)
+
+        self.token_data = access_token
         self._save_token(access_token)
 
     def authenticate(self) -> None:
@@ -124,35 +157,132 @@ class StravaAuth:
             return
 
         if time.time() > token['expires_at']:
-            logger.info("Token expired, refreshing")
-            refresh = self.client.refresh_access_token(
-                client_id=self.client_id,
-                client_secret=self.client_secret,
-                refresh_token=token['refresh_token']
-            )
-            self._update_client_tokens(refresh)
+            self._refresh_token()
         else:
             self._update_client_tokens(token)
             logger.info('Access token is still valid')
 
+    def expires_in(self):
+        """Seconds until the loaded access token expires, or None if none is loaded"""
+        expires_at = (self.token_data or {}).get('expires_at')
+        if expires_at is None:
+            return None
+        return expires_at - time.time()
+
+    def refresh_if_expiring(self, window: float) -> bool:
+        """Refresh now if the token expires within ``window`` seconds
+
+        Only the token already in memory is checked, so this is free
+        unless a refresh is due.
+
+        Returns:
+            bool: Whether the token was refreshed
+        """
+        expires_in = self.expires_in()
+        if expires_in is None or expires_in > window:
+            return False
+        self._refresh_token(window)
+        return True
+
+    def _refresh_token(self, window: float = 0) -> None:
+        """Refresh the token once across threads and processes
+
+        Strava rotates the refresh token on every refresh, so two concurrent
+        refreshes would leave one writer holding a revoked token. Callers
+        serialize on an in-process lock and a cross-process lease, then
+        re-read the stored token: if another caller already refreshed it,
+        that result is reused instead of refreshing again. ``window``
+        refreshes tokens that are still valid but expire within it.
+        """
+        with _get_refresh_lock(self._token_location()):
+            with self._refresh_lease():
+                if self.bundle is not None:
+                    # Pick up a token another container may have just saved,
+                    # even if this run has other changes pending
+                    self.bundle.load_section('token')
+                token = self._load_token()
+                if time.time() + window <= token['expires_at']:
+                    logger.info("Token already refreshed by another caller")
+                    self._set_client_tokens(token)
+                    return
+
+                logger.info("Token expired, refreshing")
+                refresh = self.client.refresh_access_token(
+                    client_id=self.client_id,
+                    client_secret=self.client_secret,
+                    refresh_token=token['refresh_token']
+                )
+                self._update_client_tokens(refresh)
+                if self.bundle is not None:
+                    # The old refresh token is now revoked; persist right away
+                    try:
+                        self.bundle.save()
+                    except StateConflict as e:
+                        # Still pending in the bundle; the end-of-run save retries
+                        logger.error(f"Could not save the refreshed token: {str(e)}")
+
+    def _token_location(self) -> str:
+        """Identify where the token is stored"""
+        if self.use_s3:
+            return f"s3://{self.s3_bucket}/{self.s3_key}"
+        return os.path.abspath(self.token_path)
+
+    def _refresh_lease(self):
+        """Cross-process lease guarding token refresh"""
+        if self.use_s3:
+            return S3Lease(self._get_s3_client(), self.s3_bucket, f"{self.s3_key}.lock")
+        return FileLease(f"{self.token_path}.lock")
+
     def _update_client_tokens(self, token_data: dict) -> None:
         """Update client tokens and save to file"""
+        # Refresh responses don't include the athlete; carry it over
+        if 'athlete' not in token_data and self.athlete:
+            token_data = dict(token_data, athlete=self.athlete)
+        self._set_client_tokens(token_data)
+        self._save_token(token_data)
+
+    def _set_client_tokens(self, token_data: dict) -> None:
+        """Update client tokens without saving"""
         self.client.access_token = token_data['access_token']
         self.client.refresh_token = token_data['refresh_token']
         self.client.token_expires_at = token_data['expires_at']
+        self.token_data = token_data
+        if token_data.get('athlete'):
+            self.athlete = token_data['athlete']
 
-        self._save_token(token_data)
+    def get_cached_athlete(self):
+        """Return the stored athlete profile, or None if missing or stale"""
+        if self.athlete and time.time() - self.athlete.get('fetched_at', 0) < ATHLETE_TTL:
+            return self.athlete
+        return None
+
+    def cache_athlete(self, athlete) -> dict:
+        """Store an athlete profile alongside the token"""
+        self.athlete = _athlete_profile(athlete)
+        if self.token_data:
+            self._update_client_tokens(dict(self.token_data, athlete=self.athlete))
+        return self.athlete
+
+    def _get_s3_client(self):
+        """Create the S3 client once and reuse it"""
+        if self._s3_client is None:
+            self._s3_client = create_s3_client()
+        return self._s3_client
 
     def _save_token(self, token_data: dict) -> None:
-        """Save token data to file or S3"""
-        if self.use_s3:
+        """Save token data to file, S3 or the state bundle"""
+        if self.bundle is not None:
+            self.bundle.set('token', token_data)
+        elif self.use_s3:
             self._save_token_to_s3(token_data)
         else:
             self._save_token_to_file(token_data)
 
     def _load_token(self) -> dict:
-        """Load token data from file or S3"""
-        if self.use_s3:
+        """Load token data from file, S3 or the state bundle"""
+        if self.bundle is not None:
+            return self._load_token_from_bundle()
+        elif self.use_s3:
             return self._load_token_from_s3()
         else:
             return self._load_token_from_file()
@@ -170,12 +300,23 @@ class StravaAuth:
             logger.info(f"Token loaded from file: {self.token_path}")
             return token
 
+    def _load_token_from_bundle(self) -> dict:
+        """Load token from the state bundle, migrating a standalone S3 token"""
+        if not self.bundle.loaded:
+            self.bundle.load()
+        token = self.bundle.get('token')
+        if token is None and self.use_s3:
+            token = self._load_token_from_s3()
+            self.bundle.set('token', token)
+            logger.info("Token migrated into the state bundle")
+        return token
+
     def _save_token_to_s3(self, token_data: dict) -> None:
         """Save token to S3 bucket"""
         if not self.s3_bucket:
             raise ValueError("S3_BUCKET environment variable must be set when use_s3=True")
         
-        s3_client = boto3.client('s3')
+        s3_client = self._get_s3_client()
         s3_client.put_object(
             Body=json.dumps(token_data),
             Bucket=self.s3_bucket,
@@ -188,11 +329,21 @@ class StravaAuth:
         if not self.s3_bucket:
             raise ValueError("S3_BUCKET environment variable must be set when use_s3=True")
         
-        s3_client = boto3.client('s3')
+        s3_client = self._get_s3_client()
         response = s3_client.get_object(
             Bucket=self.s3_bucket,
             Key=self.s3_key
         )
         token = json.loads(response['Body'].read().decode('utf-8'))
         logger.info(f"Token loaded from S3: {self.s3_bucket}/{self.s3_key}")
-        return token
\ No newline at end of file
+        return token
+
+
+def _athlete_profile(athlete) -> dict:
+    """Reduce a stravalib athlete to the fields worth caching"""
+    return {
+        'id': athlete.id,
+        'firstname': athlete.firstname,
+        'lastname': athlete.lastname,
+        'fetched_at': time.time(),
+    }
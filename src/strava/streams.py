@@ -0,0 +1,149 @@
+import logging
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Streams needed to find pauses and report effort at play time
+STREAM_TYPES = ['time', 'moving', 'heartrate', 'velocity_smooth']
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("Stream alignment requires NumPy: python3 -m pip install numpy")
+
+
+class ActivityStreams:
+    """Time-aligned sample arrays of one activity
+
+    Args:
+        start_epoch (float): Activity start, on the same clock as the play timestamps
+        time (sequence): Seconds since start for each sample
+        moving (sequence): Whether the athlete was moving at each sample
+        heartrate (sequence): Optional heart rate per sample (bpm)
+        velocity (sequence): Optional smoothed speed per sample (m/s)
+    """
+
+    def __init__(self, start_epoch: float, time, moving, heartrate=None, velocity=None):
+        _require_numpy()
+        self.start_epoch = start_epoch
+        self.time = np.asarray(time, dtype=np.float64)
+        self.moving = np.asarray(moving, dtype=bool)
+        self.heartrate = None if heartrate is None else np.asarray(heartrate, dtype=np.float64)
+        self.velocity = None if velocity is None else np.asarray(velocity, dtype=np.float64)
+        if self.moving.shape != self.time.shape:
+            raise ValueError("time and moving streams must have the same length")
+
+    @classmethod
+    def from_stravalib(cls, start_epoch: float, streams: dict) -> Optional['ActivityStreams']:
+        """Build from the dict returned by stravalib's get_activity_streams
+
+        Returns None when the activity has no time/moving streams (e.g. a
+        manually entered activity).
+        """
+        if 'time' not in streams or 'moving' not in streams:
+            return None
+        heartrate = streams['heartrate'].data if 'heartrate' in streams else None
+        velocity = streams['velocity_smooth'].data if 'velocity_smooth' in streams else None
+        return cls(start_epoch, streams['time'].data, streams['moving'].data, heartrate, velocity)
+
+    @classmethod
+    def from_intervals(cls, start_epoch: float, intervals: list) -> 'ActivityStreams':
+        """Build from (start, end) epoch pairs of moving stretches, e.g. stored ones
+
+        Each stretch becomes two moving samples, with a stopped sample
+        between stretches.
+        """
+        time = []
+        moving = []
+        for position, (start, end) in enumerate(intervals):
+            if position:
+                time.append((time[-1] + start - start_epoch) / 2)
+                moving.append(False)
+            time += [start - start_epoch, end - start_epoch]
+            moving += [True, True]
+        return cls(start_epoch, time, moving)
+
+    def moving_intervals(self):
+        """Return (starts, ends) epoch arrays of the moving stretches
+
+        A stretch runs from its first to its last moving sample.
+        """
+        flags = np.concatenate(([0], self.moving.astype(np.int8), [0]))
+        edges = np.diff(flags)
+        first = np.flatnonzero(edges == 1)
+        last = np.flatnonzero(edges == -1) - 1
+        epochs = self.start_epoch + self.time
+        return epochs[first], epochs[last]
+
+    def align(self, play_epochs) -> dict:
+        """Match play timestamps against the moving stretches in one pass
+
+        Args:
+            play_epochs (sequence): Play timestamps in epoch seconds
+
+        Returns:
+            dict: Arrays aligned with ``play_epochs``: ``moving`` (bool),
+            ``heartrate`` (bpm) and ``pace`` (seconds per km), with NaN
+            where a stream is missing or the athlete was standing still
+        """
+        plays = np.asarray(play_epochs, dtype=np.float64)
+        starts, ends = self.moving_intervals()
+
+        # Last stretch starting at or before each play, then check its end
+        interval = np.searchsorted(starts, plays, side='right') - 1
+        has_interval = interval >= 0
+        interval = interval.clip(0)
+        moving = has_interval & (plays <= ends[interval]) if len(starts) else np.zeros(plays.shape, dtype=bool)
+
+        # Nearest sample at or after each play for effort metrics
+        sample = np.searchsorted(self.start_epoch + self.time, plays).clip(0, max(len(self.time) - 1, 0))
+
+        nan = np.full(plays.shape, np.nan)
+        heartrate = self.heartrate[sample] if self.heartrate is not None and len(self.heartrate) else nan
+        if self.velocity is not None and len(self.velocity):
+            velocity = self.velocity[sample]
+            with np.errstate(divide='ignore'):
+                pace = np.where(velocity > 0, 1000.0 / velocity, np.nan)
+        else:
+            pace = nan
+
+        return {'moving': moving, 'heartrate': heartrate, 'pace': pace}
+
+
+def parse_played_at(played_at: list):
+    """Convert Spotify played_at strings to epoch seconds in one batch"""
+    _require_numpy()
+    stamps = np.array([value.rstrip('Z') for value in played_at], dtype='datetime64[ms]')
+    return stamps.astype(np.int64) / 1000.0
+
+
+def align_plays(streams: ActivityStreams, plays: list) -> list:
+    """Annotate (uri, played_at) plays with moving state and effort
+
+    Args:
+        streams (ActivityStreams): Streams of the activity
+        plays (list): (track_uri, played_at string) tuples
+
+    Returns:
+        list: One dict per play with uri, played_at, moving, heartrate and pace
+    """
+    if not plays:
+        return []
+    aligned = streams.align(parse_played_at([played_at for _, played_at in plays]))
+    return [
+        {
+            'uri': uri,
+            'played_at': played_at,
+            'moving': bool(moving),
+            'heartrate': None if np.isnan(heartrate) else float(heartrate),
+            'pace': None if np.isnan(pace) else float(pace),
+        }
+        for (uri, played_at), moving, heartrate, pace
+        in zip(plays, aligned['moving'], aligned['heartrate'], aligned['pace'])
+    ]
@@ -0,0 +1,83 @@
+import os
+import logging
+import threading
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Renew tokens this long before they expire
+DEFAULT_REFRESH_WINDOW = 15 * 60
+
+
+def refresh_tokens(clients: dict, window: float = DEFAULT_REFRESH_WINDOW, deadline=None) -> dict:
+    """Renew every token that expires within ``window`` seconds
+
+    Failures are logged, not raised: the token is still valid, and the
+    next run refreshes inline as before.
+
+    Args:
+        clients (dict): name -> object with refresh_if_expiring(window),
+            e.g. StravaAuth and SpotifyHandler
+        window (float): Seconds before expiry a token is renewed
+        deadline (Deadline): Skip the remaining refreshes once it runs out
+
+    Returns:
+        dict: name -> whether its token was refreshed
+    """
+    refreshed = {}
+    for name, client in clients.items():
+        if client is None:
+            continue
+        if deadline is not None and deadline.remaining() <= 0:
+            logger.info(f"No time left to refresh the {name} token")
+            break
+        try:
+            refreshed[name] = client.refresh_if_expiring(window)
+        except Exception as e:
+            logger.warning(f"Proactive {name} token refresh failed: {str(e)}")
+            refreshed[name] = False
+        else:
+            if refreshed[name]:
+                logger.info(f"Refreshed {name} token ahead of expiry")
+    return refreshed
+
+
+class TokenRefresher:
+    """Keep tokens fresh from a daemon thread in long-running processes
+
+    Args:
+        clients (dict): name -> object with refresh_if_expiring(window)
+        window (float): Seconds before expiry a token is renewed
+        interval (float): Seconds between checks (default: a third of the
+            window, so every token is seen at least twice inside it)
+    """
+
+    def __init__(self, clients: dict, window: float = DEFAULT_REFRESH_WINDOW, interval: float = None):
+        self.clients = clients
+        self.window = window
+        self.interval = interval or max(window / 3, 1)
+        self.checks = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            self.checks += 1
+            refresh_tokens(self.clients, self.window)
+            self._stop.wait(self.interval)
+
+    def start(self) -> 'TokenRefresher':
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='token-refresher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def refresh_window_from_env() -> float:
+    """``TOKEN_REFRESH_WINDOW``: seconds before expiry tokens are renewed, 0 disables"""
+    return float(os.environ.get('TOKEN_REFRESH_WINDOW', DEFAULT_REFRESH_WINDOW))
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import bisect
+import heapq
+import logging
+import threading
+from collections import Counter
+
+from src.storage import LocalStorage, S3Storage, S3_PREFIX
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+TOP_TRACKS_KEY = 'top-tracks.json'
+TOP_TRACKS_NAME = 'Runlist - Top tracks'
+
+
+class TopTracks:
+    """Most-played tracks over a sliding window of runs, kept in a playlist
+
+    Each matched activity contributes its per-track play counts once.
+    Running totals are updated as activities enter and leave the window,
+    so adding a run costs its own tracks rather than a recount of the
+    window. sync() compares the current top tracks with what the playlist
+    last received and only sends the difference. A lock lets batch workers
+    add activities concurrently.
+
+    Args:
+        storage: LocalStorage or S3Storage holding the state
+        runs (int): Window size in activities, newest kept
+        days (float): Window size in days; used instead of ``runs`` if set
+        size (int): Tracks in the playlist
+        name (str): Playlist name
+        clock (callable): Current time in seconds, for tests
+    """
+
+    def __init__(self, storage, runs: int = 10, days: float = None, size: int = 50,
+                 name: str = TOP_TRACKS_NAME, key: str = TOP_TRACKS_KEY, clock=time.time):
+        self.storage = storage
+        self.runs = runs
+        self.days = days
+        self.size = size
+        self.name = name
+        self.key = key
+        self.clock = clock
+        self.dirty = False
+        self._state = None
+        self._counts = None
+        self._lock = threading.RLock()
+
+    def _load(self) -> dict:
+        with self._lock:
+            if self._state is None:
+                data = self.storage.get(self.key)
+                self._state = json.loads(data.decode('utf-8')) if data else {
+                    'contributions': [],
+                    'playlist_id': None,
+                    'synced': [],
+                }
+                self._counts = Counter()
+                for _, _, counts in self._state['contributions']:
+                    self._counts.update(counts)
+            return self._state
+
+    @property
+    def counts(self) -> Counter:
+        """Plays per track within the window"""
+        self._load()
+        return self._counts
+
+    @property
+    def playlist_id(self):
+        """ID of the playlist, or None until the first sync creates it"""
+        return self._load()['playlist_id']
+
+    def add(self, activity, tracks: list) -> bool:
+        """Count an activity's tracks in, expiring what fell out of the window
+
+        Returns:
+            bool: False if the activity was already counted
+        """
+        with self._lock:
+            state = self._load()
+            key = str(getattr(activity, 'activity_id', None) or activity[2])
+            contributions = state['contributions']
+            if any(contribution[0] == key for contribution in contributions):
+                return False
+
+            counts = dict(Counter(tracks))
+            # Keep oldest first, even when older runs arrive late
+            position = bisect.bisect_right([contribution[1] for contribution in contributions], activity[2])
+            contributions.insert(position, [key, activity[2], counts])
+            self._counts.update(counts)
+            self.dirty = True
+            self._expire()
+            return True
+
+    def _expire(self) -> None:
+        contributions = self._state['contributions']
+        if self.days is not None:
+            oldest = self.clock() - self.days * 24 * 3600
+            expired = 0
+            while expired < len(contributions) and contributions[expired][1] < oldest:
+                expired += 1
+        else:
+            expired = max(len(contributions) - self.runs, 0)
+
+        for _, _, counts in contributions[:expired]:
+            self._counts.subtract(counts)
+        if expired:
+            del contributions[:expired]
+            # Drop tracks no run in the window played
+            self._counts = +self._counts
+            self.dirty = True
+
+    def top(self) -> list:
+        """Top ``size`` track URIs, most played first, ties by URI"""
+        if self.days is not None:
+            self._expire()
+        return [uri for uri, _ in heapq.nsmallest(
+            self.size, self.counts.items(), key=lambda item: (-item[1], item[0])
+        )]
+
+    def sync(self, spotify) -> dict:
+        """Bring the playlist in line with top() using the smallest diff
+
+        Returns:
+            dict: Number of tracks ``added`` and ``removed``
+        """
+        state = self._load()
+        target = self.top()
+        synced = set(state['synced'])
+        wanted = set(target)
+        add = [uri for uri in target if uri not in synced]
+        remove = [uri for uri in state['synced'] if uri not in wanted]
+        if not add and not remove:
+            return {'added': 0, 'removed': 0}
+
+        if state['playlist_id'] is None:
+            if not target:
+                return {'added': 0, 'removed': 0}
+            state['playlist_id'] = spotify.create_playlist(
+                self.name,
+                self._description()
+            )
+        spotify.update_playlist(state['playlist_id'], add=add, remove=remove)
+        state['synced'] = target
+        self.dirty = True
+        logger.info(f"Top tracks playlist updated: {len(add)} added, {len(remove)} removed")
+        return {'added': len(add), 'removed': len(remove)}
+
+    def _description(self) -> str:
+        if self.days is not None:
+            return f"Most played tracks of the last {self.days:g} days of runs"
+        return f"Most played tracks of the last {self.runs} runs"
+
+    def save(self) -> bool:
+        with self._lock:
+            if not self.dirty:
+                return False
+            self.storage.put(self.key, json.dumps(self._state).encode('utf-8'))
+            self.dirty = False
+            return True
+
+    def reload(self) -> None:
+        """Drop the cached state to see changes saved by another process"""
+        with self._lock:
+            if not self.dirty:
+                self._state = None
+                self._counts = None
+
+
+def top_tracks_from_env(use_s3=False, storage=None):
+    """Build the top tracks aggregator configured by environment variables
+
+    ``TOP_TRACKS`` selects ``local`` (``TOP_TRACKS_DIR``), ``s3`` (under
+    ``S3_BUCKET``/``S3_PREFIX``) or ``off`` (default). The window is the last
+    ``TOP_TRACKS_RUNS`` activities (default 10), or ``TOP_TRACKS_DAYS`` days
+    if set; ``TOP_TRACKS_SIZE`` tracks (default 50) go in the playlist. An
+    explicit ``storage`` (e.g. the state bundle) replaces the S3 location.
+    """
+    mode = os.environ.get('TOP_TRACKS', 'off').lower()
+    if mode == 'off':
+        return None
+    if mode == 's3':
+        if storage is None:
+            prefix = os.environ.get('S3_PREFIX', S3_PREFIX)
+            storage = S3Storage(os.environ.get('S3_BUCKET'), prefix)
+    else:
+        storage = LocalStorage(os.environ.get('TOP_TRACKS_DIR', '.motivator_cache'))
+    days = os.environ.get('TOP_TRACKS_DAYS')
+    return TopTracks(
+        storage,
+        runs=int(os.environ.get('TOP_TRACKS_RUNS', 10)),
+        days=float(days) if days else None,
+        size=int(os.environ.get('TOP_TRACKS_SIZE', 50))
+    )
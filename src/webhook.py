@@ -0,0 +1,191 @@
+import os
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import boto3
+
+from src.deadline import boto_config, get_request_guard
+from src.main import process_activity_id
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Activity fields whose change can turn an activity into a run worth processing
+RELEVANT_UPDATES = ('type',)
+
+
+def _response(status: int, body=None) -> dict:
+    """Build an API Gateway proxy response"""
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(body if body is not None else {})
+    }
+
+
+def handle_validation(params: dict) -> dict:
+    """Answer Strava's subscription validation handshake
+
+    Strava sends ``hub.mode=subscribe``, ``hub.verify_token`` and
+    ``hub.challenge`` and expects the challenge echoed back as JSON.
+    """
+    verify_token = os.environ.get('STRAVA_VERIFY_TOKEN')
+    if params.get('hub.mode') != 'subscribe' or 'hub.challenge' not in params:
+        return _response(400, {'error': 'Invalid subscription request'})
+    if not verify_token or params.get('hub.verify_token') != verify_token:
+        logger.warning("Webhook validation with wrong verify token")
+        return _response(403, {'error': 'Invalid verify token'})
+    return _response(200, {'hub.challenge': params['hub.challenge']})
+
+
+def should_process(event: dict) -> bool:
+    """Whether a webhook event needs its activity processed
+
+    Only activity creates are processed, plus updates that change the
+    activity type (e.g. a workout re-tagged as a run). Title or privacy
+    edits don't change the activity window, so they are ignored instead
+    of producing a duplicate playlist.
+    """
+    if event.get('object_type') != 'activity':
+        return False
+    if event.get('aspect_type') == 'create':
+        return True
+    if event.get('aspect_type') == 'update':
+        return any(field in event.get('updates', {}) for field in RELEVANT_UPDATES)
+    return False
+
+
+class SqsQueue:
+    """Sends messages to an SQS queue; same send() as InMemoryQueue"""
+
+    def __init__(self, sqs_client, queue_url: str):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+
+    def send(self, body) -> str:
+        response = self.sqs_client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=body if isinstance(body, str) else json.dumps(body)
+        )
+        return response['MessageId']
+
+
+def queue_from_env():
+    """``WEBHOOK_QUEUE_URL``: SQS queue events are handed to, or None to process inline"""
+    queue_url = os.environ.get('WEBHOOK_QUEUE_URL')
+    if not queue_url:
+        return None
+    return SqsQueue(boto3.client('sqs', config=boto_config()), queue_url)
+
+
+def handle_event(event: dict, create_playlist=True, use_s3=False, context=None, queue=None,
+                 deadline=None) -> dict:
+    """Process a single webhook push event
+
+    With a ``queue`` the activity is handed to the batch path and Strava
+    gets its 200 straight away; processing inline can outlast Strava's
+    2 second budget and trigger redeliveries. Inline, an activity is
+    marked in flight while it is processed, so redeliveries arriving in
+    the meantime are dropped, and is only remembered once it was
+    actually processed. ``deadline`` bounds the outbound calls.
+    """
+    get_request_guard().start(deadline)
+    subscription_id = os.environ.get('STRAVA_SUBSCRIPTION_ID')
+    if subscription_id and str(event.get('subscription_id')) != subscription_id:
+        logger.warning(f"Ignoring event for unknown subscription {event.get('subscription_id')}")
+        return _response(200, {'processed': False})
+
+    if not should_process(event):
+        logger.info(f"Ignoring {event.get('object_type')} {event.get('aspect_type')} event")
+        return _response(200, {'processed': False})
+
+    activity_id = event['object_id']
+    if queue is not None:
+        # The event means the activity changed, so it is fetched fresh
+        queue.send({'activity_id': activity_id, 'fresh': True})
+        logger.info(f"Activity {activity_id} queued")
+        return _response(200, {'processed': False, 'queued': True})
+
+    if context is not None:
+        if activity_id in context.processed_activity_ids or activity_id in context.in_flight_activity_ids:
+            # Strava retries deliveries it considers timed out
+            logger.info(f"Activity {activity_id} already processed or in progress, ignoring redelivery")
+            return _response(200, {'processed': False})
+        context.in_flight_activity_ids.add(activity_id)
+
+    try:
+        result = process_activity_id(
+            activity_id,
+            create_playlist=create_playlist,
+            use_s3=use_s3,
+            context=context,
+            fresh=True,
+            deadline=deadline
+        )
+    finally:
+        if context is not None:
+            context.in_flight_activity_ids.discard(activity_id)
+    if context is not None and result is not None:
+        context.processed_activity_ids.add(activity_id)
+    return _response(200, {'processed': result is not None, 'activity': result})
+
+
+def handle_webhook(request: dict, create_playlist=True, use_s3=False, context=None, queue=None,
+                   deadline=None) -> dict:
+    """Route an API Gateway proxy request from Strava's webhook
+
+    GET requests are subscription validations, POST requests carry events.
+    """
+    method = request.get('httpMethod') or request.get('requestContext', {}).get('http', {}).get('method')
+    if method == 'GET':
+        return handle_validation(request.get('queryStringParameters') or {})
+    if method == 'POST':
+        try:
+            event = json.loads(request.get('body') or '{}')
+        except ValueError:
+            return _response(400, {'error': 'Invalid JSON body'})
+        return handle_event(event, create_playlist=create_playlist, use_s3=use_s3, context=context, queue=queue,
+                            deadline=deadline)
+    return _response(405, {'error': f'Unsupported method {method}'})
+
+
+def make_request_handler(dispatch):
+    """Build an HTTP handler class that forwards requests to ``dispatch``"""
+
+    class WebhookRequestHandler(BaseHTTPRequestHandler):
+        def _forward(self, method):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            request = {
+                'httpMethod': method,
+                'path': url.path,
+                'queryStringParameters': {key: values[0] for key, values in parse_qs(url.query).items()},
+                'body': self.rfile.read(length).decode('utf-8') if length else None,
+            }
+            response = dispatch(request)
+            self.send_response(response['statusCode'])
+            for name, value in response.get('headers', {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(response['body'].encode('utf-8'))
+
+        def do_GET(self):
+            self._forward('GET')
+
+        def do_POST(self):
+            self._forward('POST')
+
+        def log_message(self, format, *args):
+            logger.info(format % args)
+
+    return WebhookRequestHandler
+
+
+def serve(host='localhost', port=8000, create_playlist=True, context=None) -> HTTPServer:
+    """Create a local webhook server, e.g. behind a tunnel during development"""
+    def dispatch(request):
+        return handle_webhook(request, create_playlist=create_playlist, context=context)
+
+    return HTTPServer((host, port), make_request_handler(dispatch))
@@ -0,0 +1 @@
+# Importer tests initialization
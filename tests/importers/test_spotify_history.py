@@ -0,0 +1,139 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.importers import spotify_history
+from src.importers.spotify_history import (
+    history_files,
+    history_rows,
+    import_history,
+    iter_json_array,
+    read_history_file,
+    spool_history_file,
+)
+from src.store import StateStore
+
+
+def _entry(ts, uri="spotify:track:a", ms_played=200000):
+    return {
+        "ts": ts,
+        "platform": "android",
+        "ms_played": ms_played,
+        "master_metadata_track_name": "Track",
+        "spotify_track_uri": uri,
+        "episode_name": None,
+        "skipped": False,
+    }
+
+
+def _write_history(path, entries):
+    path.write_text(json.dumps(entries, indent=2))
+    return path
+
+
+def test_iter_json_array_across_chunks():
+    entries = [_entry(f"2020-01-01T00:00:{i:02d}Z", uri=f"spotify:track:{i}") for i in range(20)]
+    f = io.StringIO(json.dumps(entries, indent=2))
+
+    assert list(iter_json_array(f, chunk_size=7)) == entries
+    assert list(iter_json_array(io.StringIO(" [ ] "))) == []
+
+
+def test_iter_json_array_rejects_truncated_files():
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.StringIO('[{"ts": "2020-01-01T00:00:00Z"}, {"ts": '), chunk_size=8))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"not": "an array"}')))
+
+
+@pytest.mark.parametrize("numpy", [True, False])
+def test_history_rows(monkeypatch, numpy):
+    if not numpy:
+        monkeypatch.setattr(spotify_history, "np", None)
+    items = [
+        _entry("2020-01-01T07:30:00Z"),
+        _entry("2020-01-01T07:31:00Z", ms_played=5000),
+        dict(_entry("2020-01-01T08:00:00Z"), spotify_track_uri=None, episode_name="Podcast"),
+    ]
+
+    rows = history_rows(items)
+
+    assert rows == [(1577863800.0, "2020-01-01T07:30:00.000Z", "spotify:track:a")]
+
+
+def test_read_history_file_in_batches(tmp_path):
+    entries = [_entry(f"2020-01-01T00:{i:02d}:00Z") for i in range(7)]
+    path = _write_history(tmp_path / "Streaming_History_Audio_2020.json", entries)
+
+    _, rows, read = read_history_file(str(path), batch_size=3)
+
+    assert read == 7
+    assert [row[1] for row in rows] == [f"2020-01-01T00:{i:02d}:00.000Z" for i in range(7)]
+
+
+def test_spool_history_file_in_batches(tmp_path):
+    entries = [_entry(f"2020-01-01T00:{i:02d}:00Z") for i in range(7)]
+    path = _write_history(tmp_path / "Streaming_History_Audio_2020.json", entries)
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+
+    _, spooled, plays, read = spool_history_file(str(path), str(spool_dir), batch_size=3)
+
+    assert (plays, read) == (7, 7)
+    # One file per batch, never the whole history at once
+    assert [len(json.loads(open(spool_path).read())) for spool_path in spooled] == [3, 3, 1]
+
+
+def test_history_files_finds_exports(tmp_path):
+    export = tmp_path / "Spotify Extended Streaming History"
+    export.mkdir()
+    _write_history(export / "Streaming_History_Audio_2019-2020_0.json", [_entry("2019-01-01T00:00:00Z")])
+    _write_history(export / "Streaming_History_Video_2019-2020.json", [])
+    _write_history(tmp_path / "endsong_0.json", [])
+
+    files = history_files([str(tmp_path)])
+
+    assert sorted(path.rsplit("/", 1)[1] for path in files) == [
+        "Streaming_History_Audio_2019-2020_0.json",
+        "endsong_0.json",
+    ]
+
+
+def test_import_history_into_store(tmp_path):
+    first = _write_history(tmp_path / "Streaming_History_Audio_2019_0.json", [
+        _entry("2019-06-01T07:10:00Z", "spotify:track:a"),
+        _entry("2019-06-01T07:15:00Z", "spotify:track:b"),
+    ])
+    second = _write_history(tmp_path / "Streaming_History_Audio_2019_1.json", [
+        _entry("2019-06-01T07:20:00Z", "spotify:track:c"),
+        _entry("2019-06-01T07:15:00Z", "spotify:track:b"),
+    ])
+    store = StateStore(str(tmp_path / "state.db"))
+
+    report = import_history([str(first), str(second)], store, workers=2, executor_factory=ThreadPoolExecutor)
+
+    assert report["files"] == 2
+    assert report["plays"] == 4
+    assert report["stored"] == 3
+    start = 1559372400  # 2019-06-01T07:00:00Z
+    assert store.plays_between(start, start + 3600) == [
+        ("spotify:track:c", "2019-06-01T07:20:00.000Z"),
+        ("spotify:track:b", "2019-06-01T07:15:00.000Z"),
+        ("spotify:track:a", "2019-06-01T07:10:00.000Z"),
+    ]
+
+
+def test_import_history_skips_plays_already_fetched_from_api(tmp_path):
+    history = _write_history(tmp_path / "Streaming_History_Audio_2019_0.json", [
+        _entry("2019-06-01T07:10:00Z", "spotify:track:a"),
+    ])
+    store = StateStore(str(tmp_path / "state.db"))
+    # The Web API reports the same play with milliseconds
+    store.add_plays([{"played_at": "2019-06-01T07:10:00.512Z", "track": {"uri": "spotify:track:a"}}])
+
+    report = import_history([str(history)], store, workers=1, executor_factory=ThreadPoolExecutor)
+
+    assert report["stored"] == 0
+    assert len(store.plays_between(1559372400, 1559376000)) == 1
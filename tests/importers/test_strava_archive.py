@@ -0,0 +1,144 @@
+import gzip
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+
+from src.importers.strava_archive import (
+    FIT_EPOCH,
+    activity_timestamps,
+    fit_timestamps,
+    import_archive,
+    moving_intervals,
+    read_archive,
+)
+from src.store import StateStore
+
+START = datetime(2020, 3, 5, 17, 42, 0, tzinfo=timezone.utc).timestamp()
+
+CSV_HEADER = "Activity ID,Activity Date,Activity Name,Activity Type,Activity Description,Elapsed Time,Distance,Filename,Elapsed Time\n"
+
+
+def _fit(stamps, compressed=()):
+    """Minimal FIT file: a file_id message, then one record per timestamp
+
+    Timestamps listed in ``compressed`` use the compressed timestamp header.
+    """
+    body = bytearray()
+    # Definition of local 0 = file_id (global 0): one 4 byte time_created field
+    body += bytes([0x40, 0, 0]) + struct.pack('<H', 0) + bytes([1, 4, 4, 0x86])
+    body += bytes([0x00]) + struct.pack('<I', stamps[0] - FIT_EPOCH)
+    # Definition of local 1 = record (global 20): timestamp plus heart rate
+    body += bytes([0x41, 0, 0]) + struct.pack('<H', 20) + bytes([2, 253, 4, 0x86, 3, 1, 0x02])
+    # Compressed records reuse local 1 but carry only the heart rate
+    body += bytes([0x42, 0, 0]) + struct.pack('<H', 20) + bytes([1, 3, 1, 0x02])
+    for stamp in stamps:
+        if stamp in compressed:
+            body += bytes([0x80 | (2 << 5) | ((stamp - FIT_EPOCH) & 0x1F), 150])
+        else:
+            body += bytes([0x01]) + struct.pack('<I', stamp - FIT_EPOCH) + bytes([150])
+    header = bytes([12, 0x10]) + struct.pack('<H', 2100) + struct.pack('<I', len(body)) + b'.FIT'
+    return header + bytes(body) + b'\x00\x00'
+
+
+def _gpx(stamps):
+    points = "".join(
+        f'<trkpt lat="48.8" lon="2.3"><ele>35</ele><time>{datetime.fromtimestamp(stamp, tz=timezone.utc):%Y-%m-%dT%H:%M:%SZ}</time></trkpt>'
+        for stamp in stamps
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><gpx xmlns="http://www.topografix.com/GPX/1/1">'
+        '<metadata><time>2000-01-01T00:00:00Z</time></metadata>'
+        f'<trk><trkseg>{points}</trkseg></trk></gpx>'
+    ).encode()
+
+
+def _tcx(stamps):
+    points = "".join(
+        f'<Trackpoint><Time>{datetime.fromtimestamp(stamp, tz=timezone.utc):%Y-%m-%dT%H:%M:%S.000Z}</Time></Trackpoint>'
+        for stamp in stamps
+    )
+    # Strava's TCX files start with whitespace
+    return (
+        '          <?xml version="1.0" encoding="UTF-8"?>'
+        '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">'
+        f'<Activities><Activity><Lap><Track>{points}</Track></Lap></Activity></Activities></TrainingCenterDatabase>'
+    ).encode()
+
+
+@pytest.fixture
+def export_zip(tmp_path):
+    path = tmp_path / "export_123.zip"
+    run = [int(START) + i * 5 for i in range(10)] + [int(START) + 300 + i * 5 for i in range(5)]
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("activities.csv", CSV_HEADER + "\n".join([
+            '1,"Mar 5, 2020, 5:42:00 PM",FIT Run,Run,,400,5.0,activities/1.fit.gz,400.0',
+            '2,"Mar 6, 2020, 5:42:00 PM",GPX Run,Run,,100,1.0,activities/2.gpx.gz,100.0',
+            '3,"Mar 7, 2020, 5:42:00 PM",TCX Run,Run,,100,1.0,activities/3.tcx,100.0',
+            '4,"Mar 8, 2020, 5:42:00 PM",Treadmill,Run,,1800,5.0,,1800.0',
+            '5,"Mar 9, 2020, 5:42:00 PM",Commute,Ride,,900,5.0,activities/5.gpx.gz,900.0',
+            '6,"Mar 10, 2020, 5:42:00 PM",Broken,Run,,600,5.0,activities/6.fit.gz,600.0',
+        ]) + "\n")
+        archive.writestr("activities/1.fit.gz", gzip.compress(_fit(run)))
+        archive.writestr("activities/2.gpx.gz", gzip.compress(_gpx([int(START) + 86400 + i for i in range(0, 60, 5)])))
+        archive.writestr("activities/3.tcx", _tcx([int(START) + 2 * 86400 + i for i in range(0, 60, 5)]))
+        archive.writestr("activities/5.gpx.gz", gzip.compress(_gpx([int(START) + 4 * 86400])))
+        archive.writestr("activities/6.fit.gz", gzip.compress(b"not a fit file"))
+    return str(path), run
+
+
+def test_fit_timestamps_with_compressed_headers():
+    stamps = [int(START) + offset for offset in (0, 1, 3, 40, 41)]
+
+    assert fit_timestamps(_fit(stamps, compressed={stamps[1], stamps[2], stamps[4]})) == stamps
+
+
+def test_fit_timestamps_rejects_other_files():
+    with pytest.raises(ValueError):
+        fit_timestamps(b"<gpx></gpx>")
+
+
+def test_activity_timestamps_by_extension():
+    stamps = [int(START), int(START) + 5]
+
+    assert activity_timestamps("a.gpx.gz", gzip.compress(_gpx(stamps))) == stamps
+    assert activity_timestamps("a.tcx", _tcx(stamps)) == stamps
+    with pytest.raises(ValueError):
+        activity_timestamps("a.kml", b"")
+
+
+def test_moving_intervals_split_at_pauses():
+    assert moving_intervals([0, 5, 10, 60, 65], pause_gap=15) == [[0, 10], [60, 65]]
+    assert moving_intervals([]) == []
+
+
+def test_read_archive(export_zip):
+    path, run = export_zip
+
+    records = read_archive(path, workers=2, executor_factory=ThreadPoolExecutor)
+
+    assert [record.activity_id for record, _ in records] == [1, 2, 3, 4, 6]
+    fit_run, fit_intervals = records[0]
+    assert fit_intervals == [[run[0], run[9]], [run[10], run[14]]]
+    assert (fit_run.start_epoch, fit_run.end_epoch) == (run[0], run[14])
+    assert fit_run.start == datetime.fromtimestamp(run[0], tz=timezone.utc)
+    assert records[1][1] == [[START + 86400, START + 86400 + 55]]
+    # No file, or an unreadable one: times from activities.csv
+    treadmill, intervals = records[3]
+    assert intervals is None
+    assert treadmill.end_epoch - treadmill.start_epoch == 1800
+    assert records[4][1] is None
+
+
+def test_import_archive_into_store(export_zip, tmp_path):
+    path, run = export_zip
+    store = StateStore(str(tmp_path / "state.db"))
+
+    report = import_archive(path, store, workers=2, executor_factory=ThreadPoolExecutor)
+
+    assert report == dict(report, activities=5, parsed=3, stored=5)
+    rows = store.activities_between(START - 1, START + 10 * 86400)
+    assert [row[0] for row in rows] == [1, 2, 3, 4, 6]
+    assert store.moving_intervals(1) == [(run[0], run[9]), (run[10], run[14])]
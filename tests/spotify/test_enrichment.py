@@ -0,0 +1,126 @@
+import time
+from unittest.mock import patch, MagicMock
+import pytest
+
+from spotipy.exceptions import SpotifyException
+
+from src.spotify.enrichment import TrackCache, TrackEnricher, describe_tracks, enricher_from_env
+from src.storage import LocalStorage
+
+
+def _track(i):
+    return {
+        "uri": f"spotify:track:{i}",
+        "name": f"Song {i}",
+        "artists": [{"name": f"Artist {i % 3}"}],
+        "duration_ms": 180000,
+    }
+
+
+def _fake_sp():
+    sp = MagicMock()
+    sp.tracks.side_effect = lambda uris: {"tracks": [_track(int(uri.rsplit(":", 1)[1])) for uri in uris]}
+    sp.audio_features.side_effect = lambda uris: [{"uri": uri, "tempo": 170.0} for uri in uris]
+    return sp
+
+
+@pytest.fixture
+def enricher(tmp_path):
+    return TrackEnricher(TrackCache(LocalStorage(str(tmp_path))))
+
+
+def test_enrich_batches_unique_tracks(enricher):
+    spotify = MagicMock()
+    spotify.sp = _fake_sp()
+    uris = [f"spotify:track:{i}" for i in range(120)] * 2
+
+    details = enricher.enrich(spotify, uris)
+
+    assert len(details) == 120
+    assert details["spotify:track:7"] == {"name": "Song 7", "artist": "Artist 1", "duration_ms": 180000, "tempo": 170.0}
+    # 3 batches of tracks (50 each) + 2 of audio features (100 each)
+    assert spotify.sp.tracks.call_count == 3
+    assert spotify.sp.audio_features.call_count == 2
+
+
+def test_cached_tracks_are_not_fetched_again(enricher, tmp_path):
+    spotify = MagicMock()
+    spotify.sp = _fake_sp()
+    enricher.enrich(spotify, ["spotify:track:1", "spotify:track:2"])
+    enricher.save()
+
+    # A later run (or another user) sharing the cache
+    other = TrackEnricher(TrackCache(LocalStorage(str(tmp_path))))
+    spotify.sp.tracks.reset_mock()
+    details = other.enrich(spotify, ["spotify:track:1", "spotify:track:2", "spotify:track:3"])
+
+    spotify.sp.tracks.assert_called_once_with(["spotify:track:3"])
+    assert len(details) == 3
+    assert other.cache.stats == {"hits": 2, "misses": 1}
+
+
+def test_cache_ttl_and_lru(tmp_path):
+    cache = TrackCache(LocalStorage(str(tmp_path)), ttl=60, max_entries=2)
+    cache.put("a", {"name": "A"})
+    cache.put("b", {"name": "B"})
+    cache.get("a")
+    cache.put("c", {"name": "C"})
+
+    # "b" was least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == {"name": "A"}
+
+    cache.entries["a"]["fetched_at"] = time.time() - 120
+    assert cache.get("a") is None
+
+
+def test_save_merges_concurrent_writers(tmp_path):
+    first = TrackCache(LocalStorage(str(tmp_path)))
+    second = TrackCache(LocalStorage(str(tmp_path)))
+    first.put("a", {"name": "A"})
+    second.put("b", {"name": "B"})
+    first.save()
+    second.save()
+
+    merged = TrackCache(LocalStorage(str(tmp_path)))
+    assert merged.get("a") == {"name": "A"}
+    assert merged.get("b") == {"name": "B"}
+    assert first.save() is False
+
+
+def test_missing_audio_features_keeps_metadata(enricher):
+    spotify = MagicMock()
+    spotify.sp = _fake_sp()
+    spotify.sp.audio_features.side_effect = SpotifyException(403, -1, "Forbidden")
+
+    details = enricher.enrich(spotify, ["spotify:track:1"])
+    enricher.enrich(spotify, ["spotify:track:2"])
+
+    assert details["spotify:track:1"]["tempo"] is None
+    assert details["spotify:track:1"]["artist"] == "Artist 1"
+    # Not retried once known to be unavailable
+    spotify.sp.audio_features.assert_called_once()
+
+
+def test_describe_tracks():
+    details = {
+        "a": {"name": "A", "artist": "X", "duration_ms": 240000, "tempo": 160.0},
+        "b": {"name": "B", "artist": "Y", "duration_ms": 180000, "tempo": 180.0},
+    }
+
+    assert describe_tracks("Morning Run", ["a", "b"], details) == "Morning Run · 2 tracks · 7 min · avg 170 BPM · X, Y"
+    assert describe_tracks("Run", ["c"], details) == "Run · 1 tracks"
+    assert len(describe_tracks("x" * 400, ["a"], details)) == 300
+
+
+def test_enricher_from_env(tmp_path):
+    with patch.dict("os.environ", {}, clear=True):
+        assert enricher_from_env() is None
+
+    with patch.dict("os.environ", {"ENRICH": "local", "TRACK_CACHE_DIR": str(tmp_path), "TRACK_CACHE_TTL_DAYS": "1"}):
+        enricher = enricher_from_env()
+    assert enricher.cache.ttl == 24 * 3600
+
+    with patch.dict("os.environ", {"ENRICH": "s3", "S3_BUCKET": "test-bucket"}), patch("boto3.client"):
+        enricher = enricher_from_env(use_s3=True)
+    assert enricher.cache.storage.prefix == "shared"
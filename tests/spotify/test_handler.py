@@ -104,3 +104,195 @@ def test_get_activity_tracks_with_paging(mock_spotify_client):
     assert len(tracks) == 2
     assert "spotify:track:test_track_1" in tracks
     assert "spotify:track:test_track_2" in tracks
+
+
+def test_get_recently_played_cached(mock_spotify_client):
+    handler = SpotifyHandler(history_max_age=60)
+    handler.sp = mock_spotify_client
+
+    now = datetime.now(timezone.utc)
+    start_epoch = (now - timedelta(hours=1)).timestamp()
+    handler.get_activity_tracks(start_epoch, now.timestamp())
+    handler.get_activity_tracks(start_epoch, now.timestamp())
+
+    # History is fetched once and reused while fresh
+    mock_spotify_client.current_user_recently_played.assert_called_once_with()
+
+
+def test_get_recently_played_incremental(mock_spotify_client):
+    handler = SpotifyHandler()
+    handler.sp = mock_spotify_client
+
+    first = handler.get_recently_played()
+    latest = first[0]["played_at"]
+
+    newer = (datetime.now(timezone.utc) - timedelta(minutes=5)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    mock_spotify_client.current_user_recently_played.return_value = {
+        "items": [{"played_at": newer, "track": {"uri": "spotify:track:test_track_2"}}],
+        "next": None
+    }
+    history = handler.get_recently_played(max_age=0)
+
+    # Only plays after the newest cached one are requested
+    after = mock_spotify_client.current_user_recently_played.call_args.kwargs["after"]
+    assert after == int(datetime.strptime(latest, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc).timestamp() * 1000)
+    assert [item["track"]["uri"] for item in history] == [
+        "spotify:track:test_track_2",
+        "spotify:track:test_track_1"
+    ]
+
+
+def test_init_injects_session():
+    from src.sessions import create_session
+
+    session = create_session()
+    handler = SpotifyHandler(session=session)
+
+    assert handler.session is session
+    assert handler.sp._session is session
+    assert handler.sp.auth_manager._session is session
+
+
+def test_create_playlist_remembers_user_with_token(mock_spotify_client):
+    handler = SpotifyHandler()
+    handler.sp = mock_spotify_client
+    cache_handler = mock_spotify_client.auth_manager.cache_handler
+    cache_handler.get_cached_token.return_value = {"access_token": "token"}
+
+    handler.create_playlist("Runlist", "Test Run")
+    handler.create_playlist("Runlist", "Test Run")
+
+    # Looked up once, then kept with the token for later runs
+    mock_spotify_client.current_user.assert_called_once()
+    cache_handler.save_token_to_cache.assert_called_once_with({"access_token": "token", "user_id": "test_user"})
+    assert handler.user_id == "test_user"
+
+
+def test_user_id_read_from_token(mock_spotify_client):
+    handler = SpotifyHandler()
+    handler.sp = mock_spotify_client
+    mock_spotify_client.auth_manager.cache_handler.get_cached_token.return_value = {"user_id": "runner"}
+
+    handler.create_playlist("Runlist", "Test Run")
+
+    mock_spotify_client.current_user.assert_not_called()
+    assert mock_spotify_client.user_playlist_create.call_args.kwargs["user"] == "runner"
+
+
+def test_scope_allows_play_recorder():
+    handler = SpotifyHandler()
+
+    # PlayRecorder polls current_user_playing_track
+    scopes = handler.sp.auth_manager.scope.split()
+    assert 'user-read-currently-playing' in scopes
+    assert 'user-read-recently-played' in scopes
+
+
+def test_get_activity_plays(mock_spotify_client):
+    handler = SpotifyHandler()
+    handler.sp = mock_spotify_client
+
+    now = datetime.now(timezone.utc)
+    plays = handler.get_activity_plays((now - timedelta(hours=1)).timestamp(), now.timestamp())
+
+    played_at = mock_spotify_client.current_user_recently_played.return_value["items"][0]["played_at"]
+    assert plays == [("spotify:track:test_track_1", played_at)]
+
+
+def test_get_activity_plays_merges_recorded_plays(mock_spotify_client):
+    from src.spotify.handler import _parse_played_at
+
+    play_log = MagicMock()
+    play_log.plays_between.return_value = [
+        ("spotify:track:early", "2024-05-01T07:02:00.000Z"),
+        ("spotify:track:late", "2024-05-01T07:40:00.000Z"),
+    ]
+    handler = SpotifyHandler(play_log=play_log)
+    handler.sp = mock_spotify_client
+    mock_spotify_client.current_user_recently_played.return_value = {
+        "items": [
+            # Same play as the recorded one, stamped at its end
+            {"played_at": "2024-05-01T07:43:30.000Z", "track": {"uri": "spotify:track:late"}},
+            {"played_at": "2024-05-01T07:50:00.000Z", "track": {"uri": "spotify:track:last"}},
+        ],
+        "next": None,
+    }
+    start = _parse_played_at("2024-05-01T07:00:00.000Z").timestamp()
+    end = _parse_played_at("2024-05-01T08:00:00.000Z").timestamp()
+
+    plays = handler.get_activity_plays(start, end)
+
+    play_log.plays_between.assert_called_once_with(start, end)
+    assert [uri for uri, _ in plays] == ["spotify:track:last", "spotify:track:late", "spotify:track:early"]
+
+
+def test_create_activity_playlist_adds_in_chunks(mock_spotify_client):
+    handler = SpotifyHandler()
+    handler.sp = mock_spotify_client
+    start_time = datetime.now(timezone.utc)
+    tracks = [f"spotify:track:{i}" for i in range(250)]
+
+    handler.create_activity_playlist("Long Run", start_time, start_time, tracks, name="Runlist - week 18/2024")
+
+    assert mock_spotify_client.user_playlist_create.call_args.kwargs["name"] == "Runlist - week 18/2024"
+    batches = [call.kwargs["items"] for call in mock_spotify_client.playlist_add_items.call_args_list]
+    assert [len(batch) for batch in batches] == [100, 100, 50]
+    assert sum(batches, []) == tracks
+
+
+def test_refresh_if_expiring():
+    import time
+
+    handler = SpotifyHandler()
+    handler.sp = MagicMock()
+    cache_handler = handler.sp.auth_manager.cache_handler
+    cache_handler.get_cached_token.return_value = {
+        "access_token": "token",
+        "refresh_token": "refresh",
+        "expires_at": int(time.time() + 600)
+    }
+
+    assert handler.refresh_if_expiring(60) is False
+    handler.sp.auth_manager.refresh_access_token.assert_not_called()
+
+    assert handler.refresh_if_expiring(900) is True
+    handler.sp.auth_manager.refresh_access_token.assert_called_once_with("refresh")
+
+    cache_handler.get_cached_token.return_value = None
+    assert handler.refresh_if_expiring(900) is False
+
+
+def test_update_playlist_chunks_removals_and_adds(mock_spotify_client):
+    handler = SpotifyHandler()
+    handler.sp = mock_spotify_client
+    remove = [f"spotify:track:old{i}" for i in range(150)]
+
+    handler.update_playlist("playlist", add=["spotify:track:new"], remove=remove)
+
+    calls = mock_spotify_client.playlist_remove_all_occurrences_of_items.call_args_list
+    assert [len(call.args[1]) for call in calls] == [100, 50]
+    mock_spotify_client.playlist_add_items.assert_called_once_with(
+        playlist_id="playlist", items=["spotify:track:new"]
+    )
+
+
+def test_history_covers():
+    import time
+    handler = SpotifyHandler()
+    now = time.time()
+    start, end = now - 3 * 3600, now - 2 * 3600
+
+    assert handler.history_covers(start, end) is False
+
+    handler._history_fetched_at = now
+    handler.play_history = [{"played_at": "2024-05-01T07:00:00.000Z"}]
+    assert handler.history_covers(start, end) is True
+
+    # 50 items that all postdate the start: older plays may have dropped out
+    recent = datetime.fromtimestamp(now - 600, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    handler.play_history = [{"played_at": recent}] * 50
+    assert handler.history_covers(start, end) is False
+
+    # Fetched right after the end: plays may not have shown up yet
+    handler.play_history = []
+    assert handler.history_covers(now - 3600, now - 60) is False
@@ -0,0 +1,122 @@
+from unittest.mock import MagicMock
+import pytest
+
+from src.archive import PlayArchive
+from src.spotify.recorder import PlayRecorder, recorded_plays_from_env, RECORDED_PLAYS
+from src.storage import LocalStorage
+
+# 2024-05-01T07:00:00Z
+START = 1714546800.0
+
+
+def _playing(uri, progress_ms, duration_ms=200000):
+    return {"is_playing": True, "progress_ms": progress_ms, "item": {"uri": uri, "duration_ms": duration_ms}}
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    spotify = MagicMock()
+    log = PlayArchive(LocalStorage(str(tmp_path)), name=RECORDED_PLAYS)
+    return PlayRecorder(spotify, log, batch_size=2, clock=FakeClock(START))
+
+
+def test_records_each_play_once(recorder):
+    sp = recorder.spotify.sp
+    sp.current_user_playing_track.return_value = _playing("spotify:track:a", 10000)
+    recorder.poll_once()
+    recorder.clock.now += 20
+    sp.current_user_playing_track.return_value = _playing("spotify:track:a", 30000)
+    recorder.poll_once()
+
+    plays = recorder.log.plays_between(START - 60, START + 60)
+    # Stamped with the time the track started
+    assert plays == [("spotify:track:a", "2024-05-01T06:59:50.000Z")]
+
+
+def test_repeated_track_is_a_new_play(recorder):
+    sp = recorder.spotify.sp
+    sp.current_user_playing_track.return_value = _playing("spotify:track:a", 190000)
+    recorder.poll_once()
+    recorder.clock.now += 15
+    sp.current_user_playing_track.return_value = _playing("spotify:track:a", 5000)
+    recorder.poll_once()
+
+    assert len(recorder.log.plays_between(START - 600, START + 600)) == 2
+
+
+def test_adaptive_interval(recorder):
+    sp = recorder.spotify.sp
+    # Poll again just after the track should end
+    sp.current_user_playing_track.return_value = _playing("spotify:track:a", 190000)
+    assert recorder.poll_once() == 11
+    # ...but never wait longer than the active interval
+    sp.current_user_playing_track.return_value = _playing("spotify:track:b", 0)
+    assert recorder.poll_once() == recorder.active_interval
+
+    # Back off while idle
+    sp.current_user_playing_track.return_value = None
+    assert recorder.poll_once() == 60
+    for _ in range(10):
+        recorder.poll_once()
+    # ...but not past the length of a short track
+    assert recorder.interval == recorder.max_interval == 60
+
+
+def test_idle_backoff_from_start(recorder):
+    recorder.spotify.sp.current_user_playing_track.return_value = None
+
+    assert [recorder.poll_once() for _ in range(3)] == [60, 60, 60]
+    recorder.interval = recorder.min_interval
+    assert [recorder.poll_once() for _ in range(3)] == [30, 60, 60]
+
+
+def test_plays_written_in_batches(recorder, tmp_path):
+    sp = recorder.spotify.sp
+    sp.current_user_playing_track.return_value = _playing("spotify:track:a", 0)
+    recorder.poll_once()
+    assert not (tmp_path / RECORDED_PLAYS / "manifest.json").exists()
+
+    sp.current_user_playing_track.return_value = _playing("spotify:track:b", 0)
+    recorder.poll_once()
+    assert (tmp_path / RECORDED_PLAYS / "manifest.json").exists()
+    assert recorder.pending == 0
+
+
+def test_idle_flushes_pending(recorder, tmp_path):
+    sp = recorder.spotify.sp
+    sp.current_user_playing_track.return_value = _playing("spotify:track:a", 0)
+    recorder.poll_once()
+    sp.current_user_playing_track.return_value = {"is_playing": False, "item": None}
+    recorder.poll_once()
+
+    reader = PlayArchive(LocalStorage(str(tmp_path)), name=RECORDED_PLAYS)
+    assert len(reader.plays_between(START - 60, START + 60)) == 1
+
+
+def test_background_thread_stops_and_flushes(recorder, tmp_path):
+    recorder.spotify.sp.current_user_playing_track.return_value = _playing("spotify:track:a", 0)
+    recorder.min_interval = 0.01
+    recorder.active_interval = 0.01
+
+    recorder.start()
+    recorder.stop(timeout=2)
+
+    assert recorder.polls >= 1
+    assert (tmp_path / RECORDED_PLAYS / "manifest.json").exists()
+
+
+def test_recorded_plays_from_env(tmp_path, monkeypatch):
+    monkeypatch.delenv("PLAY_RECORDER", raising=False)
+    assert recorded_plays_from_env() is None
+
+    monkeypatch.setenv("ARCHIVE_DIR", str(tmp_path))
+    log = recorded_plays_from_env(mode="local")
+    assert log.name == RECORDED_PLAYS
@@ -0,0 +1,81 @@
+import os
+from unittest.mock import patch, MagicMock
+import pytest
+
+from src.spotify.token_cache import BundleCacheHandler, StorageCacheHandler, cache_handler_from_env
+from src.state_bundle import StateConflict
+from src.storage import LocalStorage
+
+
+@pytest.fixture
+def fallback():
+    fallback = MagicMock()
+    fallback.get_cached_token.return_value = {"access_token": "seed", "expires_at": 100}
+    return fallback
+
+
+def test_storage_cache_handler(tmp_path, fallback):
+    handler = StorageCacheHandler(LocalStorage(str(tmp_path)), fallback=fallback)
+
+    # Seeded from the .cache file until a token is stored
+    assert handler.get_cached_token()["access_token"] == "seed"
+
+    handler.save_token_to_cache({"access_token": "refreshed", "expires_at": 200})
+    assert StorageCacheHandler(LocalStorage(str(tmp_path)), fallback=fallback).get_cached_token() == {
+        "access_token": "refreshed", "expires_at": 200
+    }
+
+
+def test_storage_cache_handler_reads_storage_once(fallback):
+    storage = MagicMock()
+    storage.get.return_value = b'{"access_token": "stored", "expires_at": 100}'
+    handler = StorageCacheHandler(storage, fallback=fallback)
+
+    # spotipy asks before every API call
+    for _ in range(3):
+        assert handler.get_cached_token()["access_token"] == "stored"
+    storage.get.assert_called_once()
+
+    handler.save_token_to_cache({"access_token": "refreshed", "expires_at": 200})
+    assert handler.get_cached_token()["access_token"] == "refreshed"
+    storage.get.assert_called_once()
+
+
+def test_refreshed_token_keeps_user_id(tmp_path, fallback):
+    handler = StorageCacheHandler(LocalStorage(str(tmp_path)), fallback=fallback)
+    handler.save_token_to_cache({"access_token": "first", "user_id": "runner"})
+
+    # spotipy builds a refreshed token from the token response alone
+    handler.save_token_to_cache({"access_token": "refreshed"})
+
+    assert handler.get_cached_token() == {"access_token": "refreshed", "user_id": "runner"}
+
+
+def test_bundle_cache_handler(fallback):
+    bundle = MagicMock()
+    bundle.get.return_value = None
+    handler = BundleCacheHandler(bundle, fallback=fallback)
+
+    bundle.register_merge.assert_called_once()
+    assert handler.get_cached_token()["access_token"] == "seed"
+    bundle.set.assert_called_once_with("spotify_token", fallback.get_cached_token.return_value)
+
+    # A refreshed token is persisted right away
+    handler.save_token_to_cache({"access_token": "refreshed", "expires_at": 200})
+    bundle.set.assert_called_with("spotify_token", {"access_token": "refreshed", "expires_at": 200})
+    bundle.save.assert_called_once()
+
+    bundle.save.side_effect = StateConflict("modified by another writer")
+    handler.save_token_to_cache({"access_token": "again", "expires_at": 300})
+
+
+def test_cache_handler_from_env():
+    bundle = MagicMock()
+    assert isinstance(cache_handler_from_env(use_s3=True, bundle=bundle), BundleCacheHandler)
+    assert cache_handler_from_env(use_s3=False) is None
+
+    with patch.dict(os.environ, {"S3_BUCKET": "test-bucket", "S3_PREFIX": "motivator"}), \
+         patch("boto3.client"):
+        handler = cache_handler_from_env(use_s3=True)
+    assert isinstance(handler, StorageCacheHandler)
+    assert handler.storage.bucket == "test-bucket"
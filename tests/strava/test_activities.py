@@ -1,9 +1,10 @@
+import pickle
 from datetime import datetime, timezone
 from unittest.mock import MagicMock, patch
 import pytest
 
 # Import directly (stravalib already mocked in conftest)
-from src.strava.activities import StravaActivities
+from src.strava.activities import ActivityRecord, StravaActivities
 
 
 def test_get_activities(mock_strava_client):
@@ -11,7 +12,7 @@ def test_get_activities(mock_strava_client):
     auth = MagicMock()
     auth.client = mock_strava_client
     
-    activities = StravaActivities(auth)
+    activities = StravaActivities(auth, lean=False)
     results = list(activities.get_activities(limit=1))
     
     # Verify get_activities was called
@@ -42,9 +43,139 @@ def test_get_athlete_info(mock_strava_client):
     activities = StravaActivities(auth)
     athlete = activities.get_athlete_info()
     
-    # Verify get_athlete was called
+    # Verify get_athlete was called and the profile cached
     mock_strava_client.get_athlete.assert_called_once()
+    auth.cache_athlete.assert_called_once_with(mock_strava_client.get_athlete.return_value)
     
     # Verify athlete info
     assert athlete.firstname == "Test"
     assert athlete.lastname == "User"
+
+
+def test_get_activity(mock_strava_client):
+    auth = MagicMock()
+    auth.client = mock_strava_client
+    activity = mock_strava_client.get_activities.return_value[0]
+    activity.id = 123
+    mock_strava_client.get_activity.return_value = activity
+
+    record = StravaActivities(auth).get_activity(123)
+
+    mock_strava_client.get_activity.assert_called_once_with(123)
+    name, start, start_epoch, end, end_epoch = record
+    assert name == "Test Run"
+    assert record.activity_id == 123
+    assert record.activity_type == "Run"
+    assert record.end_epoch - record.start_epoch == 3600
+
+
+def test_get_activity_not_a_run(mock_strava_client):
+    auth = MagicMock()
+    auth.client = mock_strava_client
+    activity = MagicMock()
+    activity.type.root = "Ride"
+    mock_strava_client.get_activity.return_value = activity
+
+    assert StravaActivities(auth).get_activity(123) is None
+
+
+def test_get_activity_streams(mock_strava_client):
+    from src.strava.activities import ActivityRecord
+
+    auth = MagicMock()
+    auth.client = mock_strava_client
+    mock_strava_client.get_activity_streams.return_value = {}
+    now = datetime.now(timezone.utc)
+    record = ActivityRecord("Test Run", now, now.timestamp(), now, now.timestamp(), activity_id=123)
+
+    assert StravaActivities(auth).get_activity_streams(record) is None
+    mock_strava_client.get_activity_streams.assert_called_once_with(
+        123,
+        types=["time", "moving", "heartrate", "velocity_smooth"],
+        series_type="time"
+    )
+
+
+def test_activity_record_pickles_with_attributes():
+    record = ActivityRecord("Run", None, 1.0, None, 2.0, activity_id=7, activity_type="Ride")
+    copy = pickle.loads(pickle.dumps(record))
+
+    assert copy == record
+    assert copy.activity_id == 7
+    assert copy.activity_type == "Ride"
+
+
+def _raw_activity(activity_id, activity_type="Run"):
+    return {
+        "id": activity_id,
+        "name": f"Activity {activity_id}",
+        "type": activity_type,
+        "start_date_local": "2024-05-01T07:30:00Z",
+        "elapsed_time": 1800,
+        "map": {"summary_polyline": "abc"},
+    }
+
+
+def _page_response(page):
+    response = MagicMock()
+    response.json.return_value = page
+    return response
+
+
+def test_get_activities_lean_reads_raw_pages(mock_strava_client):
+    auth = MagicMock()
+    auth.client = mock_strava_client
+    mock_strava_client.access_token = "token"
+    full_page = [_raw_activity(i, "Ride" if i % 2 else "Run") for i in range(200)]
+    auth.session.get.side_effect = [
+        _page_response(full_page),
+        _page_response([_raw_activity(200)]),
+    ]
+
+    results = StravaActivities(auth, lean=True).get_activities_lean(limit=None)
+
+    assert [record.activity_id for record in results] == list(range(0, 201, 2))
+    record = results[0]
+    assert record.start == datetime(2024, 5, 1, 7, 30)
+    assert (record.end - record.start).total_seconds() == 1800
+    assert auth.session.get.call_count == 2
+    _, kwargs = auth.session.get.call_args
+    assert kwargs["headers"] == {"Authorization": "Bearer token"}
+    mock_strava_client.get_activities.assert_not_called()
+
+
+def test_get_activities_lean_stops_at_limit(mock_strava_client):
+    auth = MagicMock()
+    auth.client = mock_strava_client
+    auth.session.get.return_value = _page_response([_raw_activity(i) for i in range(5)])
+
+    results = list(StravaActivities(auth, lean=True).get_activities(limit=3))
+
+    assert len(results) == 3
+    _, kwargs = auth.session.get.call_args
+    assert kwargs["params"]["per_page"] == 3
+
+
+def test_get_activities_falls_back_to_stravalib(mock_strava_client):
+    auth = MagicMock()
+    auth.client = mock_strava_client
+    auth.session.get.side_effect = RuntimeError("connection reset")
+
+    results = list(StravaActivities(auth, lean=True).get_activities(limit=1))
+
+    assert results[0].name == "Test Run"
+    mock_strava_client.get_activities.assert_called_once_with(limit=1)
+
+
+def test_activity_record_accepts_timedelta_elapsed_time(mock_strava_client):
+    # stravalib 1.6 models hold elapsed_time as a timedelta
+    from datetime import timedelta
+    from src.strava.activities import _activity_record
+
+    activity = MagicMock()
+    activity.start_date_local = datetime(2024, 5, 1, 7, 30)
+    activity.elapsed_time = timedelta(minutes=30)
+
+    record = _activity_record(activity)
+
+    assert record.end == datetime(2024, 5, 1, 8, 0)
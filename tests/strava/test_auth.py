@@ -2,11 +2,11 @@ import json
 import os
 import time
 from datetime import datetime
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 import pytest
 
 # Import directly (stravalib already mocked in conftest)
-from src.strava.auth import StravaAuth
+from src.strava.auth import StravaAuth, newest_token
 
 
 @pytest.fixture
@@ -143,3 +143,261 @@ def test_handle_auth_code(tmp_path):
         
         # Only verify that the environment variable was set
         assert os.environ["MY_STRAVA_CODE"] == "test_code"
+
+
+def test_refresh_token_expired(tmp_path, mock_expired_token_data):
+    token_file = tmp_path / "expired_token"
+    with open(token_file, "w") as f:
+        json.dump(mock_expired_token_data, f)
+
+    auth = StravaAuth(token_path=str(token_file))
+    auth.client.refresh_access_token.return_value = {
+        "access_token": "refreshed_access_token",
+        "refresh_token": "refreshed_refresh_token",
+        "expires_at": int(time.time() + 3600)
+    }
+    auth._check_token()
+
+    auth.client.refresh_access_token.assert_called_once_with(
+        client_id=auth.client_id,
+        client_secret=auth.client_secret,
+        refresh_token="mock_refresh_token"
+    )
+    with open(token_file, "r") as f:
+        assert json.load(f)["access_token"] == "refreshed_access_token"
+    # Lease is released after the refresh
+    assert not (tmp_path / "expired_token.lock").exists()
+
+
+def test_refresh_token_single_flight(tmp_path, mock_expired_token_data):
+    import threading
+
+    token_file = tmp_path / "expired_token"
+    with open(token_file, "w") as f:
+        json.dump(mock_expired_token_data, f)
+
+    refresh_calls = []
+    start = threading.Barrier(4)
+
+    def slow_refresh(**kwargs):
+        refresh_calls.append(kwargs)
+        time.sleep(0.05)
+        return {
+            "access_token": f"refreshed_{len(refresh_calls)}",
+            "refresh_token": "rotated_refresh_token",
+            "expires_at": int(time.time() + 3600)
+        }
+
+    auths = []
+    for _ in range(4):
+        auth = StravaAuth(token_path=str(token_file))
+        auth.client.refresh_access_token.side_effect = slow_refresh
+        auths.append(auth)
+
+    def run(auth):
+        start.wait()
+        auth._check_token()
+
+    threads = [threading.Thread(target=run, args=(auth,)) for auth in auths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Only one caller refreshed; everyone else reused its result
+    assert len(refresh_calls) == 1
+    assert all(auth.client.access_token == "refreshed_1" for auth in auths)
+
+
+def test_refresh_token_reuses_token_refreshed_elsewhere(tmp_path, mock_expired_token_data, mock_token_data):
+    token_file = tmp_path / "expired_token"
+    with open(token_file, "w") as f:
+        json.dump(mock_expired_token_data, f)
+
+    auth = StravaAuth(token_path=str(token_file))
+
+    # Another process refreshes while we wait for the lease
+    with open(token_file, "w") as f:
+        json.dump(mock_token_data, f)
+    auth._refresh_token()
+
+    auth.client.refresh_access_token.assert_not_called()
+    assert auth.client.access_token == "mock_access_token"
+
+
+def test_refresh_lease_uses_s3(mock_s3_client, mock_env_vars):
+    os.environ["S3_BUCKET"] = "test-bucket"
+    auth = StravaAuth(use_s3=True)
+
+    lease = auth._refresh_lease()
+
+    assert lease.bucket == "test-bucket"
+    assert lease.key == "motivator/access_token.lock"
+
+
+def test_init_uses_shared_session():
+    from src.sessions import get_shared_session
+
+    auth = StravaAuth()
+    assert auth.session is get_shared_session()
+
+    session = MagicMock()
+    auth = StravaAuth(session=session)
+    assert auth.session is session
+
+
+def test_handle_auth_code_caches_athlete(tmp_path, mock_strava_client):
+    token_file = tmp_path / "new_token"
+    auth = StravaAuth(token_path=str(token_file))
+    auth.client = mock_strava_client
+    mock_strava_client.get_athlete.return_value.id = 42
+
+    auth._handle_auth_code("test_code")
+
+    with open(token_file, "r") as f:
+        saved = json.load(f)
+    assert saved["access_token"] == "new_access_token"
+    assert saved["athlete"]["id"] == 42
+    assert saved["athlete"]["firstname"] == "Test"
+    assert auth.get_cached_athlete()["lastname"] == "User"
+
+
+def test_refresh_keeps_cached_athlete(tmp_path, mock_expired_token_data):
+    token_file = tmp_path / "expired_token"
+    athlete = {"id": 42, "firstname": "Test", "lastname": "User", "fetched_at": time.time()}
+    with open(token_file, "w") as f:
+        json.dump(dict(mock_expired_token_data, athlete=athlete), f)
+
+    auth = StravaAuth(token_path=str(token_file))
+    auth.client.refresh_access_token.return_value = {
+        "access_token": "refreshed_access_token",
+        "refresh_token": "refreshed_refresh_token",
+        "expires_at": int(time.time() + 3600)
+    }
+    auth.athlete = athlete
+    auth._check_token()
+
+    with open(token_file, "r") as f:
+        assert json.load(f)["athlete"] == athlete
+
+
+def test_get_cached_athlete_expires(mock_token_file):
+    from src.strava.auth import ATHLETE_TTL
+
+    auth = StravaAuth(token_path=str(mock_token_file))
+    assert auth.get_cached_athlete() is None
+
+    auth.athlete = {"id": 42, "firstname": "Test", "lastname": "User", "fetched_at": time.time()}
+    assert auth.get_cached_athlete() == auth.athlete
+
+    auth.athlete["fetched_at"] = time.time() - ATHLETE_TTL - 1
+    assert auth.get_cached_athlete() is None
+
+
+def test_cache_athlete_saves_with_token(mock_token_file, mock_strava_client):
+    auth = StravaAuth(token_path=str(mock_token_file))
+    auth.authenticate()
+    mock_strava_client.get_athlete.return_value.id = 42
+
+    auth.cache_athlete(mock_strava_client.get_athlete.return_value)
+
+    with open(mock_token_file, "r") as f:
+        saved = json.load(f)
+    assert saved["athlete"]["firstname"] == "Test"
+    assert saved["access_token"] == "mock_access_token"
+
+
+def test_token_in_state_bundle(mock_token_data):
+    bundle = MagicMock()
+    bundle.loaded = True
+    bundle.get.return_value = mock_token_data
+    auth = StravaAuth(use_s3=True, bundle=bundle)
+
+    auth.authenticate()
+
+    assert auth.client.access_token == "mock_access_token"
+    bundle.get.assert_called_with("token")
+    bundle.set.assert_called_with("token", mock_token_data)
+    bundle.save.assert_not_called()
+
+
+def test_token_migrated_into_state_bundle(mock_s3_client, mock_env_vars):
+    os.environ["S3_BUCKET"] = "test-bucket"
+    bundle = MagicMock()
+    bundle.loaded = False
+    bundle.get.return_value = None
+    auth = StravaAuth(use_s3=True, bundle=bundle)
+
+    token = auth._load_token()
+
+    bundle.load.assert_called_once()
+    assert token["access_token"] == "mock_s3_access_token"
+    bundle.set.assert_called_once_with("token", token)
+
+
+def test_refresh_saves_state_bundle_immediately(mock_expired_token_data, mock_s3_client, mock_env_vars):
+    os.environ["S3_BUCKET"] = "test-bucket"
+    bundle = MagicMock()
+    bundle.loaded = True
+    bundle.get.return_value = mock_expired_token_data
+    auth = StravaAuth(use_s3=True, bundle=bundle)
+    auth.client.refresh_access_token.return_value = {
+        "access_token": "refreshed_access_token",
+        "refresh_token": "refreshed_refresh_token",
+        "expires_at": int(time.time() + 3600)
+    }
+
+    auth._check_token()
+
+    # The newest stored token is fetched even if the bundle has pending changes
+    bundle.load_section.assert_called_once_with("token")
+    bundle.save.assert_called_once()
+
+
+def test_s3_client_reused(mock_s3_client, mock_token_data, mock_env_vars):
+    os.environ["S3_BUCKET"] = "test-bucket"
+    with patch("boto3.client") as mock_client:
+        auth = StravaAuth(use_s3=True)
+        auth._save_token_to_s3(mock_token_data)
+        auth._save_token_to_s3(mock_token_data)
+
+    mock_client.assert_called_once_with("s3", config=ANY)
+
+
+def test_refresh_if_expiring(tmp_path):
+    # Valid for 10 more minutes: inside a 15 minute window
+    token = {
+        "access_token": "soon_expiring",
+        "refresh_token": "mock_refresh_token",
+        "expires_at": int(time.time() + 600)
+    }
+    token_file = tmp_path / "access_token"
+    with open(token_file, "w") as f:
+        json.dump(token, f)
+
+    auth = StravaAuth(token_path=str(token_file))
+    auth.authenticate()
+    auth.client.refresh_access_token.return_value = {
+        "access_token": "refreshed_access_token",
+        "refresh_token": "refreshed_refresh_token",
+        "expires_at": int(time.time() + 21600)
+    }
+
+    assert auth.refresh_if_expiring(60) is False
+    auth.client.refresh_access_token.assert_not_called()
+
+    assert auth.refresh_if_expiring(900) is True
+    auth.client.refresh_access_token.assert_called_once()
+    assert auth.expires_in() > 21000
+    with open(token_file, "r") as f:
+        assert json.load(f)["access_token"] == "refreshed_access_token"
+
+
+def test_newest_token():
+    old = {"access_token": "old", "expires_at": 100}
+    new = {"access_token": "new", "expires_at": 200}
+
+    assert newest_token(None, old, new) == new
+    assert newest_token(None, new, old) == new
+    assert newest_token(old, None, old) == old
+    assert newest_token(None, None, None) is None
@@ -0,0 +1,111 @@
+import time
+from unittest.mock import MagicMock
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from src.strava.streams import ActivityStreams, align_plays, parse_played_at
+
+START = 1700000000.0
+
+
+def _played_at(epoch):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(epoch))
+
+
+@pytest.fixture
+def streams():
+    # 0-100s moving, 101-200s stopped at the cafe, 201-300s moving again
+    seconds = np.arange(301)
+    moving = (seconds <= 100) | (seconds > 200)
+    heartrate = np.full(301, 150.0)
+    velocity = np.where(moving, 4.0, 0.0)
+    return ActivityStreams(START, seconds, moving, heartrate, velocity)
+
+
+def test_moving_intervals(streams):
+    starts, ends = streams.moving_intervals()
+
+    assert list(starts - START) == [0, 201]
+    assert list(ends - START) == [100, 300]
+
+
+def test_align_drops_paused_plays(streams):
+    plays = START + np.array([-10, 50, 150, 250, 400])
+
+    aligned = streams.align(plays)
+
+    assert list(aligned["moving"]) == [False, True, False, True, False]
+    assert aligned["pace"][1] == pytest.approx(250.0)
+    assert np.isnan(aligned["pace"][2])
+    assert aligned["heartrate"][3] == 150.0
+
+
+def test_align_without_effort_streams():
+    streams = ActivityStreams(START, [0, 1, 2], [True, True, True])
+
+    aligned = streams.align([START + 1])
+
+    assert list(aligned["moving"]) == [True]
+    assert np.isnan(aligned["heartrate"][0])
+    assert np.isnan(aligned["pace"][0])
+
+
+def test_align_never_moving():
+    streams = ActivityStreams(START, [0, 1, 2], [False, False, False])
+
+    assert list(streams.align([START + 1])["moving"]) == [False]
+
+
+def test_parse_played_at():
+    epochs = parse_played_at(["2023-11-14T22:13:20.500Z", "2023-11-14T22:13:21Z"])
+
+    assert list(epochs) == [1700000000.5, 1700000001.0]
+
+
+def test_align_plays(streams):
+    plays = [("spotify:track:a", _played_at(START + 50)), ("spotify:track:b", _played_at(START + 150))]
+
+    aligned = align_plays(streams, plays)
+
+    assert [play["uri"] for play in aligned if play["moving"]] == ["spotify:track:a"]
+    assert aligned[0]["heartrate"] == 150.0
+    assert aligned[1]["pace"] is None
+    assert align_plays(streams, []) == []
+
+
+def test_from_stravalib():
+    def stream(data):
+        return MagicMock(data=data)
+
+    streams = ActivityStreams.from_stravalib(START, {
+        "time": stream([0, 1]),
+        "moving": stream([True, False]),
+    })
+    assert streams.heartrate is None
+    assert ActivityStreams.from_stravalib(START, {"heartrate": stream([1])}) is None
+
+
+def test_align_long_activity_is_fast():
+    # 10 hours at 1 Hz with a pause every 10 minutes
+    seconds = np.arange(36000)
+    moving = (seconds % 600) < 540
+    streams = ActivityStreams(START, seconds, moving, np.full(36000, 150.0), np.full(36000, 3.0))
+    plays = START + np.sort(np.random.default_rng(0).uniform(0, 36000, 20000))
+
+    began = time.perf_counter()
+    aligned = streams.align(plays)
+    elapsed = time.perf_counter() - began
+
+    expected = ((plays - START) % 600) <= 539
+    assert (aligned["moving"] == expected).all()
+    assert elapsed < 0.5
+
+
+def test_from_intervals():
+    streams = ActivityStreams.from_intervals(1000.0, [(1000.0, 1600.0), (1700.0, 2000.0)])
+
+    starts, ends = streams.moving_intervals()
+    assert list(starts) == [1000.0, 1700.0]
+    assert list(ends) == [1600.0, 2000.0]
+    assert list(streams.align([1500.0, 1650.0, 1800.0])["moving"]) == [True, False, True]
@@ -0,0 +1,208 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+import pytest
+
+from src.archive import (
+    PartitionedArchive, PlayArchive, archives_from_env, partition_bounds, partition_of, COMPACT_THRESHOLD
+)
+from src.storage import LocalStorage, WriteConflict
+
+
+def _play(played_at, uri):
+    return {"played_at": played_at, "track": {"uri": uri}}
+
+
+def _epoch(value):
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+class CountingStorage(LocalStorage):
+    def __init__(self, root):
+        super().__init__(root)
+        self.gets = []
+
+    def get(self, key):
+        self.gets.append(key)
+        return super().get(key)
+
+
+class RacingStorage(LocalStorage):
+    """Runs another writer right after the next manifest read"""
+
+    def __init__(self, root, race):
+        super().__init__(root)
+        self.race = race
+
+    def get_versioned(self, key):
+        result = super().get_versioned(key)
+        race, self.race = self.race, None
+        if race is not None:
+            race()
+        return result
+
+
+def test_partition_names_and_bounds():
+    epoch = _epoch("2024-02-29T23:30:00")
+
+    assert partition_of(epoch, "day") == "2024-02-29"
+    assert partition_of(epoch, "month") == "2024-02"
+    assert partition_bounds("2024-02", "month") == (_epoch("2024-02-01T00:00:00"), _epoch("2024-03-01T00:00:00"))
+    assert partition_bounds("2024-12-31", "day")[1] == _epoch("2025-01-01T00:00:00")
+
+
+def test_flush_writes_one_object_per_partition(tmp_path):
+    archive = PlayArchive(LocalStorage(str(tmp_path)))
+    archive.add_plays([
+        _play("2024-05-01T07:10:00.000Z", "spotify:track:a"),
+        _play("2024-05-01T07:20:00.000Z", "spotify:track:b"),
+        _play("2024-05-02T07:10:00.000Z", "spotify:track:c"),
+    ])
+
+    assert archive.flush() == 2
+    assert sorted(archive.manifest["partitions"]) == ["2024-05-01", "2024-05-02"]
+    assert len(list((tmp_path / "plays" / "2024-05-01").glob("part-*.jsonl.gz"))) == 1
+    assert archive.flush() == 0
+
+
+def test_window_lookup_reads_only_overlapping_partitions(tmp_path):
+    archive = PlayArchive(LocalStorage(str(tmp_path)))
+    archive.add_plays([_play(f"2024-05-{day:02d}T07:10:00.000Z", f"spotify:track:{day}") for day in range(1, 29)])
+    archive.flush()
+
+    storage = CountingStorage(str(tmp_path))
+    reader = PlayArchive(storage)
+    plays = reader.plays_between(_epoch("2024-05-10T07:00:00"), _epoch("2024-05-10T08:00:00"))
+
+    assert plays == [("spotify:track:10", "2024-05-10T07:10:00.000Z")]
+    assert storage.gets == ["plays/manifest.json", storage.gets[1]]
+    assert storage.gets[1].startswith("plays/2024-05-10/")
+
+
+def test_add_plays_skips_already_archived(tmp_path):
+    archive = PlayArchive(LocalStorage(str(tmp_path)))
+    archive.add_plays([_play("2024-05-01T07:10:00.000Z", "spotify:track:a")])
+    archive.flush()
+
+    reopened = PlayArchive(LocalStorage(str(tmp_path)))
+    added = reopened.add_plays([
+        _play("2024-05-01T07:10:00.000Z", "spotify:track:a"),
+        _play("2024-05-01T07:20:00.000Z", "spotify:track:b"),
+    ])
+
+    assert added == 1
+    # Pending plays are visible before the flush
+    assert [uri for uri, _ in reopened.plays_between(0, _epoch("2024-06-01T00:00:00"))] == [
+        "spotify:track:b", "spotify:track:a"
+    ]
+
+
+def test_compaction_merges_small_objects(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    archive = PlayArchive(storage)
+    for minute in range(COMPACT_THRESHOLD + 1):
+        archive.add_plays([_play(f"2024-05-01T07:{minute:02d}:00.000Z", f"spotify:track:{minute}")])
+        archive.flush()
+
+    objects = archive.manifest["partitions"]["2024-05-01"]
+    assert len(objects) == 1
+    assert objects[0]["count"] == COMPACT_THRESHOLD + 1
+    assert len(list((tmp_path / "plays" / "2024-05-01").glob("part-*"))) == 1
+    assert len(archive.plays_between(0, _epoch("2024-06-01T00:00:00"))) == COMPACT_THRESHOLD + 1
+
+
+def test_results_archive_by_month(tmp_path):
+    archive = PartitionedArchive(LocalStorage(str(tmp_path)), "results", "start_time", granularity="month")
+    archive.append([
+        {"activity_id": 1, "start_time": "2024-04-30T07:00:00+00:00"},
+        {"activity_id": 2, "start_time": "2024-05-01T07:00:00+00:00"},
+    ])
+    archive.flush()
+
+    results = archive.query(_epoch("2024-05-01T00:00:00"), _epoch("2024-06-01T00:00:00"))
+    assert [result["activity_id"] for result in results] == [2]
+
+
+def test_granularity_mismatch(tmp_path):
+    archive = PlayArchive(LocalStorage(str(tmp_path)), granularity="day")
+    archive.add_plays([_play("2024-05-01T07:10:00.000Z", "spotify:track:a")])
+    archive.flush()
+
+    with pytest.raises(ValueError):
+        PlayArchive(LocalStorage(str(tmp_path)), granularity="month").manifest
+    with pytest.raises(ValueError):
+        PlayArchive(LocalStorage(str(tmp_path)), granularity="year")
+
+
+def test_archives_from_env(tmp_path):
+    with patch.dict("os.environ", {}, clear=True):
+        assert archives_from_env() == (None, None)
+
+    with patch.dict("os.environ", {"ARCHIVE": "local", "ARCHIVE_DIR": str(tmp_path), "ARCHIVE_GRANULARITY": "month"}):
+        plays, results = archives_from_env()
+    assert isinstance(plays, PlayArchive)
+    assert results.name == "results"
+    assert results.granularity == "month"
+
+
+def test_flush_keeps_objects_written_by_another_process(tmp_path):
+    ours = PlayArchive(LocalStorage(str(tmp_path)))
+    theirs = PlayArchive(LocalStorage(str(tmp_path)))
+    # Both read the (empty) manifest before either flushes
+    ours.add_plays([_play("2024-05-01T07:00:00.000Z", "spotify:track:a")])
+    theirs.add_plays([_play("2024-05-02T07:00:00.000Z", "spotify:track:b")])
+
+    theirs.flush()
+    ours.flush()
+
+    reader = PlayArchive(LocalStorage(str(tmp_path)))
+    assert [uri for uri, _ in reader.plays_between(0, _epoch("2024-06-01T00:00:00"))] == [
+        "spotify:track:b", "spotify:track:a"
+    ]
+    assert reader.manifest["latest"] == _epoch("2024-05-02T07:00:00")
+
+
+def test_concurrent_flush_retries_on_manifest_conflict(tmp_path):
+    theirs = PlayArchive(LocalStorage(str(tmp_path)))
+    theirs.add_plays([_play("2024-05-02T07:00:00.000Z", "spotify:track:b")])
+    ours = PlayArchive(RacingStorage(str(tmp_path), race=theirs.flush))
+    ours.add_plays([_play("2024-05-01T07:00:00.000Z", "spotify:track:a")])
+
+    # Their manifest lands between our read and our write
+    ours.flush()
+
+    reader = PlayArchive(LocalStorage(str(tmp_path)))
+    assert [uri for uri, _ in reader.plays_between(0, _epoch("2024-06-01T00:00:00"))] == [
+        "spotify:track:b", "spotify:track:a"
+    ]
+
+
+def test_concurrent_compaction_keeps_every_record(tmp_path):
+    seed = PlayArchive(LocalStorage(str(tmp_path)))
+    for minute in range(COMPACT_THRESHOLD):
+        seed.add_plays([_play(f"2024-05-01T07:{minute:02d}:00.000Z", f"spotify:track:{minute}")])
+        seed.flush()
+
+    # Both writers compact the same partition; theirs wins the manifest
+    theirs = PlayArchive(LocalStorage(str(tmp_path)))
+    theirs.add_plays([_play("2024-05-01T08:00:00.000Z", "spotify:track:theirs")])
+    ours = PlayArchive(RacingStorage(str(tmp_path), race=theirs.flush))
+    ours.add_plays([_play("2024-05-01T09:00:00.000Z", "spotify:track:ours")])
+    ours.flush()
+
+    reader = PlayArchive(LocalStorage(str(tmp_path)))
+    uris = [uri for uri, _ in reader.plays_between(0, _epoch("2024-06-01T00:00:00"))]
+    assert len(uris) == COMPACT_THRESHOLD + 2
+    # Every listed object exists, and nothing unlisted is left behind
+    listed = {entry["key"].split("/")[-1] for entry in reader.manifest["partitions"]["2024-05-01"]}
+    assert {path.name for path in (tmp_path / "plays" / "2024-05-01").glob("part-*")} == listed
+
+
+def test_flush_keeps_records_when_every_attempt_conflicts(tmp_path):
+    archive = PlayArchive(LocalStorage(str(tmp_path)))
+    archive.add_plays([_play("2024-05-01T07:00:00.000Z", "spotify:track:a")])
+
+    with patch.object(LocalStorage, "put_if", side_effect=WriteConflict("modified")):
+        with pytest.raises(WriteConflict):
+            archive.flush()
+    assert archive.flush() == 1
+    assert len(PlayArchive(LocalStorage(str(tmp_path))).plays_between(0, _epoch("2024-06-01T00:00:00"))) == 1
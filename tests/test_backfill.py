@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+from src import backfill as backfill_module
+from src.backfill import RateBudget, ShardJob, backfill, fetch_shard, merge_shards, shard_ranges
+from src.store import StateStore
+from src.strava.activities import ActivityRecord
+
+DAY = 24 * 3600
+START = datetime(2020, 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+def _activity(activity_id, start_epoch, activity_type='Run'):
+    activity = MagicMock()
+    activity.id = activity_id
+    activity.name = f"Activity {activity_id}"
+    activity.type.root = activity_type
+    activity.start_date_local = datetime.fromtimestamp(start_epoch, tz=timezone.utc)
+    activity.elapsed_time = 1800
+    return activity
+
+
+def _fake_client(activities):
+    client = MagicMock()
+
+    def get_activities(after, before):
+        return [a for a in activities if after <= a.start_date_local < before]
+
+    client.get_activities.side_effect = get_activities
+    return client
+
+
+def test_shard_ranges_cover_the_range():
+    ranges = shard_ranges(0, 100, 4)
+
+    assert ranges == [(0, 25), (25, 50), (50, 75), (75, 100)]
+
+
+def test_rate_budget_waits_for_next_window(tmp_path):
+    now = [1000.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    budget = RateBudget(str(tmp_path / "budget.json"), limits=((2, 100),), clock=lambda: now[0], sleep=sleep)
+    budget.acquire()
+    budget.acquire()
+    budget.acquire()
+
+    assert slept == [100.0]
+    assert budget.used() == {100: 1}
+
+
+def test_rate_budget_is_shared_through_the_file(tmp_path):
+    path = str(tmp_path / "budget.json")
+    first = RateBudget(path, limits=((3, 100),), clock=lambda: 50.0)
+    second = RateBudget(path, limits=((3, 100),), clock=lambda: 50.0)
+
+    first.acquire(2)
+
+    assert second.used() == {100: 2}
+    assert second._try_take(2) == 50.0
+
+
+def test_fetch_shard_counts_pages(tmp_path):
+    activities = [_activity(i, START + i) for i in range(5)] + [_activity(99, START + 6, 'Ride')]
+    job = ShardJob(0, START, START + DAY, "token", str(tmp_path / "budget.json"), ('Run',))
+
+    with patch.object(backfill_module, "PAGE_SIZE", 2):
+        index, records, pages = fetch_shard(job, client=_fake_client(activities))
+
+    assert index == 0
+    assert [record.activity_id for record in records] == [0, 1, 2, 3, 4]
+    # Pages of 2, 2, 2 (the ride), plus the empty page that ends the listing
+    assert pages == 4
+    assert RateBudget(job.budget_path).used()[900] == 4
+
+
+def test_merge_shards_is_deterministic():
+    a = ActivityRecord("a", None, START + 10, None, START + 20, activity_id=1)
+    b = ActivityRecord("b", None, START + 5, None, START + 8, activity_id=2)
+
+    merged = merge_shards([(1, [a], 1), (0, [b, a], 1)])
+
+    assert [record.activity_id for record in merged] == [2, 1]
+
+
+def test_backfill_merges_shards_into_store(tmp_path):
+    activities = [_activity(i, START + i * DAY) for i in range(10)]
+    client = _fake_client(activities)
+    store = StateStore(str(tmp_path / "state.db"))
+
+    with patch.object(backfill_module, "Client", return_value=client):
+        report = backfill(
+            "token", store, START, START + 10 * DAY,
+            workers=3, shards=5,
+            budget_path=str(tmp_path / "budget.json"),
+            executor_factory=ThreadPoolExecutor
+        )
+
+    assert report["shards"] == 5
+    assert report["failed_shards"] == []
+    assert report["activities"] == 10
+    assert report["stored"] == 10
+    rows = store.activities_between(START, START + 10 * DAY)
+    assert [row[0] for row in rows] == list(range(10))
+
+
+def test_backfill_reports_failed_shards(tmp_path):
+    activities = [_activity(i, START + i * DAY) for i in range(4)]
+    client = _fake_client(activities)
+    get_activities = client.get_activities.side_effect
+
+    def flaky(after, before):
+        if after <= datetime.fromtimestamp(START, tz=timezone.utc) < before:
+            raise RuntimeError("boom")
+        return get_activities(after, before)
+
+    client.get_activities.side_effect = flaky
+    store = StateStore(str(tmp_path / "state.db"))
+
+    with patch.object(backfill_module, "Client", return_value=client):
+        report = backfill(
+            "token", store, START, START + 4 * DAY,
+            workers=2, shards=2,
+            budget_path=str(tmp_path / "budget.json"),
+            executor_factory=ThreadPoolExecutor
+        )
+
+    assert report["failed_shards"] == [0]
+    assert report["stored"] == 2
+
+
+def test_main_plan_calls_no_api(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+
+    with patch("src.backfill.store_from_env", return_value=store), \
+         patch("src.backfill.StravaAuth") as mock_auth, \
+         patch("src.backfill.backfill") as mock_backfill:
+        plan = backfill_module.main(["--since", "2020-01-01", "--until", "2020-02-01", "--shards", "4", "--plan"])
+
+    assert plan['pages'] == 4
+    mock_auth.assert_not_called()
+    mock_backfill.assert_not_called()
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+from unittest.mock import patch, MagicMock
+import pytest
+
+from src.batch import InMemoryQueue, parse_activity_id, process_batch
+
+
+@pytest.fixture
+def mock_process_activity_id():
+    with patch("src.batch.process_activity_id") as mock_process:
+        def process(activity_id, **kwargs):
+            if activity_id == 666:
+                raise RuntimeError("Strava error")
+            return {"activity_name": f"Run {activity_id}", "track_count": 1}
+        mock_process.side_effect = process
+        yield mock_process
+
+
+def _record(message_id, body):
+    return {"messageId": message_id, "body": json.dumps(body)}
+
+
+def test_parse_activity_id():
+    assert parse_activity_id(_record("1", 123)) == 123
+    assert parse_activity_id(_record("1", {"activity_id": 456})) == 456
+    assert parse_activity_id(_record("1", {"object_id": 789, "aspect_type": "create"})) == 789
+
+
+def test_process_batch_reports_partial_failures(mock_process_activity_id):
+    records = [
+        _record("a", 1),
+        _record("b", 666),
+        _record("c", {"activity_id": 3}),
+        {"messageId": "d", "body": "not an id"},
+    ]
+
+    response = process_batch(records, context=MagicMock())
+
+    assert response["batchItemFailures"] == [{"itemIdentifier": "b"}, {"itemIdentifier": "d"}]
+    assert [result["activity_name"] for result in response["results"]] == ["Run 1", "Run 3"]
+
+
+def test_process_batch_runs_concurrently():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def slow_process(activity_id, **kwargs):
+        with lock:
+            active.append(activity_id)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(activity_id)
+        return {}
+
+    with patch("src.batch.process_activity_id", side_effect=slow_process):
+        process_batch([_record(str(i), i) for i in range(4)], context=MagicMock(), max_workers=4)
+
+    assert max(peak) > 1
+
+
+def test_process_batch_authenticates_once(mock_process_activity_id):
+    context = MagicMock()
+
+    process_batch([_record("a", 1), _record("b", 2)], context=context)
+
+    context.ensure.assert_called_once()
+
+
+def test_process_batch_dedupes_activity_ids(mock_process_activity_id):
+    records = [_record("a", 1), _record("b", {"activity_id": 1, "fresh": True}), _record("c", 2)]
+
+    response = process_batch(records, context=MagicMock())
+
+    assert sorted(call.args[0] for call in mock_process_activity_id.call_args_list) == [1, 2]
+    assert mock_process_activity_id.call_args_list[0].kwargs["fresh"] is True
+    assert len(response["results"]) == 2
+    assert response["batchItemFailures"] == []
+
+
+def test_process_batch_duplicates_fail_together(mock_process_activity_id):
+    records = [_record("a", 666), _record("b", 666)]
+
+    response = process_batch(records, context=MagicMock())
+
+    mock_process_activity_id.assert_called_once()
+    assert response["batchItemFailures"] == [{"itemIdentifier": "a"}, {"itemIdentifier": "b"}]
+
+
+def test_process_batch_save_failure_keeps_records(mock_process_activity_id):
+    context = MagicMock()
+    context.save_state.side_effect = Exception("S3 unavailable")
+
+    response = process_batch([_record("a", 1), _record("b", 2)], context=context)
+
+    assert response["batchItemFailures"] == []
+    assert response["save_error"] == "S3 unavailable"
+
+
+def test_process_batch_starts_deadline(mock_process_activity_id):
+    from src.deadline import Deadline, get_request_guard
+
+    deadline = Deadline(30, reserve=0)
+    process_batch([_record("a", 1)], context=MagicMock(), deadline=deadline)
+
+    assert get_request_guard().deadline is deadline
+    get_request_guard().start(None)
+
+
+def test_process_batch_empty():
+    assert process_batch([]) == {"batchItemFailures": [], "results": []}
+
+
+def test_in_memory_queue_retries_only_failures(mock_process_activity_id):
+    queue = InMemoryQueue()
+    for activity_id in (1, 2, 666, 4):
+        queue.send(activity_id)
+
+    dead_letters = queue.drain(lambda event: process_batch(event["Records"], context=MagicMock()), max_messages=10)
+
+    assert dead_letters == ["666"]
+    assert len(queue) == 0
+    processed = [call.args[0] for call in mock_process_activity_id.call_args_list]
+    # Successful records are processed once; the failing one is retried
+    assert sorted(processed) == [1, 2, 4, 666, 666, 666]
+
+
+def test_in_memory_queue_batches():
+    queue = InMemoryQueue()
+    for activity_id in range(5):
+        queue.send({"activity_id": activity_id})
+
+    event = queue.receive(max_messages=3)
+
+    assert len(event["Records"]) == 3
+    assert len(queue) == 5
+    queue.acknowledge(event, {"batchItemFailures": []})
+    assert len(queue) == 2
+
+
+def test_process_batch_syncs_top_tracks_once(mock_process_activity_id):
+    context = MagicMock()
+
+    process_batch([_record("a", 1), _record("b", 2)], context=context)
+
+    context.top_tracks.sync.assert_called_once_with(context.spotify)
+    context.save_state.assert_called_once()
@@ -0,0 +1,218 @@
+import time
+from unittest.mock import patch, MagicMock, ANY
+
+import requests
+import pytest
+
+from src.context import AppContext
+
+
+@pytest.fixture
+def mock_clients():
+    with patch("src.context.StravaAuth") as mock_auth, \
+         patch("src.context.StravaActivities") as mock_activities, \
+         patch("src.context.SpotifyHandler") as mock_spotify, \
+         patch("src.context.cache_handler_from_env"):
+        mock_auth.return_value.client.token_expires_at = time.time() + 3600
+        yield mock_auth, mock_activities, mock_spotify
+
+
+def test_cold_start_initializes_clients(mock_clients):
+    mock_auth, mock_activities, mock_spotify = mock_clients
+    context = AppContext(use_s3=True)
+
+    assert context.is_valid() is False
+    context.ensure()
+
+    mock_auth.assert_called_once_with(use_s3=True, session=context.session, bundle=None)
+    mock_auth.return_value.authenticate.assert_called_once()
+    mock_activities.assert_called_once_with(mock_auth.return_value)
+    mock_spotify.assert_called_once_with(session=context.session, play_log=None, cache_handler=ANY)
+    assert isinstance(context.session, requests.Session)
+    assert context.is_valid() is True
+
+
+def test_warm_start_reuses_clients(mock_clients):
+    mock_auth, mock_activities, mock_spotify = mock_clients
+    context = AppContext()
+
+    context.ensure()
+    spotify = context.spotify
+    context.ensure()
+    context.ensure()
+
+    # Nothing is rebuilt or re-authenticated on warm runs
+    assert mock_auth.call_count == 1
+    assert mock_auth.return_value.authenticate.call_count == 1
+    assert mock_spotify.call_count == 1
+    assert context.spotify is spotify
+    assert context.invocations == 3
+
+
+def test_warm_start_reauthenticates_expiring_token(mock_clients):
+    mock_auth, _, _ = mock_clients
+    context = AppContext(token_margin=300)
+
+    context.ensure()
+    mock_auth.return_value.client.token_expires_at = time.time() + 60
+    context.ensure()
+
+    assert mock_auth.call_count == 1
+    assert mock_auth.return_value.authenticate.call_count == 2
+
+
+def test_get_athlete_uses_cached_profile(mock_clients):
+    mock_auth, mock_activities, _ = mock_clients
+    profile = {"id": 1, "firstname": "Test", "lastname": "User"}
+    mock_auth.return_value.get_cached_athlete.return_value = profile
+    context = AppContext().ensure()
+
+    assert context.get_athlete() == profile
+    assert context.get_athlete(fetch=True) == profile
+
+    mock_activities.return_value.get_athlete_info.assert_not_called()
+
+
+def test_get_athlete_fetch_when_missing(mock_clients):
+    mock_auth, mock_activities, _ = mock_clients
+    mock_auth.return_value.get_cached_athlete.return_value = None
+    context = AppContext().ensure()
+
+    assert context.get_athlete() is None
+    mock_activities.return_value.get_athlete_info.assert_not_called()
+
+    context.get_athlete(fetch=True)
+    mock_activities.return_value.get_athlete_info.assert_called_once()
+
+
+def test_cache_missing_athlete_fetches_once(mock_clients):
+    mock_auth, mock_activities, _ = mock_clients
+    mock_auth.return_value.get_cached_athlete.return_value = None
+    mock_activities.return_value.get_athlete_info.side_effect = Exception("Strava down")
+    context = AppContext().ensure()
+
+    context.cache_missing_athlete()
+    context.cache_missing_athlete()
+
+    mock_activities.return_value.get_athlete_info.assert_called_once()
+
+
+def test_cache_missing_athlete_skips_cached_profile(mock_clients):
+    mock_auth, mock_activities, _ = mock_clients
+    mock_auth.return_value.get_cached_athlete.return_value = {"id": 1, "firstname": "Test", "lastname": "User"}
+    context = AppContext().ensure()
+
+    context.cache_missing_athlete()
+
+    mock_activities.return_value.get_athlete_info.assert_not_called()
+
+
+def test_reset(mock_clients):
+    context = AppContext(use_s3=True).ensure()
+    context.secrets_loaded = True
+
+    context.reset()
+
+    assert context.initialized is False
+    assert context.secrets_loaded is False
+    assert context.use_s3 is True
+
+
+def test_save_state(mock_clients):
+    context = AppContext().ensure()
+    context.store = MagicMock()
+    context.bundle = MagicMock()
+
+    context.save_state()
+
+    context.store.save.assert_called_once()
+    context.bundle.save.assert_called_once()
+
+
+def test_save_state_conflict_does_not_fail_run(mock_clients):
+    from src.state_bundle import StateConflict
+
+    context = AppContext().ensure()
+    context.bundle = MagicMock()
+    context.bundle.save.side_effect = StateConflict("modified by another writer")
+
+    context.save_state()
+
+    context.bundle.save.assert_called_once()
+
+
+def test_state_bundle_loaded_once_per_run(mock_clients):
+    mock_auth, _, _ = mock_clients
+    bundle = MagicMock()
+    with patch("src.context.bundle_from_env", return_value=bundle):
+        context = AppContext(use_s3=True).ensure()
+
+    bundle.load.assert_called_once()
+    assert mock_auth.call_args.kwargs["bundle"] is bundle
+
+    # Unchanged bundle on a warm run: nothing to re-read
+    bundle.load.return_value = False
+    context.ensure()
+    assert mock_auth.return_value.authenticate.call_count == 1
+
+    # Changed by another container: re-read the token
+    bundle.load.return_value = True
+    context.ensure()
+    assert mock_auth.return_value.authenticate.call_count == 2
+
+
+def test_warm_start_reloads_archives(mock_clients):
+    play_archive, results_archive = MagicMock(), MagicMock()
+    with patch("src.context.archives_from_env", return_value=(play_archive, results_archive)):
+        context = AppContext().ensure()
+        context.ensure()
+
+    # Once on the cold start (a no-op there) and once on the warm one
+    assert play_archive.reload.call_count == 2
+    assert results_archive.reload.call_count == 2
+
+
+def test_spotify_token_kept_with_strava_token(mock_clients):
+    _, _, mock_spotify = mock_clients
+    bundle = MagicMock()
+    with patch("src.context.bundle_from_env", return_value=bundle), \
+         patch("src.context.cache_handler_from_env") as mock_cache_handler:
+        context = AppContext(use_s3=True).ensure()
+
+    mock_cache_handler.assert_called_once_with(use_s3=True, bundle=bundle)
+    assert mock_spotify.call_args.kwargs["cache_handler"] is mock_cache_handler.return_value
+
+
+def test_http_cache_keyed_by_athlete_and_spotify_user(mock_clients):
+    mock_auth, _, mock_spotify = mock_clients
+    with patch("src.context.cache_from_env") as mock_cache:
+        context = AppContext(use_s3=True)
+        context.prepare()
+        identities = {call.args[0]: call.args[1] for call in mock_cache.return_value.set_identity.call_args_list}
+
+        # Unknown until the clients exist
+        assert identities["www.strava.com"]() is None
+        assert identities["api.spotify.com"]() is None
+
+        mock_auth.return_value.athlete = {"id": 42}
+        mock_spotify.return_value.user_id = "runner"
+        context.ensure_strava()
+        context.ensure_spotify()
+
+    assert identities["www.strava.com"]() == 42
+    assert identities["api.spotify.com"]() == "runner"
+
+
+def test_changed_bundle_reloads_top_tracks(mock_clients):
+    bundle = MagicMock()
+    with patch("src.context.bundle_from_env", return_value=bundle), \
+         patch("src.context.top_tracks_from_env") as mock_top_tracks:
+        context = AppContext(use_s3=True).ensure()
+
+        bundle.load.return_value = False
+        context.ensure()
+        mock_top_tracks.return_value.reload.assert_not_called()
+
+        bundle.load.return_value = True
+        context.ensure()
+        mock_top_tracks.return_value.reload.assert_called_once()
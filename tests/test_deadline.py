@@ -0,0 +1,105 @@
+import time
+from unittest.mock import patch, MagicMock
+import pytest
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.deadline import (
+    CircuitBreaker, CircuitOpen, Deadline, DeadlineExceeded, RequestGuard, DEFAULT_TIMEOUT, guard_boto_client
+)
+from src.sessions import create_session
+
+
+def _response(status):
+    response = requests.Response()
+    response.status_code = status
+    return response
+
+
+def test_deadline_clamps_timeouts():
+    deadline = Deadline(20, reserve=5)
+
+    assert deadline.timeout() == DEFAULT_TIMEOUT
+    assert deadline.timeout(30) == pytest.approx(15, abs=0.1)
+    connect, read = deadline.timeout((3.05, 60))
+    assert connect == 3.05
+    assert read == pytest.approx(15, abs=0.1)
+
+
+def test_deadline_exceeded():
+    deadline = Deadline(5.2, reserve=5)
+
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeout()
+
+
+def test_deadline_from_lambda_context():
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 30000
+
+    assert Deadline.from_lambda_context(context, reserve=0).remaining() == pytest.approx(30, abs=0.1)
+    assert Deadline.from_lambda_context({}) is None
+    assert Deadline.from_lambda_context(None) is None
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker("api.spotify.com", failure_threshold=2, reset_after=0.05)
+
+    breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    # One trial call is let through, the next waits for its outcome
+    breaker.check()
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_guarded_session_sets_timeouts_and_trips_breaker():
+    guard = RequestGuard(failure_threshold=2)
+    guard.start(Deadline(12, reserve=2))
+    session = create_session(guard=guard)
+
+    with patch.object(HTTPAdapter, "send", return_value=_response(503)) as mock_send:
+        session.get("https://api.spotify.com/v1/me", timeout=60)
+        assert mock_send.call_args.kwargs["timeout"] == pytest.approx(10, abs=0.1)
+        session.get("https://api.spotify.com/v1/me")
+
+        with pytest.raises(CircuitOpen):
+            session.get("https://api.spotify.com/v1/me")
+        # Other upstreams are unaffected
+        session.get("https://www.strava.com/api/v3/athlete")
+
+    assert mock_send.call_count == 3
+
+
+def test_guarded_session_counts_connection_errors():
+    guard = RequestGuard(failure_threshold=1)
+    session = create_session(guard=guard, retries=0)
+
+    with patch.object(HTTPAdapter, "send", side_effect=requests.exceptions.ConnectTimeout()):
+        with pytest.raises(requests.exceptions.ConnectTimeout):
+            session.get("https://www.strava.com/api/v3/athlete")
+    assert guard.breaker("www.strava.com").state == "open"
+
+
+def test_guard_boto_client():
+    import boto3
+
+    client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="x", aws_secret_access_key="y")
+    guard = RequestGuard(failure_threshold=1)
+    guard_boto_client(client, guard)
+    guard.breaker("s3").record_failure()
+
+    # Raised before anything is signed or sent
+    with pytest.raises(CircuitOpen):
+        client.get_object(Bucket="test-bucket", Key="motivator/state.json.gz")
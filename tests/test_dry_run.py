@@ -0,0 +1,170 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.backfill import RateBudget
+from src.dry_run import plan_backfill, plan_from_context, plan_run, rate_windows
+from src.store import StateStore
+from src.strava.activities import ActivityRecord
+
+START = 1714546800.0  # 2024-05-01 07:00 UTC
+
+
+def _activity(activity_id, start_epoch, duration=3600):
+    from datetime import datetime
+    return ActivityRecord(
+        f"Run {activity_id}",
+        datetime.fromtimestamp(start_epoch),
+        start_epoch,
+        datetime.fromtimestamp(start_epoch + duration),
+        start_epoch + duration,
+        activity_id=activity_id
+    )
+
+
+def _play(epoch, uri):
+    from datetime import datetime, timezone
+    played_at = datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    return {"played_at": played_at, "track": {"uri": uri}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    yield store
+    store.close()
+
+
+def test_rate_windows():
+    assert rate_windows(50) == [
+        {'limit': 100, 'window': 900, 'used': 0, 'windows': 1, 'wait': 0},
+        {'limit': 1000, 'window': 86400, 'used': 0, 'windows': 1, 'wait': 0},
+    ]
+    quarter, day = rate_windows(250, used={900: 60, 86400: 900})
+    assert (quarter['windows'], quarter['wait']) == (4, 2700)
+    assert (day['windows'], day['wait']) == (2, 86400)
+
+
+def test_plan_run_from_cached_state(store):
+    processed, new = _activity(1, START - 86400), _activity(2, START)
+    store.add_activities([processed, new])
+    store.mark_processed(processed, 3)
+    store.add_plays([_play(START + 600, "spotify:track:a"), _play(START + 1200, "spotify:track:b"),
+                     _play(START + 7200, "spotify:track:later")])
+
+    plan = plan_run(store, limit=2, align_streams=True, group_by='activity')
+
+    assert plan['skipped'] == [1]
+    assert [activity['activity_id'] for activity in plan['activities']] == [2]
+    assert plan['activities'][0]['known_tracks'] == 2
+    assert plan['activities'][0]['history_pending'] is False
+    assert plan['playlists'] == [{'name': 'Runlist - 1/5', 'activities': [2], 'tracks': 2}]
+    assert plan['calls']['strava'] == {'list_activities': 1, 'get_activity': 0, 'streams': 1}
+    assert plan['calls']['spotify']['create_playlist'] == 1
+    assert plan['calls']['spotify']['add_items'] == 1
+    assert plan['calls']['writes'] == 2
+    assert plan['wall'] == pytest.approx(0.4 + 0.4 + 3 * 0.25)
+    # Planning wrote nothing
+    assert not store.is_processed(2)
+    assert store.playlist_names() == set()
+
+
+def test_plan_run_from_store(store):
+    store.add_activities([_activity(1, START - 86400), _activity(2, START)])
+    store.add_plays([_play(START + 600, "spotify:track:a")])
+
+    plan = plan_run(store, limit=1, group_by='activity', source='store', since=START - 2 * 86400)
+
+    # Every run since, and no Strava listing
+    assert [activity['activity_id'] for activity in plan['activities']] == [2, 1]
+    assert plan['calls']['strava']['list_activities'] == 0
+    # Times are UTC whatever the machine's timezone
+    assert plan['activities'][0]['start_time'] == '2024-05-01T07:00:00+00:00'
+    with pytest.raises(ValueError, match="Unknown activity source"):
+        plan_run(store, source='archive')
+
+
+def test_plan_run_without_playlists(store):
+    store.add_activities([_activity(2, START)])
+
+    plan = plan_run(store, create_playlist=False, group_by='activity')
+
+    assert plan['playlists'] == []
+    assert plan['calls']['writes'] == 0
+    assert plan['activities'][0]['history_pending'] is True
+
+
+def test_plan_run_counts_pending_history_as_a_write(store):
+    store.add_activities([_activity(2, START)])
+    store.add_plays([_play(START - 600, "spotify:track:before")])
+
+    plan = plan_run(store, group_by='activity')
+
+    assert plan['activities'][0]['history_pending'] is True
+    assert plan['playlists'][0]['tracks'] == 0
+    assert plan['calls']['spotify']['add_items'] == 1
+
+
+def test_plan_run_uses_stored_moving_intervals(store):
+    store.add_activities([_activity(2, START)])
+    store.add_moving_intervals(2, [(START, START + 3600)])
+
+    plan = plan_run(store, align_streams=True, group_by='activity')
+
+    assert plan['calls']['strava']['streams'] == 0
+
+
+def test_plan_run_for_activity_ids(store):
+    store.add_activities([_activity(2, START)])
+    store.add_plays([_play(START + 600, "spotify:track:a")])
+
+    plan = plan_run(store, activity_ids=[2, 3], align_streams=True)
+
+    assert plan['unknown'] == [3]
+    assert plan['calls']['strava'] == {'list_activities': 0, 'get_activity': 2, 'streams': 0}
+    assert len(plan['playlists']) == 1
+
+
+def test_plan_run_counts_enrichment_and_top_tracks(store):
+    store.add_activities([_activity(2, START)])
+    store.add_plays([_play(START + 600, "spotify:track:a"), _play(START + 1200, "spotify:track:b"),
+                     _play(START + 7200, "spotify:track:later")])
+    enricher = MagicMock()
+    enricher.cache.get.side_effect = lambda uri: {'name': 'A'} if uri == "spotify:track:a" else None
+    top_tracks = MagicMock(playlist_id="top", size=150)
+
+    plan = plan_run(store, group_by='activity', enricher=enricher, top_tracks=top_tracks)
+
+    spotify = plan['calls']['spotify']
+    assert (spotify['tracks'], spotify['audio_features']) == (1, 1)
+    assert spotify['remove_items'] == 2
+    assert spotify['add_items'] == 1 + 2
+
+
+def test_plan_run_includes_budget_usage(store, tmp_path):
+    budget = RateBudget(str(tmp_path / "budget.json"), limits=((100, 900), (1000, 86400)), clock=lambda: 1000.0)
+    budget.acquire(100)
+    store.add_activities([_activity(2, START)])
+
+    plan = plan_run(store, group_by='activity', budget=budget)
+
+    assert plan['rate_limits']['strava'][0]['used'] == 100
+    assert plan['rate_limits']['strava'][0]['wait'] == 900
+
+
+def test_plan_backfill(store):
+    store.add_activities([_activity(i, START + i * 3600) for i in range(250)])
+
+    plan = plan_backfill(store, START - 3600, START + 300 * 3600, workers=1, shards=1)
+
+    assert plan['known_activities'] == 250
+    assert plan['pages'] == 2
+    assert plan['wall'] == pytest.approx(0.8)
+
+
+def test_plan_from_context_needs_a_store():
+    context = MagicMock()
+    context.store = None
+
+    with pytest.raises(ValueError):
+        plan_from_context(context)
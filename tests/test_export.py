@@ -0,0 +1,145 @@
+import os
+from unittest.mock import patch
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+from src.export import ColumnarExporter, exporter_from_env, read_table
+from src.storage import LocalStorage
+
+
+def _result(activity_id, start, tracks, plays=None):
+    result = {
+        "activity_id": activity_id,
+        "activity_type": "Run",
+        "activity_name": f"Run {activity_id}",
+        "start_time": start,
+        "end_time": start.replace("T07", "T08"),
+        "track_count": len(tracks),
+        "tracks": tracks,
+    }
+    if plays is not None:
+        result["plays"] = plays
+    return result
+
+
+def _history_item(played_at, uri):
+    return {"played_at": played_at, "track": {"uri": uri}}
+
+
+@pytest.mark.parametrize("export_format", ["parquet", "arrow"])
+def test_export_results_partitioned_by_month(tmp_path, export_format):
+    exporter = ColumnarExporter(LocalStorage(str(tmp_path)), format=export_format)
+    results = [
+        _result(1, "2024-04-30T07:00:00+00:00", ["spotify:track:a", "spotify:track:b"]),
+        _result(2, "2024-05-01T07:00:00+00:00", ["spotify:track:c"]),
+    ]
+
+    keys = exporter.export_results(results)
+
+    assert sorted({key.split("/")[1] for key in keys}) == ["month=2024-04", "month=2024-05"]
+    activities = read_table(str(tmp_path), "activities", format=export_format)
+    assert sorted(activities.column("activity_id").to_pylist()) == [1, 2]
+    matches = read_table(str(tmp_path), "matches", format=export_format, months=["2024-04"])
+    assert matches.column("track_uri").to_pylist() == ["spotify:track:a", "spotify:track:b"]
+    assert matches.column("position").to_pylist() == [0, 1]
+
+
+def test_export_aligned_plays(tmp_path):
+    exporter = ColumnarExporter(LocalStorage(str(tmp_path)))
+    plays = [{
+        "uri": "spotify:track:a",
+        "played_at": "2024-05-01T07:10:00.000Z",
+        "moving": True,
+        "heartrate": 150.0,
+        "pace": 300.0,
+    }]
+
+    exporter.export_results([_result(1, "2024-05-01T07:00:00+00:00", ["spotify:track:a"], plays)])
+
+    row = read_table(str(tmp_path), "matches").to_pylist()[0]
+    assert row["heartrate"] == 150.0
+    assert row["moving"] is True
+    assert row["played_at"].isoformat() == "2024-05-01T07:10:00+00:00"
+
+
+def test_export_is_idempotent(tmp_path):
+    exporter = ColumnarExporter(LocalStorage(str(tmp_path)))
+    results = [_result(1, "2024-05-01T07:00:00+00:00", ["spotify:track:a"])]
+
+    assert exporter.export_results(results) == exporter.export_results(results)
+    assert read_table(str(tmp_path), "activities").num_rows == 1
+
+
+def test_export_plays_incremental(tmp_path):
+    exporter = ColumnarExporter(LocalStorage(str(tmp_path)))
+    history = [
+        _history_item("2024-05-01T07:20:00.000Z", "spotify:track:b"),
+        _history_item("2024-05-01T07:10:00.000Z", "spotify:track:a"),
+    ]
+    exporter.export_plays(history)
+
+    history.insert(0, _history_item("2024-06-01T07:00:00.000Z", "spotify:track:c"))
+    keys = exporter.export_plays(history)
+
+    assert len(keys) == 1
+    assert "month=2024-06" in keys[0]
+    plays = read_table(str(tmp_path), "plays")
+    assert sorted(plays.column("track_uri").to_pylist()) == ["spotify:track:a", "spotify:track:b", "spotify:track:c"]
+
+
+def test_unsupported_format(tmp_path):
+    with pytest.raises(ValueError, match="Unsupported export format"):
+        ColumnarExporter(LocalStorage(str(tmp_path)), format="csv")
+
+
+def test_exporter_from_env(tmp_path):
+    with patch.dict(os.environ, {}, clear=False):
+        os.environ.pop("EXPORT", None)
+        assert exporter_from_env() is None
+
+    with patch.dict(os.environ, {"EXPORT": "local", "EXPORT_DIR": str(tmp_path), "EXPORT_FORMAT": "arrow"}):
+        exporter = exporter_from_env()
+        assert exporter.format == "arrow"
+        assert exporter.storage.root == str(tmp_path)
+
+
+def test_export_replaces_rows_of_reexported_activity(tmp_path):
+    exporter = ColumnarExporter(LocalStorage(str(tmp_path)))
+    exporter.export_results([_result(1, "2024-05-01T07:00:00+00:00", ["spotify:track:a"])])
+
+    # A later run covers the same activity, now with another track
+    exporter.export_results([
+        _result(1, "2024-05-01T07:00:00+00:00", ["spotify:track:a", "spotify:track:b"]),
+        _result(2, "2024-05-02T07:00:00+00:00", ["spotify:track:c"]),
+    ])
+
+    assert sorted(read_table(str(tmp_path), "activities").column("activity_id").to_pylist()) == [1, 2]
+    assert read_table(str(tmp_path), "matches").num_rows == 3
+
+
+def test_export_removes_matches_of_reexport_without_tracks(tmp_path):
+    exporter = ColumnarExporter(LocalStorage(str(tmp_path)))
+    exporter.export_results([_result(1, "2024-05-01T07:00:00+00:00", ["spotify:track:a"])])
+
+    keys = exporter.export_results([_result(1, "2024-05-01T07:00:00+00:00", [])])
+
+    assert keys == ["activities/month=2024-05/part-activity-1.parquet"]
+    assert not list(tmp_path.glob("matches/*/part-activity-1.*"))
+    assert read_table(str(tmp_path), "activities").column("track_count").to_pylist() == [0]
+
+
+def test_export_naive_times_ignore_machine_timezone(tmp_path, monkeypatch):
+    import time
+    exporter = ColumnarExporter(LocalStorage(str(tmp_path)))
+
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        exporter.export_results([_result(1, "2024-05-01T07:00:00", [])])
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+    row = read_table(str(tmp_path), "activities").to_pylist()[0]
+    assert row["start_time"].isoformat() == "2024-05-01T07:00:00+00:00"
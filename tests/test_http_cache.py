@@ -0,0 +1,220 @@
+import os
+import time
+from unittest.mock import patch
+import pytest
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from src.http_cache import HttpCache, CachingAdapter, cache_from_env, CACHE_STATUS_HEADER
+from src.sessions import create_session
+from src.storage import LocalStorage
+
+ATHLETE_URL = "https://www.strava.com/api/v3/athlete"
+ACTIVITIES_URL = "https://www.strava.com/api/v3/athlete/activities?per_page=1"
+
+
+def _response(status=200, body=b'{"id": 1}', headers=None):
+    response = Response()
+    response.status_code = status
+    response._content = body
+    response.headers = CaseInsensitiveDict(headers or {})
+    return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return HttpCache(LocalStorage(str(tmp_path)))
+
+
+@pytest.fixture
+def mock_send():
+    with patch("requests.adapters.HTTPAdapter.send") as send:
+        yield send
+
+
+def test_ttl_for(cache):
+    assert cache.ttl_for(ATHLETE_URL) == 7 * 24 * 3600
+    assert cache.ttl_for(ACTIVITIES_URL) == 0
+    assert cache.ttl_for("https://www.strava.com/oauth/token") is None
+
+
+def test_fresh_entry_served_without_request(cache, mock_send):
+    mock_send.return_value = _response(headers={"X-RateLimit-Usage": "1,1"})
+    session = create_session(cache=cache)
+
+    first = session.get(ATHLETE_URL)
+    second = session.get(ATHLETE_URL)
+
+    assert mock_send.call_count == 1
+    assert second.json() == {"id": 1}
+    assert second.headers[CACHE_STATUS_HEADER] == "HIT"
+    # Rate limit usage is never replayed from the cache
+    assert "X-RateLimit-Usage" not in second.headers
+    assert cache.stats == {"hits": 1, "revalidated": 0, "misses": 1}
+
+
+def test_stale_entry_revalidated_with_etag(cache, mock_send):
+    mock_send.return_value = _response(body=b"[]", headers={"ETag": 'W/"abc"'})
+    session = create_session(cache=cache)
+    session.get(ACTIVITIES_URL)
+
+    mock_send.return_value = _response(status=304, body=b"")
+    response = session.get(ACTIVITIES_URL)
+
+    request = mock_send.call_args.args[0]
+    assert request.headers["If-None-Match"] == 'W/"abc"'
+    assert response.status_code == 200
+    assert response.json() == []
+    assert response.headers[CACHE_STATUS_HEADER] == "REVALIDATED"
+
+
+def test_last_modified_revalidation(cache, mock_send):
+    mock_send.return_value = _response(headers={"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+    session = create_session(cache=cache)
+    session.get(ACTIVITIES_URL)
+    session.get(ACTIVITIES_URL)
+
+    request = mock_send.call_args.args[0]
+    assert request.headers["If-Modified-Since"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+def test_uncacheable_requests_pass_through(cache, mock_send):
+    mock_send.return_value = _response()
+    session = create_session(cache=cache)
+
+    session.get(ACTIVITIES_URL)
+    session.get(ACTIVITIES_URL)
+    session.post(ATHLETE_URL)
+
+    # No validators and a zero TTL: nothing to reuse
+    assert mock_send.call_count == 3
+    assert cache.lookup(ACTIVITIES_URL) is None
+
+
+def test_cache_persists_across_instances(tmp_path, mock_send):
+    mock_send.return_value = _response()
+    create_session(cache=HttpCache(LocalStorage(str(tmp_path)))).get(ATHLETE_URL)
+
+    cache = HttpCache(LocalStorage(str(tmp_path)))
+    create_session(cache=cache).get(ATHLETE_URL)
+
+    assert mock_send.call_count == 1
+    assert cache.stats["hits"] == 1
+
+
+def test_expired_entry_without_validators_refetched(cache, mock_send):
+    mock_send.return_value = _response()
+    session = create_session(cache=cache)
+    session.get(ATHLETE_URL)
+
+    entry = cache.lookup(ATHLETE_URL)
+    entry["stored_at"] = time.time() - 8 * 24 * 3600
+    session.get(ATHLETE_URL)
+
+    assert mock_send.call_count == 2
+    assert "If-None-Match" not in mock_send.call_args.args[0].headers
+
+
+def test_cache_from_env(tmp_path):
+    with patch.dict(os.environ, {"HTTP_CACHE": "off"}):
+        assert cache_from_env() is None
+
+    with patch.dict(os.environ, {"HTTP_CACHE_DIR": str(tmp_path)}):
+        os.environ.pop("HTTP_CACHE", None)
+        cache = cache_from_env()
+        assert cache.storage.root == str(tmp_path)
+
+    with patch.dict(os.environ, {"HTTP_CACHE": "s3"}):
+        os.environ.pop("S3_BUCKET", None)
+        assert cache_from_env(use_s3=True) is None
+
+
+def test_create_session_uses_caching_adapter(cache):
+    session = create_session(cache=cache)
+    assert isinstance(session.get_adapter(ATHLETE_URL), CachingAdapter)
+
+
+def test_entries_are_keyed_by_authorization(cache, mock_send):
+    mock_send.return_value = _response(body=b'{"id": 1}')
+    session = create_session(cache=cache)
+    session.get(ATHLETE_URL, headers={"Authorization": "Bearer one"})
+
+    mock_send.return_value = _response(body=b'{"id": 2}')
+    other = session.get(ATHLETE_URL, headers={"Authorization": "Bearer two"})
+
+    assert mock_send.call_count == 2
+    assert other.json() == {"id": 2}
+    assert cache.lookup(ATHLETE_URL, "Bearer one")["body"] != cache.lookup(ATHLETE_URL, "Bearer two")["body"]
+
+
+def test_identity_keys_survive_token_rotation(cache, mock_send):
+    mock_send.return_value = _response(body=b'{"id": 1}')
+    cache.set_identity("www.strava.com", lambda: 42)
+    session = create_session(cache=cache)
+    session.get(ATHLETE_URL, headers={"Authorization": "Bearer old"})
+
+    rotated = session.get(ATHLETE_URL, headers={"Authorization": "Bearer new"})
+
+    assert mock_send.call_count == 1
+    assert rotated.headers[CACHE_STATUS_HEADER] == "HIT"
+    # Another user's identity never shares the entry
+    cache.set_identity("www.strava.com", lambda: 43)
+    assert cache.lookup(ATHLETE_URL, "Bearer new") is None
+
+
+def test_identity_falls_back_to_token(cache):
+    cache.set_identity("www.strava.com", lambda: None)
+    cache.store(ATHLETE_URL, {"stored_at": time.time()}, "Bearer one")
+
+    assert cache.lookup(ATHLETE_URL, "Bearer one") is not None
+    assert cache.lookup(ATHLETE_URL, "Bearer two") is None
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    cache = HttpCache(storage)
+    cache.store(ATHLETE_URL, {"stored_at": time.time() - 8 * 24 * 3600}, "Bearer old")
+    expired = cache._key(ATHLETE_URL, "Bearer old")
+
+    # Dropped when the next entry is stored
+    cache.store(ATHLETE_URL, {"stored_at": time.time()}, "Bearer new")
+    assert storage.get(expired) is None
+    assert cache.lookup(ATHLETE_URL, "Bearer old") is None
+
+    # Entries from before the index, e.g. under a rotated token, go on load
+    storage.put("http-cache/orphan.json", b"{}")
+    fresh = HttpCache(storage)
+    assert fresh.lookup(ATHLETE_URL, "Bearer new") is not None
+    assert sorted(storage.keys("http-cache/")) == sorted([
+        "http-cache/index.json", cache._key(ATHLETE_URL, "Bearer new")
+    ])
+
+
+def test_stale_entries_with_validators_are_kept_for_revalidation(cache):
+    stored_at = time.time() - 2 * 3600
+    entry = {"stored_at": stored_at, "headers": {"ETag": 'W/"abc"'}}
+    url = "https://www.strava.com/api/v3/activities/1"
+
+    assert cache.expires_at(url, entry) == stored_at + 3600 + 7 * 24 * 3600
+    assert cache.expires_at(url, {"stored_at": stored_at}) == stored_at + 3600
+
+
+def test_activity_pattern_is_anchored(cache):
+    assert cache.ttl_for("https://www.strava.com/api/v3/activities/123") == 3600
+    assert cache.ttl_for("https://www.strava.com/api/v3/activities/123/streams") is None
+
+
+def test_bypass_fetches_and_stores_fresh_response(cache, mock_send):
+    mock_send.return_value = _response(body=b'{"id": 1}')
+    session = create_session(cache=cache)
+    session.get(ATHLETE_URL)
+
+    mock_send.return_value = _response(body=b'{"id": 2}')
+    with cache.bypass():
+        fresh = session.get(ATHLETE_URL)
+    cached = session.get(ATHLETE_URL)
+
+    assert mock_send.call_count == 2
+    assert fresh.json() == cached.json() == {"id": 2}
+    assert not cache.bypassed
@@ -4,9 +4,17 @@ from unittest.mock import patch, MagicMock
 import pytest
 
 # Import directly (stravalib already mocked in conftest)
+import lambda_function
 from lambda_function import lambda_handler, get_secret
 
 
+@pytest.fixture(autouse=True)
+def cold_app_context():
+    # Every test starts from a cold container
+    lambda_function.app_context.reset()
+    yield lambda_function.app_context
+
+
 @pytest.fixture
 def mock_env_vars():
     # Save original environment variables
@@ -59,6 +67,16 @@ def mock_process_activities():
         yield mock_process
 
 
+def test_get_secret_uses_bounded_timeouts(mock_secrets_manager, mock_env_vars):
+    with patch("boto3.session.Session") as mock_session:
+        mock_session.return_value.client.return_value = mock_secrets_manager
+        get_secret()
+
+    config = mock_session.return_value.client.call_args.kwargs["config"]
+    assert config.connect_timeout is not None
+    assert config.read_timeout is not None
+
+
 def test_get_secret(mock_secrets_manager, mock_env_vars):
     # Test get_secret function
     get_secret()
@@ -86,7 +104,11 @@ def test_lambda_handler_success(mock_secrets_manager, mock_process_activities, m
     mock_process_activities.assert_called_once_with(
         create_playlist=True,
         limit=2,
-        use_s3=True
+        use_s3=True,
+        context=lambda_function.app_context,
+        align_streams=False,
+        exporter=None,
+        deadline=None
     )
     
     # Verify the result
@@ -116,3 +138,106 @@ def test_lambda_handler_exception(mock_secrets_manager, mock_process_activities,
     # Should raise the exception
     with pytest.raises(Exception, match="Test error"):
         lambda_handler(event, context)
+
+
+def test_lambda_handler_warm_invocation_skips_secrets(mock_secrets_manager, mock_process_activities, mock_env_vars):
+    lambda_handler({}, {})
+    lambda_handler({}, {})
+
+    # Secrets are only loaded on the cold start
+    mock_secrets_manager.get_secret_value.assert_called_once()
+    assert mock_process_activities.call_count == 2
+
+
+def test_lambda_handler_exception_resets_context(mock_secrets_manager, mock_process_activities, mock_env_vars, cold_app_context):
+    mock_process_activities.side_effect = Exception("Test error")
+
+    with pytest.raises(Exception, match="Test error"):
+        lambda_handler({}, {})
+
+    assert cold_app_context.secrets_loaded is False
+
+
+def test_webhook_handler(mock_secrets_manager, mock_env_vars):
+    from lambda_function import webhook_handler
+
+    with patch("lambda_function.handle_webhook") as mock_handle:
+        mock_handle.return_value = {"statusCode": 200, "body": "{}"}
+        response = webhook_handler({"httpMethod": "POST", "body": "{}"}, {})
+
+    mock_handle.assert_called_once_with(
+        {"httpMethod": "POST", "body": "{}"},
+        create_playlist=True,
+        use_s3=True,
+        context=lambda_function.app_context,
+        queue=None,
+        deadline=None
+    )
+    assert response["statusCode"] == 200
+
+
+def test_batch_handler(mock_secrets_manager, mock_env_vars):
+    from lambda_function import batch_handler
+
+    event = {"Records": [{"messageId": "a", "body": "1"}]}
+    with patch("lambda_function.process_batch") as mock_batch:
+        mock_batch.return_value = {"batchItemFailures": [{"itemIdentifier": "a"}], "results": []}
+        response = batch_handler(event, {})
+
+    mock_batch.assert_called_once_with(
+        event["Records"],
+        create_playlist=True,
+        use_s3=True,
+        context=lambda_function.app_context,
+        max_workers=4,
+        deadline=None
+    )
+    assert response == {"batchItemFailures": [{"itemIdentifier": "a"}]}
+
+
+def test_lambda_handler_passes_deadline(mock_secrets_manager, mock_process_activities, mock_env_vars):
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 60000
+
+    lambda_handler({}, context)
+
+    deadline = mock_process_activities.call_args.kwargs["deadline"]
+    assert 50 < deadline.remaining() <= 55
+
+
+def test_lambda_handler_deferred_run(mock_secrets_manager, mock_process_activities, mock_env_vars):
+    from src.deadline import CircuitOpen
+
+    mock_process_activities.side_effect = CircuitOpen("api.spotify.com failed 3 times in a row, deferring")
+
+    result = lambda_handler({}, {})
+
+    assert result["success"] is False
+    assert "api.spotify.com" in result["deferred"]
+    # Warm clients survive an upstream outage
+    assert lambda_function.app_context.secrets_loaded is True
+
+
+def test_lambda_handler_refreshes_tokens_after_work(mock_secrets_manager, mock_process_activities, mock_env_vars):
+    calls = []
+    mock_process_activities.side_effect = lambda **kwargs: calls.append("process") or []
+
+    with patch.object(lambda_function.app_context, "refresh_tokens",
+                      side_effect=lambda window, deadline=None: calls.append(("refresh", window))) as mock_refresh:
+        lambda_handler({}, {})
+
+        assert calls == ["process", ("refresh", 900)]
+
+        os.environ["TOKEN_REFRESH_WINDOW"] = "0"
+        lambda_handler({}, {})
+        mock_refresh.assert_called_once()
+
+
+def test_batch_handler_error_resets_context(mock_secrets_manager, mock_env_vars, cold_app_context):
+    from lambda_function import batch_handler
+
+    with patch("lambda_function.process_batch", side_effect=Exception("Test error")):
+        with pytest.raises(Exception, match="Test error"):
+            batch_handler({"Records": []}, {})
+
+    assert cold_app_context.secrets_loaded is False
@@ -0,0 +1,126 @@
+import json
+import time
+from unittest.mock import MagicMock
+import pytest
+
+from botocore.exceptions import ClientError
+
+from src.lease import FileLease, S3Lease, LeaseTimeout
+
+
+def _precondition_failed():
+    return ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+
+
+def test_file_lease_acquire_release(tmp_path):
+    lock_file = tmp_path / "token.lock"
+
+    with FileLease(str(lock_file)):
+        assert lock_file.exists()
+        assert "expires_at" in json.loads(lock_file.read_text())
+
+    assert not lock_file.exists()
+
+
+def test_file_lease_timeout(tmp_path):
+    lock_file = tmp_path / "token.lock"
+    holder = FileLease(str(lock_file))
+    holder.acquire()
+
+    waiter = FileLease(str(lock_file), timeout=0.1, poll_interval=0.01)
+    with pytest.raises(LeaseTimeout):
+        waiter.acquire()
+
+    holder.release()
+
+
+def test_file_lease_breaks_stale_lease(tmp_path):
+    lock_file = tmp_path / "token.lock"
+    lock_file.write_text(json.dumps({"pid": 0, "expires_at": time.time() - 1}))
+
+    with FileLease(str(lock_file), timeout=1):
+        assert json.loads(lock_file.read_text())["expires_at"] > time.time()
+
+
+def test_s3_lease_conditional_put():
+    s3_client = MagicMock()
+    s3_client.put_object.return_value = {"ETag": '"lock-etag"'}
+
+    with S3Lease(s3_client, "test-bucket", "motivator/access_token.lock"):
+        pass
+
+    kwargs = s3_client.put_object.call_args.kwargs
+    assert kwargs["IfNoneMatch"] == "*"
+    assert kwargs["Key"] == "motivator/access_token.lock"
+    s3_client.delete_object.assert_called_once_with(
+        Bucket="test-bucket",
+        Key="motivator/access_token.lock",
+        IfMatch='"lock-etag"'
+    )
+
+
+def test_s3_lease_waits_for_holder():
+    s3_client = MagicMock()
+    s3_client.put_object.side_effect = [_precondition_failed(), {}]
+    s3_client.get_object.return_value = {"Body": MagicMock()}
+    s3_client.get_object.return_value["Body"].read.return_value = json.dumps(
+        {"expires_at": time.time() + 30}
+    ).encode("utf-8")
+
+    lease = S3Lease(s3_client, "test-bucket", "lock", poll_interval=0.01)
+    lease.acquire()
+
+    assert s3_client.put_object.call_count == 2
+    s3_client.delete_object.assert_not_called()
+
+
+def test_s3_lease_propagates_other_errors():
+    s3_client = MagicMock()
+    s3_client.put_object.side_effect = ClientError({"Error": {"Code": "AccessDenied"}}, "PutObject")
+
+    with pytest.raises(ClientError):
+        S3Lease(s3_client, "test-bucket", "lock").acquire()
+
+
+def test_file_lease_broken_holder_keeps_new_lease(tmp_path):
+    lock_file = tmp_path / "token.lock"
+    stale = FileLease(str(lock_file), ttl=0.01)
+    stale.acquire()
+    time.sleep(0.02)
+
+    # The stale lease is broken and taken over while its holder still runs
+    successor = FileLease(str(lock_file), timeout=1)
+    successor.acquire()
+    stale.release()
+
+    assert json.loads(lock_file.read_text())["owner"] == successor.owner
+    successor.release()
+    assert not lock_file.exists()
+
+
+def test_s3_lease_breaks_stale_lease_by_etag():
+    s3_client = MagicMock()
+    s3_client.put_object.side_effect = [_precondition_failed(), {"ETag": '"new"'}]
+    s3_client.get_object.return_value = {"Body": MagicMock(), "ETag": '"stale"'}
+    s3_client.get_object.return_value["Body"].read.return_value = json.dumps(
+        {"owner": "other", "expires_at": time.time() - 1}
+    ).encode("utf-8")
+
+    lease = S3Lease(s3_client, "test-bucket", "lock", poll_interval=0.01)
+    lease.acquire()
+    s3_client.delete_object.assert_called_once_with(Bucket="test-bucket", Key="lock", IfMatch='"stale"')
+
+    lease.release()
+    s3_client.delete_object.assert_called_with(Bucket="test-bucket", Key="lock", IfMatch='"new"')
+
+
+def test_s3_lease_release_after_takeover_is_a_no_op():
+    s3_client = MagicMock()
+    s3_client.put_object.return_value = {"ETag": '"mine"'}
+    s3_client.delete_object.side_effect = _precondition_failed()
+
+    lease = S3Lease(s3_client, "test-bucket", "lock")
+    lease.acquire()
+    lease.release()
+
+    assert lease.owner is None
@@ -1,4 +1,4 @@
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 import pytest
 
 # Import directly (stravalib already mocked in conftest)
@@ -7,9 +7,9 @@ from src.main import process_activities
 
 def test_process_activities(mock_strava_client, mock_spotify_client):
     # Setup mocks
-    with patch("src.main.StravaAuth") as mock_auth, \
-         patch("src.main.StravaActivities") as mock_activities, \
-         patch("src.main.SpotifyHandler") as mock_spotify:
+    with patch("src.context.StravaAuth") as mock_auth, \
+         patch("src.context.StravaActivities") as mock_activities, \
+         patch("src.context.SpotifyHandler") as mock_spotify:
         
         # Configure mock returns
         mock_auth_instance = MagicMock()
@@ -41,7 +41,7 @@ def test_process_activities(mock_strava_client, mock_spotify_client):
         results = process_activities(create_playlist=True, limit=1)
         
         # Verify StravaAuth was initialized
-        mock_auth.assert_called_once_with(use_s3=False)
+        mock_auth.assert_called_once_with(use_s3=False, session=ANY, bundle=None)
         mock_auth_instance.authenticate.assert_called_once()
         
         # Verify StravaActivities was initialized with the auth instance
@@ -50,8 +50,8 @@ def test_process_activities(mock_strava_client, mock_spotify_client):
         # Verify SpotifyHandler was initialized
         mock_spotify.assert_called_once()
         
-        # Verify get_athlete_info was called
-        mock_activities_instance.get_athlete_info.assert_called_once()
+        # The greeting comes from the cached profile, not an API call
+        mock_activities_instance.get_athlete_info.assert_not_called()
         
         # Verify get_activities was called with limit
         mock_activities_instance.get_activities.assert_called_once_with(limit=1)
@@ -67,7 +67,9 @@ def test_process_activities(mock_strava_client, mock_spotify_client):
             activity_data[0][0],  # name
             activity_data[0][1],  # start
             activity_data[0][3],  # end
-            ["spotify:track:test_track"]
+            ["spotify:track:test_track"],
+            description="Test Run",
+            name=f"Runlist - {now.day}/{now.month}"
         )
         
         # Verify results
@@ -78,9 +80,9 @@ def test_process_activities(mock_strava_client, mock_spotify_client):
 
 def test_process_activities_no_playlist(mock_strava_client, mock_spotify_client):
     # Setup mocks
-    with patch("src.main.StravaAuth") as mock_auth, \
-         patch("src.main.StravaActivities") as mock_activities, \
-         patch("src.main.SpotifyHandler") as mock_spotify:
+    with patch("src.context.StravaAuth") as mock_auth, \
+         patch("src.context.StravaActivities") as mock_activities, \
+         patch("src.context.SpotifyHandler") as mock_spotify:
         
         # Configure mock returns
         mock_auth_instance = MagicMock()
@@ -117,3 +119,551 @@ def test_process_activities_no_playlist(mock_strava_client, mock_spotify_client)
         # Verify results still include track count
         assert len(results) == 1
         assert results[0]["track_count"] == 1
+
+
+def test_benchmark_hot_path_call_counts(tmp_path, mock_strava_client, mock_token_data, monkeypatch):
+    # Count Strava API calls over several warm runs with real auth/activities
+    import json
+    import time
+    from src.context import AppContext
+    from src.strava.auth import StravaAuth
+
+    # The calls counted are stravalib's
+    monkeypatch.setenv("STRAVA_LEAN", "false")
+
+    token_file = tmp_path / "access_token"
+    athlete = {"id": 42, "firstname": "Test", "lastname": "User", "fetched_at": time.time()}
+    with open(token_file, "w") as f:
+        json.dump(dict(mock_token_data, athlete=athlete), f)
+
+    def make_auth(use_s3=False, session=None, bundle=None):
+        auth = StravaAuth(token_path=str(token_file), session=session)
+        auth.client = mock_strava_client
+        return auth
+
+    runs = 5
+    with patch("src.context.StravaAuth", side_effect=make_auth), \
+         patch("src.context.SpotifyHandler") as mock_spotify:
+        mock_spotify.return_value.get_activity_tracks.return_value = []
+        context = AppContext()
+        for _ in range(runs):
+            process_activities(create_playlist=False, context=context)
+
+    assert context.get_athlete()["firstname"] == "Test"
+    assert mock_strava_client.get_athlete.call_count == 0
+    assert mock_strava_client.get_activities.call_count == runs
+    assert mock_strava_client.refresh_access_token.call_count == 0
+
+
+def test_process_activity_id():
+    from datetime import datetime, timezone, timedelta
+    from src.main import process_activity_id
+
+    now = datetime.now(timezone.utc)
+    activity = ("Test Run", now, now.timestamp(), now + timedelta(hours=1), (now + timedelta(hours=1)).timestamp())
+    context = MagicMock()
+    context.store = None
+    context.play_archive = None
+    context.enricher = None
+    context.top_tracks = None
+    context.strava.get_activity.return_value = activity
+    context.spotify.get_activity_tracks.return_value = ["spotify:track:test_track"]
+
+    result = process_activity_id(123, context=context)
+
+    context.ensure.assert_called_once()
+    context.strava.get_activity.assert_called_once_with(123)
+    context.spotify.create_activity_playlist.assert_called_once()
+    assert result["track_count"] == 1
+
+    context.strava.get_activity.return_value = None
+    assert process_activity_id(456, context=context) is None
+
+
+def test_process_activity_id_starts_request_guard():
+    from src.deadline import Deadline, get_request_guard
+    from src.main import process_activity_id
+
+    context = MagicMock()
+    context.store = None
+    context.strava.get_activity.return_value = None
+    stale = Deadline(0.01)
+
+    get_request_guard().start(stale)
+    process_activity_id(123, context=context)
+    assert get_request_guard().deadline is None
+
+    # Batch workers keep the batch's deadline
+    get_request_guard().start(stale)
+    process_activity_id(123, context=context, save=False)
+    assert get_request_guard().deadline is stale
+    get_request_guard().start(None)
+
+
+def test_process_activity_id_counts_top_tracks():
+    from datetime import datetime, timezone, timedelta
+    from src.main import process_activity_id
+    from src.strava.activities import ActivityRecord
+
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(hours=1)
+    activity = ActivityRecord("Test Run", now, now.timestamp(), end, end.timestamp(), activity_id=123)
+    context = MagicMock()
+    context.store = None
+    context.play_archive = None
+    context.enricher = None
+    context.strava.get_activity.return_value = activity
+    context.spotify.get_activity_tracks.return_value = ["spotify:track:a"]
+
+    process_activity_id(123, context=context)
+
+    context.top_tracks.add.assert_called_once_with(activity, ["spotify:track:a"])
+    context.top_tracks.sync.assert_called_once_with(context.spotify)
+
+    # Batch workers leave the sync to the batch
+    process_activity_id(123, context=context, save=False)
+    assert context.top_tracks.add.call_count == 2
+    context.top_tracks.sync.assert_called_once()
+
+
+def test_process_activity_aligns_streams():
+    from datetime import datetime, timezone, timedelta
+    from src.main import process_activity
+    from src.strava.activities import ActivityRecord
+
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(hours=1)
+    activity = ActivityRecord("Test Run", now, now.timestamp(), end, end.timestamp(), activity_id=123)
+    strava = MagicMock()
+    spotify = MagicMock()
+    spotify.get_activity_plays.return_value = [("spotify:track:a", "x"), ("spotify:track:b", "y")]
+
+    with patch("src.main.align_plays") as mock_align:
+        mock_align.return_value = [
+            {"uri": "spotify:track:a", "moving": True},
+            {"uri": "spotify:track:b", "moving": False},
+        ]
+        result = process_activity(activity, spotify, create_playlist=True, strava=strava)
+
+    strava.get_activity_streams.assert_called_once_with(activity)
+    spotify.get_activity_tracks.assert_not_called()
+    spotify.create_activity_playlist.assert_called_once_with(
+        "Test Run", now, end, ["spotify:track:a"], description="Test Run", name=f"Runlist - {now.day}/{now.month}"
+    )
+    assert result["track_count"] == 1
+    assert len(result["plays"]) == 2
+
+
+def test_process_activity_without_streams_falls_back():
+    from datetime import datetime, timezone, timedelta
+    from src.main import process_activity
+    from src.strava.activities import ActivityRecord
+
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(hours=1)
+    activity = ActivityRecord("Manual Run", now, now.timestamp(), end, end.timestamp(), activity_id=123)
+    strava = MagicMock()
+    strava.get_activity_streams.return_value = None
+    spotify = MagicMock()
+    spotify.get_activity_tracks.return_value = ["spotify:track:a"]
+
+    result = process_activity(activity, spotify, create_playlist=False, strava=strava)
+
+    spotify.get_activity_tracks.assert_called_once()
+    assert "plays" not in result
+
+
+def test_process_activities_exports_results():
+    from datetime import datetime, timezone, timedelta
+
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(hours=1)
+    context = MagicMock()
+    context.store = None
+    context.play_archive = None
+    context.enricher = None
+    context.top_tracks = None
+    context.strava.get_activities.return_value = [("Test Run", now, now.timestamp(), end, end.timestamp())]
+    context.spotify.get_activity_tracks.return_value = ["spotify:track:test_track"]
+    exporter = MagicMock()
+
+    results = process_activities(create_playlist=False, context=context, exporter=exporter)
+
+    exporter.export_run.assert_called_once_with(results, context.spotify.play_history)
+    assert results[0]["tracks"] == ["spotify:track:test_track"]
+
+
+def test_process_activities_with_state_store(tmp_path):
+    from datetime import datetime, timezone, timedelta
+    from src.store import StateStore
+    from src.strava.activities import ActivityRecord
+
+    start = datetime(2024, 5, 1, 7, 0, tzinfo=timezone.utc)
+    end = start + timedelta(hours=1)
+    activity = ActivityRecord("Test Run", start, start.timestamp(), end, end.timestamp(), activity_id=123)
+    store = StateStore(str(tmp_path / "state.db"))
+    # A play from an earlier run that Spotify no longer returns
+    store.add_plays([{"played_at": "2024-05-01T07:10:00.000Z", "track": {"uri": "spotify:track:old"}}])
+
+    context = MagicMock()
+    context.store = store
+    context.enricher = None
+    context.top_tracks = None
+    context.spotify.play_log = None
+    context.strava.get_activities.return_value = [activity]
+    context.spotify.get_recently_played.return_value = [
+        {"played_at": "2024-05-01T07:50:00.000Z", "track": {"uri": "spotify:track:new"}},
+        {"played_at": "2024-05-01T09:00:00.000Z", "track": {"uri": "spotify:track:after"}},
+    ]
+    context.spotify.create_activity_playlist.return_value = "playlist_1"
+
+    results = process_activities(create_playlist=True, context=context)
+
+    assert results[0]["tracks"] == ["spotify:track:new", "spotify:track:old"]
+    context.spotify.get_activity_tracks.assert_not_called()
+    assert store.is_processed(123)
+    assert store.playlists_for_activity(123) == ["playlist_1"]
+
+    # The next run skips the processed activity without touching Spotify
+    assert process_activities(create_playlist=True, context=context) == []
+    context.spotify.create_activity_playlist.assert_called_once()
+
+
+def test_process_activities_with_play_archive(tmp_path):
+    from datetime import datetime, timezone, timedelta
+    from src.archive import PlayArchive, PartitionedArchive
+    from src.storage import LocalStorage
+    from src.strava.activities import ActivityRecord
+
+    start = datetime(2024, 5, 1, 7, 0, tzinfo=timezone.utc)
+    end = start + timedelta(hours=1)
+    storage = LocalStorage(str(tmp_path))
+    archive = PlayArchive(storage)
+    archive.add_plays([{"played_at": "2024-05-01T07:10:00.000Z", "track": {"uri": "spotify:track:old"}}])
+    archive.flush()
+
+    context = MagicMock()
+    context.store = None
+    context.play_archive = PlayArchive(storage)
+    context.results_archive = PartitionedArchive(storage, "results", "start_time")
+    context.enricher = None
+    context.top_tracks = None
+    context.spotify.play_log = None
+    context.strava.get_activities.return_value = [
+        ActivityRecord("Test Run", start, start.timestamp(), end, end.timestamp(), activity_id=123)
+    ]
+    context.spotify.get_recently_played.return_value = [
+        {"played_at": "2024-05-01T07:50:00.000Z", "track": {"uri": "spotify:track:new"}},
+    ]
+
+    results = process_activities(create_playlist=False, context=context)
+
+    assert results[0]["tracks"] == ["spotify:track:new", "spotify:track:old"]
+    context.spotify.get_activity_tracks.assert_not_called()
+    assert context.results_archive.query(start.timestamp() - 1, end.timestamp())[0]["activity_id"] == 123
+
+
+def test_process_activities_defers_after_circuit_opens():
+    from datetime import datetime, timezone, timedelta
+    from src.deadline import CircuitOpen
+
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(hours=1)
+    first = ("First Run", now, now.timestamp(), end, end.timestamp())
+    second = ("Second Run", now, now.timestamp(), end, end.timestamp())
+    context = MagicMock()
+    context.store = None
+    context.play_archive = None
+    context.enricher = None
+    context.top_tracks = None
+    context.strava.get_activities.return_value = [first, second]
+    context.spotify.get_activity_tracks.side_effect = CircuitOpen("api.spotify.com down")
+
+    results = process_activities(create_playlist=True, limit=2, context=context)
+
+    assert results == []
+    assert context.deferred == [first, second]
+    context.spotify.create_activity_playlist.assert_not_called()
+    # Whatever was done is still saved
+    context.save_state.assert_called_once()
+
+
+def test_main_parses_deadline():
+    from src.main import main
+
+    with patch("src.main.process_activities") as mock_process, \
+         patch("src.main.exporter_from_env", return_value=None):
+        main(["--deadline", "30"])
+
+    deadline = mock_process.call_args.kwargs["deadline"]
+    assert 29 < deadline.remaining() <= 30
+
+
+def test_process_activity_enriches_tracks():
+    from datetime import datetime, timezone, timedelta
+    from src.main import process_activity
+
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(hours=1)
+    spotify = MagicMock()
+    spotify.get_activity_tracks.return_value = ["spotify:track:a", "spotify:track:a"]
+    enricher = MagicMock()
+    enricher.enrich.return_value = {
+        "spotify:track:a": {"name": "A", "artist": "X", "duration_ms": 180000, "tempo": 170.0}
+    }
+
+    result = process_activity(("Test Run", now, now.timestamp(), end, end.timestamp()), spotify, enricher=enricher)
+
+    enricher.enrich.assert_called_once_with(spotify, ["spotify:track:a"])
+    assert result["track_details"][1]["artist"] == "X"
+    description = spotify.create_activity_playlist.call_args.kwargs["description"]
+    assert description == "Test Run · 2 tracks · 6 min · avg 170 BPM · X"
+
+
+def test_process_activities_groups_same_day_runs(tmp_path):
+    from datetime import datetime, timezone, timedelta
+    from src.store import StateStore
+    from src.strava.activities import ActivityRecord
+
+    morning = datetime(2024, 5, 1, 7, 0, tzinfo=timezone.utc)
+    evening = datetime(2024, 5, 1, 18, 0, tzinfo=timezone.utc)
+    store = StateStore(str(tmp_path / "state.db"))
+    context = MagicMock()
+    context.store = store
+    context.enricher = None
+    context.top_tracks = None
+    context.spotify.play_log = None
+    context.strava.get_activities.return_value = [
+        ActivityRecord("Evening Run", evening, evening.timestamp(), evening + timedelta(hours=1),
+                       evening.timestamp() + 3600, activity_id=2),
+        ActivityRecord("Morning Run", morning, morning.timestamp(), morning + timedelta(hours=1),
+                       morning.timestamp() + 3600, activity_id=1),
+    ]
+    context.spotify.get_recently_played.return_value = [
+        {"played_at": "2024-05-01T18:30:00.000Z", "track": {"uri": "spotify:track:evening"}},
+        {"played_at": "2024-05-01T07:30:00.000Z", "track": {"uri": "spotify:track:morning"}},
+    ]
+    context.spotify.create_activity_playlist.return_value = "playlist_1"
+
+    results = process_activities(create_playlist=True, limit=2, context=context, group_by="day")
+
+    context.spotify.create_activity_playlist.assert_called_once()
+    args, kwargs = context.spotify.create_activity_playlist.call_args
+    assert args[3] == ["spotify:track:morning", "spotify:track:evening"]
+    assert kwargs["name"] == "Runlist - 1/5"
+    assert [result["playlist_id"] for result in results] == ["playlist_1", "playlist_1"]
+    assert store.is_processed(1) and store.is_processed(2)
+
+
+def test_process_activities_enriches_once_per_run(tmp_path):
+    from datetime import datetime, timezone, timedelta
+    from src.store import StateStore
+    from src.strava.activities import ActivityRecord
+
+    morning = datetime(2024, 5, 1, 7, 0, tzinfo=timezone.utc)
+    evening = datetime(2024, 5, 1, 18, 0, tzinfo=timezone.utc)
+    context = MagicMock()
+    context.store = StateStore(str(tmp_path / "state.db"))
+    context.top_tracks = None
+    context.spotify.play_log = None
+    context.strava.get_activities.return_value = [
+        ActivityRecord("Evening Run", evening, evening.timestamp(), evening + timedelta(hours=1),
+                       evening.timestamp() + 3600, activity_id=2),
+        ActivityRecord("Morning Run", morning, morning.timestamp(), morning + timedelta(hours=1),
+                       morning.timestamp() + 3600, activity_id=1),
+    ]
+    context.spotify.get_recently_played.return_value = [
+        {"played_at": "2024-05-01T18:30:00.000Z", "track": {"uri": "spotify:track:a"}},
+        {"played_at": "2024-05-01T18:40:00.000Z", "track": {"uri": "spotify:track:b"}},
+        {"played_at": "2024-05-01T07:30:00.000Z", "track": {"uri": "spotify:track:a"}},
+    ]
+    context.enricher.enrich.return_value = {
+        "spotify:track:a": {"name": "A", "artist": "X", "duration_ms": 180000, "tempo": 170.0},
+    }
+    context.spotify.create_activity_playlist.return_value = "playlist_1"
+
+    results = process_activities(create_playlist=True, limit=2, context=context)
+
+    context.enricher.enrich.assert_called_once_with(context.spotify, ["spotify:track:b", "spotify:track:a"])
+    details = {result["activity_name"]: result["track_details"] for result in results}
+    assert details["Evening Run"] == [None, {"name": "A", "artist": "X", "duration_ms": 180000, "tempo": 170.0}]
+    assert details["Morning Run"] == [{"name": "A", "artist": "X", "duration_ms": 180000, "tempo": 170.0}]
+    # Descriptions are written with the details
+    assert "170 BPM" in context.spotify.create_activity_playlist.call_args.kwargs["description"]
+
+
+def test_process_activities_updates_top_tracks(tmp_path):
+    from datetime import datetime, timezone, timedelta
+    from src.storage import LocalStorage
+    from src.store import StateStore
+    from src.strava.activities import ActivityRecord
+    from src.top_tracks import TopTracks
+
+    start = datetime(2024, 5, 1, 7, 0, tzinfo=timezone.utc)
+    context = MagicMock()
+    context.store = StateStore(str(tmp_path / "state.db"))
+    context.enricher = None
+    context.top_tracks = TopTracks(LocalStorage(str(tmp_path)), runs=5)
+    context.spotify.play_log = None
+    context.strava.get_activities.return_value = [
+        ActivityRecord("Morning Run", start, start.timestamp(), start + timedelta(hours=1),
+                       start.timestamp() + 3600, activity_id=1),
+    ]
+    context.spotify.get_recently_played.return_value = [
+        {"played_at": "2024-05-01T07:40:00.000Z", "track": {"uri": "spotify:track:b"}},
+        {"played_at": "2024-05-01T07:30:00.000Z", "track": {"uri": "spotify:track:a"}},
+        {"played_at": "2024-05-01T07:20:00.000Z", "track": {"uri": "spotify:track:b"}},
+    ]
+    context.spotify.create_activity_playlist.return_value = "run_playlist"
+    context.spotify.create_playlist.return_value = "top_playlist"
+
+    process_activities(create_playlist=True, limit=1, context=context)
+
+    assert context.top_tracks.counts == {"spotify:track:a": 1, "spotify:track:b": 2}
+    context.spotify.update_playlist.assert_called_once_with(
+        "top_playlist", add=["spotify:track:b", "spotify:track:a"], remove=[]
+    )
+
+
+def test_process_activity_uses_stored_moving_intervals(tmp_path):
+    from datetime import datetime, timezone, timedelta
+    from src.main import process_activity
+    from src.store import StateStore
+    from src.strava.activities import ActivityRecord
+
+    start = datetime(2024, 5, 1, 7, 0, tzinfo=timezone.utc)
+    end = start + timedelta(hours=1)
+    activity = ActivityRecord("Imported Run", start, start.timestamp(), end, end.timestamp(), activity_id=7)
+    store = StateStore(str(tmp_path / "state.db"))
+    # Stopped between 07:20 and 07:40
+    store.add_moving_intervals(7, [
+        (start.timestamp(), start.timestamp() + 1200),
+        (start.timestamp() + 2400, end.timestamp()),
+    ])
+    strava = MagicMock()
+    spotify = MagicMock()
+    spotify.play_log = None
+    spotify.get_recently_played.return_value = [
+        {"played_at": "2024-05-01T07:50:00.000Z", "track": {"uri": "spotify:track:running"}},
+        {"played_at": "2024-05-01T07:30:00.000Z", "track": {"uri": "spotify:track:stopped"}},
+    ]
+
+    result = process_activity(activity, spotify, create_playlist=False, strava=strava, store=store)
+
+    strava.get_activity_streams.assert_not_called()
+    assert result["tracks"] == ["spotify:track:running"]
+
+
+def test_process_activities_from_store(tmp_path):
+    from datetime import datetime, timezone, timedelta
+    from src.store import StateStore
+    from src.strava.activities import ActivityRecord
+
+    morning = datetime(2019, 6, 1, 7, 0, tzinfo=timezone.utc)
+    store = StateStore(str(tmp_path / "state.db"))
+    # As left by a Strava archive import: activities and old plays, nothing processed
+    store.add_activities([
+        ActivityRecord("Old Run", morning, morning.timestamp(), morning + timedelta(hours=1),
+                       morning.timestamp() + 3600, activity_id=1),
+        ActivityRecord("Old Ride", morning, morning.timestamp() + 7200, morning + timedelta(hours=3),
+                       morning.timestamp() + 10800, activity_id=2, activity_type="Ride"),
+    ])
+    store.add_play_rows([(morning.timestamp() + 600, "2019-06-01T07:10:00.000Z", "spotify:track:a")])
+    context = MagicMock()
+    context.store = store
+    context.enricher = None
+    context.top_tracks = None
+    context.spotify.play_log = None
+    context.spotify.get_recently_played.return_value = []
+    context.spotify.create_activity_playlist.return_value = "playlist_1"
+
+    results = process_activities(create_playlist=True, context=context, source="store",
+                                 since=morning.timestamp() - 1)
+
+    context.strava.get_activities.assert_not_called()
+    assert [(result["activity_id"], result["tracks"]) for result in results] == [(1, ["spotify:track:a"])]
+    assert store.is_processed(1)
+
+    with pytest.raises(ValueError, match="Unknown activity source"):
+        process_activities(context=context, source="elsewhere")
+
+
+def test_stored_activities():
+    from src.main import stored_activities
+
+    store = MagicMock()
+    store.runs.return_value = [(1, "Run", "Run", 100.0, 200.0, None, None)]
+
+    records = stored_activities(store, 5)
+
+    store.runs.assert_called_once_with(5, None)
+    assert records[0].activity_id == 1
+    assert records[0].start.tzinfo is not None
+    with pytest.raises(ValueError, match="STATE_DB"):
+        stored_activities(None, 5)
+
+
+def test_main_from_store_since():
+    from src.main import main
+
+    with patch("src.main.process_activities") as mock_process, \
+         patch("src.main.exporter_from_env", return_value=None):
+        main(["--from-store", "--since", "2019-06-01", "--limit", "3"])
+
+    kwargs = mock_process.call_args.kwargs
+    assert kwargs["source"] == "store"
+    assert kwargs["since"] == 1559347200.0
+    assert kwargs["limit"] == 3
+    # Imported moving stretches are used without asking
+    assert kwargs["align_streams"] is True
+
+
+def test_main_align_streams_flag():
+    from src.main import main
+
+    with patch("src.main.process_activities") as mock_process, \
+         patch("src.main.exporter_from_env", return_value=None):
+        main([])
+        assert mock_process.call_args.kwargs["align_streams"] is False
+
+        main(["--align-streams"])
+        assert mock_process.call_args.kwargs["align_streams"] is True
+
+
+def test_main_plan_makes_no_run():
+    from src.main import main
+
+    with patch("src.main.AppContext"), \
+         patch("src.main.plan_from_context", return_value={'calls': {}}) as mock_plan, \
+         patch("src.main.process_activities") as mock_process:
+        assert main(["--plan"]) == {'calls': {}}
+
+    mock_plan.assert_called_once()
+    mock_process.assert_not_called()
+
+
+def test_main_plan_follows_run_options():
+    from src.main import main
+
+    with patch("src.main.AppContext"), \
+         patch("src.main.plan_from_context", return_value={'calls': {}}) as mock_plan:
+        main(["--plan", "--from-store", "--since", "2019-06-01", "--limit", "3"])
+
+    kwargs = mock_plan.call_args.kwargs
+    assert kwargs["limit"] == 3
+    assert kwargs["source"] == "store"
+    assert kwargs["since"] == 1559347200.0
+    assert kwargs["align_streams"] is True
+
+
+def test_process_activity_id_fresh_bypasses_http_cache():
+    from src.main import process_activity_id
+
+    context = MagicMock()
+    context.store = None
+    context.strava.get_activity.return_value = None
+
+    assert process_activity_id(123, context=context, fresh=True) is None
+
+    context.http_cache.bypass.assert_called_once()
+    context.http_cache.bypass.return_value.__enter__.assert_called_once()
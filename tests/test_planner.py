@@ -0,0 +1,137 @@
+from datetime import datetime, timezone, timedelta
+from unittest.mock import MagicMock
+import pytest
+
+from src.planner import plan_playlists, write_playlist
+from src.store import StateStore
+from src.strava.activities import ActivityRecord
+
+
+def _matched(activity_id, start, tracks, activity_type="Run"):
+    end = start + timedelta(hours=1)
+    activity = ActivityRecord(
+        f"Run {activity_id}", start, start.timestamp(), end, end.timestamp(),
+        activity_id=activity_id, activity_type=activity_type
+    )
+    result = {
+        "activity_id": activity_id,
+        "activity_type": activity_type,
+        "activity_name": f"Run {activity_id}",
+        "start_time": start.isoformat(),
+        "end_time": end.isoformat(),
+        "track_count": len(tracks),
+        "tracks": tracks,
+    }
+    return activity, result
+
+
+MORNING = datetime(2024, 5, 1, 7, 0, tzinfo=timezone.utc)
+EVENING = datetime(2024, 5, 1, 18, 0, tzinfo=timezone.utc)
+NEXT_DAY = datetime(2024, 5, 2, 7, 0, tzinfo=timezone.utc)
+
+
+def test_one_playlist_per_activity_has_unique_names():
+    matched = [_matched(1, MORNING, ["a"]), _matched(2, EVENING, ["b"])]
+
+    groups = plan_playlists(matched, "activity")
+
+    assert [group.name for group in groups] == ["Runlist - 1/5", "Runlist - 1/5 (2)"]
+
+
+def test_group_by_day_merges_in_order():
+    matched = [_matched(3, NEXT_DAY, ["c"]), _matched(2, EVENING, ["b1", "b2"]), _matched(1, MORNING, ["a"])]
+
+    groups = plan_playlists(matched, "day")
+
+    assert [group.key for group in groups] == ["2024-05-01", "2024-05-02"]
+    assert groups[0].tracks == ["a", "b1", "b2"]
+    assert groups[0].description() == "Run 1 + Run 2"
+
+
+def test_group_by_week_and_type():
+    matched = [
+        _matched(1, MORNING, ["a"]),
+        _matched(2, NEXT_DAY, ["b"], activity_type="TrailRun"),
+        _matched(3, NEXT_DAY + timedelta(days=7), ["c"]),
+    ]
+
+    by_week = plan_playlists(matched, "week")
+    assert [group.name for group in by_week] == ["Runlist - week 18/2024", "Runlist - week 19/2024"]
+
+    by_type = plan_playlists(matched, "type")
+    assert [(group.key, len(group.members)) for group in by_type] == [("Run", 2), ("TrailRun", 1)]
+
+
+def test_taken_names_are_avoided():
+    groups = plan_playlists([_matched(1, MORNING, ["a"])], "day", taken_names={"Runlist - 1/5", "Runlist - 1/5 (2)"})
+
+    assert groups[0].name == "Runlist - 1/5 (3)"
+
+
+def test_unknown_grouping():
+    with pytest.raises(ValueError):
+        plan_playlists([], "month")
+
+
+def test_description_uses_track_details():
+    activity, result = _matched(1, MORNING, ["a"])
+    result["track_details"] = [{"name": "A", "artist": "X", "duration_ms": 240000, "tempo": 160.0}]
+
+    group = plan_playlists([(activity, result)], "day")[0]
+
+    assert group.description() == "Run 1 · 1 tracks · 4 min · avg 160 BPM · X"
+
+
+def test_write_playlist_records_every_member(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    spotify = MagicMock()
+    spotify.create_activity_playlist.return_value = "playlist_1"
+    group = plan_playlists([_matched(1, MORNING, ["a"]), _matched(2, EVENING, ["b"]), _matched(3, EVENING, [])], "day")[0]
+
+    assert write_playlist(group, spotify, store) == "playlist_1"
+
+    spotify.create_activity_playlist.assert_called_once_with(
+        "Run 1", MORNING, EVENING + timedelta(hours=1), ["a", "b"],
+        description="Run 1 + Run 2 + Run 3", name="Runlist - 1/5"
+    )
+    assert store.playlists_for_activity(2) == ["playlist_1"]
+    assert all(store.is_processed(activity_id) for activity_id in (1, 2, 3))
+    assert store.playlist_names() == {"Runlist - 1/5"}
+    assert group.members[0][1]["playlist_id"] == "playlist_1"
+
+
+def test_write_playlist_leaves_uncovered_empty_activity(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    spotify = MagicMock()
+    spotify.history_covers.return_value = False
+    group = plan_playlists([_matched(1, MORNING, [])], "activity")[0]
+
+    write_playlist(group, spotify, store)
+    assert not store.is_processed(1)
+
+    spotify.history_covers.return_value = True
+    write_playlist(group, spotify, store)
+    assert store.is_processed(1)
+
+
+def test_write_playlist_counts_top_tracks(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    spotify = MagicMock()
+    spotify.history_covers.return_value = False
+    spotify.create_activity_playlist.return_value = "playlist_1"
+    top_tracks = MagicMock()
+    groups = plan_playlists([_matched(1, MORNING, ["a", "a"]), _matched(2, EVENING, [])], "activity")
+
+    for group in groups:
+        write_playlist(group, spotify, store, top_tracks=top_tracks)
+
+    # The activity still waiting for its plays is not counted yet
+    top_tracks.add.assert_called_once_with(groups[0].activities[0], ["a", "a"])
+
+
+def test_write_playlist_without_tracks():
+    spotify = MagicMock()
+    group = plan_playlists([_matched(1, MORNING, [])], "activity")[0]
+
+    assert write_playlist(group, spotify) is None
+    spotify.create_activity_playlist.assert_not_called()
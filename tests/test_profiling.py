@@ -0,0 +1,83 @@
+import pstats
+from unittest.mock import patch, MagicMock
+import pytest
+
+from src.profiling import Profiler, profiler_from_env, peak_rss_mb
+from src.storage import LocalStorage
+
+
+def _work():
+    return sorted(str(i) for i in range(20000))
+
+
+def test_profiler_writes_report_and_stats(tmp_path):
+    with Profiler(LocalStorage(str(tmp_path)), label="test") as profiler:
+        _work()
+
+    assert len(profiler.keys) == 2
+    report = (tmp_path / profiler.keys[0]).read_text()
+    assert "cProfile" in report
+    assert "tracemalloc" in report
+    assert "_work" in report
+    assert "peak RSS" in report
+    # The raw stats load with pstats
+    pstats.Stats(str(tmp_path / profiler.keys[1]))
+
+
+def _pooled_work():
+    return sorted(str(i) for i in range(20000))
+
+
+def test_profiler_covers_thread_pools(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    with Profiler(LocalStorage(str(tmp_path)), memory=False) as profiler:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(lambda _: _pooled_work(), range(2)))
+
+    report = (tmp_path / profiler.keys[0]).read_text()
+    assert "_pooled_work" in report
+    assert "threads" in report
+    assert "_pooled_work" in str(pstats.Stats(str(tmp_path / profiler.keys[1])).stats)
+
+
+def test_profiler_memory_only(tmp_path):
+    with Profiler(LocalStorage(str(tmp_path)), cpu=False) as profiler:
+        _work()
+
+    assert profiler.keys[0].endswith(".txt")
+    assert len(profiler.keys) == 1
+    assert "cProfile" not in (tmp_path / profiler.keys[0]).read_text()
+
+
+def test_profiler_does_not_mask_errors_or_fail_run():
+    storage = MagicMock()
+    storage.put.side_effect = OSError("disk full")
+
+    with pytest.raises(ValueError):
+        with Profiler(storage, memory=False):
+            raise ValueError("run failed")
+
+    with Profiler(storage, memory=False):
+        _work()
+
+
+def test_peak_rss():
+    assert peak_rss_mb() > 0
+
+
+def test_profiler_from_env(tmp_path):
+    with patch.dict("os.environ", {}, clear=True):
+        assert profiler_from_env() is None
+        profiler = profiler_from_env(mode="cpu", directory=str(tmp_path))
+    assert profiler.cpu is True
+    assert profiler.memory is False
+    assert profiler.storage.root == str(tmp_path)
+
+    with patch.dict("os.environ", {"PROFILE": "all", "PROFILE_SAMPLE_RATE": "0"}):
+        assert profiler_from_env() is None
+
+    with patch.dict("os.environ", {"PROFILE": "memory", "S3_BUCKET": "test-bucket"}), \
+         patch("boto3.client"):
+        profiler = profiler_from_env(use_s3=True)
+    assert profiler.storage.prefix == "motivator/profiles"
@@ -0,0 +1,45 @@
+from src.sessions import (
+    PooledAdapter,
+    RETRY_METHODS,
+    connection_stats,
+    create_session,
+    get_shared_session,
+)
+
+
+def test_create_session_mounts_pooled_adapter():
+    session = create_session(pool_maxsize=7, retries=5, backoff_factor=0.5)
+    adapter = session.get_adapter("https://www.strava.com/api/v3/athlete")
+
+    assert isinstance(adapter, PooledAdapter)
+    assert adapter._pool_maxsize == 7
+    assert adapter.max_retries.total == 5
+    assert adapter.max_retries.backoff_factor == 0.5
+    assert 429 in adapter.max_retries.status_forcelist
+    assert session.headers["Connection"] == "keep-alive"
+
+
+def test_retry_policy_skips_post():
+    # Retrying a playlist create could create duplicate playlists
+    assert "POST" not in RETRY_METHODS
+    assert "GET" in RETRY_METHODS
+
+
+def test_get_shared_session_is_singleton():
+    assert get_shared_session() is get_shared_session()
+
+
+def test_connection_stats():
+    session = create_session()
+    adapter = session.get_adapter("https://api.spotify.com")
+    pool = adapter.poolmanager.connection_from_host("api.spotify.com", 443, scheme="https")
+    pool.num_requests = 5
+    pool.num_connections = 1
+
+    stats = connection_stats(session)
+
+    assert stats == {"api.spotify.com": {"requests": 5, "connections": 1, "reused": 4}}
+
+
+def test_connection_stats_empty_session():
+    assert connection_stats(create_session()) == {}
@@ -0,0 +1,63 @@
+import time
+import threading
+from unittest.mock import MagicMock
+import pytest
+
+from src.startup import StartupReport, run_parallel, start_run
+
+
+def test_run_parallel_overlaps_chains():
+    def slow(value):
+        def chain():
+            time.sleep(0.1)
+            return value
+        return chain
+
+    results, report = run_parallel({"strava": slow("a"), "spotify": slow("b")})
+
+    assert results == {"strava": "a", "spotify": "b"}
+    assert report.wall < report.sequential
+    assert report.saved > 0.05
+
+
+def test_run_parallel_waits_for_all_before_raising():
+    finished = threading.Event()
+
+    def failing():
+        raise RuntimeError("strava down")
+
+    def slow():
+        time.sleep(0.05)
+        finished.set()
+
+    with pytest.raises(RuntimeError):
+        run_parallel({"strava": failing, "spotify": slow})
+    assert finished.is_set()
+
+
+def test_startup_report():
+    report = StartupReport({"strava": 1.2, "spotify": 0.8}, wall=1.25)
+
+    assert report.sequential == pytest.approx(2.0)
+    assert report.saved == pytest.approx(0.75)
+    assert report.as_dict()["saved"] == 0.75
+    assert "saved 0.75s" in str(report)
+
+
+def test_start_run_lists_activities_and_prefetches_history():
+    context = MagicMock()
+    context.strava.get_activities.return_value = iter(["run"])
+    context.spotify.history_max_age = 60
+
+    activities, report = start_run(context, limit=3)
+
+    assert activities == ["run"]
+    context.prepare.assert_called_once()
+    context.ensure_strava.assert_called_once()
+    context.ensure_spotify.assert_called_once()
+    context.strava.get_activities.assert_called_once_with(limit=3)
+    context.spotify.get_recently_played.assert_called_once_with(max_age=60)
+    assert set(report.durations) == {"strava", "spotify"}
+
+    start_run(context, limit=1, prefetch_history=False)
+    context.spotify.get_recently_played.assert_called_once()
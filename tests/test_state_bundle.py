@@ -0,0 +1,240 @@
+import gzip
+import json
+import os
+from unittest.mock import patch, MagicMock
+import pytest
+
+from botocore.exceptions import ClientError
+
+from src.state_bundle import BundleStorage, StateBundle, StateConflict, bundle_from_env
+
+
+def _client_error(code):
+    return ClientError({"Error": {"Code": code}}, "Operation")
+
+
+def _body(sections, version=1):
+    body = MagicMock()
+    body.read.return_value = gzip.compress(json.dumps({"version": version, "sections": sections}).encode("utf-8"))
+    return body
+
+
+@pytest.fixture
+def s3_client():
+    client = MagicMock()
+    client.get_object.return_value = {"Body": _body({"token": {"access_token": "a"}}), "ETag": '"v1"'}
+    client.put_object.return_value = {"ETag": '"v2"'}
+    return client
+
+
+def test_load_and_get(s3_client):
+    bundle = StateBundle(s3_client, "test-bucket", "motivator/state.json.gz")
+
+    assert bundle.load() is True
+    assert bundle.get("token") == {"access_token": "a"}
+    assert bundle.etag == '"v1"'
+    s3_client.get_object.assert_called_once_with(Bucket="test-bucket", Key="motivator/state.json.gz")
+
+
+def test_reload_is_conditional(s3_client):
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+    s3_client.get_object.side_effect = _client_error("304")
+
+    assert bundle.load() is False
+    assert s3_client.get_object.call_args.kwargs["IfNoneMatch"] == '"v1"'
+    assert bundle.get("token") == {"access_token": "a"}
+
+
+def test_missing_bundle(s3_client):
+    s3_client.get_object.side_effect = _client_error("NoSuchKey")
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+
+    bundle.load()
+    bundle.set("token", {"access_token": "b"})
+    bundle.save()
+
+    assert bundle.loaded is True
+    assert s3_client.put_object.call_args.kwargs["IfNoneMatch"] == "*"
+
+
+def test_save_only_when_dirty(s3_client):
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+
+    bundle.set("token", {"access_token": "a"})
+    assert bundle.save() is False
+
+    bundle.set("cursor", 5)
+    assert bundle.save() is True
+    kwargs = s3_client.put_object.call_args.kwargs
+    assert kwargs["IfMatch"] == '"v1"'
+    assert json.loads(gzip.decompress(kwargs["Body"]))["sections"]["cursor"] == 5
+    assert bundle.etag == '"v2"'
+    assert bundle.save() is False
+
+
+def test_save_conflict(s3_client):
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+    bundle.set("cursor", 5)
+    s3_client.put_object.side_effect = _client_error("PreconditionFailed")
+
+    with pytest.raises(StateConflict):
+        bundle.save()
+
+
+def test_save_conflict_merges_and_retries(s3_client):
+    s3_client.get_object.return_value = {
+        "Body": _body({"token": {"access_token": "a"}, "blobs": {"shared": "x", "mine": "1"}}), "ETag": '"v1"'}
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+    bundle.set("cursor", 5)
+    bundle.set("blobs", {"shared": "x", "mine": "2"})
+
+    # Another writer changed a different blob in the meantime
+    s3_client.get_object.return_value = {
+        "Body": _body({"token": {"access_token": "b"}, "blobs": {"shared": "y", "mine": "1"}}), "ETag": '"v9"'}
+    s3_client.put_object.side_effect = [_client_error("PreconditionFailed"), {"ETag": '"v10"'}]
+
+    assert bundle.save() is True
+    kwargs = s3_client.put_object.call_args.kwargs
+    assert kwargs["IfMatch"] == '"v9"'
+    assert json.loads(gzip.decompress(kwargs["Body"]))["sections"] == {
+        "token": {"access_token": "b"},
+        "blobs": {"shared": "y", "mine": "2"},
+        "cursor": 5,
+    }
+    assert bundle.dirty is False
+    # The merged content is news to whatever derives from the bundle
+    s3_client.get_object.side_effect = _client_error("304")
+    assert bundle.load() is True
+    assert bundle.load() is False
+
+
+def test_save_conflict_uses_registered_merge(s3_client):
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+    bundle.set("token", {"access_token": "ours"})
+    bundle.register_merge("token", lambda base, ours, theirs: {"access_token": ours["access_token"] + theirs["access_token"]})
+
+    s3_client.get_object.return_value = {"Body": _body({"token": {"access_token": "theirs"}}), "ETag": '"v9"'}
+    s3_client.put_object.side_effect = [_client_error("PreconditionFailed"), {"ETag": '"v10"'}]
+    bundle.save()
+
+    assert bundle.get("token") == {"access_token": "ourstheirs"}
+
+
+def test_save_conflict_keeps_changes_pending(s3_client):
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+    bundle.set("cursor", 5)
+    s3_client.put_object.side_effect = _client_error("PreconditionFailed")
+
+    with pytest.raises(StateConflict):
+        bundle.save(attempts=2)
+
+    assert s3_client.put_object.call_count == 2
+    assert bundle.dirty is True
+    assert bundle.get("cursor") == 5
+
+
+def test_bundle_storage_merge_on_bytes(s3_client):
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+    storage = BundleStorage(bundle)
+    storage.put("state.db", b"ours")
+    storage.register_merge("state.db", lambda base, ours, theirs: ours + theirs)
+
+    other = StateBundle(MagicMock(), "test-bucket", "state")
+    BundleStorage(other).put("state.db", b"theirs")
+    s3_client.get_object.return_value = {"Body": _body(other.sections), "ETag": '"v9"'}
+    s3_client.put_object.side_effect = [_client_error("PreconditionFailed"), {"ETag": '"v10"'}]
+    bundle.save()
+
+    assert storage.get("state.db") == b"ourstheirs"
+
+
+def test_load_keeps_pending_changes(s3_client):
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+    bundle.set("cursor", 5)
+
+    assert bundle.load() is False
+    assert bundle.get("cursor") == 5
+    assert s3_client.get_object.call_count == 1
+
+
+def test_load_section_while_dirty(s3_client):
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+    bundle.set("blobs", {"state.db": "ours"})
+
+    # Another container rotated the token meanwhile
+    s3_client.get_object.return_value = {
+        "Body": _body({"token": {"access_token": "rotated"}, "blobs": {"state.db": "theirs"}}), "ETag": '"v3"'
+    }
+    assert bundle.load() is False
+    assert bundle.load_section("token") is True
+
+    assert bundle.get("token") == {"access_token": "rotated"}
+    # Other pending changes and the ETag are left for the save to reconcile
+    assert bundle.get("blobs") == {"state.db": "ours"}
+    assert bundle.etag == '"v1"'
+    assert bundle.dirty is True
+    assert bundle.load_section("token") is False
+
+
+def test_newer_version_rejected(s3_client):
+    s3_client.get_object.return_value = {"Body": _body({}, version=99), "ETag": '"v1"'}
+
+    with pytest.raises(ValueError, match="newer than supported"):
+        StateBundle(s3_client, "test-bucket", "state").load()
+
+
+def test_bundle_storage(s3_client):
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+    storage = BundleStorage(bundle)
+
+    assert storage.get("state.db") is None
+    storage.put("state.db", b"\x00sqlite")
+    assert storage.get("state.db") == b"\x00sqlite"
+    assert storage.keys("state") == ["state.db"]
+    assert storage.keys("http-cache/") == []
+    storage.delete("state.db")
+    assert storage.get("state.db") is None
+    assert bundle.dirty is True
+
+
+def test_constant_requests_per_run(s3_client, tmp_path):
+    # Token, HTTP cache entries and the state database all share one object
+    from src.http_cache import HttpCache
+    from src.store import SyncedStateStore
+
+    bundle = StateBundle(s3_client, "test-bucket", "state")
+    bundle.load()
+    storage = BundleStorage(bundle)
+    cache = HttpCache(storage)
+    store = SyncedStateStore(str(tmp_path / "state.db"), storage)
+
+    bundle.set("token", {"access_token": "refreshed"})
+    for i in range(20):
+        cache.store(f"https://www.strava.com/api/v3/activities/{i}", {"stored_at": 0})
+    store.add_plays([{"played_at": "2024-05-01T07:10:00.000Z", "track": {"uri": "spotify:track:a"}}])
+    store.save()
+    bundle.save()
+
+    assert s3_client.get_object.call_count == 1
+    assert s3_client.put_object.call_count == 1
+
+
+def test_bundle_from_env():
+    with patch.dict(os.environ, {"STATE_BUNDLE": "true", "S3_BUCKET": "test-bucket"}), \
+         patch("boto3.client"):
+        assert bundle_from_env(use_s3=False) is None
+        bundle = bundle_from_env(use_s3=True)
+        assert bundle.key == "motivator/state.json.gz"
+
+    with patch.dict(os.environ, {"STATE_BUNDLE": "false"}):
+        assert bundle_from_env(use_s3=True) is None
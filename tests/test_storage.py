@@ -0,0 +1,101 @@
+from unittest.mock import MagicMock
+import pytest
+
+from botocore.exceptions import ClientError
+
+from src.storage import LocalStorage, S3Storage, WriteConflict
+
+
+def test_local_storage_roundtrip(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+
+    assert storage.get("a/b.json") is None
+    storage.put("a/b.json", b"data")
+    assert storage.get("a/b.json") == b"data"
+    assert (tmp_path / "a" / "b.json").exists()
+
+    storage.delete("a/b.json")
+    storage.delete("a/b.json")
+    assert storage.get("a/b.json") is None
+
+
+def test_local_storage_keys(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    storage.put("cache/a.json", b"a")
+    storage.put("cache/b.json", b"b")
+    storage.put("other.json", b"c")
+
+    assert sorted(storage.keys("cache/")) == ["cache/a.json", "cache/b.json"]
+    assert len(storage.keys()) == 3
+
+
+def test_local_storage_put_if(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    storage.put_if("manifest.json", b"one", None)
+    data, version = storage.get_versioned("manifest.json")
+    assert data == b"one"
+
+    with pytest.raises(WriteConflict):
+        storage.put_if("manifest.json", b"stale", None)
+    storage.put_if("manifest.json", b"two", version)
+    with pytest.raises(WriteConflict):
+        storage.put_if("manifest.json", b"stale", version)
+    assert storage.get("manifest.json") == b"two"
+    assert storage.keys() == ["manifest.json"]
+
+
+def test_s3_storage_put_if():
+    s3_client = MagicMock()
+    storage = S3Storage("test-bucket", "motivator", s3_client=s3_client)
+
+    storage.put_if("manifest.json", b"data", '"etag"')
+    storage.put_if("new.json", b"data", None)
+    assert s3_client.put_object.call_args_list[0].kwargs["IfMatch"] == '"etag"'
+    assert s3_client.put_object.call_args_list[1].kwargs["IfNoneMatch"] == "*"
+
+    s3_client.put_object.side_effect = ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+    with pytest.raises(WriteConflict):
+        storage.put_if("manifest.json", b"data", '"etag"')
+
+
+def test_s3_storage_keys():
+    s3_client = MagicMock()
+    s3_client.get_paginator.return_value.paginate.return_value = [
+        {"Contents": [{"Key": "motivator/cache/a.json"}]},
+        {"Contents": [{"Key": "motivator/cache/b.json"}]},
+    ]
+    storage = S3Storage("test-bucket", "motivator/", s3_client=s3_client)
+
+    assert storage.keys("cache/") == ["cache/a.json", "cache/b.json"]
+    s3_client.get_paginator.return_value.paginate.assert_called_once_with(
+        Bucket="test-bucket", Prefix="motivator/cache/"
+    )
+
+
+def test_s3_storage_prefixes_keys():
+    s3_client = MagicMock()
+    s3_client.get_object.return_value = {"Body": MagicMock()}
+    s3_client.get_object.return_value["Body"].read.return_value = b"data"
+    storage = S3Storage("test-bucket", "motivator/", s3_client=s3_client)
+
+    storage.put("state.json", b"data")
+    assert storage.get("state.json") == b"data"
+
+    s3_client.put_object.assert_called_once_with(
+        Body=b"data",
+        Bucket="test-bucket",
+        Key="motivator/state.json"
+    )
+    s3_client.get_object.assert_called_once_with(Bucket="test-bucket", Key="motivator/state.json")
+
+
+def test_s3_storage_missing_key():
+    s3_client = MagicMock()
+    s3_client.get_object.side_effect = ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+
+    assert S3Storage("test-bucket", s3_client=s3_client).get("missing") is None
+
+
+def test_s3_storage_requires_bucket():
+    with pytest.raises(ValueError, match="S3_BUCKET environment variable must be set"):
+        S3Storage(None, s3_client=MagicMock())
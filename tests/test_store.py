@@ -0,0 +1,211 @@
+import os
+from unittest.mock import patch
+import pytest
+
+from src.storage import LocalStorage
+from src.store import StateStore, SyncedStateStore, merge_databases, store_from_env
+from src.strava.activities import ActivityRecord
+
+
+def _play(played_at, uri):
+    return {"played_at": played_at, "track": {"uri": uri}}
+
+
+def _activity(activity_id, start_epoch, duration=3600):
+    from datetime import datetime, timezone
+    start = datetime.fromtimestamp(start_epoch, tz=timezone.utc)
+    end = datetime.fromtimestamp(start_epoch + duration, tz=timezone.utc)
+    return ActivityRecord(f"Run {activity_id}", start, start_epoch, end, start_epoch + duration, activity_id=activity_id)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    yield store
+    store.close()
+
+
+def test_wal_mode(store):
+    assert store.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_indexes_exist(store):
+    indexes = {row[1] for row in store.conn.execute("SELECT * FROM sqlite_master WHERE type = 'index'")}
+    assert {"activities_start", "playlists_activity"} <= indexes
+
+
+def test_add_plays_dedupes(store):
+    plays = [
+        _play("2024-05-01T07:10:00.000Z", "spotify:track:a"),
+        _play("2024-05-01T07:20:00.000Z", "spotify:track:b"),
+    ]
+
+    assert store.add_plays(plays) == 2
+    assert store.add_plays(plays) == 0
+    assert store.latest_play() == "2024-05-01T07:20:00.000Z"
+
+
+def test_plays_between(store):
+    store.add_plays([
+        _play("2024-05-01T06:59:00.000Z", "spotify:track:before"),
+        _play("2024-05-01T07:10:00.000Z", "spotify:track:a"),
+        _play("2024-05-01T07:20:00.000Z", "spotify:track:b"),
+        _play("2024-05-01T08:01:00.000Z", "spotify:track:after"),
+    ])
+    start = 1714546800.0  # 2024-05-01T07:00:00Z
+
+    plays = store.plays_between(start, start + 3600)
+
+    assert plays == [
+        ("spotify:track:b", "2024-05-01T07:20:00.000Z"),
+        ("spotify:track:a", "2024-05-01T07:10:00.000Z"),
+    ]
+
+
+def test_plays_between_uses_index(store):
+    plan = store.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT track_uri FROM plays WHERE played_at > 1 AND played_at < 2"
+    ).fetchall()
+    assert "USING" in " ".join(str(row) for row in plan)
+
+
+def test_processed_activities(store):
+    activity = _activity(1, 1714546800.0)
+
+    store.add_activities([activity, _activity(2, 1714633200.0)])
+    assert store.is_processed(1) is False
+
+    store.mark_processed(activity, 5)
+    assert store.is_processed(1) is True
+    assert store.is_processed(2) is False
+    rows = store.activities_between(1714546800.0, 1714546801.0)
+    assert [(row[0], row[5]) for row in rows] == [(1, 5)]
+
+
+def test_playlists(store):
+    store.add_playlist("playlist_1", 1, "Runlist - 1/5", 5)
+    assert store.playlists_for_activity(1) == ["playlist_1"]
+
+
+def test_dirty_tracking(store):
+    assert store.dirty is False
+    store.add_plays([])
+    assert store.dirty is False
+    store.add_plays([_play("2024-05-01T07:10:00.000Z", "spotify:track:a")])
+    assert store.dirty is True
+
+
+def test_sync_roundtrip(tmp_path):
+    remote = LocalStorage(str(tmp_path / "remote"))
+
+    first = SyncedStateStore(str(tmp_path / "a.db"), remote)
+    first.add_plays([_play("2024-05-01T07:10:00.000Z", "spotify:track:a")])
+    assert first.save() is True
+    assert first.save() is False
+
+    second = SyncedStateStore(str(tmp_path / "b.db"), remote)
+    assert second.latest_play() == "2024-05-01T07:10:00.000Z"
+    assert second.dirty is False
+
+
+def test_store_from_env(tmp_path):
+    with patch.dict(os.environ, {}):
+        os.environ.pop("STATE_DB", None)
+        assert store_from_env() is None
+
+    with patch.dict(os.environ, {"STATE_DB": "local", "STATE_DB_PATH": str(tmp_path / "state.db")}):
+        store = store_from_env()
+        assert isinstance(store, StateStore)
+        assert store.save() is False
+
+
+def test_reload(tmp_path):
+    remote = LocalStorage(str(tmp_path / "remote"))
+    writer = SyncedStateStore(str(tmp_path / "a.db"), remote)
+    reader = SyncedStateStore(str(tmp_path / "b.db"), remote)
+
+    writer.add_plays([_play("2024-05-01T07:10:00.000Z", "spotify:track:a")])
+    writer.save()
+
+    assert reader.reload() is True
+    assert reader.latest_play() == "2024-05-01T07:10:00.000Z"
+    assert StateStore(str(tmp_path / "c.db")).reload() is False
+
+
+def test_recent_activities(store):
+    runs = [_activity(1, 1000), _activity(2, 5000), _activity(3, 9000)]
+    ride = ActivityRecord("Ride", runs[0].start, 12000, runs[0].end, 13000, activity_id=4, activity_type="Ride")
+    store.add_activities(runs + [ride])
+
+    assert [row[0] for row in store.recent_activities(2)] == [3, 2]
+    assert [row[0] for row in store.recent_activities(2, activity_types=None)] == [4, 3]
+    assert store.activity(2)[:2] == (2, "Run 2")
+    assert store.activity(99) is None
+
+
+def test_runs(store):
+    runs = [_activity(1, 1000), _activity(2, 5000), _activity(3, 9000)]
+    ride = ActivityRecord("Ride", runs[0].start, 6000, runs[0].end, 7000, activity_id=4, activity_type="Ride")
+    store.add_activities(runs + [ride])
+
+    assert [row[0] for row in store.runs(2)] == [3, 2]
+    # Every run since, however many
+    assert [row[0] for row in store.runs(1, since=2000)] == [3, 2]
+
+
+def test_reload_reconnects_under_lock(tmp_path):
+    source = StateStore(str(tmp_path / "source.db"))
+    source.add_plays([_play("2024-05-01T07:10:00.000Z", "spotify:track:a")])
+    storage = LocalStorage(str(tmp_path / "blobs"))
+    source.sync_to(storage, "state.db", force=True)
+    store = StateStore(str(tmp_path / "state.db"))
+
+    connects = []
+    original = store._connect
+
+    def connect():
+        connects.append(store._lock.locked())
+        original()
+
+    store._connect = connect
+    assert store.sync_from(storage, "state.db")
+    assert connects == [True]
+    assert store.latest_play() == "2024-05-01T07:10:00.000Z"
+
+
+def _database_bytes(store):
+    store.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    with open(store.path, 'rb') as f:
+        return f.read()
+
+
+def test_merge_databases(tmp_path):
+    ours = StateStore(str(tmp_path / "ours.db"))
+    theirs = StateStore(str(tmp_path / "theirs.db"))
+    ours.add_play_rows([(1.0, "a", "spotify:track:a")])
+    theirs.add_play_rows([(2.0, "b", "spotify:track:b"), (1.5, "a", "spotify:track:a")])
+    activity = _activity(1, 1000)
+    ours.add_activities([activity])
+    theirs.add_activities([activity])
+    theirs.mark_processed(activity, 3)
+    theirs.add_playlist("p1", 1, "Run", 3)
+
+    merged = StateStore(str(tmp_path / "merged.db"))
+    merged.conn.close()
+    with open(merged.path, 'wb') as f:
+        f.write(merge_databases(None, _database_bytes(ours), _database_bytes(theirs)))
+    merged._connect()
+
+    assert len(merged.plays_between(0, 10)) == 2
+    assert merged.is_processed(1)
+    assert merged.playlists_for_activity(1) == ["p1"]
+    assert merge_databases(None, b"ours", None) == b"ours"
+
+
+def test_plays_within_a_second_are_one_play(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+
+    assert store.add_play_rows([(100.0, "a", "spotify:track:a")]) == 1
+    assert store.add_play_rows([(100.6, "b", "spotify:track:a"), (99.4, "c", "spotify:track:a")]) == 0
+    # Another track, or the same one a track length later, is a new play
+    assert store.add_play_rows([(100.0, "d", "spotify:track:b"), (300.0, "e", "spotify:track:a")]) == 2
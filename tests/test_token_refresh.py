@@ -0,0 +1,61 @@
+import time
+from unittest.mock import MagicMock
+
+from src.deadline import Deadline
+from src.token_refresh import TokenRefresher, refresh_tokens, refresh_window_from_env
+
+
+def _client(refreshed=True):
+    client = MagicMock()
+    client.refresh_if_expiring.return_value = refreshed
+    return client
+
+
+def test_refresh_tokens():
+    strava = _client(True)
+    spotify = _client(False)
+
+    refreshed = refresh_tokens({"strava": strava, "spotify": spotify, "missing": None}, window=600)
+
+    assert refreshed == {"strava": True, "spotify": False}
+    strava.refresh_if_expiring.assert_called_once_with(600)
+    spotify.refresh_if_expiring.assert_called_once_with(600)
+
+
+def test_refresh_tokens_swallows_failures():
+    strava = _client()
+    strava.refresh_if_expiring.side_effect = RuntimeError("invalid_grant")
+    spotify = _client(True)
+
+    refreshed = refresh_tokens({"strava": strava, "spotify": spotify})
+
+    assert refreshed == {"strava": False, "spotify": True}
+
+
+def test_refresh_tokens_respects_deadline():
+    strava = _client()
+
+    refreshed = refresh_tokens({"strava": strava}, deadline=Deadline(0, reserve=0))
+
+    assert refreshed == {}
+    strava.refresh_if_expiring.assert_not_called()
+
+
+def test_token_refresher_thread():
+    spotify = _client(False)
+
+    refresher = TokenRefresher({"spotify": spotify}, window=900, interval=0.01).start()
+    time.sleep(0.05)
+    refresher.stop(timeout=1)
+
+    assert refresher.checks >= 2
+    assert spotify.refresh_if_expiring.call_count == refresher.checks
+    assert not refresher._thread.is_alive()
+
+
+def test_refresh_window_from_env(monkeypatch):
+    monkeypatch.delenv("TOKEN_REFRESH_WINDOW", raising=False)
+    assert refresh_window_from_env() == 900
+
+    monkeypatch.setenv("TOKEN_REFRESH_WINDOW", "0")
+    assert refresh_window_from_env() == 0
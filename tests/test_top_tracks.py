@@ -0,0 +1,114 @@
+from unittest.mock import MagicMock
+
+from src.storage import LocalStorage
+from src.strava.activities import ActivityRecord
+from src.top_tracks import TopTracks, top_tracks_from_env
+
+DAY = 24 * 3600
+
+
+def _run(activity_id, start_epoch):
+    return ActivityRecord(f"Run {activity_id}", None, start_epoch, None, start_epoch + 1800, activity_id=activity_id)
+
+
+def test_counts_slide_over_last_runs(tmp_path):
+    top = TopTracks(LocalStorage(str(tmp_path)), runs=2, size=2)
+
+    top.add(_run(1, 100), ["a", "a", "b"])
+    top.add(_run(2, 200), ["b", "c"])
+    assert top.counts == {"a": 2, "b": 2, "c": 1}
+    assert top.top() == ["a", "b"]
+
+    # Run 1 leaves the window
+    top.add(_run(3, 300), ["c"])
+    assert top.counts == {"b": 1, "c": 2}
+    assert top.top() == ["c", "b"]
+
+
+def test_add_ignores_counted_and_expired_runs(tmp_path):
+    top = TopTracks(LocalStorage(str(tmp_path)), runs=2)
+    top.add(_run(2, 200), ["a"])
+    top.add(_run(3, 300), ["b"])
+
+    assert top.add(_run(2, 200), ["a"]) is False
+    # Older than everything in a full window: counted out right away
+    assert top.add(_run(1, 100), ["z"]) is True
+    assert "z" not in top.counts
+
+
+def test_day_window_expires_by_time(tmp_path):
+    now = [10 * DAY]
+    top = TopTracks(LocalStorage(str(tmp_path)), days=3, clock=lambda: now[0])
+    top.add(_run(1, 8 * DAY), ["a"])
+    top.add(_run(2, 9 * DAY), ["b"])
+
+    now[0] = 11.5 * DAY
+    assert top.top() == ["b"]
+
+
+def test_sync_sends_only_the_diff(tmp_path):
+    spotify = MagicMock()
+    spotify.create_playlist.return_value = "top_playlist"
+    top = TopTracks(LocalStorage(str(tmp_path)), runs=2, size=2)
+
+    top.add(_run(1, 100), ["a", "a", "b"])
+    assert top.sync(spotify) == {"added": 2, "removed": 0}
+    spotify.create_playlist.assert_called_once()
+    spotify.update_playlist.assert_called_once_with("top_playlist", add=["a", "b"], remove=[])
+
+    top.add(_run(2, 200), ["c", "c", "c"])
+    assert top.sync(spotify) == {"added": 1, "removed": 1}
+    spotify.update_playlist.assert_called_with("top_playlist", add=["c"], remove=["b"])
+
+    # Nothing changed: no API calls
+    spotify.reset_mock()
+    assert top.sync(spotify) == {"added": 0, "removed": 0}
+    spotify.update_playlist.assert_not_called()
+
+
+def test_state_persists_between_runs(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    spotify = MagicMock()
+    spotify.create_playlist.return_value = "top_playlist"
+    top = TopTracks(storage, runs=5)
+    top.add(_run(1, 100), ["a", "b"])
+    top.sync(spotify)
+    assert top.save() is True
+    assert top.save() is False
+
+    reloaded = TopTracks(storage, runs=5)
+    assert reloaded.counts == {"a": 1, "b": 1}
+    reloaded.add(_run(2, 200), ["c"])
+    reloaded.sync(spotify)
+
+    spotify.create_playlist.assert_called_once()
+    spotify.update_playlist.assert_called_with("top_playlist", add=["c"], remove=[])
+
+
+def test_reload_picks_up_saved_state(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    ours = TopTracks(storage, runs=5)
+    assert ours.counts == {}
+
+    theirs = TopTracks(storage, runs=5)
+    theirs.add(_run(1, 100), ["a"])
+    theirs.save()
+
+    ours.reload()
+    assert ours.counts == {"a": 1}
+    # Unsaved changes are never dropped
+    ours.add(_run(2, 200), ["b"])
+    ours.reload()
+    assert ours.counts == {"a": 1, "b": 1}
+
+
+def test_top_tracks_from_env(tmp_path, monkeypatch):
+    monkeypatch.delenv("TOP_TRACKS", raising=False)
+    assert top_tracks_from_env() is None
+
+    monkeypatch.setenv("TOP_TRACKS", "local")
+    monkeypatch.setenv("TOP_TRACKS_DIR", str(tmp_path))
+    monkeypatch.setenv("TOP_TRACKS_DAYS", "30")
+    top = top_tracks_from_env()
+    assert top.days == 30
+    assert top.size == 50
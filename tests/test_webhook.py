@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+import urllib.request
+from unittest.mock import patch, MagicMock
+from urllib.error import HTTPError
+import pytest
+
+from src.context import AppContext
+from src.webhook import handle_webhook, handle_event, should_process, serve
+
+
+@pytest.fixture
+def mock_env_vars():
+    with patch.dict(os.environ, {"STRAVA_VERIFY_TOKEN": "verify-me"}):
+        os.environ.pop("STRAVA_SUBSCRIPTION_ID", None)
+        yield
+
+
+@pytest.fixture
+def mock_process_activity_id():
+    with patch("src.webhook.process_activity_id") as mock_process:
+        mock_process.return_value = {"activity_name": "Test Run", "track_count": 3}
+        yield mock_process
+
+
+def _event(aspect_type="create", object_id=123, **kwargs):
+    event = {
+        "object_type": "activity",
+        "object_id": object_id,
+        "aspect_type": aspect_type,
+        "owner_id": 42,
+        "subscription_id": 7,
+        "event_time": 1700000000,
+        "updates": {},
+    }
+    event.update(kwargs)
+    return event
+
+
+class FakeEventSender:
+    """Sends Strava-style webhook requests to a local webhook server"""
+
+    def __init__(self, server):
+        self.base_url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+
+    def validate(self, verify_token, challenge="challenge-123"):
+        query = f"hub.mode=subscribe&hub.verify_token={verify_token}&hub.challenge={challenge}"
+        return self._send(urllib.request.Request(f"{self.base_url}/webhook?{query}"))
+
+    def push(self, event):
+        request = urllib.request.Request(
+            f"{self.base_url}/webhook",
+            data=json.dumps(event).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        return self._send(request)
+
+    def _send(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except HTTPError as e:
+            return e.code, json.loads(e.read())
+
+
+@pytest.fixture
+def fake_sender(mock_env_vars):
+    context = AppContext()
+    server = serve(port=0, context=context)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield FakeEventSender(server), context
+    server.shutdown()
+    server.server_close()
+
+
+def test_validation_handshake(mock_env_vars):
+    response = handle_webhook({
+        "httpMethod": "GET",
+        "queryStringParameters": {
+            "hub.mode": "subscribe",
+            "hub.verify_token": "verify-me",
+            "hub.challenge": "abc"
+        }
+    })
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"]) == {"hub.challenge": "abc"}
+
+
+def test_validation_rejects_wrong_token(mock_env_vars):
+    response = handle_webhook({
+        "httpMethod": "GET",
+        "queryStringParameters": {
+            "hub.mode": "subscribe",
+            "hub.verify_token": "wrong",
+            "hub.challenge": "abc"
+        }
+    })
+
+    assert response["statusCode"] == 403
+
+
+def test_should_process():
+    assert should_process(_event("create")) is True
+    assert should_process(_event("update", updates={"title": "Renamed"})) is False
+    assert should_process(_event("update", updates={"type": "Run"})) is True
+    assert should_process(_event("delete")) is False
+    assert should_process(_event("update", object_type="athlete", updates={"authorized": "false"})) is False
+
+
+def test_create_event_processes_activity(mock_env_vars, mock_process_activity_id):
+    context = MagicMock()
+    context.processed_activity_ids = set()
+
+    response = handle_webhook({"httpMethod": "POST", "body": json.dumps(_event())}, context=context)
+
+    mock_process_activity_id.assert_called_once_with(
+        123,
+        create_playlist=True,
+        use_s3=False,
+        context=context,
+        fresh=True,
+        deadline=None
+    )
+    assert json.loads(response["body"])["processed"] is True
+    assert 123 in context.processed_activity_ids
+
+
+def test_redelivered_event_ignored(mock_env_vars, mock_process_activity_id):
+    context = MagicMock()
+    context.processed_activity_ids = set()
+
+    handle_event(_event(), context=context)
+    handle_event(_event(), context=context)
+
+    mock_process_activity_id.assert_called_once()
+
+
+def test_event_for_other_subscription_ignored(mock_env_vars, mock_process_activity_id):
+    with patch.dict(os.environ, {"STRAVA_SUBSCRIPTION_ID": "99"}):
+        response = handle_event(_event())
+
+    mock_process_activity_id.assert_not_called()
+    assert response["statusCode"] == 200
+
+
+def test_invalid_body(mock_env_vars):
+    response = handle_webhook({"httpMethod": "POST", "body": "not json"})
+    assert response["statusCode"] == 400
+
+
+def test_fake_sender_validation(fake_sender):
+    sender, _ = fake_sender
+
+    assert sender.validate("verify-me") == (200, {"hub.challenge": "challenge-123"})
+    assert sender.validate("wrong")[0] == 403
+
+
+def test_fake_sender_events(fake_sender, mock_process_activity_id):
+    sender, context = fake_sender
+
+    status, body = sender.push(_event("create", object_id=555))
+    assert status == 200
+    assert body["processed"] is True
+
+    status, body = sender.push(_event("update", object_id=555, updates={"title": "New title"}))
+    assert body["processed"] is False
+
+    mock_process_activity_id.assert_called_once_with(
+        555,
+        create_playlist=True,
+        use_s3=False,
+        context=context,
+        fresh=True,
+        deadline=None
+    )
+
+
+def test_event_queued_when_queue_configured(mock_env_vars, mock_process_activity_id):
+    from src.batch import InMemoryQueue, wants_fresh
+
+    queue = InMemoryQueue()
+    response = handle_event(_event(), context=MagicMock(), queue=queue)
+
+    assert json.loads(response["body"]) == {"processed": False, "queued": True}
+    mock_process_activity_id.assert_not_called()
+    record = queue.receive()["Records"][0]
+    assert json.loads(record["body"])["activity_id"] == 123
+    assert wants_fresh(record)
+
+
+def test_redelivery_during_processing_ignored(mock_env_vars, mock_process_activity_id):
+    context = AppContext()
+    responses = []
+
+    def process(activity_id, **kwargs):
+        # Strava redelivers while the first delivery is still being handled
+        responses.append(handle_event(_event(), context=context))
+        return {"activity_name": "Test Run"}
+
+    mock_process_activity_id.side_effect = process
+    handle_event(_event(), context=context)
+
+    mock_process_activity_id.assert_called_once()
+    assert json.loads(responses[0]["body"])["processed"] is False
+    assert context.in_flight_activity_ids == set()
+    assert context.processed_activity_ids == {123}
+
+
+def test_unprocessed_activity_not_remembered(mock_env_vars, mock_process_activity_id):
+    context = AppContext()
+    mock_process_activity_id.return_value = None
+
+    handle_event(_event(), context=context)
+    handle_event(_event("update", updates={"type": "Run"}), context=context)
+
+    assert mock_process_activity_id.call_count == 2
+    assert context.processed_activity_ids == set()
+
+
+def test_failed_processing_clears_in_flight(mock_env_vars, mock_process_activity_id):
+    context = AppContext()
+    mock_process_activity_id.side_effect = RuntimeError("Strava down")
+
+    with pytest.raises(RuntimeError):
+        handle_event(_event(), context=context)
+
+    assert context.in_flight_activity_ids == set()
+
+
+def test_event_starts_request_guard(mock_env_vars, mock_process_activity_id):
+    from src.deadline import Deadline, get_request_guard
+
+    get_request_guard().start(Deadline(0.01))
+    deadline = Deadline(30)
+    handle_webhook({"httpMethod": "POST", "body": json.dumps(_event())}, deadline=deadline)
+
+    # A stale deadline from an earlier run is replaced by this request's
+    assert get_request_guard().deadline is deadline
+    assert mock_process_activity_id.call_args.kwargs["deadline"] is deadline
+    get_request_guard().start(None)